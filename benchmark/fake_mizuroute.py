@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Stand-in mizuRoute executable for benchmarking and testing the calibration workflow.
+# It accepts the mizuRoute command line (the control file) and writes outputs with mizuRoute-like names.
+# 1. Read mizuroute.control, the river network topology and the SUMMA runoff file.
+# 2. Accumulate GRU runoff downstream with a one-step linear smoothing per segment.
+# 3. Write [case_name].h.[sim_start]-00000.nc with IRFroutedRunoff (time, seg).
+# 4. Write [case_name].r.[sim_end+1]-00000.nc if <restart_write> is 'last'.
+# Note: This is not a routing model. Its outputs are plausible in shape and size only.
+
+# import packages
+import os, sys
+from datetime import datetime, timedelta
+import netCDF4 as nc
+import numpy as np
+
+# define functions
+def read_from_summa_route_config(config_file, setting, default=None):
+    '''Function to extract a given setting from the mizuRoute configuration file. Return default if not found.'''
+    with open(config_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('!',1)[0].strip().split(None,1)[1].strip("'")
+    return default
+
+def parse_date(date_str):
+    '''Function to parse a mizuRoute date (yyyy-mm-dd with optional hh:mm:ss).'''
+    for fmt in ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d']:
+        try:
+            return datetime.strptime(date_str.strip(), fmt)
+        except ValueError:
+            continue
+    raise ValueError('Unrecognized date: %s'%(date_str))
+
+def upstream_first_order(segIds, downSegIds):
+    '''Function to return segment indices ordered so that every segment comes after all its upstream segments.'''
+    nseg    = len(segIds)
+    seg_pos = dict(zip(segIds, range(nseg)))
+    down    = np.array([seg_pos.get(x, -1) for x in downSegIds])
+    n_up    = np.bincount(down[down >= 0], minlength=nseg)
+    order, stack = [], list(np.where(n_up == 0)[0])
+    while stack:
+        i = stack.pop()
+        order.append(i)
+        if down[i] >= 0:
+            n_up[down[i]] -= 1
+            if n_up[down[i]] == 0:
+                stack.append(down[i])
+    return np.array(order), down
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python fake_mizuroute.py mizuroute.control
+
+    # ------------------------------ Prepare ---------------------------------
+    if len(sys.argv) != 2:
+        print("Usage: %s <route_control>" % sys.argv[0])
+        sys.exit(0)
+    route_control = sys.argv[1]
+
+    ancil_dir  = read_from_summa_route_config(route_control, '<ancil_dir>')
+    input_dir  = read_from_summa_route_config(route_control, '<input_dir>')
+    output_dir = read_from_summa_route_config(route_control, '<output_dir>')
+    case_name  = read_from_summa_route_config(route_control, '<case_name>')
+    sim_start  = parse_date(read_from_summa_route_config(route_control, '<sim_start>'))
+    sim_end    = parse_date(read_from_summa_route_config(route_control, '<sim_end>'))
+    fname_ntop = read_from_summa_route_config(route_control, '<fname_ntopOld>')
+    fname_qsim = read_from_summa_route_config(route_control, '<fname_qsim>')
+    vname_qsim = read_from_summa_route_config(route_control, '<vname_qsim>')
+    vname_hruid   = read_from_summa_route_config(route_control, '<vname_hruid>')
+    restart_write = read_from_summa_route_config(route_control, '<restart_write>', 'never')
+    restart_dir   = read_from_summa_route_config(route_control, '<restart_dir>', output_dir)
+    fname_state_in = read_from_summa_route_config(route_control, '<fname_state_in>', None)
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Read topology and runoff.
+    with nc.Dataset(os.path.join(ancil_dir, fname_ntop)) as f:
+        segIds     = f['segId'][:].astype('int64')
+        downSegIds = f['downSegId'][:].astype('int64')
+        hruIds     = f['hruId'][:].astype('int64')
+        hruToSegId = f['hruToSegId'][:].astype('int64')
+        area       = f['area'][:]
+    order, down = upstream_first_order(segIds, downSegIds)
+    seg_pos = dict(zip(segIds, range(len(segIds))))
+    hru_seg = np.array([seg_pos[x] for x in hruToSegId])
+
+    with nc.Dataset(os.path.join(input_dir, fname_qsim)) as f:
+        time_var = f['time']
+        times    = nc.num2date(time_var[:], time_var.units, only_use_cftime_datetimes=False,
+                               only_use_python_datetimes=True)
+        keep     = np.array([(t >= sim_start) and (t <= sim_end) for t in times])
+        time_values = time_var[:][keep]
+        time_units  = time_var.units
+        runoff_ids  = f[vname_hruid][:].astype('int64')
+        runoff      = np.ma.filled(f[vname_qsim][:], 0.0)[keep,:]
+
+    # Map runoff columns to topology HRUs.
+    runoff_pos = dict(zip(runoff_ids, range(len(runoff_ids))))
+    hru_cols   = np.array([runoff_pos.get(x, -1) for x in hruIds])
+
+    # #### 2. Route.
+    nseg, ntime = len(segIds), len(time_values)
+    routed = np.zeros(nseg)
+    if fname_state_in is not None:
+        state_file = os.path.join(restart_dir, fname_state_in)
+        if os.path.exists(state_file):
+            with nc.Dataset(state_file) as f:
+                routed = f['routedRunoff'][:]
+
+    IRFroutedRunoff = np.zeros((ntime, nseg))
+    for it in range(ntime):
+        q_hru  = np.where(hru_cols >= 0, runoff[it, np.maximum(hru_cols,0)], 0.0)*area  # m3/s
+        inflow = np.bincount(hru_seg, weights=q_hru, minlength=nseg)
+        total  = inflow.copy()
+        for i in order:
+            if down[i] >= 0:
+                total[down[i]] += total[i]
+        routed = 0.5*total + 0.5*routed
+        IRFroutedRunoff[it,:] = routed
+
+    # #### 3. Write output.
+    os.makedirs(output_dir, exist_ok=True)
+    outputFile = os.path.join(output_dir, '%s.h.%s-00000.nc'%(case_name, sim_start.strftime('%Y-%m-%d')))
+    with nc.Dataset(outputFile, 'w') as dst:
+        dst.createDimension('time', None)
+        dst.createDimension('seg', nseg)
+        t = dst.createVariable('time', 'f8', ('time',))
+        t.units = time_units
+        t.calendar = 'standard'
+        t[:] = time_values
+        dst.createVariable('reachID', 'i8', ('seg',))[:] = segIds
+        var = dst.createVariable('IRFroutedRunoff', 'f8', ('time','seg'))
+        var.units = 'm3/s'
+        var[:] = IRFroutedRunoff
+
+    # #### 4. Write restart.
+    if restart_write.lower() == 'last':
+        restart_date = sim_end + timedelta(days=1)
+        restartFile  = os.path.join(restart_dir, '%s.r.%s-00000.nc'%(case_name, restart_date.strftime('%Y-%m-%d')))
+        with nc.Dataset(restartFile, 'w') as dst:
+            dst.createDimension('seg', nseg)
+            dst.createVariable('reachID', 'i8', ('seg',))[:] = segIds
+            dst.createVariable('routedRunoff', 'f8', ('seg',))[:] = routed
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Stand-in SUMMA executable for benchmarking and testing the calibration workflow.
+# It accepts the SUMMA command line used by the workflow (-m, -g, -r) and writes outputs
+# with the same names, dimensions and variables as SUMMA, so that all workflow scripts can run.
+# 1. Read fileManager.txt, attributes, trial parameters, initial states and forcing (if present).
+# 2. Run a linear-reservoir water balance per HRU with parameter-dependent coefficients.
+# 3. Write [outFilePrefix][_Gxxx-yyy]_day.nc with the variables listed in outputControl.txt.
+# 4. Write [outFilePrefix]_timestep.nc with parameters listed in outputControl.txt (used by generate_priori_trialParam.py).
+# 5. Write a restart file if -r e is specified.
+# Note: This is not a hydrologic model. Its outputs are plausible in shape and size only.
+
+# import packages
+import os, argparse
+from datetime import datetime, timedelta
+import netCDF4 as nc
+import numpy as np
+
+time_units = 'seconds since 1990-1-1 0:0:0.0 -0:00'
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Stand-in SUMMA executable.')
+    parser.add_argument('-m', dest='file_manager', required=True, help='path of the SUMMA fileManager.')
+    parser.add_argument('-g', dest='gru_subset', nargs=2, type=int, default=None, help='startGRU and countGRU.')
+    parser.add_argument('-r', dest='restart', default='never', help='restart option: never, e (end), y, m, d.')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_summa_route_config(config_file, setting):
+    '''Function to extract a given setting from the summa or mizuRoute configuration file.'''
+    # Open fileManager.txt or route_control and locate the line with setting
+    with open(config_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                break
+    # Extract the setting's value
+    substring = line.split('!',1)[0].strip().split(None,1)[1].strip("'")
+    # Return this value
+    return substring
+
+def read_output_control(outputControlFile):
+    '''Function to read outputControl.txt. Return a list of (variable, statistic) and a list of bare names.'''
+    model_vars, bare_names = [], []
+    with open(outputControlFile) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('!'):
+                continue
+            splits = [x.strip() for x in line.split('!',1)[0].split('|')]
+            if len(splits) == 1:
+                bare_names.append(splits[0])
+            elif len(splits) >= 3:
+                model_vars.append((splits[0], splits[2]))
+            elif len(splits) == 2:
+                model_vars.append((splits[0], 'mean'))
+    return model_vars, bare_names
+
+def read_param_info(filename):
+    '''Function to read default values from basinParamInfo.txt or localParamInfo.txt.'''
+    defaults = {}
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('!') and not line.startswith("'"):
+                splits = line.split('|')
+                defaults[splits[0].strip()] = float(splits[1].strip().replace('d','e'))
+    return defaults
+
+def read_params(trialParamFile, hru_idx, gru_idx, local_defaults, basin_defaults):
+    '''Function to read trial parameters for the selected HRUs/GRUs. Missing parameters use default values.'''
+    params = {}
+    if os.path.exists(trialParamFile):
+        with nc.Dataset(trialParamFile) as f:
+            for name, variable in f.variables.items():
+                if name in ['hruId','gruId']:
+                    continue
+                if variable.dimensions == ('hru',):
+                    params[name] = np.ma.filled(variable[:], np.nan)[hru_idx]
+                elif variable.dimensions == ('gru',):
+                    params[name] = np.ma.filled(variable[:], np.nan)[gru_idx]
+    for name, value in local_defaults.items():
+        if name not in params:
+            params[name] = value*np.ones(len(hru_idx))
+    for name, value in basin_defaults.items():
+        if name not in params:
+            params[name] = value*np.ones(len(gru_idx))
+    return params
+
+def read_forcing_precip(forcingPath, forcingListFile, hruIds, sim_start, ndays):
+    '''Function to read daily mean precipitation (kg m-2 s-1) of the selected HRUs from the forcing files.
+    Return None if no forcing file is available.'''
+    if not os.path.exists(forcingListFile):
+        return None
+    with open(forcingListFile) as f:
+        files = [os.path.join(forcingPath, x.strip().strip("'")) for x in f if x.strip() and not x.startswith('!')]
+    files = [x for x in files if os.path.exists(x)]
+    if len(files) == 0:
+        return None
+
+    precip = np.zeros((ndays, len(hruIds)))
+    count  = np.zeros((ndays, 1))
+    for file in files:
+        with nc.Dataset(file) as f:
+            forc_hruIds = f['hruId'][:].astype('int64')
+            sorter      = np.argsort(forc_hruIds)
+            hru_pos     = sorter[np.searchsorted(forc_hruIds, hruIds, sorter=sorter)]
+            times = nc.num2date(f['time'][:], f['time'].units, only_use_cftime_datetimes=False,
+                                only_use_python_datetimes=True)
+            day_idx = np.array([(t - sim_start).total_seconds()//86400 for t in times]).astype(int)
+            valid   = np.where((day_idx >= 0) & (day_idx < ndays))[0]
+            if len(valid) == 0:
+                continue
+            # Read the contiguous time block once, then subset HRUs in memory.
+            block = f['pptrate'][valid[0]:valid[-1]+1, :]
+            block = np.ma.filled(block, 0.0)[:, hru_pos]
+            np.add.at(precip, day_idx[valid[0]:valid[-1]+1], block)
+            np.add.at(count, day_idx[valid[0]:valid[-1]+1], 1)
+    return precip/np.maximum(count, 1)
+
+def write_day_output(outputFile, model_vars, times, gruIds, hruIds, gru_values, hru_values):
+    '''Function to write a SUMMA-like daily output file.'''
+    with nc.Dataset(outputFile, 'w') as dst:
+        dst.createDimension('time', None)
+        dst.createDimension('gru', len(gruIds))
+        dst.createDimension('hru', len(hruIds))
+        t = dst.createVariable('time', 'f8', ('time',))
+        t.units = time_units
+        t.calendar = 'standard'
+        t[:] = times
+        dst.createVariable('gruId', 'i8', ('gru',))[:] = gruIds
+        dst.createVariable('hruId', 'i8', ('hru',))[:] = hruIds
+        for name, stat in model_vars:
+            out_name = name + '_' + stat
+            if name in gru_values:
+                var = dst.createVariable(out_name, 'f8', ('time','gru'), fill_value=-9999.0)
+                var[:] = gru_values[name]
+            else:
+                var = dst.createVariable(out_name, 'f8', ('time','hru'), fill_value=-9999.0)
+                var[:] = hru_values.get(name, hru_values['pptrate'])
+            var.long_name = name
+            var.units = 'm s-1' if name == 'averageRoutedRunoff' else '-'
+
+def write_param_output(outputFile, bare_names, params, gruIds, hruIds, times, local_defaults, basin_defaults):
+    '''Function to write parameters to a SUMMA-like timestep output file.'''
+    with nc.Dataset(outputFile, 'w') as dst:
+        dst.createDimension('time', None)
+        dst.createDimension('gru', len(gruIds))
+        dst.createDimension('hru', len(hruIds))
+        t = dst.createVariable('time', 'f8', ('time',))
+        t.units = time_units
+        t[:] = times[:1]
+        dst.createVariable('gruId', 'i8', ('gru',))[:] = gruIds
+        dst.createVariable('hruId', 'i8', ('hru',))[:] = hruIds
+        for name in bare_names:
+            if name in local_defaults:
+                dst.createVariable(name, 'f8', ('hru',))[:] = params[name]
+            elif name in basin_defaults:
+                dst.createVariable(name, 'f8', ('gru',))[:] = params[name]
+
+def write_restart(restartFile, hruIds, storage):
+    '''Function to write a SUMMA-like restart file with the aquifer storage state.'''
+    with nc.Dataset(restartFile, 'w') as dst:
+        dst.createDimension('hru', len(hruIds))
+        dst.createDimension('scalarv', 1)
+        dst.createVariable('hruId', 'i8', ('hru',))[:] = hruIds
+        dst.createVariable('scalarAquiferStorage', 'f8', ('scalarv','hru'))[:] = storage[np.newaxis,:]
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python fake_summa.py -g 1 10 -r never -m fileManager.txt
+
+    # ------------------------------ Prepare ---------------------------------
+    args = process_command_line()
+    file_manager = args.file_manager
+
+    settingsPath  = read_from_summa_route_config(file_manager, 'settingsPath')
+    forcingPath   = read_from_summa_route_config(file_manager, 'forcingPath')
+    outputPath    = read_from_summa_route_config(file_manager, 'outputPath')
+    statePath     = read_from_summa_route_config(file_manager, 'statePath')
+    outFilePrefix = read_from_summa_route_config(file_manager, 'outFilePrefix')
+    sim_start = datetime.strptime(read_from_summa_route_config(file_manager, 'simStartTime'), '%Y-%m-%d %H:%M')
+    sim_end   = datetime.strptime(read_from_summa_route_config(file_manager, 'simEndTime'), '%Y-%m-%d %H:%M')
+
+    attributeFile     = os.path.join(settingsPath, read_from_summa_route_config(file_manager, 'attributeFile'))
+    trialParamFile    = os.path.join(settingsPath, read_from_summa_route_config(file_manager, 'trialParamFile'))
+    forcingListFile   = os.path.join(settingsPath, read_from_summa_route_config(file_manager, 'forcingListFile'))
+    outputControlFile = os.path.join(settingsPath, read_from_summa_route_config(file_manager, 'outputControlFile'))
+    initConditionFile = os.path.join(statePath, read_from_summa_route_config(file_manager, 'initConditionFile'))
+    local_defaults = read_param_info(os.path.join(settingsPath, read_from_summa_route_config(file_manager, 'globalHruParamFile')))
+    basin_defaults = read_param_info(os.path.join(settingsPath, read_from_summa_route_config(file_manager, 'globalGruParamFile')))
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Identify the simulated GRUs and HRUs.
+    with nc.Dataset(attributeFile) as f:
+        gruIds    = f['gruId'][:].astype('int64')
+        hruIds    = f['hruId'][:].astype('int64')
+        hru2gruId = f['hru2gruId'][:].astype('int64')
+        HRUarea   = f['HRUarea'][:]
+
+    suffix  = ''
+    gru_idx = np.arange(len(gruIds))
+    if args.gru_subset is not None:
+        startGRU, countGRU = args.gru_subset
+        gru_idx = np.arange(startGRU-1, min(startGRU-1+countGRU, len(gruIds)))
+        suffix  = '_G%06d-%06d'%(startGRU, startGRU+len(gru_idx)-1)
+    hru_idx = np.where(np.isin(hru2gruId, gruIds[gru_idx]))[0]
+    sub_gruIds, sub_hruIds = gruIds[gru_idx], hruIds[hru_idx]
+    sorter      = np.argsort(sub_gruIds)
+    hru_gru_pos = sorter[np.searchsorted(sub_gruIds, hru2gruId[hru_idx], sorter=sorter)] # GRU position of each HRU
+
+    # #### 2. Read parameters, states and forcing.
+    params = read_params(trialParamFile, hru_idx, gru_idx, local_defaults, basin_defaults)
+    ndays  = max(1, int(np.ceil((sim_end - sim_start).total_seconds()/86400.0)))
+    times  = np.array([(sim_start + timedelta(days=i+1) - datetime(1990,1,1)).total_seconds() for i in range(ndays)])
+
+    storage = 0.1*np.ones(len(hru_idx))
+    if os.path.exists(initConditionFile):
+        with nc.Dataset(initConditionFile) as f:
+            if 'scalarAquiferStorage' in f.variables:
+                state_hruIds = f['hruId'][:].astype('int64')
+                state_values = np.ravel(f['scalarAquiferStorage'][:])
+                lookup  = dict(zip(state_hruIds, state_values))
+                storage = np.array([lookup.get(x, 0.1) for x in sub_hruIds])
+
+    precip = read_forcing_precip(forcingPath, forcingListFile, sub_hruIds, sim_start, ndays)
+    if precip is None:
+        day = np.arange(ndays)[:,np.newaxis] + (sim_start - datetime(1990,1,1)).days
+        precip = 3e-5*(1.0 + np.sin(2*np.pi*day/365.0 + 0.01*sub_hruIds[np.newaxis,:]))
+
+    # #### 3. Run a linear reservoir per HRU. Parameters modulate the outflow coefficient and the input.
+    coef = 0.05*(np.nan_to_num(params['k_soil'], nan=7.5e-6)/7.5e-6)**0.3 \
+           *(np.nan_to_num(params['qSurfScale'], nan=50.0)/50.0)**-0.2 \
+           *(np.nan_to_num(params['theta_sat'], nan=0.55)/0.55)**-0.5
+    coef = np.clip(coef, 1e-3, 0.9)
+    pmult = np.nan_to_num(params['frozenPrecipMultip'], nan=1.0)**0.2
+
+    runoff_hru = np.zeros((ndays, len(hru_idx)))
+    for i in range(ndays):
+        storage = storage + precip[i,:]*pmult*86.4        # kg m-2 s-1 -> m/day
+        outflow = coef*storage
+        storage = storage - outflow
+        runoff_hru[i,:] = outflow/86400.0                 # m/s
+
+    # GRU runoff is the area-weighted mean of its HRUs.
+    area = HRUarea[hru_idx]
+    runoff_gru = np.zeros((ndays, len(gru_idx)))
+    area_gru   = np.bincount(hru_gru_pos, weights=area, minlength=len(gru_idx))
+    for i in range(ndays):
+        runoff_gru[i,:] = np.bincount(hru_gru_pos, weights=runoff_hru[i,:]*area, minlength=len(gru_idx))
+    runoff_gru = runoff_gru/np.maximum(area_gru, 1e-12)
+
+    # #### 4. Write outputs.
+    os.makedirs(outputPath, exist_ok=True)
+    model_vars, bare_names = read_output_control(outputControlFile)
+    gru_values = {'averageRoutedRunoff': runoff_gru}
+    for name, stat in model_vars:
+        if name.startswith('basin') or name.startswith('average'):
+            gru_values.setdefault(name, runoff_gru)
+    hru_values = {'pptrate': precip, 'airtemp': 273.15 + 10*np.sin(precip*1e4), 'scalarTotalRunoff': runoff_hru}
+    write_day_output(os.path.join(outputPath, outFilePrefix+suffix+'_day.nc'), model_vars,
+                     times, sub_gruIds, sub_hruIds, gru_values, hru_values)
+
+    param_names = [x for x in bare_names if x in local_defaults or x in basin_defaults]
+    if len(param_names) > 0:
+        write_param_output(os.path.join(outputPath, outFilePrefix+suffix+'_timestep.nc'), param_names, params,
+                           sub_gruIds, sub_hruIds, times, local_defaults, basin_defaults)
+
+    if args.restart.lower().startswith('e'):
+        restartFile = os.path.join(outputPath, outFilePrefix+'_restart_'+sim_end.strftime('%Y%m%d%H')+suffix+'.nc')
+        write_restart(restartFile, sub_hruIds, storage)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Create a synthetic calibration case of a configurable size for benchmarking.
+# The case has the same layout as the demos and uses the stand-in executables fake_summa.py and fake_mizuroute.py.
+# 1. Write attributes.nc, coldState.nc, forcing, topology.nc and the SUMMA/mizuRoute configuration files.
+# 2. Write control_active.txt.
+# 3. Run the workflow preparation scripts (a priori parameters, multiplier bounds, config file update).
+# 4. Run the stand-in models to create split SUMMA outputs (*G*_day.nc) and the mizuRoute output.
+# 5. Write synthetic observations and a search history of a given length.
+
+# import packages
+import os, sys, argparse, shutil, subprocess
+from datetime import datetime, timedelta
+import netCDF4 as nc
+import numpy as np
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir      = os.path.dirname(benchmark_dir)
+
+# Model variables written by the stand-in SUMMA. The first one is required by routing.
+output_vars = ['averageRoutedRunoff', 'pptrate', 'airtemp', 'scalarTotalRunoff', 'scalarSWE', 'scalarTotalET',
+               'scalarRainPlusMelt', 'scalarCanopyWat', 'scalarTotalSoilWat', 'scalarAquiferStorage',
+               'scalarSurfaceRunoff', 'scalarInfiltration', 'scalarSoilDrainage', 'scalarAquiferBaseflow']
+
+object_parameters = 'k_macropore, k_soil, theta_sat, aquiferBaseflowExp, aquiferBaseflowRate, qSurfScale, summerLAI, ' + \
+                    'frozenPrecipMultip, heightCanopyBottom, heightCanopyTop, routingGammaScale, routingGammaShape, Fcapil'
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to create a synthetic calibration case.')
+    parser.add_argument('case_dir', help='path of the case directory to create.')
+    parser.add_argument('--ngru', type=int, default=50, help='number of GRUs (also the number of river segments).')
+    parser.add_argument('--nhru', type=int, default=120, help='number of HRUs (>= ngru).')
+    parser.add_argument('--ndays', type=int, default=30, help='number of simulated days.')
+    parser.add_argument('--nvars', type=int, default=3, help='number of SUMMA output variables (1 to %d).'%(len(output_vars)))
+    parser.add_argument('--nsubset', type=int, default=4, help='number of GRU subsets of the split SUMMA outputs.')
+    parser.add_argument('--nhistory', type=int, default=1000, help='number of records in the search history.')
+    parser.add_argument('--no_forcing', action='store_true', help='do not write forcing files.')
+    parser.add_argument('--seed', type=int, default=1, help='random seed.')
+    args = parser.parse_args()
+    return(args)
+
+def run(cmd, cwd):
+    '''Function to run a command and stop if it fails.'''
+    result = subprocess.run(cmd, cwd=cwd, stdout=subprocess.DEVNULL)
+    if result.returncode != 0:
+        print('Error: command failed: %s'%(' '.join(cmd)))
+        sys.exit(1)
+
+def split_hrus(rng, ngru, nhru):
+    '''Function to assign HRUs to GRUs with a skewed distribution (at least one HRU per GRU).'''
+    weights = rng.pareto(1.5, ngru) + 1.0
+    counts  = np.ones(ngru, dtype=int)
+    extra   = rng.multinomial(nhru-ngru, weights/weights.sum())
+    return counts + extra
+
+def write_attributes(filename, rng, gruIds, hru_counts):
+    '''Function to write a SUMMA attribute file.'''
+    nhru = hru_counts.sum()
+    hru2gruId = np.repeat(gruIds, hru_counts)
+    with nc.Dataset(filename, 'w') as dst:
+        dst.createDimension('hru', nhru)
+        dst.createDimension('gru', len(gruIds))
+        dst.createVariable('hruId', 'i4', ('hru',))[:] = np.arange(1, nhru+1)
+        dst.createVariable('gruId', 'i4', ('gru',))[:] = gruIds
+        dst.createVariable('hru2gruId', 'i4', ('hru',))[:] = hru2gruId
+        dst.createVariable('downHRUindex', 'i4', ('hru',))[:] = np.zeros(nhru)
+        dst.createVariable('longitude', 'f8', ('hru',))[:] = -116.0 + rng.random(nhru)
+        dst.createVariable('latitude', 'f8', ('hru',))[:] = 51.0 + rng.random(nhru)
+        dst.createVariable('elevation', 'f8', ('hru',))[:] = 1200.0 + 2000.0*rng.random(nhru)
+        dst.createVariable('HRUarea', 'f8', ('hru',))[:] = 1e6*(1.0 + 50.0*rng.random(nhru))
+        dst.createVariable('tan_slope', 'f8', ('hru',))[:] = 0.1*rng.random(nhru)
+        dst.createVariable('contourLength', 'f8', ('hru',))[:] = 100.0*np.ones(nhru)
+        dst.createVariable('slopeTypeIndex', 'i4', ('hru',))[:] = np.ones(nhru)
+        dst.createVariable('soilTypeIndex', 'i4', ('hru',))[:] = rng.integers(1, 13, nhru)
+        dst.createVariable('vegTypeIndex', 'i4', ('hru',))[:] = rng.integers(1, 17, nhru)
+        dst.createVariable('mHeight', 'f8', ('hru',))[:] = 40.0*np.ones(nhru)
+    return hru2gruId
+
+def write_cold_state(filename, nhru):
+    '''Function to write a minimal SUMMA cold state file.'''
+    with nc.Dataset(filename, 'w') as dst:
+        dst.createDimension('hru', nhru)
+        dst.createDimension('scalarv', 1)
+        dst.createVariable('hruId', 'i4', ('hru',))[:] = np.arange(1, nhru+1)
+        dst.createVariable('dt_init', 'f8', ('scalarv','hru'))[:] = 3600.0*np.ones((1,nhru))
+        dst.createVariable('nSoil', 'i4', ('scalarv','hru'))[:] = 8*np.ones((1,nhru))
+        dst.createVariable('nSnow', 'i4', ('scalarv','hru'))[:] = np.zeros((1,nhru))
+        dst.createVariable('scalarAquiferStorage', 'f8', ('scalarv','hru'))[:] = 0.4*np.ones((1,nhru))
+
+def write_forcing(filename, rng, nhru, sim_start, ndays):
+    '''Function to write an hourly forcing file with precipitation and air temperature.'''
+    ntime = ndays*24
+    with nc.Dataset(filename, 'w') as dst:
+        dst.createDimension('time', None)
+        dst.createDimension('hru', nhru)
+        t = dst.createVariable('time', 'i4', ('time',))
+        t.units = 'hours since 1900-01-01'
+        t.calendar = 'gregorian'
+        t[:] = (sim_start - datetime(1900,1,1)).total_seconds()/3600 + np.arange(ntime)
+        dst.createVariable('hruId', 'f8', ('hru',))[:] = np.arange(1, nhru+1)
+        storm = (rng.random((ntime//24+1, 1)) < 0.3)*rng.gamma(2.0, 5e-5, (ntime//24+1, 1))
+        precip = np.repeat(storm, 24, axis=0)[:ntime,:]*(0.5 + rng.random((1, nhru)))
+        dst.createVariable('pptrate', 'f4', ('time','hru'), fill_value=-9999.0)[:] = precip
+        dst.createVariable('airtemp', 'f8', ('time','hru'))[:] = 273.15 + 10.0*rng.random((ntime, nhru))
+
+def write_topology(filename, rng, gruIds, gru_area):
+    '''Function to write a river network topology with one segment per GRU. The last segment is the outlet.'''
+    nseg = len(gruIds)
+    downSegId = np.zeros(nseg, dtype='int64')
+    for i in range(nseg-1):
+        downSegId[i] = gruIds[rng.integers(i+1, min(i+4, nseg-1)+1)]
+    with nc.Dataset(filename, 'w') as dst:
+        dst.createDimension('seg', nseg)
+        dst.createDimension('hru', nseg)
+        dst.createVariable('segId', 'i8', ('seg',))[:] = gruIds
+        dst.createVariable('downSegId', 'i8', ('seg',))[:] = downSegId
+        dst.createVariable('slope', 'f8', ('seg',))[:] = 0.01*np.ones(nseg)
+        dst.createVariable('length', 'f8', ('seg',))[:] = 5000.0*np.ones(nseg)
+        dst.createVariable('hruId', 'i8', ('hru',))[:] = gruIds
+        dst.createVariable('hruToSegId', 'i8', ('hru',))[:] = gruIds
+        dst.createVariable('area', 'f8', ('hru',))[:] = gru_area
+
+def write_file_manager(filename, model_path, sim_start, sim_end):
+    '''Function to write a SUMMA fileManager.txt.'''
+    lines = [("controlVersion", "'SUMMA_FILE_MANAGER_V3.0.0'", "file manager version"),
+             ("simStartTime", "'%s'"%(sim_start.strftime('%Y-%m-%d %H:%M')), ""),
+             ("simEndTime", "'%s'"%(sim_end.strftime('%Y-%m-%d %H:%M')), ""),
+             ("tmZoneInfo", "'utcTime'", ""),
+             ("outFilePrefix", "'run1'", ""),
+             ("settingsPath", "'%s/settings/SUMMA/'"%(model_path), ""),
+             ("forcingPath", "'%s/forcing/'"%(model_path), ""),
+             ("outputPath", "'%s/simulations/run1/SUMMA/'"%(model_path), ""),
+             ("statePath", "'%s/settings/SUMMA/states/'"%(model_path), ""),
+             ("initConditionFile", "'coldState.nc'", "Relative to settingsPath"),
+             ("attributeFile", "'attributes.nc'", "Relative to settingsPath"),
+             ("trialParamFile", "'trialParams.nc'", "Relative to settingsPath"),
+             ("forcingListFile", "'forcingFileList.txt'", "Relative to settingsPath"),
+             ("decisionsFile", "'modelDecisions.txt'", "Relative to settingsPath"),
+             ("outputControlFile", "'outputControl.txt'", "Relative to settingsPath"),
+             ("globalHruParamFile", "'localParamInfo.txt'", "Relative to settingsPath"),
+             ("globalGruParamFile", "'basinParamInfo.txt'", "Relative to settingsPath"),
+             ("vegTableFile", "'TBL_VEGPARM.TBL'", "Relative to settingsPath"),
+             ("soilTableFile", "'TBL_SOILPARM.TBL'", "Relative to settingsPath"),
+             ("generalTableFile", "'TBL_GENPARM.TBL'", "Relative to settingsPath"),
+             ("noahmpTableFile", "'TBL_MPTABLE.TBL'", "Relative to settingsPath")]
+    with open(filename, 'w') as f:
+        for name, value, comment in lines:
+            f.write('%-20s %s ! %s\n'%(name, value, comment))
+
+def write_route_control(filename, model_path, sim_start, sim_end):
+    '''Function to write a mizuroute.control with the entries used by the workflow.'''
+    lines = [('<ancil_dir>', '%s/settings/mizuRoute/'%(model_path), 'directory containing ancillary data'),
+             ('<input_dir>', '%s/simulations/run1/SUMMA/'%(model_path), 'directory containing input data'),
+             ('<output_dir>', '%s/simulations/run1/mizuRoute/'%(model_path), 'directory containing output data'),
+             ('<case_name>', 'run1', 'name of simulation'),
+             ('<sim_start>', sim_start.strftime('%Y-%m-%d'), 'time of simulation start'),
+             ('<sim_end>', sim_end.strftime('%Y-%m-%d'), 'time of simulation end'),
+             ('<route_opt>', '1', 'river routing options'),
+             ('<restart_write>', 'never', 'restart write option'),
+             ('<fname_ntopOld>', 'topology.nc', 'netCDF name for River Network'),
+             ('<dname_sseg>', 'seg', 'dimension name of the stream segments'),
+             ('<dname_nhru>', 'hru', 'dimension name of the HRUs'),
+             ('<fname_qsim>', 'run1_day.nc', 'name of file containing the HRU runoff'),
+             ('<vname_qsim>', 'averageRoutedRunoff_mean', 'name of HRU runoff variable'),
+             ('<vname_time>', 'time', 'name of time variable'),
+             ('<vname_hruid>', 'gruId', 'name of runoff HRU id variable'),
+             ('<dname_time>', 'time', 'name of time dimension'),
+             ('<dname_hruid>', 'gru', 'name of the HRU dimension'),
+             ('<units_qsim>', 'm/s', 'units of runoff depth'),
+             ('<dt_qsim>', '86400', 'time interval of the runoff [sec]'),
+             ('<is_remap>', 'F', 'logical whether or not runnoff needs to be mapped to river network HRU'),
+             ('<param_nml>', 'param.nml.default', 'Namelist name containing routing parameter values')]
+    with open(filename, 'w') as f:
+        for name, value, comment in lines:
+            f.write('%-23s %-40s ! %s\n'%(name, value, comment))
+
+def write_control(filename, case_dir, q_seg_index, sim_start, sim_end):
+    '''Function to write control_active.txt of the synthetic case.'''
+    settings = [('calib_path', case_dir, 'Path where parameter estimation is stored.'),
+                ('object_parameters', object_parameters, 'Parameter names to be optimized or evaluated.'),
+                ('initial_option', 'UseInitialParamValues', 'Initial value option.'),
+                ('max_iterations', '1000', 'Maximum Number of iterations for optimization.'),
+                ('WarmStart', 'no', 'Warm start.'),
+                ('model_path', 'default', "Path of destination hydrologic model. If 'default', use '[calib_path]/model'."),
+                ('summa_settings_relpath', 'settings/SUMMA', 'Relative path of summa model settings folder.'),
+                ('summa_filemanager', 'fileManager.txt', 'Name of the SUMMA master configuration file.'),
+                ('summa_exe_path', os.path.join(benchmark_dir, 'fake_summa.py'), 'summa executable path (stand-in).'),
+                ('route_settings_relpath', 'settings/mizuRoute', 'Relative path of mizuRoute settings folder.'),
+                ('route_control', 'mizuroute.control', 'Name of the mizuRoute configuration file.'),
+                ('route_exe_path', os.path.join(benchmark_dir, 'fake_mizuroute.py'), 'mizuroute executable path (stand-in).'),
+                ('simStartTime', sim_start.strftime('%Y-%m-%d %H:%M'), 'Start time for hydrologic simualtion.'),
+                ('simEndTime', sim_end.strftime('%Y-%m-%d %H:%M'), 'End time for hydrologic simualtion.'),
+                ('q_seg_index', str(q_seg_index), 'segment index in routing output file that matches obs location.'),
+                ('obs_file', os.path.join(case_dir, 'obs_flow.csv'), 'Path of observed streamflow data.'),
+                ('obs_unit', 'cms', 'Observation streamflow data unit (cfs or cms).'),
+                ('stat_output', 'trial_stats.txt', 'Name of file with statistical metric results.'),
+                ('statStartDate', sim_start.strftime('%Y-%m-%d'), 'Start date for statistics calculation.'),
+                ('statEndDate', sim_end.strftime('%Y-%m-%d'), 'End date for statistics calculation.'),
+                ('trace_output', 'calib_trace.jsonl', 'Name of the stage timing/resource trace file.')]
+    with open(filename, 'w') as f:
+        f.write('# Synthetic SUMMA parameter estimation case created by make_synthetic_case.py.\n')
+        for i, (name, value, comment) in enumerate(settings):
+            f.write('%-22s | %s    # (%02d) %s\n'%(name, value, i+1, comment))
+
+def write_search_history(filename, rng, param_names, bounds, nrecord):
+    '''Function to write a search history file in the format of save_param_obj.py.'''
+    with open(filename, 'w') as f:
+        f.write('Run  obj.function  ' + ''.join([x+'  ' for x in param_names]) + '\n')
+        for i in range(nrecord):
+            sample = bounds[:,0] + (bounds[:,1]-bounds[:,0])*rng.random(len(param_names))
+            f.write('%d %.6E  '%(i+1, -rng.random()) + ''.join(['%.6E  '%(x) for x in sample]) + '\n')
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python make_synthetic_case.py /tmp/case_small --ngru 50 --nhru 120 --ndays 30
+
+    # ------------------------------ Prepare ---------------------------------
+    args = process_command_line()
+    if args.nhru < args.ngru:
+        print('Error: nhru must be larger than or equal to ngru.')
+        sys.exit(1)
+    rng = np.random.default_rng(args.seed)
+
+    case_dir   = os.path.abspath(args.case_dir)
+    model_path = os.path.join(case_dir, 'model')
+    summa_settings_path = os.path.join(model_path, 'settings', 'SUMMA')
+    route_settings_path = os.path.join(model_path, 'settings', 'mizuRoute')
+    for path in [os.path.join(summa_settings_path, 'states'), route_settings_path, os.path.join(model_path, 'forcing')]:
+        os.makedirs(path, exist_ok=True)
+
+    sim_start = datetime(2000, 1, 1)
+    sim_end   = sim_start + timedelta(days=args.ndays) - timedelta(hours=1)
+    control_file = os.path.join(case_dir, 'control_active.txt')
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Write model inputs and configuration files.
+    gruIds     = np.arange(1001, 1001+args.ngru)
+    hru_counts = split_hrus(rng, args.ngru, args.nhru)
+    write_attributes(os.path.join(summa_settings_path, 'attributes.nc'), rng, gruIds, hru_counts)
+    write_cold_state(os.path.join(summa_settings_path, 'states', 'coldState.nc'), args.nhru)
+    with nc.Dataset(os.path.join(summa_settings_path, 'attributes.nc')) as f:
+        gru_area = np.bincount(np.repeat(np.arange(args.ngru), hru_counts), weights=f['HRUarea'][:])
+    write_topology(os.path.join(route_settings_path, 'topology.nc'), rng, gruIds, gru_area)
+
+    with open(os.path.join(summa_settings_path, 'forcingFileList.txt'), 'w') as f:
+        if not args.no_forcing:
+            f.write('forcing_%s.nc\n'%(sim_start.strftime('%Y-%m-%d')))
+    if not args.no_forcing:
+        write_forcing(os.path.join(model_path, 'forcing', 'forcing_%s.nc'%(sim_start.strftime('%Y-%m-%d'))),
+                      rng, args.nhru, sim_start, args.ndays)
+
+    for name in ['localParamInfo.txt', 'basinParamInfo.txt', 'modelDecisions.txt']:
+        shutil.copy2(os.path.join(repo_dir, 'demo2', 'model', 'settings', 'SUMMA', name), summa_settings_path)
+    with open(os.path.join(summa_settings_path, 'outputControl.txt'), 'w') as f:
+        f.write('! varName          | outFreq | sum | inst | mean | var | min | max | mode\n')
+        for name in output_vars[:max(1, min(args.nvars, len(output_vars)))]:
+            f.write('%-20s | 24  |  mean\n'%(name))
+
+    write_file_manager(os.path.join(summa_settings_path, 'fileManager.txt'), model_path, sim_start, sim_end)
+    write_route_control(os.path.join(route_settings_path, 'mizuroute.control'), model_path, sim_start, sim_end)
+
+    # #### 2. Write control_active.txt. The gauge is at the outlet (the last segment).
+    write_control(control_file, case_dir, args.ngru, sim_start, sim_end)
+
+    # #### 3. Run the workflow preparation scripts.
+    scripts_dir = os.path.join(repo_dir, 'scripts')
+    for script in ['generate_priori_trialParam.py', 'calculate_multp_bounds.py', 'update_model_config_files.py']:
+        run([sys.executable, os.path.join(scripts_dir, script), control_file], case_dir)
+    run([sys.executable, os.path.join(scripts_dir, 'update_paramTrial.py'), control_file], case_dir)
+
+    # #### 4. Run the stand-in models: split summa outputs, a full summa output and the routing output.
+    summa_filemanager = os.path.join(summa_settings_path, 'fileManager.txt')
+    summa_outputPath  = os.path.join(model_path, 'simulations', 'run1', 'SUMMA')
+    route_outputPath  = os.path.join(model_path, 'simulations', 'run1', 'mizuRoute')
+    for path in [summa_outputPath, route_outputPath]:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+    countGRU = int(np.ceil(args.ngru/float(args.nsubset)))
+    for startGRU in range(1, args.ngru+1, countGRU):
+        run([sys.executable, os.path.join(benchmark_dir, 'fake_summa.py'), '-g', str(startGRU), str(countGRU),
+             '-r', 'never', '-m', summa_filemanager], case_dir)
+    run([sys.executable, os.path.join(benchmark_dir, 'fake_summa.py'), '-r', 'never', '-m', summa_filemanager], case_dir)
+    run([sys.executable, os.path.join(benchmark_dir, 'fake_mizuroute.py'),
+         os.path.join(route_settings_path, 'mizuroute.control')], case_dir)
+    route_output = os.path.join(route_outputPath, 'run1.h.%s-00000.nc'%(sim_start.strftime('%Y-%m-%d')))
+    shutil.copy2(route_output, os.path.join(route_outputPath, 'run1.mizuRoute.nc'))
+
+    # #### 5. Write observations and search history.
+    with nc.Dataset(route_output) as f:
+        times = nc.num2date(f['time'][:], f['time'].units, only_use_cftime_datetimes=False,
+                            only_use_python_datetimes=True)
+        sim   = f['IRFroutedRunoff'][:, args.ngru-1]
+    obs = sim*1.15*(1.0 + 0.1*rng.standard_normal(len(sim)))
+    with open(os.path.join(case_dir, 'obs_flow.csv'), 'w') as f:
+        f.write('Date,flow\n')
+        for t, q in zip(times, obs):
+            f.write('%s,%.6f\n'%(t.strftime('%Y-%m-%d'), q))
+
+    bounds_arr  = np.loadtxt(os.path.join(case_dir, 'multiplier_bounds.txt'), dtype='str', delimiter=',')
+    param_names = list(bounds_arr[:,0])
+    bounds      = bounds_arr[:,2:4].astype(float)
+    write_search_history(os.path.join(case_dir, 'calib_search_history.txt'), rng, param_names, bounds, args.nhistory)
+    shutil.copy2(os.path.join(case_dir, 'calib_search_history.txt'), os.path.join(case_dir, 'calib_converge_history.txt'))
+    with open(os.path.join(case_dir, 'trial_stats.txt'), 'w') as f:
+        f.write('%.6f\t#KGE\n'%(0.5))
+    print('Synthetic case created in %s (%d GRUs, %d HRUs, %d days).'%(case_dir, args.ngru, args.nhru, args.ndays))
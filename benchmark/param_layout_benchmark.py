@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Benchmark storage layouts of the trial parameter file ####
+# 1. Write a synthetic trialParams.priori.nc per layout (param_file_layout, eg, 'chunk:8, float32, zlib:1').
+# 2. Time the per-trial rewrite of trialParams.nc as done by update_paramTrial.py (copy the a priori file,
+#    then multiply and rewrite every parameter).
+# 3. Time the SUMMA-side read: one process per GRU subset opens the file and reads its HRU/GRU slice of every
+#    parameter (as summa -g does). Reads are from the page cache after the first repeat.
+# 4. Report the median times and file sizes per layout, and optionally save them as JSON.
+
+# import packages
+import os, sys, argparse, json, shutil, time
+import numpy as np
+import netCDF4 as nc
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(benchmark_dir), 'scripts'))
+from generate_priori_trialParam import parse_param_layout, param_var_kwargs, split_grus
+
+# Parameter names written to the synthetic file (dimension hru or gru).
+hru_params = ['k_macropore', 'k_soil', 'theta_sat', 'aquiferBaseflowExp', 'aquiferBaseflowRate', 'qSurfScale',
+              'summerLAI', 'frozenPrecipMultip', 'heightCanopyBottom', 'heightCanopyTop', 'Fcapil', 'theta_res',
+              'critSoilWilting', 'critSoilTranspire', 'fieldCapacity']
+gru_params = ['routingGammaScale', 'routingGammaShape']
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to benchmark storage layouts of the trial parameter file.')
+    parser.add_argument('--ngru', type=int, default=20000, help='number of GRUs.')
+    parser.add_argument('--nhru', type=int, default=100000, help='number of HRUs.')
+    parser.add_argument('--nsubset', type=int, default=8, help='number of summa GRU subsets reading the file.')
+    parser.add_argument('--layouts', nargs='+', default=['default', 'chunk:8', 'chunk:8, float32', 'chunk:8, zlib:1',
+                                                         'chunk:8, float32, zlib:1'], help='param_file_layout values.')
+    parser.add_argument('--repeats', type=int, default=3, help='number of timed runs per layout (median is reported).')
+    parser.add_argument('--work_dir', default=os.path.join(benchmark_dir, 'cases', 'param_layout'), help='directory of the test files.')
+    parser.add_argument('--output', default=None, help='path of the JSON result file.')
+    args = parser.parse_args()
+    return(args)
+
+def write_priori(priori_file, layout, hru2gru, seed=0):
+    '''Function to write a synthetic a priori parameter file in a layout.'''
+    rng = np.random.default_rng(seed)
+    options = parse_param_layout(layout)
+    ngru, nhru = hru2gru.max()+1, len(hru2gru)
+    with nc.Dataset(priori_file, 'w') as dst:
+        dst.createDimension('hru', nhru)
+        dst.createDimension('gru', ngru)
+        dst.createVariable('hruId', 'i4', ('hru',))[:] = np.arange(1, nhru+1)
+        dst.createVariable('gruId', 'i4', ('gru',))[:] = np.arange(1, ngru+1)
+        for name in hru_params:
+            dst.createVariable(name, dimensions=('hru',), **param_var_kwargs(options, nhru))[:] = rng.random(nhru)
+        for name in gru_params:
+            dst.createVariable(name, dimensions=('gru',), **param_var_kwargs(options, ngru))[:] = rng.random(ngru)
+
+def rewrite_trial(priori_file, trial_file, multipliers):
+    '''Function to rewrite the trial parameter file as update_paramTrial.py does.'''
+    shutil.copy(priori_file, trial_file)
+    with nc.Dataset(priori_file, 'r') as src:
+        with nc.Dataset(trial_file, 'r+') as dst:
+            for name, multp in multipliers.items():
+                param_priori_ma = src.variables[name][:]
+                dst.variables[name][:] = np.ma.array(param_priori_ma.data * multp, mask=np.ma.getmask(param_priori_ma),
+                                                     fill_value=param_priori_ma.get_fill_value())
+
+def read_subsets(trial_file, subsets, hru_bounds):
+    '''Function to read the HRU/GRU slice of every parameter per GRU subset, each with its own file handle.'''
+    for (start, count), (hru_start, hru_end) in zip(subsets, hru_bounds):
+        with nc.Dataset(trial_file, 'r') as f:
+            for name in hru_params:
+                f[name][hru_start:hru_end]
+            for name in gru_params:
+                f[name][start-1:start-1+count]
+
+def median_time(func, repeats):
+    '''Function to return the median wall time of func over repeats.'''
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python param_layout_benchmark.py --ngru 20000 --nhru 100000 --nsubset 8
+
+    # ------------------------------ Prepare ---------------------------------
+    args = process_command_line()
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    # HRUs are assigned to GRUs in order (as in attributes.nc). GRU subsets are contiguous.
+    hru2gru = np.sort(np.random.default_rng(1).integers(0, args.ngru, args.nhru))
+    hru2gru[:args.ngru] = np.arange(args.ngru)
+    hru2gru = np.sort(hru2gru)
+    subsets = split_grus(args.ngru, args.nsubset)
+    hru_bounds = [(np.searchsorted(hru2gru, start-1), np.searchsorted(hru2gru, start-1+count)) for start, count in subsets]
+    multipliers = {name: 1.1 for name in hru_params + gru_params}
+
+    # -----------------------------------------------------------------------
+
+    # #### 1-3. Time the writes and reads per layout.
+    results = []
+    for i, layout in enumerate(args.layouts):
+        priori_file = os.path.join(args.work_dir, 'trialParams.priori.layout%d.nc'%(i))
+        trial_file  = os.path.join(args.work_dir, 'trialParams.layout%d.nc'%(i))
+        write_priori(priori_file, layout, hru2gru)
+        write_s = median_time(lambda: rewrite_trial(priori_file, trial_file, multipliers), args.repeats)
+        read_s  = median_time(lambda: read_subsets(trial_file, subsets, hru_bounds), args.repeats)
+        results.append({'layout': layout, 'trial_write_s': write_s, 'summa_read_s': read_s,
+                        'file_mb': os.path.getsize(trial_file)/1e6})
+
+    # #### 4. Report.
+    print('%d GRUs, %d HRUs, %d GRU subsets, median of %d repeats.'%(args.ngru, args.nhru, len(subsets), args.repeats))
+    print('%-28s %14s %14s %10s'%('layout', 'trial write(s)', 'summa read(s)', 'size(MB)'))
+    for x in results:
+        print('%-28s %14.4f %14.4f %10.2f'%(x['layout'], x['trial_write_s'], x['summa_read_s'], x['file_mb']))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'ngru': args.ngru, 'nhru': args.nhru, 'nsubset': len(subsets), 'results': results}, f, indent=2)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Benchmark the Python side of the calibration pipeline on synthetic cases.
+# 1. Create one synthetic case per size with make_synthetic_case.py (GRUs x HRUs x days).
+# 2. Time each workflow script (median over repeats) and record its peak RSS and throughput.
+# 3. Save the results as JSON and compare them with a baseline result file to report regressions.
+# The scripts under test are taken from --scripts_dir, so two versions can be compared on the same cases.
+
+# import packages
+import os, sys, argparse, json, shutil, subprocess, tempfile, time, socket
+from datetime import datetime
+import numpy as np
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir      = os.path.dirname(benchmark_dir)
+
+# Benchmark targets: script name and command line arguments after the script path.
+# Files listed in 'restore' are modified by the script and restored before every repeat.
+targets = {'update_paramTrial':   {'script': 'update_paramTrial.py',   'args': ['{control}'], 'restore': []},
+           'concat_summa_ouputs': {'script': 'concat_summa_ouputs.py', 'args': ['{control}'], 'restore': []},
+           'calculate_sim_stats': {'script': 'calculate_sim_stats.py', 'args': ['{control}'], 'restore': ['trial_stats.txt']},
+           'save_param_obj':      {'script': 'save_param_obj.py',      'args': ['{control}', '2'],
+                                   'restore': ['calib_search_history.txt', 'calib_converge_history.txt']},
+           'DDS':                 {'script': 'DDS.py',
+                                   'args': ['2', '1000', 'UseInitialParamValues', 'no', '{calib_path}/multiplier_bounds.txt',
+                                            '{calib_path}/multipliers.tpl', '{calib_path}/multipliers.txt',
+                                            '{calib_path}/calib_converge_history.txt'],
+                                   'restore': ['multipliers.txt']},
+           'calculate_multp_bounds': {'script': 'calculate_multp_bounds.py', 'args': ['{control}'],
+                                      'restore': ['multiplier_bounds.txt', 'multipliers.tpl', 'multipliers.txt']}}
+default_targets = ['update_paramTrial', 'concat_summa_ouputs', 'calculate_sim_stats', 'save_param_obj', 'DDS']
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to benchmark the calibration workflow scripts on synthetic cases.')
+    parser.add_argument('--sizes', nargs='+', default=['50x120x30', '500x1200x365'],
+                        help='case sizes as GRUsxHRUsxDays, eg, 50x120x30.')
+    parser.add_argument('--targets', nargs='+', default=default_targets, choices=list(targets.keys()),
+                        help='scripts to benchmark.')
+    parser.add_argument('--repeats', type=int, default=3, help='number of timed runs per target (median is reported).')
+    parser.add_argument('--nsubset', type=int, default=4, help='number of split SUMMA outputs per case.')
+    parser.add_argument('--nvars', type=int, default=3, help='number of SUMMA output variables per case.')
+    parser.add_argument('--work_dir', default=os.path.join(benchmark_dir, 'cases'), help='directory of the synthetic cases.')
+    parser.add_argument('--scripts_dir', default=os.path.join(repo_dir, 'scripts'), help='directory of the scripts to benchmark.')
+    parser.add_argument('--output', default=None, help='path of the JSON result file.')
+    parser.add_argument('--baseline', default=None, help='path of a JSON result file to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='relative slowdown/memory growth reported as a regression.')
+    parser.add_argument('--fail_on_regression', action='store_true', help='exit with 1 if a regression is found.')
+    parser.add_argument('--rebuild', action='store_true', help='recreate the synthetic cases even if they exist.')
+    args = parser.parse_args()
+    return(args)
+
+def parse_size(size):
+    '''Function to parse a case size string GRUsxHRUsxDays.'''
+    try:
+        ngru, nhru, ndays = [int(x) for x in size.lower().split('x')]
+    except ValueError:
+        print('Error: Size %s is not in the format of GRUsxHRUsxDays.'%(size))
+        sys.exit(1)
+    return ngru, nhru, ndays
+
+def get_version(scripts_dir):
+    '''Function to label the version of the scripts under test.'''
+    result = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=scripts_dir,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    return result.stdout.strip() if result.returncode == 0 else os.path.abspath(scripts_dir)
+
+def prepare_case(case_dir, ngru, nhru, ndays, nsubset, nvars, rebuild=False):
+    '''Function to create a synthetic case unless it already exists.'''
+    control_file = os.path.join(case_dir, 'control_active.txt')
+    if os.path.exists(control_file) and not rebuild:
+        return control_file
+    if os.path.isdir(case_dir):
+        shutil.rmtree(case_dir)
+    cmd = [sys.executable, os.path.join(benchmark_dir, 'make_synthetic_case.py'), case_dir,
+           '--ngru', str(ngru), '--nhru', str(nhru), '--ndays', str(ndays),
+           '--nsubset', str(nsubset), '--nvars', str(nvars), '--no_forcing']
+    if subprocess.run(cmd, stdout=subprocess.DEVNULL).returncode != 0:
+        print('Error: Failed to create the synthetic case %s.'%(case_dir))
+        sys.exit(1)
+    return control_file
+
+def time_command(cmd, cwd):
+    '''Function to run a command and return its wall time (s), CPU time (s), peak RSS (MB) and exit code.
+    stderr goes to a temporary file, as a pipe would block the command once its buffer is full.'''
+    with tempfile.TemporaryFile() as err:
+        start = time.perf_counter()
+        proc  = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.DEVNULL, stderr=err)
+        _, status, ru = os.wait4(proc.pid, 0)
+        wall  = time.perf_counter() - start
+        err.seek(0)
+        stderr = err.read().decode(errors='replace')
+    return wall, ru.ru_utime + ru.ru_stime, ru.ru_maxrss/1024.0, os.waitstatus_to_exitcode(status), stderr
+
+def benchmark_target(name, scripts_dir, case_dir, control_file, repeats):
+    '''Function to time one target on one case. Return a result dictionary.'''
+    target = targets[name]
+    args   = [x.format(control=control_file, calib_path=case_dir) for x in target['args']]
+    cmd    = [sys.executable, os.path.join(scripts_dir, target['script'])] + args
+
+    # Keep a copy of the files that the target modifies, so that every repeat starts from the same state.
+    backups = {}
+    for filename in target['restore']:
+        path = os.path.join(case_dir, filename)
+        if os.path.exists(path):
+            backups[path] = path + '.bench_backup'
+            shutil.copy2(path, backups[path])
+
+    walls, cpus, rsss = [], [], []
+    try:
+        for i in range(repeats):
+            for path, backup in backups.items():
+                shutil.copy2(backup, path)
+            wall, cpu, rss, returncode, stderr = time_command(cmd, case_dir)
+            if returncode != 0:
+                print('Error: %s failed (exit code %d):\n%s'%(name, returncode, stderr))
+                return {'failed': True}
+            walls.append(wall)
+            cpus.append(cpu)
+            rsss.append(rss)
+    finally:
+        for path, backup in backups.items():
+            shutil.move(backup, path)
+
+    return {'failed': False, 'wall_s': float(np.median(walls)), 'wall_min_s': float(np.min(walls)),
+            'cpu_s': float(np.median(cpus)), 'maxrss_mb': float(np.max(rsss))}
+
+def compare(results, baseline, tolerance):
+    '''Function to compare results with a baseline. Return a list of regression messages.'''
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline or result.get('failed') or baseline[key].get('failed'):
+            continue
+        for metric in ['wall_s', 'maxrss_mb']:
+            old, new = baseline[key][metric], result[metric]
+            change = (new - old)/old if old > 0 else 0.0
+            result[metric+'_change'] = change
+            if change > tolerance:
+                regressions.append('%s: %s %.3f -> %.3f (%+.1f%%)'%(key, metric, old, new, 100*change))
+    return regressions
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python run_benchmark.py --sizes 50x120x30 500x1200x365 --output results.json --baseline base.json
+
+    # ------------------------------ Prepare ---------------------------------
+    args = process_command_line()
+    scripts_dir = os.path.abspath(args.scripts_dir)
+    version = get_version(scripts_dir)
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Run the benchmark per case size and target.
+    results = {}
+    print('%-24s %-15s %9s %9s %10s %14s'%('target', 'size', 'wall_s', 'cpu_s', 'maxrss_mb', 'hru_days/s'))
+    for size in args.sizes:
+        ngru, nhru, ndays = parse_size(size)
+        case_dir = os.path.abspath(os.path.join(args.work_dir, 'case_%s'%(size)))
+        control_file = prepare_case(case_dir, ngru, nhru, ndays, args.nsubset, args.nvars, args.rebuild)
+
+        for name in args.targets:
+            result = benchmark_target(name, scripts_dir, case_dir, control_file, args.repeats)
+            result.update({'target': name, 'size': size, 'ngru': ngru, 'nhru': nhru, 'ndays': ndays})
+            if not result['failed']:
+                result['hru_days_per_s'] = nhru*ndays/result['wall_s']
+                print('%-24s %-15s %9.3f %9.3f %10.1f %14.0f'%(name, size, result['wall_s'], result['cpu_s'],
+                                                               result['maxrss_mb'], result['hru_days_per_s']))
+            results['%s|%s'%(name, size)] = result
+
+    # #### 2. Compare with the baseline.
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        print('\nCompared with %s (%s):'%(args.baseline, baseline.get('version', 'unknown')))
+        for key, result in results.items():
+            if 'wall_s_change' in result:
+                print('%-40s wall %+7.1f%%   maxrss %+7.1f%%'%(key, 100*result['wall_s_change'],
+                                                              100*result['maxrss_mb_change']))
+        if regressions:
+            print('\nRegressions (tolerance %.0f%%):'%(100*args.tolerance))
+            for message in regressions:
+                print('  ' + message)
+        else:
+            print('\nNo regressions (tolerance %.0f%%).'%(100*args.tolerance))
+
+    # #### 3. Save the results.
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'version': version, 'host': socket.gethostname(), 'python': sys.version.split()[0],
+                       'date': datetime.now().isoformat(timespec='seconds'), 'repeats': args.repeats,
+                       'results': results}, f, indent=2)
+
+    if any(x['failed'] for x in results.values()):
+        sys.exit(1)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
@@ -27,6 +27,8 @@ python ../scripts/calculate_multp_bounds.py $control_active
 # (3) Update summa and mizuRoute start/end time based on control_active.txt.
 echo "----- Update summa and mizuRoute configuration files -----"
 python ../scripts/update_model_config_files.py $control_active
+# The best param set is not rerun with full outputs here (see rerun_best.py), so the trials write the full outputs.
+python ../scripts/prune_output_control.py $control_active --full_only || exit 1
 
 # (4) Create ostIn.txt by adding multiplier and other configurations.
 echo "----- Create ostIn.txt -----"
@@ -81,6 +81,13 @@ route_outFilePrefix="$(read_from_summa_route_config $route_control "<case_name>"
 stat_output="$(read_from_control $control_file "stat_output")"
 stat_output=${calib_path}/${stat_output}
 
+# Read the number of simulation time chunks. If more than one, route each chunk while summa runs the next one.
+sim_chunks="$(read_from_control $control_file "sim_chunks")"
+if [ -z "$sim_chunks" ]; then sim_chunks=1; fi
+
+# Trace each stage's time and resource usage into [calib_path]/[trace_output].
+trace="python ../scripts/trace_stage.py $control_file"
+
 # -----------------------------------------------------------------------------------------
 # ---------------------------------- Execute trial ----------------------------------------
 # -----------------------------------------------------------------------------------------
@@ -93,7 +100,7 @@ date | awk '{printf("%s: run trial\n",$0)}' >> $calib_path/timetrack.log
 # ------------------------------------------------------------------------------
 echo "--- updating params ---"
 date | awk '{printf("%s: update params\n",$0)}' >> $calib_path/timetrack.log
-python ../scripts/update_paramTrial.py $control_file
+$trace update_params python ../scripts/update_paramTrial.py $control_file
 echo " "
 
 # ------------------------------------------------------------------------------
@@ -106,8 +113,14 @@ date | awk '{printf("%s: run summa\n",$0)}' >> $calib_path/timetrack.log
 if [ ! -d $summa_outputPath ]; then mkdir -p $summa_outputPath; fi
 rm -f $summa_outputPath/${summa_outFilePrefix}*
 
-# (2) Run Summa.
-${summaExe} -r never -m $summa_filemanager
+# (2) Run Summa. For a chunked run, also route and merge the chunks (steps 3 and 4 are done in this step).
+if [ "$sim_chunks" -gt 1 ]; then
+    if [ ! -d $route_outputPath ]; then mkdir -p $route_outputPath; fi
+    rm -f $route_outputPath/${route_outFilePrefix}*
+    python ../scripts/run_chunked_simulation.py $control_file
+else
+    $trace summa ${summaExe} -r never -m $summa_filemanager
+fi
 
 # ------------------------------------------------------------------------------
 # --- 3.  Post-process summa output for route                                ---
@@ -117,7 +130,9 @@ date | awk '{printf("%s: post-process summa output\n",$0)}' >> $calib_path/timet
 # Hard coded file name "xxx_day.nc". Valid for daily simulation.
 # Shift summa output time back 1 day for routing - only if computing daily outputs!
 # Summa use end of time step for time values, but mizuRoute use beginning of time step.
-ncap2 -h -O -s 'time[time]=time-86400' $summa_outputPath/$summa_outFilePrefix\_day.nc $summa_outputPath/$summa_outFilePrefix\_day.nc
+if [ "$sim_chunks" -le 1 ]; then
+    $trace time_shift ncap2 -h -O -s 'time[time]=time-86400' $summa_outputPath/$summa_outFilePrefix\_day.nc $summa_outputPath/$summa_outFilePrefix\_day.nc
+fi
 
 # ------------------------------------------------------------------------------
 # --- 4.  Run mizuRoute                                                      ---
@@ -125,23 +140,25 @@ ncap2 -h -O -s 'time[time]=time-86400' $summa_outputPath/$summa_outFilePrefix\_d
 echo "--- run mizuRoute ---"
 date | awk '{printf("%s: run mizuRoute\n",$0)}' >> $calib_path/timetrack.log
 
-# (1) Create mizuRoute output path if it does not exist; and remove existing outputs.
-if [ ! -d $route_outputPath ]; then mkdir -p $route_outputPath; fi
-rm -f $route_outputPath/${route_outFilePrefix}*
+if [ "$sim_chunks" -le 1 ]; then
+    # (1) Create mizuRoute output path if it does not exist; and remove existing outputs.
+    if [ ! -d $route_outputPath ]; then mkdir -p $route_outputPath; fi
+    rm -f $route_outputPath/${route_outFilePrefix}*
 
-# (2) Run mizuRoute.
-${routeExe} $route_control
-wait
+    # (2) Run mizuRoute.
+    $trace route ${routeExe} $route_control
+    wait
 
-# (3) Merge output runoff into one file for statistics calculation. Hard coded output file name.
-ncrcat -O -h $route_outputPath/${route_outFilePrefix}* $route_outputPath/${route_outFilePrefix}.mizuRoute.nc
+    # (3) Merge output runoff into one file for statistics calculation. Hard coded output file name.
+    $trace route_merge ncrcat -O -h $route_outputPath/${route_outFilePrefix}* $route_outputPath/${route_outFilePrefix}.mizuRoute.nc
+fi
 
 # ------------------------------------------------------------------------------
 # --- 5.  Calculate statistics for Ostrich                                   ---
 # ------------------------------------------------------------------------------
 echo "--- calculating statistics ---"
 date | awk '{printf("%s: calculate statistics\n",$0)}' >> $calib_path/timetrack.log
-python ../scripts/calculate_sim_stats.py $control_file 
+$trace stats python ../scripts/calculate_sim_stats.py $control_file 
 
 date | awk '{printf("%s: done with trial\n",$0)}' >> $calib_path/timetrack.log
 
@@ -7,7 +7,7 @@
 # -----------------------------------------------------------------------------------------
 # ----------------------------- User specified input --------------------------------------
 # -----------------------------------------------------------------------------------------
-control_file=control_active.txt
+control_file=${1:-control_active.txt}  # path of the active control file. Optional argument, eg, a sub-basin control file.
 
 # -----------------------------------------------------------------------------------------
 # ------------------------------------ Functions ------------------------------------------
@@ -36,12 +36,32 @@ read_from_summa_route_config () {
     echo $info
 }
 
+# Function to rerun the best param set with the full summa outputs if the trials wrote the runoff only
+# (trial_output minimal). Called at the end of every optimizer.
+rerun_best () {
+    trial_output="$(read_from_control $control_file "trial_output")"
+    if [ -n "$trial_output" ] && [ "$trial_output" != "full" ]; then
+        echo "===== Rerun the best param set with full outputs ====="
+        $trace rerun_best python ../scripts/rerun_best.py $control_file --trial_script ./run_trial.sh
+    fi
+}
+
 # -----------------------------------------------------------------------------------------
 # -------------------------- Read settings from control_file ------------------------------
 # -----------------------------------------------------------------------------------------
 # Read calibration path from control_file.
 calib_path="$(read_from_control $control_file "calib_path")"
 
+# Calibrate only the domain upstream of the gauge (upstream_only = yes). The reduced model is extracted into 
+# [calib_path]/model_upstream, and all later steps use its control file [calib_path]/control_upstream.txt.
+# The extraction is skipped while the reduced model is newer than its sources (eg, on resume).
+upstream_only="$(read_from_control $control_file "upstream_only")"
+if [ "$upstream_only" = "yes" ]; then
+    echo "----- Extract the model domain upstream of the gauge -----"
+    python ../scripts/extract_upstream_domain.py $control_file || exit 1
+    control_file=$calib_path/control_upstream.txt
+fi
+
 # Read hydrologic model path from control_file.
 model_path="$(read_from_control $control_file "model_path")"
 if [ "$model_path" = "default" ]; then model_path="${calib_path}/model"; fi
@@ -61,10 +81,32 @@ max_iterations="$(read_from_control $control_file "max_iterations")"
 warm_start="$(read_from_control $control_file "WarmStart")"
 initial_option="$(read_from_control $control_file "initial_option")"
 
+# Read the screening period for multi-fidelity evaluation ('none': evaluate every param set on the full period).
+screen_simPeriod="$(read_from_control $control_file "screen_simPeriod")"
+
+# Read the number of DDS neighbours screened by a surrogate per iteration (0: plain DDS).
+surrogate_candidates="$(read_from_control $control_file "surrogate_candidates")"
+if [ -z "$surrogate_candidates" ]; then surrogate_candidates=0; fi
+dds_script=../scripts/DDS.py
+if [ "$surrogate_candidates" -gt 0 ]; then
+    dds_script="../scripts/surrogate_DDS.py --ncandidate $surrogate_candidates --search_hist_file $calib_path/calib_search_history.txt"
+fi
+
+# Read whether to resume from the checkpoint of a preempted or time-limited run (see calib_checkpoint.py).
+resume_from_checkpoint="$(read_from_control $control_file "resume_from_checkpoint")"
+checkpoint=$calib_path/calib_checkpoint.json
+
 # Get statistical output file from control_file.
 stat_output="$(read_from_control $control_file "stat_output")"
 stat_output=${calib_path}/${stat_output}
 
+# Read the number of trials whose outputs can wait for the background archiver (0: archive before the next trial).
+archive_queue="$(read_from_control $control_file "archive_queue")"
+if [ -z "$archive_queue" ]; then archive_queue=0; fi
+
+# Trace each stage's time and resource usage into [calib_path]/[trace_output].
+trace="python ../scripts/trace_stage.py $control_file"
+
 # -----------------------------------------------------------------------------------------
 # ------------------------------------ Execute  -------------------------------------------
 # -----------------------------------------------------------------------------------------
@@ -82,52 +124,163 @@ python ../scripts/calculate_multp_bounds.py $control_file
 # (3) Update summa and mizuRoute start/end time based on control_file.
 echo "----- Update summa and mizuRoute configuration files -----"
 python ../scripts/update_model_config_files.py $control_file
+# Calibration trials only write the runoff read by mizuRoute if trial_output is minimal (see prune_output_control.py).
+python ../scripts/prune_output_control.py $control_file
+
+# (4) Resume from the checkpoint, or start a new calibration. On resume, multipliers.txt is restored to the 
+# in-flight param set (restored=yes, re-run without generating a new one) or to the last recorded one.
+start_iteration=1
+restored=no
+if [ "$resume_from_checkpoint" = "yes" ]; then
+    read start_iteration restored <<< "$(python ../scripts/calib_checkpoint.py $control_file resume)"
+    echo "----- Resume from iteration $start_iteration (in-flight param set restored: $restored) -----"
+else
+    rm -f $calib_path/calib_checkpoint.json
+fi
+
+# (5) Evaluate a space-filling initial design in parallel (initial_design), and start DDS from its best param set.
+# The design points count as the first iterations. Skipped when resuming after the design.
+initial_design="$(read_from_control $control_file "initial_design")"
+if [ -n "$initial_design" ] && [ "$initial_design" != "none" ] && [ "$start_iteration" -eq 1 ] && [ "$restored" != "yes" ]; then
+    echo "----- Evaluate initial design -----"
+    $trace initial_design python ../scripts/initial_design.py $control_file --trial_script ./run_trial.sh || exit 1
+    read start_iteration restored <<< "$(python ../scripts/calib_checkpoint.py $control_file resume)"
+fi
 
 
-# ### Run DDS ###
+# ### Run a population-based or multi-objective optimizer ###
+# Run SCE-UA, the genetic algorithm or PA-DDS (optimizer) with the remaining iterations, instead of DDS below.
+# After an initial design, the initial population includes its best param sets (SCE and GA).
+optimizer="$(read_from_control $control_file "optimizer")"
+if [ "$optimizer" = "SCE" ] || [ "$optimizer" = "GA" ] || [ "$optimizer" = "PADDS" ]; then
+    echo "===== Run $optimizer ====="
+    pop_warm_start=$warm_start
+    if [ "$start_iteration" -gt 1 ]; then pop_warm_start=yes; fi
+    case $optimizer in
+        SCE)   optimizer_script=SCE_UA.py ;;
+        GA)    optimizer_script=GA.py ;;
+        PADDS) optimizer_script=PA_DDS.py ;;
+    esac
+    $trace $optimizer python ../scripts/$optimizer_script $control_file --trial_script ./run_trial.sh \
+    --max_iterations $(( max_iterations-start_iteration+1 )) --warm_start $pop_warm_start || exit 1
+    rerun_best
+    exit
+elif [ -n "$optimizer" ] && [ "$optimizer" != "DDS" ]; then
+    echo "ERROR: optimizer must be DDS, SCE, GA or PADDS."
+    exit 1
+fi
+
+# ### Run multi-start DDS ###
+# Run [multistart] DDS trajectories concurrently with the remaining iterations, instead of one trajectory below.
+# After an initial design, the trajectories start from its best param sets.
+multistart="$(read_from_control $control_file "multistart")"
+if [ -n "$multistart" ] && [ "$multistart" -gt 1 ]; then
+    echo "===== Run multi-start DDS ====="
+    ms_warm_start=$warm_start
+    if [ "$start_iteration" -gt 1 ]; then ms_warm_start=yes; fi
+    $trace multistart python ../scripts/multistart_DDS.py $control_file --trial_script ./run_trial.sh \
+    --max_iterations $(( max_iterations-start_iteration+1 )) --warm_start $ms_warm_start || exit 1
+    rerun_best
+    exit
+fi
 echo "===== Run DDS  ====="
-for iteration_idx in $(seq 1 $max_iterations); do
+# Start the background archiver (see async_archiver.py). Outputs of an interrupted run left in its spool are archived first.
+if [ "$archive_queue" -gt 0 ]; then
+    python ../scripts/async_archiver.py $control_file serve &
+fi
+for iteration_idx in $(seq $start_iteration $max_iterations); do
     
     echo "----- iteration $iteration_idx -----"
+    export CALIB_ITERATION=$iteration_idx # used by trace_stage.py
     
     # # ----------------------------------------------------------------------------
     # --- 1.  generate a new sample param set                                    ---
     # ------------------------------------------------------------------------------
-    echo generate param sett
-    date | awk '{printf("%s: generate parameter set\n",$0)}' >> $calib_path/timetrack.log
-    
-    python ../scripts/DDS.py $iteration_idx $max_iterations $initial_option $warm_start \
-    $calib_path/multiplier_bounds.txt $calib_path/multipliers.tpl \
-    $calib_path/multipliers.txt $calib_path/calib_converge_history.txt
+    if [ "$restored" = "yes" ]; then
+        # the in-flight param set of the checkpoint is already in multipliers.txt
+        restored=no
+    else
+        echo generate param sett
+        date | awk '{printf("%s: generate parameter set\n",$0)}' >> $calib_path/timetrack.log
+
+        $trace dds python $dds_script $iteration_idx $max_iterations $initial_option $warm_start \
+        $calib_path/multiplier_bounds.txt $calib_path/multipliers.tpl \
+        $calib_path/multipliers.txt $calib_path/calib_converge_history.txt --checkpoint $checkpoint
+    fi
     
     # # ----------------------------------------------------------------------------
-    # --- 2.  conduct run_trial.sh                                               ---
+    # --- 2.  screen the param set on a short period (multi-fidelity)            ---
+    # ------------------------------------------------------------------------------
+    if [ -n "$screen_simPeriod" ] && [ "$screen_simPeriod" != "none" ]; then
+        echo screen trial
+        date | awk '{printf("%s: screen trial\n",$0)}' >> $calib_path/timetrack.log
+        python ../scripts/screen_candidate.py $control_file prepare
+        python ../scripts/update_model_config_files.py $calib_path/control_screen.txt
+        ./run_trial.sh $calib_path/control_screen.txt > $calib_path/ExeOut_screen.txt
+        decision=$(python ../scripts/screen_candidate.py $control_file decide $iteration_idx)
+        python ../scripts/update_model_config_files.py $control_file
+        echo screening result: $decision
+
+        # Skip the full-period run of a rejected param set. The next DDS param set is a neighbour of the best one.
+        if [ "$decision" != "promote" ]; then
+            if [ "$archive_queue" -gt 0 ]; then python ../scripts/async_archiver.py $control_file wait; fi
+            if [ -f $calib_path/output_archive/multipliers.txt ]; then 
+                cp $calib_path/output_archive/multipliers.txt $calib_path/multipliers.txt
+            fi
+            python ../scripts/calib_checkpoint.py $control_file record $iteration_idx
+            continue
+        fi
+    fi
+
+    # # ----------------------------------------------------------------------------
+    # --- 3.  conduct run_trial.sh                                               ---
     # ------------------------------------------------------------------------------
     echo run trial
     date | awk '{printf("%s: run trial\n",$0)}' >> $calib_path/timetrack.log    
-    ./run_trial.sh > ExeOut.txt
+    ./run_trial.sh $control_file > $calib_path/ExeOut.txt
     
     # # ----------------------------------------------------------------------------
-    # --- 3.  save param and obj                                                  ---
+    # --- 4.  save param and obj                                                  ---
     # ------------------------------------------------------------------------------
     echo save param and obj
     date | awk '{printf("%s: save param and obj\n",$0)}' >> $calib_path/timetrack.log
-    python ../scripts/save_param_obj.py $control_file $iteration_idx
+    $trace save_param_obj python ../scripts/save_param_obj.py $control_file $iteration_idx
 
     # # ----------------------------------------------------------------------------
-    # --- 4.  save model output                                              ---
+    # --- 5.  save model output                                              ---
     # ------------------------------------------------------------------------------
-    echo save model output
-    date | awk '{printf("%s: saving model output\n",$0)}' >> $calib_path/timetrack.log
-    ../scripts/save_model_output.sh $control_file $iteration_idx
+    # With archive_queue > 0, hand the outputs over to the background archiver, which saves them (steps 5 and 6)
+    # while the next trial runs.
+    if [ "$archive_queue" -gt 0 ]; then
+        echo submit model output to the archiver
+        date | awk '{printf("%s: submit model output\n\n",$0)}' >> $calib_path/timetrack.log
+        $trace archive_submit python ../scripts/async_archiver.py $control_file submit $iteration_idx
+    else
+        echo save model output
+        date | awk '{printf("%s: saving model output\n",$0)}' >> $calib_path/timetrack.log
+        $trace archive ../scripts/save_model_output.sh $control_file $iteration_idx
+
+        # # ----------------------------------------------------------------------------
+        # --- 6.  save the best output                                              ---
+        # ------------------------------------------------------------------------------
+        echo save best output
+        date | awk '{printf("%s: save best output\n\n",$0)}' >> $calib_path/timetrack.log
+        $trace save_best python ../scripts/save_best.py $control_file $iteration_idx
+    fi
 
     # # ----------------------------------------------------------------------------
-    # --- 5.  save the best output                                              ---
+    # --- 7.  record the iteration in the checkpoint                             ---
     # ------------------------------------------------------------------------------
-    echo save best output
-    date | awk '{printf("%s: save best output\n\n",$0)}' >> $calib_path/timetrack.log
-    python ../scripts/save_best.py $control_file $iteration_idx
+    python ../scripts/calib_checkpoint.py $control_file record $iteration_idx
 
 done
 
+# Wait until the background archiver has saved all outputs, and stop it.
+if [ "$archive_queue" -gt 0 ]; then
+    python ../scripts/async_archiver.py $control_file stop
+fi
+
+# Rerun the best param set with the full summa outputs (trial_output minimal).
+rerun_best
+
 exit
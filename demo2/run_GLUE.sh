@@ -0,0 +1,75 @@
+#!/bin/bash
+
+# Run GLUE uncertainty estimation with a parallel trial pool (scripts/GLUE.py).
+
+#### Note: When use on cluster: module load python; module load nco.
+
+# -----------------------------------------------------------------------------------------
+# ----------------------------- User specified input --------------------------------------
+# -----------------------------------------------------------------------------------------
+control_file=${1:-control_active.txt}  # path of the active control file. Optional argument, eg, a sub-basin control file.
+
+# -----------------------------------------------------------------------------------------
+# ------------------------------------ Functions ------------------------------------------
+# -----------------------------------------------------------------------------------------
+# Function to extract a given setting from the control_file.
+read_from_control () {
+    control_file=$1
+    setting=$2
+    
+    line=$(grep -m 1 "^${setting}" $control_file)
+    info=$(echo ${line##*|}) # remove the part that ends at "|"
+    info=$(echo ${info%%#*}) # remove the part starting at '#'; does nothing if no '#' is present
+    echo $info
+}
+
+# Function to extract a given setting from the summa or mizuRoute configuration file.
+read_from_summa_route_config () {
+    input_file=$1
+    setting=$2
+    
+    line=$(grep -m 1 "^${setting}" $input_file) 
+    info=$(echo ${line%%!*}) # remove the part starting at '!'
+    info="$( cut -d ' ' -f 2- <<< "$info" )" # get string after the first space
+    info="${info%\'}" # remove the suffix '. Do nothing if no '.
+    info="${info#\'}" # remove the prefix '. Do nothing if no '.
+    echo $info
+}
+
+# -----------------------------------------------------------------------------------------
+# -------------------------- Read settings from control_file ------------------------------
+# -----------------------------------------------------------------------------------------
+# Read calibration path from control_file.
+calib_path="$(read_from_control $control_file "calib_path")"
+
+# Trace each stage's time and resource usage into [calib_path]/[trace_output].
+trace="python ../scripts/trace_stage.py $control_file"
+
+# -----------------------------------------------------------------------------------------
+# ------------------------------------ Execute  -------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+# ### Prepare ###
+echo "===== Prepare ====="
+# (1) Generate the a priori parameter file.
+echo "----- Generate a priori parameter file -----"
+python ../scripts/generate_priori_trialParam.py $control_file
+
+# (2) Calculate the parameter multiplier lower and upper bounds.
+echo "----- Calculate multiplier bounds -----"
+python ../scripts/calculate_multp_bounds.py $control_file
+
+# (3) Update summa and mizuRoute start/end time based on control_file.
+echo "----- Update summa and mizuRoute configuration files -----"
+python ../scripts/update_model_config_files.py $control_file
+# Calibration trials only write the runoff read by mizuRoute if trial_output is minimal (see prune_output_control.py).
+python ../scripts/prune_output_control.py $control_file
+
+
+# ### Run GLUE ###
+# Sample glue_samples param sets, run them in parallel with run_trial.sh, and keep the behavioural runs
+# (KGE >= glue_threshold) in [calib_path]/glue_behavioural.nc and their uncertainty bounds in [calib_path]/glue_bounds.nc.
+echo "===== Run GLUE ====="
+$trace glue python ../scripts/GLUE.py $control_file --trial_script ./run_trial.sh
+
+exit
@@ -7,7 +7,8 @@
 # -----------------------------------------------------------------------------------------
 # ----------------------------- User specified input --------------------------------------
 # -----------------------------------------------------------------------------------------
-control_file="control_active.txt"  # path of the active control file
+control_file=${1:-control_active.txt}  # path of the active control file. Optional argument, eg, the screening control file.
+start_stage=${2:-params}               # first stage: params (full trial), or route (summa output exists, eg, a member of gru_ensemble).
 
 # -----------------------------------------------------------------------------------------
 # ------------------------------------ Functions ------------------------------------------
@@ -80,32 +81,49 @@ route_outFilePrefix="$(read_from_summa_route_config $route_control "<case_name>"
 stat_output="$(read_from_control $control_file "stat_output")"
 stat_output=${calib_path}/${stat_output}
 
+# Read the number of simulation time chunks. If more than one, route each chunk while summa runs the next one.
+sim_chunks="$(read_from_control $control_file "sim_chunks")"
+if [ -z "$sim_chunks" ]; then sim_chunks=1; fi
+
+# Trace each stage's time and resource usage into [calib_path]/[trace_output].
+trace="python ../scripts/trace_stage.py $control_file"
+
 # -----------------------------------------------------------------------------------------
 # ---------------------------------- Execute trial ----------------------------------------
 # -----------------------------------------------------------------------------------------
 
 echo "===== executing trial ====="
 
-# ------------------------------------------------------------------------------
-# --- 1.  Update params                                                      ---
-# ------------------------------------------------------------------------------
-echo "--- updating params ---"
-date | awk '{printf("%s: update params\n",$0)}' >> $calib_path/timetrack.log
-python ../scripts/update_paramTrial.py $control_file
-echo " "
-
-# ------------------------------------------------------------------------------
-# --- 2.  Run summa                                                          ---
-# ------------------------------------------------------------------------------
-echo "--- run summa ---"
-date | awk '{printf("%s: run summa\n",$0)}' >> $calib_path/timetrack.log
-
-# (1) Create summa output path if it does not exist; and remove previous outputs.
-if [ ! -d $summa_outputPath ]; then mkdir -p $summa_outputPath; fi
-rm -f $summa_outputPath/${summa_outFilePrefix}*
-
-# (2) Run Summa.
-${summaExe} -r never -m $summa_filemanager
+if [ "$start_stage" != "route" ]; then
+
+    # ------------------------------------------------------------------------------
+    # --- 1.  Update params                                                      ---
+    # ------------------------------------------------------------------------------
+    echo "--- updating params ---"
+    date | awk '{printf("%s: update params\n",$0)}' >> $calib_path/timetrack.log
+    $trace update_params python ../scripts/update_paramTrial.py $control_file
+    echo " "
+
+    # ------------------------------------------------------------------------------
+    # --- 2.  Run summa                                                          ---
+    # ------------------------------------------------------------------------------
+    echo "--- run summa ---"
+    date | awk '{printf("%s: run summa\n",$0)}' >> $calib_path/timetrack.log
+
+    # (1) Create summa output path if it does not exist; and remove previous outputs.
+    if [ ! -d $summa_outputPath ]; then mkdir -p $summa_outputPath; fi
+    rm -f $summa_outputPath/${summa_outFilePrefix}*
+
+    # (2) Run Summa. For a chunked run, also route and merge the chunks (steps 3 and 4 are done in this step).
+    if [ "$sim_chunks" -gt 1 ]; then
+        if [ ! -d $route_outputPath ]; then mkdir -p $route_outputPath; fi
+        rm -f $route_outputPath/${route_outFilePrefix}*
+        python ../scripts/run_chunked_simulation.py $control_file
+    else
+        $trace summa ${summaExe} -r never -m $summa_filemanager
+    fi
+
+fi
 
 # ------------------------------------------------------------------------------
 # --- 3.  Post-process summa output for route                                ---
@@ -115,7 +133,15 @@ date | awk '{printf("%s: post-process summa output\n",$0)}' >> $calib_path/timet
 # Hard coded file name "xxx_day.nc". Valid for daily simulation.
 # Shift summa output time back 1 day for routing - only if computing daily outputs!
 # Summa use end of time step for time values, but mizuRoute use beginning of time step.
-ncap2 -h -O -s 'time[time]=time-86400' $summa_outputPath/$summa_outFilePrefix\_day.nc $summa_outputPath/$summa_outFilePrefix\_day.nc
+if [ "$sim_chunks" -le 1 ]; then
+    $trace time_shift ncap2 -h -O -s 'time[time]=time-86400' $summa_outputPath/$summa_outFilePrefix\_day.nc $summa_outputPath/$summa_outFilePrefix\_day.nc
+fi
+
+# Append the fixed runoff of upstream GRUs (downstream sub-basins of schedule_subbasins.py; route_inflow_file).
+route_inflow_file="$(read_from_control $control_file "route_inflow_file")"
+if [ -n "$route_inflow_file" ] && [ "$route_inflow_file" != "none" ]; then
+    $trace merge_inflow python ../scripts/merge_upstream_runoff.py $control_file
+fi
 
 # ------------------------------------------------------------------------------
 # --- 4.  Run mizuRoute                                                      ---
@@ -123,23 +149,25 @@ ncap2 -h -O -s 'time[time]=time-86400' $summa_outputPath/$summa_outFilePrefix\_d
 echo "--- run mizuRoute ---"
 date | awk '{printf("%s: run mizuRoute\n",$0)}' >> $calib_path/timetrack.log
 
-# (1) Create mizuRoute output path if it does not exist; and remove existing outputs.
-if [ ! -d $route_outputPath ]; then mkdir -p $route_outputPath; fi
-rm -f $route_outputPath/${route_outFilePrefix}*
+if [ "$sim_chunks" -le 1 ]; then
+    # (1) Create mizuRoute output path if it does not exist; and remove existing outputs.
+    if [ ! -d $route_outputPath ]; then mkdir -p $route_outputPath; fi
+    rm -f $route_outputPath/${route_outFilePrefix}*
 
-# (2) Run mizuRoute.
-${routeExe} $route_control
-wait
+    # (2) Run mizuRoute.
+    $trace route ${routeExe} $route_control
+    wait
 
-# (3) Merge output runoff into one file for statistics calculation. Hard coded output file name.
-ncrcat -O -h $route_outputPath/${route_outFilePrefix}* $route_outputPath/${route_outFilePrefix}.mizuRoute.nc
+    # (3) Merge output runoff into one file for statistics calculation. Hard coded output file name.
+    $trace route_merge ncrcat -O -h $route_outputPath/${route_outFilePrefix}* $route_outputPath/${route_outFilePrefix}.mizuRoute.nc
+fi
 
 # ------------------------------------------------------------------------------
 # --- 5.  Calculate statistics                                               ---
 # ------------------------------------------------------------------------------
 echo "--- calculating statistics ---"
 date | awk '{printf("%s: calculate statistics\n",$0)}' >> $calib_path/timetrack.log
-python ../scripts/calculate_sim_stats.py $control_file 
+$trace stats python ../scripts/calculate_sim_stats.py $control_file 
 
 date | awk '{printf("%s: done with trial\n",$0)}' >> $calib_path/timetrack.log
 
@@ -16,6 +16,20 @@
 control_active=control_active.txt  # path of the active control file
 nSubset=51                         # number of GRU subsets to split summa run. Suggest being consistent with the above ntasks.
 
+# -----------------------------------------------------------------------------------------
+# ------------------------------------ Functions ------------------------------------------
+# -----------------------------------------------------------------------------------------
+# Function to extract a given setting from the control_file.
+read_from_control () {
+    control_file=$1
+    setting=$2
+    
+    line=$(grep -m 1 "^${setting}" $control_file)
+    info=$(echo ${line##*|}) # remove the part that ends at "|"
+    info=$(echo ${info%%#*}) # remove the part starting at '#'; does nothing if no '#' is present
+    echo $info
+}
+
 # -----------------------------------------------------------------------------------------
 # ------------------------------------ Execute  -------------------------------------------
 # -----------------------------------------------------------------------------------------
@@ -33,14 +47,31 @@ python ../scripts/calculate_multp_bounds.py $control_active
 # (3) Update summa and mizuRoute start/end time based on control_active.txt.
 echo "----- Update summa and mizuRoute configuration files -----"
 python ../scripts/update_model_config_files.py $control_active
+# The best param set is not rerun with full outputs here (see rerun_best.py), so the trials write the full outputs.
+python ../scripts/prune_output_control.py $control_active --full_only || exit 1
 
 # (4) Create ostIn.txt by adding multiplier and other configurations.
 echo "----- Create ostIn.txt -----"
 python ../scripts/create_ostIn.py $control_active
 
-# (5) Make a summa_run_list to split and parallalize summa runs based on nSubset.
+# (5) Stage the model inputs on node-local storage (if node_staging is set), on every node of the allocation. 
+# With srun, the GRU subsets run on several nodes, so summa outputs and trialParams.nc stay in the shared model
+# (--keep_outputs): the trial updates the params on this node only.
+control_model=$control_active
+node_staging="$(read_from_control $control_active "node_staging")"
+if [ -n "$node_staging" ] && [ "$node_staging" != "none" ]; then
+    echo "----- Stage model inputs -----"
+    if [ "$(read_from_control $control_active "summa_run_backend")" = "local" ]; then
+        control_model="$(python ../scripts/stage_model.py $control_active)"
+    else
+        srun --ntasks-per-node=1 --ntasks=$SLURM_JOB_NUM_NODES python ../scripts/stage_model.py $control_active --keep_outputs > /dev/null
+        control_model="$(python ../scripts/stage_model.py $control_active --keep_outputs)"
+    fi
+fi
+
+# (6) Make a summa_run_list to split and parallalize summa runs based on nSubset.
 echo "----- Make summa_run_list -----"
-../scripts/make_summa_run_list.sh $control_active $nSubset
+../scripts/make_summa_run_list.sh $control_model $nSubset
 
 
 # ### Run Ostrich ###
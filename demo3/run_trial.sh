@@ -41,6 +41,15 @@ read_from_summa_route_config () {
 # ---------------------- Read configurations from control_file ----------------------------
 # -----------------------------------------------------------------------------------------
 
+# Use the model staged on node-local storage if node_staging is set (see stage_model.py and run_Ostrich.sh).
+# The staged control file only differs in model_path, so outputs are read from (and written to) the staged model.
+node_staging="$(read_from_control $control_file "node_staging")"
+if [ -n "$node_staging" ] && [ "$node_staging" != "none" ]; then
+    keep_outputs="--keep_outputs"
+    if [ "$(read_from_control $control_file "summa_run_backend")" = "local" ]; then keep_outputs=""; fi
+    control_file="$(python ../scripts/stage_model.py $control_file $keep_outputs)"
+fi
+
 # Read calibration path from control_file.
 calib_path="$(read_from_control $control_file "calib_path")"
 
@@ -69,6 +78,10 @@ summa_attributeFile="$(read_from_summa_route_config $summa_filemanager "attribut
 summa_attributeFile=$summa_settings_path/$summa_attributeFile
 nGRU=$( ncks -Cm -v gruId -m $summa_attributeFile | grep 'gru = '| cut -d' ' -f 7 )
 
+# Read the GRU split option (equal or balanced) and how to run the GRU subsets (srun or local).
+gru_partition="$(read_from_control $control_file "gru_partition")"
+summa_run_backend="$(read_from_control $control_file "summa_run_backend")"
+
 # Extract summa output path and prefix from fileManager.txt (use to remove summa outputs).
 summa_outputPath="$(read_from_summa_route_config $summa_filemanager "outputPath")"
 summa_outFilePrefix="$(read_from_summa_route_config $summa_filemanager "outFilePrefix")"
@@ -81,6 +94,9 @@ route_outFilePrefix="$(read_from_summa_route_config $route_control "<case_name>"
 stat_output="$(read_from_control $control_file "stat_output")"
 stat_output=${calib_path}/${stat_output}
 
+# Trace each stage's time and resource usage into [calib_path]/[trace_output].
+trace="python ../scripts/trace_stage.py $control_file"
+
 # -----------------------------------------------------------------------------------------
 # ---------------------------------- Execute trial ----------------------------------------
 # -----------------------------------------------------------------------------------------
@@ -93,7 +109,7 @@ date | awk '{printf("%s: ---- executing new trial ----\n",$0)}' >> $calib_path/t
 # ------------------------------------------------------------------------------
 echo "--- updating params ---"
 date | awk '{printf("%s: update params\n",$0)}' >> $calib_path/timetrack.log
-python ../scripts/update_paramTrial.py $control_file
+$trace update_params python ../scripts/update_paramTrial.py $control_file
 echo " "
 
 # ------------------------------------------------------------------------------
@@ -106,13 +122,22 @@ date | awk '{printf("%s: run summa\n",$0)}' >> $calib_path/timetrack.log
 if [ ! -d $summa_outputPath ]; then mkdir -p $summa_outputPath; fi
 rm -f $summa_outputPath/${summa_outFilePrefix}*
 
-# (2) Run summa (use multiples cores on the allocated nodes).
-srun --kill-on-bad-exit=0 --multi-prog ./summa_run_list.txt
+# (2) Rebalance GRU subsets based on the measured subset run times of previous trials. Keep the number of subsets.
+if [ "$gru_partition" = "balanced" ]; then
+    ../scripts/make_summa_run_list.sh $control_file $(grep -c . ./summa_run_list.txt)
+fi
+
+# (3) Run summa (use multiples cores on the allocated nodes, or on the current node if backend is local).
+if [ "$summa_run_backend" = "local" ]; then
+    $trace summa python ../scripts/run_summa_subsets.py $control_file ./summa_run_list.txt
+else
+    $trace summa srun --kill-on-bad-exit=0 --multi-prog ./summa_run_list.txt
+fi
 wait
 
-# (3) Merge GRU subsets' daily output runoff into one file for routing. 
+# (4) Merge GRU subsets' daily output runoff into one file for routing. 
 echo concatenate summa output files in $summa_outputPath
-python ../scripts/concat_summa_ouputs.py $control_file 
+$trace concat python ../scripts/concat_summa_ouputs.py $control_file 
 
 # ------------------------------------------------------------------------------
 # --- 3.  Post-process summa output for route                                ---
@@ -122,7 +147,7 @@ date | awk '{printf("%s: post-process summa output\n",$0)}' >> $calib_path/timet
 # Hard coded file name "xxx_day.nc". Valid for daily simulation.
 # Shift summa output time back 1 day for routing - only if computing daily outputs!
 # Summa use end of time step for time values, but mizuRoute use beginning of time step.
-ncap2 -h -O -s 'time[time]=time-86400' $summa_outputPath/$summa_outFilePrefix\_day.nc $summa_outputPath/$summa_outFilePrefix\_day.nc
+$trace time_shift ncap2 -h -O -s 'time[time]=time-86400' $summa_outputPath/$summa_outFilePrefix\_day.nc $summa_outputPath/$summa_outFilePrefix\_day.nc
 
 # ------------------------------------------------------------------------------
 # --- 4.  Run mizuRoute                                                      ---
@@ -147,18 +172,18 @@ rm -f $route_outputPath/${route_outFilePrefix}*
 #############################################
 
 # (2) Run mizuRoute.
-${routeExe} $route_control
+$trace route ${routeExe} $route_control
 wait
 
 # (3) Merge output runoff into one file for statistics calculation. Hard coded output file name.
-ncrcat -O -h $route_outputPath/${route_outFilePrefix}* $route_outputPath/${route_outFilePrefix}.mizuRoute.nc
+$trace route_merge ncrcat -O -h $route_outputPath/${route_outFilePrefix}* $route_outputPath/${route_outFilePrefix}.mizuRoute.nc
 
 # ------------------------------------------------------------------------------
 # --- 5.  Calculate statistics for Ostrich                                   ---
 # ------------------------------------------------------------------------------
 echo "--- calculating statistics ---"
 date | awk '{printf("%s: calculate statistics\n",$0)}' >> $calib_path/timetrack.log
-python ../scripts/calculate_sim_stats.py $control_file 
+$trace stats python ../scripts/calculate_sim_stats.py $control_file 
 
 date | awk '{printf("%s: done with trial\n",$0)}' >> $calib_path/timetrack.log
 
@@ -36,6 +36,15 @@ read_from_summa_route_config () {
 # -----------------------------------------------------------------------------------------
 # ------------------------- Settings based on control_file --------------------------------
 # -----------------------------------------------------------------------------------------
+# Use the model staged on node-local storage if node_staging is set (see stage_model.py and run_Ostrich.sh).
+# The staged control file only differs in model_path, so outputs are read from (and written to) the staged model.
+node_staging="$(read_from_control $control_file "node_staging")"
+if [ -n "$node_staging" ] && [ "$node_staging" != "none" ]; then
+    keep_outputs="--keep_outputs"
+    if [ "$(read_from_control $control_file "summa_run_backend")" = "local" ]; then keep_outputs=""; fi
+    control_file="$(python ../scripts/stage_model.py $control_file $keep_outputs)"
+fi
+
 # Read calibration path from control_file.
 calib_path="$(read_from_control $control_file "calib_path")"
 
@@ -84,7 +93,7 @@ mkdir -p $outDir
 echo "saving input and output files for the best solution."
 
 # save control_file
-cp $calib_path/$control_file $outDir/
+cp $calib_path/$(basename $control_file) $outDir/
 
 # save multiplier related files.
 cp $calib_path/multiplier* $outDir/
@@ -63,6 +63,21 @@ max_iterations="$(read_from_control $control_file "max_iterations")"
 warm_start="$(read_from_control $control_file "WarmStart")"
 initial_option="$(read_from_control $control_file "initial_option")"
 
+# Read the GRU split option (equal or balanced).
+gru_partition="$(read_from_control $control_file "gru_partition")"
+
+# Read the wall-time limit of packed jobs (none: submit a summa job array and a route job per iteration), 
+# and how to run the GRU subsets (local also runs the packed jobs on the current node without SLURM).
+packing_walltime="$(read_from_control $control_file "packing_walltime")"
+summa_run_backend="$(read_from_control $control_file "summa_run_backend")"
+
+# Read whether to resume from the checkpoint of a preempted or time-limited run (see calib_checkpoint.py).
+resume_from_checkpoint="$(read_from_control $control_file "resume_from_checkpoint")"
+checkpoint=$calib_path/calib_checkpoint.json
+
+# Trace each stage's time and resource usage into [calib_path]/[trace_output].
+trace="python ../scripts/trace_stage.py $control_file"
+
 # -----------------------------------------------------------------------------------------
 # ------------------------------------ Execute  -------------------------------------------
 # -----------------------------------------------------------------------------------------
@@ -80,32 +95,80 @@ python ../scripts/calculate_multp_bounds.py $control_file
 # (3) Update summa and mizuRoute start/end time based on control_file.
 echo "----- Update summa and mizuRoute configuration files -----"
 python ../scripts/update_model_config_files.py $control_file
+# The best param set is not rerun with full outputs here (see rerun_best.py), so the trials write the full outputs.
+python ../scripts/prune_output_control.py $control_file --full_only || exit 1
 
 # (4) Create slurm output folder if not exist
 if [ ! -d slurm_outputs ]; then mkdir slurm_outputs; fi
 
+# (5) Split GRUs into nJob*nSubset subsets of balanced run time (nJob and nSubset are set in summa_job_file).
+if [ "$gru_partition" = "balanced" ]; then
+    echo "----- Make GRU partition -----"
+    nJob=$(grep -m 1 "^nJob=" $summa_job_file | cut -d'=' -f 2 | cut -d' ' -f 1)
+    nSubset=$(grep -m 1 "^nSubset=" $summa_job_file | cut -d'=' -f 2 | cut -d' ' -f 1)
+    python ../scripts/partition_grus.py $control_file $(( nJob*nSubset ))
+fi
+
+# (6) Resume from the checkpoint, or start a new calibration. On resume, multipliers.txt is restored to the 
+# in-flight param set (restored=yes, re-run without generating a new one) or to the last recorded one.
+start_iteration=1
+restored=no
+if [ "$resume_from_checkpoint" = "yes" ]; then
+    read start_iteration restored <<< "$(python ../scripts/calib_checkpoint.py $control_file resume)"
+    echo "----- Resume from iteration $start_iteration (in-flight param set restored: $restored) -----"
+else
+    rm -f $calib_path/calib_checkpoint.json
+fi
+
+
+# ### Run packed jobs ###
+# One allocation runs as many iterations as fit in packing_walltime, then submits the next one (see run_packed.sh).
+if [ -n "$packing_walltime" ] && [ "$packing_walltime" != "none" ]; then
+    echo "===== Run packed jobs ====="
+    if [ "$summa_run_backend" = "local" ]; then
+        # Run the packed jobs one after another on the current node, with the same wall-time limit.
+        packed_idx=0
+        while ./run_packed.sh $control_file > slurm_outputs/demo4packed-local-${packed_idx}.out; do
+            next_iteration=$(python ../scripts/calib_checkpoint.py $control_file resume | cut -d' ' -f1)
+            echo packed job $packed_idx done, next iteration $next_iteration
+            if [ "$next_iteration" -gt "$max_iterations" ]; then break; fi
+            packed_idx=$(( packed_idx+1 ))
+        done
+    else
+        current=$( sbatch --time=$packing_walltime run_packed.sh $control_file | awk '{ print $4 }' )
+        echo packed $current
+    fi
+    exit 0
+fi
+
 
 # ### Submit jobs ###
 # Submit depedent jobs by updating next and current
 echo "===== Submit depedent jobs ====="
-for iteration_idx in $(seq 1 $max_iterations); do
+for iteration_idx in $(seq $start_iteration $max_iterations); do
     echo iteration $iteration_idx
+    export CALIB_ITERATION=$iteration_idx # used by trace_stage.py
 
     # ------------------------------------------------------------------------------
-    # The first iteration jobs.
+    # The first iteration jobs (the first iteration after a resume).
     # ------------------------------------------------------------------------------
-    if [ "$iteration_idx" -eq 1 ]; then
+    if [ "$iteration_idx" -eq "$start_iteration" ]; then
         # ------------------------------------------------------------------------------
         # --- 1.  Generate params via DDS                                            ---
         # ------------------------------------------------------------------------------
-        python ../scripts/DDS.py $iteration_idx $max_iterations $initial_option $warm_start \
-        $calib_path/multiplier_bounds.txt $calib_path/multipliers.tpl \
-        $calib_path/multipliers.txt $calib_path/calib_converge_history.txt
+        # As in run_route.sh, the param set of iteration i+1 is generated by DDS iteration i.
+        if [ "$restored" != "yes" ]; then
+            dds_idx=$(( iteration_idx > 1 ? iteration_idx-1 : 1 ))
+            $trace dds python ../scripts/DDS.py $dds_idx $max_iterations $initial_option $warm_start \
+            $calib_path/multiplier_bounds.txt $calib_path/multipliers.tpl \
+            $calib_path/multipliers.txt $calib_path/calib_converge_history.txt \
+            --checkpoint $checkpoint --trial_idx $iteration_idx
+        fi
 
         # ------------------------------------------------------------------------------
         # --- 2.  Update params for summa                                             ---
         # ------------------------------------------------------------------------------
-        python ../scripts/update_paramTrial.py $control_file
+        $trace update_params python ../scripts/update_paramTrial.py $control_file
 
         # ------------------------------------------------------------------------------
         # --- 3.  Submit run summa & route                                           ---
@@ -116,7 +179,7 @@ for iteration_idx in $(seq 1 $max_iterations); do
 
         # (2) Submit the 1st job: run summa (array job)
         # $4 is used to return jobid
-        current=$( sbatch ${summa_job_file} ${control_file} | awk '{ print $4 }' )  
+        current=$( sbatch ${summa_job_file} ${control_file} ${iteration_idx} | awk '{ print $4 }' )  
         echo summa $current
         
         # (3) Submit depedent job: run route and all others except run summa
@@ -133,7 +196,7 @@ for iteration_idx in $(seq 1 $max_iterations); do
         # --- 1.  Submit run summa & route                                           ---
         # ------------------------------------------------------------------------------
         # (1) Submit depedent job: run summa (array job)
-        next=$( sbatch --dependency=afterany:${current} ${summa_job_file} ${control_file} | awk '{ print $4 }' )
+        next=$( sbatch --dependency=afterany:${current} ${summa_job_file} ${control_file} ${iteration_idx} | awk '{ print $4 }' )
         current=$next
         echo summa $current
 
@@ -0,0 +1,160 @@
+#!/bin/bash
+#SBATCH --account=<account>
+#SBATCH --time=03:00:00
+#SBATCH --ntasks=6
+#SBATCH --mem-per-cpu=100MB
+#SBATCH --job-name=demo4packed
+#SBATCH --output=slurm_outputs/%x-%j.out
+
+# Run many calibration iterations back-to-back in one allocation (packing_walltime in control_file).
+# Each iteration runs summa on all GRU subsets, then run_route.sh (route, statistics, save, DDS, update params).
+# Before each iteration, plan_job_packing.py checks that it fits in the remaining wall time (estimated from the
+# measured trial times). When it does not, the job submits the next allocation, which resumes from the checkpoint.
+
+# -----------------------------------------------------------------------------------------
+# ----------------------------- User specified input --------------------------------------
+# -----------------------------------------------------------------------------------------
+control_file=$1   # "control_active.txt"
+nTask=6           # number of GRU subsets in summa GRUs split. Should be the same as in --ntasks.
+
+# -----------------------------------------------------------------------------------------
+# ------------------------------------ Functions ------------------------------------------
+# -----------------------------------------------------------------------------------------
+# Function to extract a given setting from the control_file.
+read_from_control () {
+    control_file=$1
+    setting=$2
+
+    line=$(grep -m 1 "^${setting}" $control_file)
+    info=$(echo ${line##*|}) # remove the part that ends at "|"
+    info=$(echo ${info%%#*}) # remove the part starting at '#'; does nothing if no '#' is present
+    echo $info
+}
+
+# Function to extract a given setting from the summa or mizuRoute configuration file.
+read_from_summa_route_config () {
+    input_file=$1
+    setting=$2
+
+    line=$(grep -m 1 "^${setting}" $input_file)
+    info=$(echo ${line%%!*}) # remove the part starting at '!'
+    info="$( cut -d ' ' -f 2- <<< "$info" )" # get string after the first space
+    info="${info%\'}" # remove the suffix '. Do nothing if no '.
+    info="${info#\'}" # remove the prefix '. Do nothing if no '.
+    echo $info
+}
+
+# -----------------------------------------------------------------------------------------
+# -------------------------- Read settings from control_file ------------------------------
+# -----------------------------------------------------------------------------------------
+# Stage the model inputs on node-local storage of every node of this allocation, if node_staging is set (see
+# stage_model.py). The staged control file only differs in model_path, and is used by all steps below. With srun,
+# the GRU subsets may run on several nodes, so summa outputs stay in the shared model (--keep_outputs).
+# The next packed job is submitted with the shared control file (control_shared), and stages again.
+control_shared=$control_file
+node_staging="$(read_from_control $control_file "node_staging")"
+if [ -n "$node_staging" ] && [ "$node_staging" != "none" ]; then
+    if [ "$(read_from_control $control_file "summa_run_backend")" = "local" ]; then
+        control_file="$(python ../scripts/stage_model.py $control_file)"
+    else
+        srun --ntasks-per-node=1 --ntasks=$SLURM_JOB_NUM_NODES python ../scripts/stage_model.py $control_file --keep_outputs > /dev/null
+        control_file="$(python ../scripts/stage_model.py $control_file --keep_outputs)"
+    fi
+fi
+
+# Read calibration path from control_file.
+calib_path="$(read_from_control $control_file "calib_path")"
+
+# Read hydrologic model path from control_file.
+model_path="$(read_from_control $control_file "model_path")"
+if [ "$model_path" = "default" ]; then model_path="${calib_path}/model"; fi
+
+# Read summa setting and summa_filemanager paths.
+summa_settings_relpath="$(read_from_control $control_file "summa_settings_relpath")"
+summa_settings_path=$model_path/$summa_settings_relpath
+summa_filemanager="$(read_from_control $control_file "summa_filemanager")"
+summa_filemanager=$summa_settings_path/$summa_filemanager
+
+# Extract summa output path and prefix from fileManager.txt (use to remove summa outputs).
+summa_outputPath="$(read_from_summa_route_config $summa_filemanager "outputPath")"
+summa_outFilePrefix="$(read_from_summa_route_config $summa_filemanager "outFilePrefix")"
+
+# Read DDS max_iterations, warm_start, and initial_option from control_file.
+max_iterations="$(read_from_control $control_file "max_iterations")"
+warm_start="$(read_from_control $control_file "WarmStart")"
+initial_option="$(read_from_control $control_file "initial_option")"
+
+# Read how to run the GRU subsets (srun or local), and the wall-time limit of each packed job.
+summa_run_backend="$(read_from_control $control_file "summa_run_backend")"
+packing_walltime="$(read_from_control $control_file "packing_walltime")"
+
+# Read the number of trials whose outputs can wait for the background archiver (0: archive before the next trial).
+archive_queue="$(read_from_control $control_file "archive_queue")"
+if [ -z "$archive_queue" ]; then archive_queue=0; fi
+
+# Trace each stage's time and resource usage into [calib_path]/[trace_output].
+trace="python ../scripts/trace_stage.py $control_file"
+
+# -----------------------------------------------------------------------------------------
+# ------------------------------------- Execute -------------------------------------------
+# -----------------------------------------------------------------------------------------
+# (1) Restore the param set of the next iteration from the checkpoint.
+read iteration_idx restored <<< "$(python ../scripts/calib_checkpoint.py $control_file resume)"
+echo "----- Packed job from iteration $iteration_idx (in-flight param set restored: $restored) -----"
+if [ "$restored" != "yes" ] && [ "$iteration_idx" -le "$max_iterations" ]; then
+    # As in run_route.sh, the param set of iteration i+1 is generated by DDS iteration i.
+    dds_idx=$(( iteration_idx > 1 ? iteration_idx-1 : 1 ))
+    python ../scripts/DDS.py $dds_idx $max_iterations $initial_option $warm_start \
+    $calib_path/multiplier_bounds.txt $calib_path/multipliers.tpl \
+    $calib_path/multipliers.txt $calib_path/calib_converge_history.txt \
+    --checkpoint $calib_path/calib_checkpoint.json --trial_idx $iteration_idx
+fi
+python ../scripts/update_paramTrial.py $control_file
+if [ ! -d $summa_outputPath ]; then mkdir -p $summa_outputPath; fi
+rm -f $summa_outputPath/${summa_outFilePrefix}*
+
+# (2) Run iterations while the next one fits in the remaining wall time. The outputs of an iteration are archived
+# in the background while the next one runs (archive_queue > 0, see async_archiver.py).
+if [ "$archive_queue" -gt 0 ]; then
+    python ../scripts/async_archiver.py $control_file serve &
+fi
+nRun=0
+while [ "$iteration_idx" -le "$max_iterations" ]; do
+    nFit=$(python ../scripts/plan_job_packing.py $control_file $packing_walltime --elapsed $SECONDS)
+    echo "iteration $iteration_idx (elapsed ${SECONDS}s, iterations fitting: $nFit)"
+    if [ "$nFit" -lt 1 ]; then break; fi
+    export CALIB_ITERATION=$iteration_idx # used by trace_stage.py
+
+    # (2.1) Run summa on all GRU subsets.
+    ../scripts/make_summa_run_list.sh $control_file $nTask
+    if [ "$summa_run_backend" = "local" ]; then
+        $trace summa python ../scripts/run_summa_subsets.py $control_file summa_run_list.txt --nproc $nTask
+    else
+        $trace summa srun --kill-on-bad-exit=0 --multi-prog summa_run_list.txt
+    fi
+
+    # (2.2) Route, calculate statistics, save, generate and write the next param set.
+    ./run_route.sh $control_file $iteration_idx
+
+    iteration_idx=$(( iteration_idx+1 ))
+    nRun=$(( nRun+1 ))
+done
+
+# Wait until the background archiver has saved all outputs, and stop it.
+if [ "$archive_queue" -gt 0 ]; then
+    python ../scripts/async_archiver.py $control_file stop
+fi
+
+# (3) Submit the next packed job if iterations are left (the local backend is looped by run_DDS.sh).
+if [ "$iteration_idx" -le "$max_iterations" ]; then
+    if [ "$nRun" -eq 0 ]; then
+        echo "ERROR: No iteration fits in packing_walltime $packing_walltime. Increase packing_walltime."
+        exit 1
+    fi
+    if [ "$summa_run_backend" != "local" ]; then
+        next=$( sbatch --time=$packing_walltime run_packed.sh $control_shared | awk '{ print $4 }' )
+        echo packed $next
+    fi
+fi
+
+exit 0
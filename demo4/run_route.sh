@@ -79,10 +79,29 @@ max_iterations="$(read_from_control $control_file "max_iterations")"
 warm_start="$(read_from_control $control_file "WarmStart")"
 initial_option="$(read_from_control $control_file "initial_option")"
 
+# Read the number of DDS neighbours screened by a surrogate per iteration (0: plain DDS).
+surrogate_candidates="$(read_from_control $control_file "surrogate_candidates")"
+if [ -z "$surrogate_candidates" ]; then surrogate_candidates=0; fi
+dds_script=../scripts/DDS.py
+if [ "$surrogate_candidates" -gt 0 ]; then
+    dds_script="../scripts/surrogate_DDS.py --ncandidate $surrogate_candidates --search_hist_file $calib_path/calib_search_history.txt"
+fi
+
+# Read the GRU split option (equal or balanced).
+gru_partition="$(read_from_control $control_file "gru_partition")"
+
 # Get statistical output file from control_file.
 stat_output="$(read_from_control $control_file "stat_output")"
 stat_output=${calib_path}/${stat_output}
 
+# Read the number of trials whose outputs can wait for the background archiver (0: archive before the next trial).
+archive_queue="$(read_from_control $control_file "archive_queue")"
+if [ -z "$archive_queue" ]; then archive_queue=0; fi
+
+# Trace each stage's time and resource usage into [calib_path]/[trace_output].
+trace="python ../scripts/trace_stage.py $control_file"
+export CALIB_ITERATION=$iteration_idx
+
 # -----------------------------------------------------------------------------------------
 # ------------------------------------- Execute -------------------------------------------
 # -----------------------------------------------------------------------------------------
@@ -95,11 +114,11 @@ date | awk '{printf("%s: post-process summa output\n",$0)}' >> $calib_path/timet
 
 # Be careful. Hard coded file name "xxx_day.nc". Valid for daily simulation.
 # (1) Merge summa daily outputs into one file. 
-python ../scripts/concat_summa_ouputs.py $control_file 
+$trace concat python ../scripts/concat_summa_ouputs.py $control_file 
 
 # (2) Shift summa output time back 1 day for routing - only if computing daily outputs!
 # Summa use end of time step for time values, but mizuRoute use beginning of time step.
-ncap2 -h -O -s 'time[time]=time-86400' $summa_outputPath/${summa_outFilePrefix}_day.nc $summa_outputPath/${summa_outFilePrefix}_day.nc
+$trace time_shift ncap2 -h -O -s 'time[time]=time-86400' $summa_outputPath/${summa_outFilePrefix}_day.nc $summa_outputPath/${summa_outFilePrefix}_day.nc
 
 # ------------------------------------------------------------------------------
 # --- 2.  Run mizuRoute                                                      ---
@@ -125,17 +144,17 @@ rm -f $route_outputPath/${route_outFilePrefix}*
 #############################################
 
 # (2) Run mizuRoute.
-${routeExe} $route_control
+$trace route ${routeExe} $route_control
 
 # (3) Merge output runoff into one file for statistics calculation.
-ncrcat -O -h $route_outputPath/${route_outFilePrefix}* $route_outputPath/${route_outFilePrefix}.mizuRoute.nc
+$trace route_merge ncrcat -O -h $route_outputPath/${route_outFilePrefix}* $route_outputPath/${route_outFilePrefix}.mizuRoute.nc
 
 # ------------------------------------------------------------------------------
 # --- 3.  Calculate statistics                                               ---
 # ------------------------------------------------------------------------------
 echo calculate statistics
 date | awk '{printf("%s: calculate statistics\n",$0)}' >> $calib_path/timetrack.log
-python ../scripts/calculate_sim_stats.py $control_file
+$trace stats python ../scripts/calculate_sim_stats.py $control_file
 wait
 
 # # ----------------------------------------------------------------------------
@@ -143,21 +162,32 @@ wait
 # ------------------------------------------------------------------------------
 echo save param and obj
 date | awk '{printf("%s: save param and obj\n",$0)}' >> $calib_path/timetrack.log
-python ../scripts/save_param_obj.py $control_file $iteration_idx 
+$trace save_param_obj python ../scripts/save_param_obj.py $control_file $iteration_idx 
 
 # # ----------------------------------------------------------------------------
 # --- 5.  Save model output                                                  ---
 # ------------------------------------------------------------------------------
-echo save model output
-date | awk '{printf("%s: saving model output\n",$0)}' >> $calib_path/timetrack.log
-../scripts/save_model_output.sh $control_file $iteration_idx
-
-# # ----------------------------------------------------------------------------
-# --- 6.  Save the best output                                               ---
-# ------------------------------------------------------------------------------
-echo save best output
-date | awk '{printf("%s: save best output\n",$0)}' >> $calib_path/timetrack.log
-python ../scripts/save_best.py $control_file $iteration_idx
+# With archive_queue > 0, hand the outputs over to the background archiver started by run_packed.sh, which saves
+# them (steps 5 and 6) while the next iteration runs. Without a running archiver, they are saved at once.
+if [ "$archive_queue" -gt 0 ]; then
+    echo submit model output to the archiver
+    date | awk '{printf("%s: submit model output\n",$0)}' >> $calib_path/timetrack.log
+    $trace archive_submit python ../scripts/async_archiver.py $control_file submit $iteration_idx
+else
+    echo save model output
+    date | awk '{printf("%s: saving model output\n",$0)}' >> $calib_path/timetrack.log
+    $trace archive ../scripts/save_model_output.sh $control_file $iteration_idx
+
+    # # ----------------------------------------------------------------------------
+    # --- 6.  Save the best output                                               ---
+    # ------------------------------------------------------------------------------
+    echo save best output
+    date | awk '{printf("%s: save best output\n",$0)}' >> $calib_path/timetrack.log
+    $trace save_best python ../scripts/save_best.py $control_file $iteration_idx
+fi
+
+# Record the iteration in the checkpoint (see calib_checkpoint.py).
+python ../scripts/calib_checkpoint.py $control_file record $iteration_idx
 
 # ------------------------------------------------------------------------------
 # --- 7.  Generate a new param based on DDS                                  ---
@@ -165,15 +195,16 @@ python ../scripts/save_best.py $control_file $iteration_idx
 echo generate a new parameter sample
 date | awk '{printf("%s: generate a new parameter sample\n",$0)}' >> $calib_path/timetrack.log
 
-python ../scripts/DDS.py $iteration_idx $max_iterations $initial_option $warm_start \
+$trace dds python $dds_script $iteration_idx $max_iterations $initial_option $warm_start \
 $calib_path/multiplier_bounds.txt $calib_path/multipliers.tpl \
-$calib_path/multipliers.txt $calib_path/calib_record.txt
+$calib_path/multipliers.txt $calib_path/calib_record.txt \
+--checkpoint $calib_path/calib_checkpoint.json --trial_idx $(( iteration_idx+1 ))
 
 # ------------------------------------------------------------------------------
 # --- 8.  Update params for summa                                            ---
 # ------------------------------------------------------------------------------
 echo update params for summa
-python ../scripts/update_paramTrial.py $control_file
+$trace update_params python ../scripts/update_paramTrial.py $control_file
 
 # ------------------------------------------------------------------------------
 # --- 9.  Delete existing summa outputs for the next run                     ---
@@ -185,4 +216,13 @@ date | awk '{printf("%s: delete existing summa outputs\n",$0)}' >> $calib_path/t
 if [ ! -d $summa_outputPath ]; then mkdir -p $summa_outputPath; fi
 rm -f $summa_outputPath/${summa_outFilePrefix}*
 
+# ------------------------------------------------------------------------------
+# --- 10.  Rebalance GRU subsets for the next run                            ---
+# ------------------------------------------------------------------------------
+# Use the measured subset run times of this and previous runs. Keep the number of subsets.
+if [ "$gru_partition" = "balanced" ] && [ -f $calib_path/gru_partition.txt ]; then
+    echo rebalance GRU subsets
+    python ../scripts/partition_grus.py $control_file $(grep -v '^#' $calib_path/gru_partition.txt | grep -c .)
+fi
+
 exit 0
@@ -11,6 +11,7 @@
 # ----------------------------- User specified input --------------------------------------
 # -----------------------------------------------------------------------------------------
 control_file=$1   # "control_active.txt"
+iteration_idx=$2  # iteration index, starting from one.
 nJob=3            # number of jobs in job array. Should be the same as in --array.
 nSubset=2         # number of GRU subsets in summa GRUs split. Should be the same as in --ntasks.
 
@@ -65,6 +66,13 @@ summa_attributeFile="$(read_from_summa_route_config $summa_filemanager "attribut
 summa_attributeFile=$summa_settings_path/$summa_attributeFile
 nGRU=$( ncks -Cm -v gruId -m $summa_attributeFile | grep 'gru = '| cut -d' ' -f 7 )
 
+# Read how to run the GRU subsets (srun or local).
+summa_run_backend="$(read_from_control $control_file "summa_run_backend")"
+
+# Trace each stage's time and resource usage into [calib_path]/[trace_output].
+trace="python ../scripts/trace_stage.py $control_file"
+export CALIB_ITERATION=$iteration_idx
+
 # -----------------------------------------------------------------------------------------
 # ------------------------------------- Execute -------------------------------------------
 # -----------------------------------------------------------------------------------------
@@ -87,5 +95,9 @@ fi
 ../scripts/make_summa_run_list_jobarray.sh $control_file $gruStart $gruEnd $nSubset $countGRU $offset
 
 # (5) Run job array 
-srun --kill-on-bad-exit=0 --multi-prog summa_run_lists/summa_run_list_${offset}.txt 
+if [ "$summa_run_backend" = "local" ]; then
+    $trace summa python ../scripts/run_summa_subsets.py $control_file summa_run_lists/summa_run_list_${offset}.txt --nproc $nSubset
+else
+    $trace summa srun --kill-on-bad-exit=0 --multi-prog summa_run_lists/summa_run_list_${offset}.txt 
+fi
 
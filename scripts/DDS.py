@@ -6,6 +6,7 @@ import os, sys, argparse
 import numpy as np
 import pandas as pd
 import math as m
+from calib_checkpoint import read_checkpoint, write_checkpoint, get_rng_state, set_rng_state
 
 # import functions
 def process_command_line():
@@ -19,6 +20,8 @@ def process_command_line():
     parser.add_argument('param_tpl_file',    help='param template file where param value is replaced by param name.')
     parser.add_argument('param_file',        help='param file that stores one set of param sample.')
     parser.add_argument('converge_hist_file', help='converge history file that saves all the best param searching history.')
+    parser.add_argument('--checkpoint', default=None, help='calibration checkpoint file (see calib_checkpoint.py). Default: no checkpoint.')
+    parser.add_argument('--trial_idx', type=int, default=None, help='iteration id that evaluates the new param set. Default: iteration_idx.')
     args = parser.parse_args()
     return(args)
 
@@ -135,6 +138,31 @@ def perturb_disc(s,s_min,s_max):
 
     return s_new  
 
+def generate_neighbour(param_sample_previous, param_lower_limit, param_upper_limit, discrete_flags, iteration_idx, max_iterations):
+    ''' Function to generate a DDS neighbour of a param set. Uses the numpy global random state.'''
+    # basic definitions
+    param_dim = len(param_sample_previous)
+    select_param_count = 0                   # number of decision variables that vary in neighbour
+    rand_numbers=np.random.random(param_dim) # random number array for pertubation
+    Pn=1.0-m.log1p(iteration_idx)/m.log(max_iterations)  # probability of being selected as neighbour
+    param_sample = param_sample_previous.copy()
+
+    # define a new param set
+    for i_param in range(param_dim):
+        # then the i^th param selected to vary in neighbour
+        if rand_numbers[i_param]< Pn:
+            select_param_count=select_param_count+1
+            param_sample[i_param] = perturb_type(param_sample_previous[i_param], param_lower_limit[i_param],
+                                    param_upper_limit[i_param], discrete_flags[i_param])
+
+    # no params selected at random, so select ONE.
+    if select_param_count==0:
+        # which param to modify for neighbour
+        i_param=int(m.floor((param_dim)*np.random.random(1)))
+        param_sample[i_param] = perturb_type(param_sample_previous[i_param], param_lower_limit[i_param],
+                                    param_upper_limit[i_param], discrete_flags[i_param])
+    return param_sample
+
 def stand_norm():
     ''' Function returns a standard Gaussian random number (zvalue)'''  
     # based upon Numerical recipes gasdev and Marsagalia-Bray Algorithm
@@ -172,9 +200,10 @@ if __name__ == "__main__":
     # ------------------------------ Prepare ---------------------------------
     # process command line 
     # check args
-    if len(sys.argv) != 9:
+    if len(sys.argv) < 9:
         print("Usage: %s <iteration_idx> <max_iterations> <initial_option> <warm_start> \
-        <param_bounds_file> <param_tpl_file> <param_file> <converge_hist_file> " % sys.argv[0])
+        <param_bounds_file> <param_tpl_file> <param_file> <converge_hist_file> \
+        [--checkpoint <file>] [--trial_idx <n>]" % sys.argv[0])
         sys.exit(0)
     
     # otherwise continue
@@ -187,7 +216,15 @@ if __name__ == "__main__":
     param_tpl_file = args.param_tpl_file        # input. param template file where param value is replaced by param name.
     param_file = args.param_file                # input & output. one set of param sample.
     converge_hist_file = args.converge_hist_file  # input & output. param converge history file.
+    checkpoint_file = args.checkpoint           # input & output. calibration checkpoint file.
+    trial_idx = args.trial_idx if args.trial_idx is not None else iteration_idx
 
+    # continue the random sequence of the previous iterations (a new calibration starts a new sequence)
+    checkpoint = {}
+    if checkpoint_file is not None:
+        checkpoint = read_checkpoint(checkpoint_file)
+        if iteration_idx > 1 and checkpoint.get('rng_state') is not None:
+            set_rng_state(checkpoint['rng_state'])
 
     # read param initials and ranges
     param_bounds_df = pd.read_csv(param_bounds_file, delimiter=',', comment='#', 
@@ -226,7 +263,7 @@ if __name__ == "__main__":
                     param_sample = np.zeros((param_dim,))
                     for i_param in range(param_dim):
                         # return random integers from the discrete uniform dist'n
-                        param_sample[i_param] = np.random.randit([param_lower_limit[i_param], param_upper_limit[i_param]],size=1) 
+                        param_sample[i_param] = np.random.randint(param_lower_limit[i_param], param_upper_limit[i_param]+1)
 
     # =======================================================================
     # Generate a new param set based on DDS
@@ -239,26 +276,9 @@ if __name__ == "__main__":
             quit()
         param_sample_previous = np.loadtxt(param_file) 
 
-        # basic definitions
-        select_param_count = 0                   # number of decision variables that vary in neighbour
-        rand_numbers=np.random.random(param_dim) # random number array for pertubation        
-        Pn=1.0-m.log1p(iteration_idx)/m.log(max_iterations)  # probability of being selected as neighbour
-        param_sample = param_sample_previous.copy()
-        
-        # define a new param set
-        for i_param in range(param_dim):
-            # then the i^th param selected to vary in neighbour
-            if rand_numbers[i_param]< Pn: 
-                select_param_count=select_param_count+1
-                param_sample[i_param] = perturb_type(param_sample_previous[i_param], param_lower_limit[i_param], 
-                                        param_upper_limit[i_param], discrete_flags[i_param])
-
-        # no params selected at random, so select ONE.   
-        if select_param_count==0: 
-            # which param to modify for neighbour 
-            i_param=int(m.floor((param_dim)*np.random.random(1)))
-            param_sample[i_param] = perturb_type(param_sample_previous[i_param], param_lower_limit[i_param], 
-                                        param_upper_limit[i_param], discrete_flags[i_param])
+        # define a new param set in the neighbour of the previous one
+        param_sample = generate_neighbour(param_sample_previous, param_lower_limit, param_upper_limit,
+                                          discrete_flags, iteration_idx, max_iterations)
 
     # =======================================================================
     # Output the new param set
@@ -271,5 +291,11 @@ if __name__ == "__main__":
         for i_param in range(len(param_names_tpl)):
             param_idx = param_names_tpl.index(param_names[i_param])
             f.write('%.6E\n'%(param_sample[param_idx]))
+
+    # save the random state and the in-flight param set, so that a restarted calibration re-evaluates it
+    if checkpoint_file is not None:
+        checkpoint.update({'stage': 'generated', 'trial_iteration': trial_idx, 'dds_iteration': iteration_idx,
+                           'in_flight': [np.atleast_1d(np.loadtxt(param_file)).tolist()], 'rng_state': get_rng_state()})
+        write_checkpoint(checkpoint_file, checkpoint)
                 
     # print(param_sample)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Real-coded genetic algorithm (GA) with concurrent evaluation of each generation ####
+# All members of a generation are independent, so this script evaluates each generation as one batch on a
+# TrialPool (trial_pool.py).
+# 1. Sample the initial population by Latin hypercube. With WarmStart yes, the best distinct param sets of the
+#    history replace the first samples (they are not run again).
+# 2. Evaluate the generation concurrently.
+# 3. Stop if [ngeneration] generations are done, if the next generation does not fit in max_iterations trials, or if
+#    the population has converged ((median - best)/|best| of the objectives < conv_val).
+# 4. Breed the next generation: the [nsurvivor] best members survive unchanged (and are not run again). The others
+#    are children of two parents chosen by binary tournament, with blend crossover (BLX-0.5, clipped to the
+#    bounds) and a mutation rate per param (a mutated param is drawn uniformly within its bounds). Go to 2.
+# 5. Write the best param set to multipliers.txt. Each trial is recorded in calib_search_history.txt and
+#    calib_converge_history.txt, and the outputs of the best trial are archived in [calib_path]/output_archive.
+# The default settings follow the OSTRICH template of demo1 (tpl/ostIn.GA.tpl).
+
+# import packages
+import os, sys, argparse
+import numpy as np
+from trial_pool import make_pool
+from initial_design import latin_hypercube
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to calibrate with a genetic algorithm and concurrent evaluation of each generation.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('--npopulation', type=int, default=50, help='number of members per generation.')
+    parser.add_argument('--ngeneration', type=int, default=50, help='maximum number of generations.')
+    parser.add_argument('--mutation_rate', type=float, default=0.05, help='probability that a param of a child is mutated.')
+    parser.add_argument('--nsurvivor', type=int, default=1, help='number of best members that survive unchanged.')
+    parser.add_argument('--conv_val', type=float, default=1.0e-4, help='convergence value of the population objectives.')
+    parser.add_argument('--nparallel', type=int, default=None, help='number of trials run at the same time. Default: available cores.')
+    parser.add_argument('--max_iterations', type=int, default=None, help='maximum number of trials. Default: max_iterations in control_file.')
+    parser.add_argument('--warm_start', default=None, help="start from the best param sets of the history: 'yes' or 'no'. Default: WarmStart in control_file.")
+    parser.add_argument('--trial_script', default='./run_trial.sh', help='script that runs one trial with a control file.')
+    parser.add_argument('--seed', type=int, default=None, help='random seed.')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def tournament(objs, rng):
+    '''Function to return the index of the better of two members drawn at random (binary tournament).'''
+    i, j = rng.choice(len(objs), size=2, replace=False)
+    return i if objs[i] <= objs[j] else j
+
+def breed(population, objs, nsurvivor, mutation_rate, lower, upper, rng):
+    '''Function to return the next generation: the nsurvivor best members, then children of tournament parents
+    with blend crossover (BLX-0.5) and uniform mutation.'''
+    order = np.argsort(objs, kind='stable')
+    children = [population[i] for i in order[:nsurvivor]]
+    while len(children) < len(population):
+        parent1, parent2 = population[tournament(objs, rng)], population[tournament(objs, rng)]
+        low, high = np.minimum(parent1, parent2), np.maximum(parent1, parent2)
+        child = rng.uniform(low - 0.5*(high-low), high + 0.5*(high-low))
+        mutated = rng.random(len(child)) < mutation_rate
+        child[mutated] = rng.uniform(lower[mutated], upper[mutated])
+        children.append(np.clip(child, lower, upper))
+    return np.array(children)
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python GA.py ../control_active.txt --npopulation 50 --nparallel 10
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 2:
+        print("Usage: %s <control_file> [--npopulation <n>] [--ngeneration <n>] [--mutation_rate <f>] [--nsurvivor <n>] \
+        [--conv_val <f>] [--nparallel <n>] [--max_iterations <n>] [--warm_start <yes|no>] [--trial_script <script>] \
+        [--seed <n>]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = os.path.abspath(args.control_file)
+    max_iterations = args.max_iterations if args.max_iterations is not None else int(read_from_control(control_file, 'max_iterations'))
+    rng = np.random.default_rng(args.seed)
+    npopulation, nsurvivor = args.npopulation, args.nsurvivor
+    if npopulation < 2 or nsurvivor < 0 or nsurvivor >= npopulation:
+        print('ERROR: npopulation must be at least 2, and nsurvivor between 0 and npopulation-1.')
+        sys.exit(1)
+    if max_iterations < npopulation:
+        print('ERROR: max_iterations (%d) is smaller than the population (%d).'%(max_iterations, npopulation))
+        sys.exit(1)
+
+    # Prepare the workers and read the history (warm start).
+    pool = make_pool(control_file, 'ga', args.nparallel, args.trial_script, args.warm_start)
+    lower, upper = pool.lower, pool.upper
+    nparam = len(pool.param_names)
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Sample the initial population.
+    population = lower + latin_hypercube(npopulation, nparam, rng) * (upper - lower)
+    starts = pool.history_starts(npopulation)
+    population[:len(starts)] = starts
+    print('GA: %d members, %d params, %d trials at most, %d in parallel.'%(npopulation, nparam, max_iterations, pool.nparallel))
+
+    for generation in range(1, args.ngeneration+1):
+        # #### 2. Evaluate the generation.
+        objs = pool.evaluate(population)
+        best, median = np.min(objs), np.median(objs)
+        print('Generation %d: %d trials, best objective %.6E, median objective %.6E.'%(generation, pool.ntrial, best, median))
+
+        # #### 3. Check the stopping criteria.
+        if generation == args.ngeneration:
+            print('Stop: ngeneration is reached.')
+            break
+        if pool.ntrial + npopulation - nsurvivor > max_iterations:
+            print('Stop: max_iterations is reached.')
+            break
+        if np.isfinite(median) and (median - best) <= args.conv_val*max(abs(best), 1e-12):
+            print('Stop: the population has converged.')
+            break
+
+        # #### 4. Breed the next generation.
+        population = breed(population, objs, nsurvivor, args.mutation_rate, lower, upper, rng)
+
+    # #### 5. Write the best param set to multipliers.txt.
+    pool.close()
+    if pool.best is None:
+        print('ERROR: no GA trial succeeded. Check the trial logs.')
+        sys.exit(1)
+    print('GA: best objective %.6E after %d trials.'%(pool.obj_best, pool.ntrial))
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Generalized Likelihood Uncertainty Estimation (GLUE) with a parallel trial pool ####
+# Instead of running OSTRICH GLUE (one model run at a time, all outputs kept), sample many multiplier sets and
+# evaluate them concurrently, keeping only what the uncertainty analysis needs.
+# 1. Sample [glue_samples] param sets within multiplier_bounds.txt (Latin hypercube or uniform random).
+# 2. Prepare a TrialPool (trial_pool.py) with [nparallel] workers in [calib_path]/glue. Unlike the optimizers, GLUE
+#    keeps out of the calibration files (record_history=False): the search and converge histories, output_archive and
+#    multipliers.txt of a calibration in the same calib_path are neither read nor changed. glue_samples.txt is the
+#    GLUE history.
+# 3. Run the trials concurrently with the trial script (eg, run_trial.sh). For each trial, as soon as it finishes:
+#    - compute the likelihood from its KGE: L = (KGE - threshold)/(1 - threshold) for a behavioural run
+#      (KGE >= glue_threshold), and 0 otherwise,
+#    - record the param set, KGE and likelihood in glue_samples.txt,
+#    - for a behavioural run, append the simulated flow at q_seg_index to glue_behavioural.nc, and add it to
+#      a weighted histogram per time step (log-spaced flow bins), so that the likelihood-weighted quantiles are
+#      available without holding all runs in memory.
+# 4. Write the weighted flow quantiles (eg, 5%, 50%, 95% uncertainty bounds) to glue_bounds.nc, and a summary.
+
+# import packages
+import os, sys, argparse
+import concurrent.futures
+import numpy as np
+import netCDF4 as nc
+from trial_pool import TrialPool, get_output_files
+from initial_design import latin_hypercube
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to run GLUE with a parallel trial pool.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('--nsample', type=int, default=None, help='number of sampled param sets. Default: glue_samples in control_file.')
+    parser.add_argument('--threshold', type=float, default=None, help='behavioural KGE threshold. Default: glue_threshold in control_file.')
+    parser.add_argument('--sampling', choices=['lhs', 'random'], default='lhs', help='sampling of the param sets.')
+    parser.add_argument('--nparallel', type=int, default=None, help='number of trials run at the same time. Default: number of available cores.')
+    parser.add_argument('--quantiles', type=float, nargs='+', default=[0.05, 0.5, 0.95], help='flow quantiles written to glue_bounds.nc.')
+    parser.add_argument('--flow_range', type=float, nargs=2, default=[1e-3, 1e5], help='range (cms) of the log-spaced histogram bins.')
+    parser.add_argument('--nbins', type=int, default=400, help='number of histogram bins per time step.')
+    parser.add_argument('--trial_script', default='./run_trial.sh', help='script that runs one trial with a control file.')
+    parser.add_argument('--seed', type=int, default=None, help='random seed of the sampling.')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+class WeightedHistogram:
+    '''Streaming weighted quantiles of a series per time step.
+    Each time step keeps the weights of its values in fixed bins: [0, lo], nbins-1 log-spaced bins up to hi, and [hi, max].
+    A quantile is interpolated linearly within its bin (the outer bins are bounded by the running min/max).
+    The relative error of a quantile is at most the bin width, (hi/lo)**(1/(nbins-1)) - 1.'''
+    def __init__(self, ntime, lo, hi, nbins):
+        self.edges   = np.concatenate([[0.0], np.logspace(np.log10(lo), np.log10(hi), nbins)])
+        self.weights = np.zeros((ntime, nbins+1))
+        self.vmin    = np.full(ntime, np.inf)
+        self.vmax    = np.full(ntime, -np.inf)
+
+    def add(self, values, weight):
+        '''Add one series (ntime,) with a weight.'''
+        ibin = np.searchsorted(self.edges, values, side='right') - 1
+        ibin = np.clip(ibin, 0, self.weights.shape[1]-1)
+        self.weights[np.arange(len(values)), ibin] += weight
+        self.vmin = np.minimum(self.vmin, values)
+        self.vmax = np.maximum(self.vmax, values)
+
+    def quantiles(self, probs):
+        '''Return the weighted quantiles (ntime, nprob). NaN where no series was added.'''
+        ntime, nbin = self.weights.shape
+        cum   = np.cumsum(self.weights, axis=1)
+        total = cum[:,-1]
+        lower = np.broadcast_to(self.edges, (ntime, nbin)).copy()
+        upper = np.broadcast_to(np.append(self.edges[1:], np.inf), (ntime, nbin)).copy()
+        lower = np.maximum(lower, self.vmin[:,None])
+        upper = np.minimum(upper, self.vmax[:,None])
+        result = np.full((ntime, len(probs)), np.nan)
+        rows = np.arange(ntime)
+        for j, p in enumerate(probs):
+            target = p*total
+            ibin   = np.minimum((cum < target[:,None]).sum(axis=1), nbin-1)
+            below  = np.where(ibin > 0, cum[rows, ibin-1], 0.0)
+            inbin  = self.weights[rows, ibin]
+            frac   = np.divide(target - below, inbin, out=np.zeros(ntime), where=inbin > 0)
+            result[:,j] = lower[rows, ibin] + np.clip(frac, 0, 1)*(upper[rows, ibin] - lower[rows, ibin])
+        result[total <= 0] = np.nan
+        return result
+
+def read_sim_flow(route_output_file, q_seg_index):
+    '''Function to read the simulated flow (cms) at the gauge segment and the time values of a mizuRoute output.'''
+    # Note: simVarName is hard coded for the demo output, as in calculate_sim_stats.py.
+    with nc.Dataset(route_output_file) as f:
+        flow = np.ma.filled(f['IRFroutedRunoff'][:, q_seg_index-1].astype('float64'), np.nan)
+        time = f['time'][:]
+        time_units = f['time'].units
+        time_calendar = getattr(f['time'], 'calendar', 'standard')
+    return flow, time, time_units, time_calendar
+
+def create_behavioural_file(nc_file, time, time_units, time_calendar, param_names):
+    '''Function to create the file of behavioural runs: flow (run, time), param values, KGE and likelihood per run.'''
+    dst = nc.Dataset(nc_file, 'w')
+    dst.createDimension('run', None)
+    dst.createDimension('time', len(time))
+    dst.createDimension('param', len(param_names))
+    var = dst.createVariable('time', 'f8', ('time',))
+    var.units, var.calendar = time_units, time_calendar
+    var[:] = time
+    var = dst.createVariable('param_name', str, ('param',))
+    for i, name in enumerate(param_names):
+        var[i] = name
+    dst.createVariable('sample', 'i4', ('run',)).long_name = 'index of the param set in glue_samples.txt'
+    dst.createVariable('KGE', 'f8', ('run',))
+    dst.createVariable('likelihood', 'f8', ('run',))
+    dst.createVariable('param', 'f8', ('run', 'param'))
+    var = dst.createVariable('q_sim', 'f4', ('run', 'time'), chunksizes=(1, len(time)), zlib=True, complevel=1)
+    var.units, var.long_name = 'm3/s', 'simulated flow at q_seg_index'
+    return dst
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python GLUE.py ../control_active.txt --nsample 5000 --nparallel 16
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 2:
+        print("Usage: %s <control_file> [--nsample <n>] [--threshold <kge>] [--nparallel <n>] [--quantiles <p> ...] \
+        [--trial_script <script>] [--seed <n>]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = os.path.abspath(args.control_file)
+
+    # Read GLUE settings.
+    nsample = args.nsample if args.nsample is not None else int(read_from_control(control_file, 'glue_samples', '1000'))
+    threshold = args.threshold if args.threshold is not None else float(read_from_control(control_file, 'glue_threshold', '0.5'))
+    q_seg_index = int(read_from_control(control_file, 'q_seg_index'))
+    nparallel = args.nparallel if args.nparallel is not None else len(os.sched_getaffinity(0))
+    nparallel = max(1, min(nparallel, nsample))
+    if threshold >= 1:
+        print('ERROR: glue_threshold must be below 1 (the best KGE).')
+        sys.exit(1)
+
+    # Prepare the workers.
+    pool = TrialPool(control_file, 'glue', nparallel, args.trial_script, record_history=False)
+    param_names = pool.param_names
+    samples_file      = os.path.join(pool.calib_path, 'glue_samples.txt')
+    behavioural_file  = os.path.join(pool.calib_path, 'glue_behavioural.nc')
+    bounds_file       = os.path.join(pool.calib_path, 'glue_bounds.nc')
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Sample the param sets.
+    rng = np.random.default_rng(args.seed)
+    if args.sampling == 'lhs':
+        unit = latin_hypercube(nsample, len(param_names), rng)
+    else:
+        unit = rng.random((nsample, len(param_names)))
+    samples = pool.lower + unit*(pool.upper - pool.lower)
+
+    # #### 2. Start the samples file.
+    print('GLUE: %d param sets, behavioural KGE >= %.3f, %d parallel workers.'%(nsample, threshold, pool.nparallel))
+    with open(samples_file, 'w') as f:
+        f.write('Sample  KGE  likelihood  behavioural  ' + ''.join([x+'  ' for x in param_names]) + '\n')
+
+    # #### 3. Run the trials concurrently, and stream the behavioural runs into the file and the histogram.
+    state = {'dst': None, 'hist': None, 'nbehavioural': 0, 'nfailed': 0, 'kge_max': -np.inf}
+
+    def evaluate(i_sample):
+        '''Run param set i_sample, and record it. Return its KGE (nan if the trial failed).'''
+        def record_sample(run_idx, obj, worker_control):
+            # Called under the pool lock while the worker holds the outputs (netCDF4 is not thread-safe).
+            if run_idx is None:
+                state['nfailed'] += 1
+                return
+            kge = -obj
+            likelihood = (kge - threshold)/(1.0 - threshold) if kge >= threshold else 0.0
+            with open(samples_file, 'a') as f:
+                f.write('%d %.6E %.6E %d  '%(i_sample+1, kge, likelihood, likelihood > 0) +
+                        ''.join(['%.6E  '%(x) for x in samples[i_sample]]) + '\n')
+            state['kge_max'] = max(state['kge_max'], kge)
+            if likelihood > 0:
+                flow, time, time_units, time_calendar = read_sim_flow(get_output_files(worker_control)[1], q_seg_index)
+                if state['dst'] is None:
+                    state['dst']  = create_behavioural_file(behavioural_file, time, time_units, time_calendar, param_names)
+                    state['hist'] = WeightedHistogram(len(flow), args.flow_range[0], args.flow_range[1], args.nbins)
+                dst, irun = state['dst'], state['nbehavioural']
+                dst['sample'][irun]     = i_sample+1
+                dst['KGE'][irun]        = kge
+                dst['likelihood'][irun] = likelihood
+                dst['param'][irun,:]    = samples[i_sample]
+                dst['q_sim'][irun,:]    = flow
+                state['hist'].add(flow, likelihood)
+                state['nbehavioural'] += 1
+        obj = pool.run(samples[i_sample], record_sample)
+        return -obj if np.isfinite(obj) else np.nan
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=nparallel) as executor:
+        for ndone, future in enumerate(concurrent.futures.as_completed([executor.submit(evaluate, i) for i in range(nsample)])):
+            future.result()
+            if (ndone+1) % max(1, nsample//20) == 0 or ndone+1 == nsample:
+                print('%d/%d param sets done, %d behavioural, %d failed, best KGE %.4f.'%(
+                    ndone+1, nsample, state['nbehavioural'], state['nfailed'], state['kge_max']))
+
+    # #### 4. Write the uncertainty bounds and the summary.
+    pool.close()
+    if state['dst'] is None:
+        print('No behavioural run (KGE >= %.3f). See %s.'%(threshold, samples_file))
+        sys.exit(0)
+    time = state['dst']['time'][:]
+    with nc.Dataset(bounds_file, 'w') as dst:
+        dst.createDimension('time', len(time))
+        dst.createDimension('quantile', len(args.quantiles))
+        var = dst.createVariable('time', 'f8', ('time',))
+        var.units, var.calendar = state['dst']['time'].units, state['dst']['time'].calendar
+        var[:] = time
+        dst.createVariable('quantile', 'f8', ('quantile',))[:] = args.quantiles
+        var = dst.createVariable('q_bounds', 'f4', ('time', 'quantile'))
+        var.units, var.long_name = 'm3/s', 'likelihood-weighted quantiles of the behavioural simulated flow'
+        var[:] = state['hist'].quantiles(args.quantiles)
+        dst.nbehavioural = state['nbehavioural']
+        dst.nsample = nsample
+        dst.threshold = threshold
+    state['dst'].close()
+    print('GLUE done: %d of %d param sets are behavioural. Bounds in %s, behavioural runs in %s.'%(
+        state['nbehavioural'], nsample, bounds_file, behavioural_file))
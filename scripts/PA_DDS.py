@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Pareto Archived DDS (PA-DDS) for two objectives, with concurrent evaluation of the candidates ####
+# PA-DDS (Asadzadeh and Tolson, 2013) keeps an archive of non-dominated param sets, and perturbs archived param sets
+# with the DDS neighbourhood. The objectives are the negative of the two metrics listed in objectives of the control
+# file (eg, KGE,logNSE; see calculate_sim_stats.py). One run gives the trade-off front of the two metrics.
+# 1. Start the archive from the trials of calib_objectives_history.txt (WarmStart yes), or evaluate the initial
+#    param values of multiplier_bounds.txt and [ninitial]-1 Latin hypercube samples concurrently.
+# 2. Select [nparallel] archived param sets by roulette on their hypervolume contribution. The two extreme param sets
+#    get the largest contribution of the others, so that the ends of the front are explored too.
+# 3. Perturb each selected param set with the DDS neighbourhood of DDS.py, and evaluate the candidates concurrently.
+# 4. Insert the non-dominated candidates into the archive, and remove the archived param sets they dominate.
+#    The archive is sorted by the first objective, so an insertion is a binary search and a slice deletion.
+# 5. Write the archive to pareto_front.txt, and go to 2 until max_iterations trials are used.
+# 6. Write the archived param set with the best first objective to multipliers.txt. Each trial is recorded in
+#    calib_objectives_history.txt, and also in calib_search_history.txt and calib_converge_history.txt with the first
+#    objective. The outputs of the trial with the best first objective are archived in [calib_path]/output_archive.
+
+# import packages
+import os, sys, argparse, bisect
+import numpy as np
+from trial_pool import make_pool
+from initial_design import latin_hypercube
+from DDS import generate_neighbour
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to calibrate two objectives with PA-DDS and concurrent evaluation of the candidates.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('--ninitial', type=int, default=None, help='number of initial param sets. Default: max(5, nparallel).')
+    parser.add_argument('--nparallel', type=int, default=None, help='number of candidates evaluated at the same time. Default: available cores.')
+    parser.add_argument('--max_iterations', type=int, default=None, help='maximum number of trials. Default: max_iterations in control_file.')
+    parser.add_argument('--warm_start', default=None, help="start from the trials of calib_objectives_history.txt: 'yes' or 'no'. Default: WarmStart in control_file.")
+    parser.add_argument('--reference', default='0,0', help='reference point of the reported hypervolume, in objectives (negative metrics). Default: 0,0.')
+    parser.add_argument('--trial_script', default='./run_trial.sh', help='script that runs one trial with a control file.')
+    parser.add_argument('--seed', type=int, default=None, help='random seed.')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+class ParetoArchive:
+    '''Non-dominated archive of two minimized objectives. The members are sorted by the first objective (ascending),
+    so the second one is strictly descending, and dominance checks only need the neighbours of an insertion point.'''
+    def __init__(self):
+        self.f1, self.f2, self.samples = [], [], []
+
+    def __len__(self):
+        return len(self.f1)
+
+    def insert(self, objs, sample):
+        '''Insert a member unless a member dominates or equals it, and remove the members it dominates.
+        Return True if inserted.'''
+        a, b = float(objs[0]), float(objs[1])
+        if not (np.isfinite(a) and np.isfinite(b)):
+            return False
+        i = bisect.bisect_left(self.f1, a)
+        # The member before i has the lowest f2 among the members with f1 < a.
+        if i > 0 and self.f2[i-1] <= b:
+            return False
+        if i < len(self.f1) and self.f1[i] == a and self.f2[i] <= b:
+            return False
+        # The members dominated by (a, b) have f1 >= a and f2 >= b: a contiguous run from i.
+        j = i
+        while j < len(self.f1) and self.f2[j] >= b:
+            j += 1
+        self.f1[i:j], self.f2[i:j], self.samples[i:j] = [a], [b], [np.array(sample)]
+        return True
+
+    def contributions(self):
+        '''Return the hypervolume contribution of each member. The extreme members get the largest interior one.'''
+        n = len(self.f1)
+        if n <= 2:
+            return np.ones(n)
+        f1, f2 = np.array(self.f1), np.array(self.f2)
+        hvc = np.zeros(n)
+        hvc[1:-1] = (f1[2:] - f1[1:-1]) * (f2[:-2] - f2[1:-1])
+        hvc[0] = hvc[-1] = hvc[1:-1].max() if hvc[1:-1].max() > 0 else 1.0
+        return hvc
+
+    def select(self, n, rng):
+        '''Return n members (with replacement) drawn by roulette on the hypervolume contributions.'''
+        hvc = self.contributions()
+        return [self.samples[i] for i in rng.choice(len(hvc), size=n, p=hvc/hvc.sum())]
+
+    def hypervolume(self, reference):
+        '''Return the hypervolume dominated by the members and bounded by the reference point.'''
+        hv, f2_previous = 0.0, reference[1]
+        for a, b in zip(self.f1, self.f2):
+            if a < reference[0] and b < f2_previous:
+                hv += (reference[0] - a) * (f2_previous - b)
+                f2_previous = b
+        return hv
+
+def write_front(front_file, archive, objectives, param_names, param_names_tpl):
+    '''Function to write the archive (objectives and param sets in the order of the template file).'''
+    with open(front_file + '.tmp', 'w') as f:
+        f.write(''.join(['obj.'+x+'  ' for x in objectives]) + ''.join([x+'  ' for x in param_names_tpl]) + '\n')
+        for a, b, sample in zip(archive.f1, archive.f2, archive.samples):
+            f.write('%.6E  %.6E  '%(a, b) + ''.join(['%.6E  '%(sample[param_names.index(x)]) for x in param_names_tpl]) + '\n')
+    os.replace(front_file + '.tmp', front_file)
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python PA_DDS.py ../control_active.txt --nparallel 8
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 2:
+        print("Usage: %s <control_file> [--ninitial <n>] [--nparallel <n>] [--max_iterations <n>] [--warm_start <yes|no>] \
+        [--reference <f1,f2>] [--trial_script <script>] [--seed <n>]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = os.path.abspath(args.control_file)
+    max_iterations = args.max_iterations if args.max_iterations is not None else int(read_from_control(control_file, 'max_iterations'))
+    objectives = [x.strip() for x in read_from_control(control_file, 'objectives', 'KGE').split(',')]
+    reference = [float(x) for x in args.reference.split(',')]
+    if len(objectives) != 2:
+        print('ERROR: PA-DDS needs two objectives (eg, objectives | KGE,logNSE), but %d are set.'%(len(objectives)))
+        sys.exit(1)
+    rng = np.random.default_rng(args.seed)
+    np.random.seed(args.seed)  # generate_neighbour uses the numpy global random state
+
+    # Prepare the workers and read the history (warm start).
+    pool = make_pool(control_file, 'padds', args.nparallel, args.trial_script, args.warm_start, objectives)
+    lower, upper = pool.lower, pool.upper
+    nparam = len(pool.param_names)
+    discrete_flags = np.zeros(nparam)  # 1: discrete param. 0: continuous param
+    front_file = os.path.join(pool.calib_path, 'pareto_front.txt')
+    ninitial = args.ninitial if args.ninitial is not None else max(5, pool.nparallel)
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Start the archive.
+    archive = ParetoArchive()
+    for key, objs in pool.cache.items():
+        archive.insert(objs, [float(x) for x in key])
+    iteration = 0
+    if len(archive) == 0:
+        initial = np.vstack([pool.initial, lower + latin_hypercube(ninitial-1, nparam, rng) * (upper - lower)])
+        for objs, sample in zip(pool.evaluate(initial), initial):
+            archive.insert(objs, sample)
+        iteration = len(initial)
+    if len(archive) == 0:
+        pool.close()
+        print('ERROR: no initial PA-DDS trial succeeded. Check the trial logs.')
+        sys.exit(1)
+    print('PA-DDS: objectives %s, %d params, %d trials at most, %d in parallel. Initial archive: %d param sets.'%(
+        ','.join(objectives), nparam, max_iterations, pool.nparallel, len(archive)))
+
+    while iteration < max_iterations:
+        # #### 2-3. Select and perturb archived param sets, and evaluate the candidates.
+        nbatch = min(pool.nparallel, max_iterations - iteration)
+        candidates = np.array([generate_neighbour(sample, lower, upper, discrete_flags, iteration+k+1, max_iterations)
+                               for k, sample in enumerate(archive.select(nbatch, rng))])
+        iteration += nbatch
+
+        # #### 4. Update the archive.
+        ninserted = sum([archive.insert(objs, sample) for objs, sample in zip(pool.evaluate(candidates), candidates)])
+
+        # #### 5. Write the archive.
+        write_front(front_file, archive, objectives, pool.param_names, pool.param_names_tpl)
+        print('Iteration %d: %d of %d candidates archived, %d param sets in the archive, hypervolume %.6E.'%(
+            iteration, ninserted, nbatch, len(archive), archive.hypervolume(reference)))
+
+    # #### 6. Write the param set with the best first objective to multipliers.txt.
+    write_front(front_file, archive, objectives, pool.param_names, pool.param_names_tpl)
+    pool.close()
+    print('PA-DDS: %d param sets in %s after %d trials.'%(len(archive), front_file, pool.ntrial))
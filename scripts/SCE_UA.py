@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Shuffled Complex Evolution (SCE-UA) with concurrent evaluation of the complexes ####
+# SCE-UA (Duan et al., 1992) evolves a population partitioned into complexes. The complexes evolve independently
+# between shuffles, so this script evaluates the offspring of all complexes together on a TrialPool (trial_pool.py).
+# 1. Sample the initial population ([ncomplex] x [npoint_complex] points) by Latin hypercube. With WarmStart yes,
+#    the best distinct param sets of the history replace the first samples (they are not run again).
+# 2. Evaluate the population concurrently.
+# 3. Partition the sorted population into complexes (point i goes to complex i mod ncomplex).
+# 4. Evolve each complex for [nstep] competitive complex evolution (CCE) steps. In each step, every complex selects a
+#    sub-complex of [npoint_sub] points with trapezoidal probability, and replaces its worst point by the reflection
+#    through the centroid of the others. A reflection that is worse than the worst point is replaced by the
+#    contraction, and a contraction that is still worse by a random point in the range of the complex. The
+#    reflections (then contractions, then random points) of all complexes are evaluated as one batch.
+# 5. Shuffle the complexes back into the population, and stop if max_iterations trials are used, if the population
+#    has converged (normalized geometric range < pop_conv), or if the best objective improved less than pct_change
+#    over [nstagnation] shuffles. Otherwise go to 3.
+# 6. Write the best param set to multipliers.txt. Each trial is recorded in calib_search_history.txt and
+#    calib_converge_history.txt, and the outputs of the best trial are archived in [calib_path]/output_archive.
+# The default settings follow the SCE section of the OSTRICH template of demo1 (tpl/ostIn.SCE.tpl).
+
+# import packages
+import os, sys, argparse
+import numpy as np
+from trial_pool import make_pool
+from initial_design import latin_hypercube
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to calibrate with SCE-UA and concurrent evaluation of the complexes.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('--ncomplex', type=int, default=4, help='number of complexes.')
+    parser.add_argument('--npoint_complex', type=int, default=None, help='number of points per complex. Default: 2*nparam+1.')
+    parser.add_argument('--npoint_sub', type=int, default=None, help='number of points per sub-complex. Default: nparam+1.')
+    parser.add_argument('--nstep', type=int, default=None, help='number of evolution steps per complex between shuffles. Default: npoint_complex.')
+    parser.add_argument('--nstagnation', type=int, default=5, help='number of shuffles for the pct_change criterion.')
+    parser.add_argument('--pct_change', type=float, default=0.01, help='minimum relative improvement of the best objective over nstagnation shuffles.')
+    parser.add_argument('--pop_conv', type=float, default=0.001, help='minimum normalized geometric range of the population.')
+    parser.add_argument('--nparallel', type=int, default=None, help='number of trials run at the same time. Default: available cores.')
+    parser.add_argument('--max_iterations', type=int, default=None, help='maximum number of trials. Default: max_iterations in control_file.')
+    parser.add_argument('--warm_start', default=None, help="start from the best param sets of the history: 'yes' or 'no'. Default: WarmStart in control_file.")
+    parser.add_argument('--trial_script', default='./run_trial.sh', help='script that runs one trial with a control file.')
+    parser.add_argument('--seed', type=int, default=None, help='random seed.')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def select_subcomplex(npoint_complex, npoint_sub, rng):
+    '''Function to select npoint_sub indices of a sorted complex with trapezoidal probability (best most likely).
+    Return the sorted indices.'''
+    weights = 2.0*(npoint_complex - np.arange(npoint_complex)) / (npoint_complex*(npoint_complex+1))
+    return np.sort(rng.choice(npoint_complex, size=npoint_sub, replace=False, p=weights/weights.sum()))
+
+def geometric_range(population, lower, upper):
+    '''Function to return the normalized geometric range of the population (Duan et al., 1994).'''
+    spread = (population.max(axis=0) - population.min(axis=0)) / (upper - lower)
+    return np.exp(np.mean(np.log(np.maximum(spread, 1e-300))))
+
+def evolve_complexes(pool, complexes, complex_objs, npoint_sub, lower, upper, rng):
+    '''Function to run one CCE step on all complexes. The complexes (list of (npoint_complex, nparam) arrays, sorted
+    by complex_objs) are updated in place.'''
+    ncomplex = len(complexes)
+    worst, centroid, new = np.zeros(ncomplex, dtype=int), [], []
+    for k in range(ncomplex):
+        sub = select_subcomplex(len(complexes[k]), npoint_sub, rng)
+        worst[k] = sub[-1]
+        centroid.append(complexes[k][sub[:-1]].mean(axis=0))
+        # Reflection. Outside the bounds, use a random point in the range of the complex (mutation).
+        reflection = 2.0*centroid[k] - complexes[k][worst[k]]
+        if np.any(reflection < lower) or np.any(reflection > upper):
+            reflection = rng.uniform(complexes[k].min(axis=0), complexes[k].max(axis=0))
+        new.append(reflection)
+    new = np.array(new)
+    new_objs = pool.evaluate(new)
+
+    # Contraction for the complexes whose reflection is worse than their worst point.
+    failed = [k for k in range(ncomplex) if new_objs[k] > complex_objs[k][worst[k]]]
+    if failed:
+        contraction = np.array([(centroid[k] + complexes[k][worst[k]])/2.0 for k in failed])
+        contraction_objs = pool.evaluate(contraction)
+        for j, k in enumerate(failed):
+            new[k], new_objs[k] = contraction[j], contraction_objs[j]
+
+    # Random point in the range of the complex if the contraction is still worse.
+    failed = [k for k in range(ncomplex) if new_objs[k] > complex_objs[k][worst[k]]]
+    if failed:
+        random_points = np.array([rng.uniform(complexes[k].min(axis=0), complexes[k].max(axis=0)) for k in failed])
+        random_objs = pool.evaluate(random_points)
+        for j, k in enumerate(failed):
+            new[k], new_objs[k] = random_points[j], random_objs[j]
+
+    # Replace the worst point of each sub-complex and keep each complex sorted.
+    for k in range(ncomplex):
+        complexes[k][worst[k]], complex_objs[k][worst[k]] = new[k], new_objs[k]
+        order = np.argsort(complex_objs[k], kind='stable')
+        complexes[k][:], complex_objs[k][:] = complexes[k][order], complex_objs[k][order]
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python SCE_UA.py ../control_active.txt --ncomplex 4 --nparallel 8
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 2:
+        print("Usage: %s <control_file> [--ncomplex <n>] [--npoint_complex <n>] [--npoint_sub <n>] [--nstep <n>] \
+        [--nstagnation <n>] [--pct_change <f>] [--pop_conv <f>] [--nparallel <n>] [--max_iterations <n>] \
+        [--warm_start <yes|no>] [--trial_script <script>] [--seed <n>]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = os.path.abspath(args.control_file)
+    max_iterations = args.max_iterations if args.max_iterations is not None else int(read_from_control(control_file, 'max_iterations'))
+    rng = np.random.default_rng(args.seed)
+
+    # Prepare the workers and read the history (warm start).
+    pool = make_pool(control_file, 'sce', args.nparallel, args.trial_script, args.warm_start)
+    lower, upper = pool.lower, pool.upper
+    nparam = len(pool.param_names)
+    ncomplex = args.ncomplex
+    npoint_complex = args.npoint_complex if args.npoint_complex is not None else 2*nparam+1
+    npoint_sub = args.npoint_sub if args.npoint_sub is not None else nparam+1
+    nstep = args.nstep if args.nstep is not None else npoint_complex
+    if npoint_sub < 2 or npoint_sub > npoint_complex:
+        print('ERROR: npoint_sub must be between 2 and npoint_complex (%d).'%(npoint_complex))
+        sys.exit(1)
+    npopulation = ncomplex*npoint_complex
+    if max_iterations < npopulation:
+        print('ERROR: max_iterations (%d) is smaller than the initial population (%d).'%(max_iterations, npopulation))
+        sys.exit(1)
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Sample the initial population.
+    population = lower + latin_hypercube(npopulation, nparam, rng) * (upper - lower)
+    starts = pool.history_starts(npopulation)
+    population[:len(starts)] = starts
+    print('SCE-UA: %d complexes of %d points, %d params, %d trials at most, %d in parallel.'%(
+        ncomplex, npoint_complex, nparam, max_iterations, pool.nparallel))
+
+    # #### 2. Evaluate the initial population.
+    objs = pool.evaluate(population)
+    best_history = [np.min(objs)]
+
+    nshuffle = 0
+    while True:
+        # #### 3. Partition the sorted population into complexes.
+        order = np.argsort(objs, kind='stable')
+        population, objs = population[order], objs[order]
+        complexes = [population[k::ncomplex].copy() for k in range(ncomplex)]
+        complex_objs = [objs[k::ncomplex].copy() for k in range(ncomplex)]
+
+        # #### 4. Evolve the complexes (each step costs up to 3 trials per complex).
+        for step in range(nstep):
+            if pool.ntrial + 3*ncomplex > max_iterations:
+                break
+            evolve_complexes(pool, complexes, complex_objs, npoint_sub, lower, upper, rng)
+
+        # #### 5. Shuffle the complexes and check the stopping criteria.
+        population, objs = np.concatenate(complexes), np.concatenate(complex_objs)
+        nshuffle += 1
+        best_history.append(np.min(objs))
+        gnrng = geometric_range(population, lower, upper)
+        print('Shuffle %d: %d trials, best objective %.6E, normalized geometric range %.3E.'%(
+            nshuffle, pool.ntrial, best_history[-1], gnrng))
+        if pool.ntrial + 3*ncomplex > max_iterations:
+            print('Stop: max_iterations is reached.')
+            break
+        if gnrng < args.pop_conv:
+            print('Stop: the population has converged.')
+            break
+        if len(best_history) > args.nstagnation:
+            previous = best_history[-1-args.nstagnation]
+            if abs(previous - best_history[-1]) <= args.pct_change*max(abs(previous), 1e-12):
+                print('Stop: the best objective improved less than %g over %d shuffles.'%(args.pct_change, args.nstagnation))
+                break
+
+    # #### 6. Write the best param set to multipliers.txt.
+    pool.close()
+    if pool.best is None:
+        print('ERROR: no SCE-UA trial succeeded. Check the trial logs.')
+        sys.exit(1)
+    print('SCE-UA: best objective %.6E after %d trials.'%(pool.obj_best, pool.ntrial))
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Archive trial outputs in the background while the next trial runs ####
+# save_model_output.sh and save_best.py copy the outputs of a trial (summa and mizuRoute outputs, trialParams.nc,
+# stat file, multipliers) before the next trial starts. With archive_queue > 0 in the control file, the copies are
+# made by a background server instead:
+# Mode 'submit': take ownership of the outputs of a finished trial. The summa and mizuRoute outputs are moved and
+#                the small files are copied into a spool entry [calib_path]/archive_spool/entry_[n], so the next trial
+#                can start at once. The spool is on the shared filesystem next to output_archive: the move is a rename
+#                for the default model_path ([calib_path]/model), and a copy when the model is staged on node-local
+#                storage (stage_model.py), so pending entries outlive the allocation. Back-pressure: wait while
+#                archive_queue entries are pending, or while entries are pending and the free space of calib_path is
+#                below archive_min_free_gb. Without a running server, archive the entry (and any left over) at once.
+# Mode 'serve':  archive the spool entries in submission order, as save_model_output.sh ([calib_path]/output_archive/
+#                run[n]) and save_best.py ([calib_path]/output_archive) do. Entries left by an interrupted run are
+#                archived first. Each entry is traced as stage archive_async (see trace_stage.py).
+# Mode 'wait':   wait until all entries are archived (eg, before reading output_archive).
+# Mode 'stop':   wait until all entries are archived, then stop the server.
+# An example: python async_archiver.py ../control_active.txt serve &
+#             python async_archiver.py ../control_active.txt submit 5
+
+# import packages
+import os, sys, argparse, json, time, socket, shutil, glob
+import numpy as np
+from extract_upstream_domain import get_model_files, read_from_summa_route_config
+from trace_stage import get_trace_file, StageTimer
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to archive trial outputs in the background.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('mode', choices=['submit', 'serve', 'wait', 'stop'], help='submit: spool the outputs of a trial. serve: run the archiver. wait: wait for the archiver. stop: wait and stop the archiver.')
+    parser.add_argument('iteration_idx', nargs='?', default=None, help='iteration id starting from 1 (used by submit).')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def get_output_paths(control_file):
+    '''Function to return the files archived for a trial of control_file: summa output, mizuRoute output,
+    trial param file and stat file.'''
+    files = get_model_files(control_file)
+    summa_outputPath    = read_from_summa_route_config(files['summa_filemanager'], 'outputPath')
+    summa_outFilePrefix = read_from_summa_route_config(files['summa_filemanager'], 'outFilePrefix')
+    route_outputPath    = read_from_summa_route_config(files['route_control'], '<output_dir>')
+    route_outFilePrefix = read_from_summa_route_config(files['route_control'], '<case_name>')
+    return {'summa': os.path.join(summa_outputPath, summa_outFilePrefix + '_day.nc'),
+            'route': os.path.join(route_outputPath, route_outFilePrefix + '.mizuRoute.nc'),
+            'trialParam': files['trialParamFile'],
+            'stat': os.path.join(files['calib_path'], read_from_control(control_file, 'stat_output'))}
+
+def get_spool_path(control_file):
+    '''Function to return the spool folder. It is in calib_path, which stage_model.py keeps on the shared filesystem,
+    so the entries left by an allocation are archived by the next one.'''
+    return os.path.join(get_model_files(control_file)['calib_path'], 'archive_spool')
+
+def list_entries(spool_path):
+    '''Function to return the complete spool entries in submission order.'''
+    entries = [x for x in glob.glob(os.path.join(spool_path, 'entry_*')) if not x.endswith('.tmp')]
+    return sorted(entries, key=lambda x: int(x.rsplit('_',1)[1]))
+
+def server_alive(spool_path):
+    '''Function to check that an archiver server is running. The server runs on the host of the calibration script,
+    so a pid file of another host is left over from an earlier allocation.'''
+    pid_file = os.path.join(spool_path, 'archiver.pid')
+    if not os.path.exists(pid_file):
+        return False
+    with open(pid_file) as f:
+        host, pid = f.read().split()
+    if host != socket.gethostname():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except OSError:
+        return False
+    return True
+
+def write_entry_info(entry_path, info):
+    '''Function to write entry.json of a spool entry atomically.'''
+    with open(os.path.join(entry_path, 'entry.json.tmp'), 'w') as f:
+        json.dump(info, f, indent=1)
+    os.replace(os.path.join(entry_path, 'entry.json.tmp'), os.path.join(entry_path, 'entry.json'))
+
+def submit_entry(spool_path, calib_path, output_paths, iteration_idx):
+    '''Function to move the outputs of a trial into a new spool entry. The entry becomes visible to the server
+    by a rename at the end, so the server never sees a partial entry.'''
+    os.makedirs(spool_path, exist_ok=True)
+    numbers = [int(x.rsplit('_',1)[1].split('.')[0]) for x in glob.glob(os.path.join(spool_path, 'entry_*'))]
+    entry_path = os.path.join(spool_path, 'entry_%d'%(max(numbers + [0]) + 1))
+    os.makedirs(entry_path + '.tmp')
+    names = {}
+    for key in ['summa', 'route']:
+        shutil.move(output_paths[key], os.path.join(entry_path + '.tmp', os.path.basename(output_paths[key])))
+        names[key] = os.path.basename(output_paths[key])
+    for key in ['trialParam', 'stat']:
+        shutil.copy2(output_paths[key], entry_path + '.tmp')
+        names[key] = os.path.basename(output_paths[key])
+    names['multipliers'] = []
+    for file in glob.glob(os.path.join(calib_path, 'multiplier*')):
+        shutil.copy2(file, entry_path + '.tmp')
+        names['multipliers'].append(os.path.basename(file))
+    write_entry_info(entry_path + '.tmp', {'iteration': iteration_idx, 'files': names})
+    os.rename(entry_path + '.tmp', entry_path)
+    return entry_path
+
+def archive_entry(entry_path, calib_path, warm_start):
+    '''Function to archive a spool entry into [calib_path]/output_archive/run[n] (as save_model_output.sh), and into
+    [calib_path]/output_archive if it is the first or a better trial (as save_best.py). Then remove the entry.'''
+    with open(os.path.join(entry_path, 'entry.json')) as f:
+        info = json.load(f)
+    names = info['files']
+    save_best_dir = os.path.join(calib_path, 'output_archive')
+    os.makedirs(save_best_dir, exist_ok=True)
+
+    # (1) Archive the trial. The run folder is kept in entry.json, so an interrupted entry is archived into the same one.
+    if 'run_dir' not in info:
+        if warm_start == 'no':
+            info['run_dir'] = os.path.join(save_best_dir, 'run%d'%(info['iteration']))
+        else:
+            info['run_dir'] = os.path.join(save_best_dir, 'run%d'%(len(glob.glob(os.path.join(save_best_dir, 'run*'))) + 1))
+        write_entry_info(entry_path, info)
+    os.makedirs(info['run_dir'], exist_ok=True)
+    for name in ['multipliers.txt', names['trialParam'], names['summa'], names['route'], names['stat']]:
+        if os.path.exists(os.path.join(entry_path, name)):
+            shutil.copy2(os.path.join(entry_path, name), info['run_dir'])
+
+    # (2) Archive the best trial.
+    stat_best_output = os.path.join(save_best_dir, names['stat'])
+    obj = np.loadtxt(os.path.join(entry_path, names['stat']), usecols=[0]) * (-1)  # eg, obj = negative KGE
+    if (info['iteration'] == 1 and warm_start == 'no') or not os.path.exists(stat_best_output) or \
+       obj < np.loadtxt(stat_best_output, usecols=[0]) * (-1):
+        for name in [names['summa'], names['route'], names['stat'], names['trialParam']] + names['multipliers']:
+            shutil.copy2(os.path.join(entry_path, name), save_best_dir)
+    shutil.rmtree(entry_path)
+
+def archive_pending(spool_path, calib_path, warm_start, trace_file=None):
+    '''Function to archive all pending entries in submission order. Return the number of archived entries.'''
+    entries = list_entries(spool_path)
+    for entry_path in entries:
+        with open(os.path.join(entry_path, 'entry.json')) as f:
+            iteration_idx = json.load(f)['iteration']
+        with StageTimer(trace_file, 'archive_async', iteration_idx):
+            archive_entry(entry_path, calib_path, warm_start)
+    return len(entries)
+
+def wait_for_server(spool_path, calib_path, warm_start, trace_file, condition):
+    '''Function to wait while condition() is true and the server runs. If the server stops, archive the pending
+    entries in this process.'''
+    while condition():
+        if not server_alive(spool_path):
+            archive_pending(spool_path, calib_path, warm_start, trace_file)
+            return
+        time.sleep(0.5)
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python async_archiver.py ../control_active.txt submit 1
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 3:
+        print("Usage: %s <control_file> <submit|serve|wait|stop> [iteration_idx]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = args.control_file
+    calib_path   = read_from_control(control_file, 'calib_path')
+    warm_start   = read_from_control(control_file, 'WarmStart')
+    queue_size   = max(1, int(read_from_control(control_file, 'archive_queue', '1')))
+    min_free     = float(read_from_control(control_file, 'archive_min_free_gb', '0')) * 1024**3
+    spool_path   = get_spool_path(control_file)
+    trace_file   = get_trace_file(control_file)
+    pid_file     = os.path.join(spool_path, 'archiver.pid')
+    stop_file    = os.path.join(spool_path, 'archiver.stop')
+    os.makedirs(spool_path, exist_ok=True)
+
+    # -----------------------------------------------------------------------
+
+    if args.mode == 'submit':
+        if args.iteration_idx is None:
+            print('ERROR: Mode submit needs iteration_idx.')
+            sys.exit(1)
+        # #### 1. Back-pressure: wait for a free queue slot and enough free disk space.
+        wait_for_server(spool_path, calib_path, warm_start, trace_file,
+                        lambda: len(list_entries(spool_path)) >= queue_size or
+                        (len(list_entries(spool_path)) > 0 and shutil.disk_usage(calib_path).free < min_free))
+
+        # #### 2. Move the outputs into the spool. Archive them at once if no server runs.
+        submit_entry(spool_path, calib_path, get_output_paths(control_file), int(args.iteration_idx))
+        if not server_alive(spool_path):
+            archive_pending(spool_path, calib_path, warm_start, trace_file)
+
+    elif args.mode == 'serve':
+        if server_alive(spool_path):
+            print('ERROR: An archiver already runs for %s (see %s).'%(spool_path, pid_file))
+            sys.exit(1)
+        with open(pid_file, 'w') as f:
+            f.write('%s %d\n'%(socket.gethostname(), os.getpid()))
+        if os.path.exists(stop_file):
+            os.remove(stop_file)
+        # #### 1. Archive entries as they come, until stopped with an empty spool.
+        try:
+            while True:
+                if archive_pending(spool_path, calib_path, warm_start, trace_file) == 0:
+                    if os.path.exists(stop_file):
+                        break
+                    time.sleep(0.5)
+        finally:
+            os.remove(pid_file)
+            if os.path.exists(stop_file):
+                os.remove(stop_file)
+
+    else:
+        # #### 1. Wait until all entries are archived, and stop the server (mode stop).
+        wait_for_server(spool_path, calib_path, warm_start, trace_file, lambda: len(list_entries(spool_path)) > 0)
+        if args.mode == 'stop' and server_alive(spool_path):
+            open(stop_file, 'w').close()
+            wait_for_server(spool_path, calib_path, warm_start, trace_file, lambda: os.path.exists(pid_file))
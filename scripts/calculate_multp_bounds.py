@@ -4,15 +4,21 @@
 # #### Calculate multiplier lower/upper bounds ####
 # Given the a priori parameter values and the lower/upper bounds in localParam.txt and basinParam.txt, 
 # determine globally constant multiplier lower/upper bounds.
+# If multp_regions is set in control_file, each parameter gets one multiplier per region (eg, per soil class or
+# elevation band), named [param]_multp_r[N], with bounds that are only constrained by the HRUs/GRUs of the region.
+# The region index of each HRU and GRU is saved in [calib_path]/multiplier_regions.nc for update_paramTrial.py.
 # 1. Determine to-be-evaluated multipliers.
 # 2. Read the a priori parameter values and lower/upper limits.
 # 3. Calculate the multiplier lower/upper bounds.
 # 4. Save multiplier bounds into a text.
+# The Info files are parsed once into dictionaries, each a priori variable is read once, and the bounds are
+# reduced over the non-zero a priori values only (no full-size bound arrays), so that it scales to large domains.
 
 # import packages
 import os, sys, argparse
 import numpy as np
 import xarray as xr
+import netCDF4 as nc
 
 # define functions
 def process_command_line():
@@ -22,18 +28,16 @@ def process_command_line():
     args = parser.parse_args()
     return(args)
 
-def read_from_control(config_file, setting):
-    ''' Function to extract a given setting from the config_file.'''      
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
     # Open 'control_active.txt' and locate the line with setting
     with open(control_file) as ff:
         for line in ff:
             line = line.strip()
             if line.startswith(setting):
-                break
-    # Extract the setting's value
-    substring = line.split('|',1)[1].split('#',1)[0].strip() 
-    # Return this value    
-    return substring
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
 
 def read_from_summa_route_config(config_file, setting):
     '''Function to extract a given setting from the summa or mizuRoute configuration file.'''
@@ -48,21 +52,76 @@ def read_from_summa_route_config(config_file, setting):
     # Return this value    
     return substring
 
-def read_basinParam_localParam(filename):
-    '''Function to extract the param limits from basinParamInfo.txt and localParamInfo.txt'''
-    param_names = []
-    param_min = []
-    param_max =[]
+def read_param_info(filename):
+    '''Function to extract the param limits from basinParamInfo.txt and localParamInfo.txt.
+    Return a dictionary of param name: (min, max).'''
+    param_limits = {}
     with open (filename, 'r') as f:
         for line in f:
             line=line.strip()
             if line and not line.startswith('!') and not line.startswith("'"):
                 splits=line.split('|')
-                if isinstance(splits[0].strip(), str):
-                    param_names.append(splits[0].strip())
-                    param_min.append(str_to_float(splits[2].strip()))
-                    param_max.append(str_to_float(splits[3].strip()))
-    return param_names, param_min, param_max
+                param_limits[splits[0].strip()] = (str_to_float(splits[2].strip()), str_to_float(splits[3].strip()))
+    return param_limits
+
+def multp_range(param_priori, param_min, param_max, mask=None, region=None, nregion=1):
+    '''Function to calculate the feasible multiplier range max(param_min/priori), min(param_max/priori).
+    param_min and param_max are scalars or arrays of the param_priori shape. Zero a priori values (and mask==False)
+    are excluded. Only the selected elements are divided, so no full-size temporaries are created.
+    If region (region index per element, start from 0) is given, return arrays of the range per region.'''
+    valid = (param_priori != 0.0) if mask is None else ((param_priori != 0.0) & mask)
+    priori = param_priori[valid]
+    bound_min = param_min[valid] if np.ndim(param_min) > 0 else param_min
+    bound_max = param_max[valid] if np.ndim(param_max) > 0 else param_max
+    if region is None:
+        return np.max(bound_min/priori), np.min(bound_max/priori)
+    # Reduce per region. Regions without valid elements get an infinite range.
+    region = np.broadcast_to(region, np.shape(param_priori))[valid]
+    multp_min = np.full(nregion, -np.inf)
+    multp_max = np.full(nregion, np.inf)
+    np.maximum.at(multp_min, region, bound_min/priori)
+    np.minimum.at(multp_max, region, bound_max/priori)
+    return multp_min, multp_max
+
+def make_regions(attributeFile, multp_regions):
+    '''Function to assign each HRU and GRU to a multiplier region based on an HRU attribute of attributeFile.
+    multp_regions is an attribute name (one region per attribute value, eg, soilTypeIndex), or attribute:N 
+    (N bands with equal numbers of HRUs, eg, elevation:3). A GRU belongs to the region of its largest HRU.
+    Return the region index (start from 0) per HRU and per GRU, and the region labels.'''
+    attr_name, _, nband = multp_regions.partition(':')
+    with xr.open_dataset(attributeFile) as f:
+        values    = f[attr_name].values
+        hru2gruId = f['hru2gruId'].values
+        gruId     = f['gruId'].values
+        HRUarea   = f['HRUarea'].values
+
+    if nband:
+        edges = np.quantile(values, np.linspace(0, 1, int(nband)+1))
+        hru_region = np.searchsorted(edges[1:-1], values, side='right')
+        labels = ['%s %g-%g'%(attr_name, edges[i], edges[i+1]) for i in range(int(nband))]
+    else:
+        uniq, hru_region = np.unique(values, return_inverse=True)
+        labels = ['%s %g'%(attr_name, x) for x in uniq]
+    # Drop empty regions (eg, bands with tied values).
+    used, hru_region = np.unique(hru_region, return_inverse=True)
+    labels = [labels[i] for i in used]
+
+    # GRU region: the region of its largest HRU. Sort by GRU then area, and take the last HRU of each GRU.
+    order   = np.lexsort((HRUarea, hru2gruId))
+    sorted_gru = hru2gruId[order]
+    largest = order[np.append(sorted_gru[1:] != sorted_gru[:-1], True)]
+    gru_region = hru_region[largest][np.searchsorted(hru2gruId[largest], gruId)]
+    return hru_region, gru_region, labels
+
+def write_regions(region_file, hru_region, gru_region, labels):
+    '''Function to save the region index per HRU and GRU (start from 0) into a netCDF file.'''
+    with nc.Dataset(region_file, 'w') as f:
+        f.createDimension('hru', len(hru_region))
+        f.createDimension('gru', len(gru_region))
+        f.createVariable('hruRegion', 'i4', ('hru',))[:] = hru_region
+        f.createVariable('gruRegion', 'i4', ('gru',))[:] = gru_region
+        f.nregion = len(labels)
+        f.region_labels = '; '.join(['r%d: %s'%(i+1, x) for i, x in enumerate(labels)])
 
 def str_to_float(data_str):
     '''Function to convert data from Fortran format to scientific format.
@@ -126,9 +185,9 @@ if __name__ == '__main__':
     basinParam = os.path.join(summa_setting_path, basinParam)
     localParam = os.path.join(summa_setting_path, localParam)
     
-    # Read basin and local param names, min and max bounds from basinParam and localParam files.
-    basin_param_names, basin_param_min, basin_param_max = read_basinParam_localParam(basinParam)    
-    local_param_names, local_param_min, local_param_max = read_basinParam_localParam(localParam)
+    # Read basin and local param limits from basinParam and localParam files.
+    basin_param_limits = read_param_info(basinParam)
+    local_param_limits = read_param_info(localParam)
 
     # #### 3. Read a priori param values
     summa_settings_relpath = read_from_control(control_file, 'summa_settings_relpath')
@@ -140,140 +199,148 @@ if __name__ == '__main__':
     # a priori param file generated from 1_generate_priori_trialParam.py.
     trialParamFile_priori = trialParamFile.split('.nc')[0] + '.priori.nc' 
     trialParamFile_priori = os.path.join(summa_settings_path, trialParamFile_priori)
+
+    # Determine all a priori variables needed by the multipliers, and read each of them once.
+    soil_params = ['theta_res', 'critSoilWilting', 'critSoilTranspire', 'fieldCapacity'] # theta_sat lower limits
+    priori_vars = set()
+    for multp_name in object_multps:
+        param_name = multp_name.replace('_multp','')
+        if param_name == 'thickness':
+            priori_vars.update(['heightCanopyBottom', 'heightCanopyTop'])
+        else:
+            priori_vars.add(param_name)
+        if param_name == 'theta_sat':
+            priori_vars.update(soil_params)
+        elif param_name == 'routingGammaScale':
+            priori_vars.add('routingGammaShape')
+    # The domain area and GRU number of the routingGammaScale bounds are read in the same pass.
+    attributeFile = os.path.join(summa_setting_path, read_from_summa_route_config(summa_filemanager, 'attributeFile'))
+    with xr.open_dataset(trialParamFile_priori) as f, xr.open_dataset(attributeFile) as fa:
+        missing = [x for x in priori_vars if x not in f.variables]
+        if missing:
+            print('Error: Parameter(s) %s do not exist in %s.'%(', '.join(sorted(missing)), trialParamFile_priori))
+            sys.exit(1)
+        priori = {x: f[x].values for x in priori_vars}
+        priori_dim = {x: f[x].dims[-1] for x in priori_vars}  # 'hru' or 'gru'
+        if 'routingGammaScale' in priori_vars:
+            nGRU = fa.sizes['gru']
+            domain_area = fa['HRUarea'].values.sum()
+
+    # Read multiplier regions. 'none': one globally constant multiplier per parameter.
+    multp_regions = read_from_control(control_file, 'multp_regions', 'none')
+    region_file = os.path.join(calib_path, 'multiplier_regions.nc')
+    if multp_regions != 'none':
+        hru_region, gru_region, region_labels = make_regions(attributeFile, multp_regions)
+        nregion = len(region_labels)
+        # A GRU param has one global multiplier if a region is not the largest HRU of any GRU.
+        region_index = {'hru': hru_region, 'gru': gru_region if len(np.unique(gru_region)) == nregion else None}
+        print('Multiplier regions: %s.'%('; '.join(['r%d: %s'%(i+1, x) for i, x in enumerate(region_labels)])))
+        if region_index['gru'] is None:
+            print('Some regions have no GRU. GRU params get one global multiplier.')
+    else:
+        region_index = {'hru': None, 'gru': None}
+        nregion = 1
  
     # #### 4. Calculate multiplier lower/upper bounds
     multp_bounds_list = []   # list of [multiplier name, initial, lower, upper]. 
 
-    with xr.open_dataset(trialParamFile_priori) as f:
-        for i in range(object_multps_num):
-            multp_name = object_multps[i]                # multiplier name (eg, k_soil_multp)
-            param_name = multp_name.replace('_multp','') # SUMMA parameter name (eg, k_soil)
-
-            # (1) Read a priori param values.
-            if param_name != 'thickness': 
-                param_priori = f[param_name].values                                     
-            elif param_name == 'thickness': 
-                canopyBottom_priori = f['heightCanopyBottom'].values
-                canopyTop_priori    = f['heightCanopyTop'].values
-                param_priori  = canopyTop_priori - canopyBottom_priori
-            
-            param_priori_shp = np.shape(param_priori)
-            param_priori_ma = np.ma.masked_array(param_priori, mask=(param_priori==0.0))
-            if all(param_priori == 0.0):
-                print('Error: Parameter %s a-prioir values are all 0.0, \
-                so the mutiplier-based calibration is not applicable to it.' %(param_name))
-                sys.exit()
+    for i in range(object_multps_num):
+        multp_name = object_multps[i]                # multiplier name (eg, k_soil_multp)
+        param_name = multp_name.replace('_multp','') # SUMMA parameter name (eg, k_soil)
+
+        # (1) Get a priori param values.
+        if param_name != 'thickness': 
+            param_priori = priori[param_name]
+            region = region_index[priori_dim[param_name]]
+        elif param_name == 'thickness': 
+            param_priori = priori['heightCanopyTop'] - priori['heightCanopyBottom']
+            region = region_index[priori_dim['heightCanopyTop']]
         
-            # (2) Get param upper and lower limits.                
-            if param_name in local_param_names:
-                if param_name != 'theta_sat': 
-                    index     = local_param_names.index(param_name)
-                    param_min = local_param_min[index]*np.ones(param_priori_shp)
-                    param_max = local_param_max[index]*np.ones(param_priori_shp)              
-                
-                elif param_name == 'theta_sat': 
-                    index     = local_param_names.index(param_name)
-                    param_max = local_param_max[index]*np.ones(param_priori_shp)
-
-                    # Calculate 'theta_sat' param_min which should be larger than \
-                    # the max of all other variables of soil_params.
-                    soil_params = ['theta_res', 'critSoilWilting', 'critSoilTranspire', 'fieldCapacity']
-
-                    # (a) Use a multi-layer array to store the a priori soil_params values \
-                    # and the min 'theta_sat' values per hru.
-                    nhru  = f.dims['hru']                               # number of hrus. len(f[param_name])
-                    nsoil = len(soil_params)+1                          # soil_params variables + 'theta_sat'
-                    soil_params_priori_layers = np.ones((nhru,nsoil))                    
-                    
-                    for isoil in range(nsoil-1):                        # a-priori values for all soil_params variables.
-                        soil_param = soil_params[isoil]
-                        soil_params_priori_layers[:,isoil] = f[soil_param].values                    
-                    
-                    # add 'theta_sat' local_param_min to the last layer.
-                    soil_params_priori_layers[:,-1] = local_param_min[index]*np.ones(param_priori_shp)  
-                    
-                    # (b) 'theta_sat' param_min = the max among the a priori values of \
-                    # all soil_param variables and the local_param_min per hru.
-                    param_min = np.max(soil_params_priori_layers, axis=1)
-
-            elif param_name in basin_param_names:
-                if param_name != 'routingGammaScale': 
-                    index   = basin_param_names.index(param_name)
-                    param_min = basin_param_min[index]*np.ones(param_priori_shp)
-                    param_max = basin_param_max[index]*np.ones(param_priori_shp)
-
-                elif param_name == 'routingGammaScale': 
-                    # Calculate scale bounds based on GRU river length and runoff velocity.
-                    # mean_time_delay = GRU_channel_length / runoff_velocity
-                    # routingGammaScale = mean_time_delay / routingGammaShape
-                    
-                    # (a) Calculate GRU_channel_length (m)
-                    # Assume each GRU is a round circle, take its radius as the mean chennel length.                     
-                    attributeFile = read_from_summa_route_config(summa_filemanager, 'attributeFile')
-                    attributeFile = os.path.join(summa_setting_path, attributeFile)
-                    with xr.open_dataset(attributeFile) as fa:
-                        nGRU = fa.dims['gru']
-                        domain_area = fa['HRUarea'].values.sum()
-
-                    GRU_area = domain_area/nGRU                   # mean GRU area in square meter
-                    GRU_channel_length = np.sqrt(GRU_area/np.pi)  # mean GRU chennel length in meter
-
-                    # (b) Calculate routingGammaScale lower and upper bounds.
-                    # Assume lower and upper runoff_velocity.
-                    v_lower, v_upper = 0.1, 10 # unit: m/s            
-                    # Read a priori value of routingGammaShape
-                    gammaShape_priori = f['routingGammaShape'].values
-                    gammaShape_priori_ma  = np.ma.masked_array(gammaShape_priori, mask=(gammaShape_priori==0.0))
-
-                    param_min = np.divide((GRU_channel_length/v_upper), gammaShape_priori_ma)
-                    param_max = np.divide((GRU_channel_length/v_lower), gammaShape_priori_ma)
-
-            elif param_name == 'thickness': 
-                # Read a priori canopy bottom and top heights
-                index            = local_param_names.index('heightCanopyBottom')
-                canopyBottom_min = local_param_min[index]*np.ones(param_priori_shp)
-                canopyBottom_max = local_param_max[index]*np.ones(param_priori_shp)   
-
-                index            = local_param_names.index('heightCanopyTop')
-                canopyTop_min    = local_param_min[index]*np.ones(param_priori_shp)
-                canopyTop_max    = local_param_max[index]*np.ones(param_priori_shp)    
-
-                # Get thickness lower/upper bounds based canopy bottom and top bounds
-                param_min        = canopyTop_min - canopyBottom_min
-                param_max        = canopyTop_max - canopyBottom_max
-
-            else:
-                print('Error: Parameter %s does not exist in localParam.txt and basinParam.txt'%(param_name))
-                sys.exit()
-
-
-            # (3) Determine multiplier feasible range (globally feasible)
-            multp_min = np.max(param_min/param_priori_ma)
-            multp_max = np.min(param_max/param_priori_ma)
-            
-            if multp_min>=multp_max:
-                print('Error: %s multiplier does not have a feasible range (multiplier min >= multiplier max).'%(param_name))
-                sys.exit()
+        if not np.any(param_priori):
+            print('Error: Parameter %s a-prioir values are all 0.0, \
+            so the mutiplier-based calibration is not applicable to it.' %(param_name))
+            sys.exit(1)
     
-            # (4) Update initial multiplier value.
-            # When lower_bound < 1 < upper_bound (ie, a priori param value is in the param range), set initial multp = 1.0.
-            # If not, set initial multp = 0.5*(lower_bound + upper_bound).
-            if (multp_max < 1) or (multp_min > 1):
-                multp_initial = np.nanmean([multp_min, multp_max])
-            else:
-                multp_initial = 1.0
+        # (2) Get param upper and lower limits, and (3) determine multiplier feasible range (globally feasible).
+        if param_name in local_param_limits:
+            if param_name != 'theta_sat': 
+                param_min, param_max = local_param_limits[param_name]
+                multp_min, multp_max = multp_range(param_priori, param_min, param_max, region=region, nregion=nregion)
             
-            # (5) Append to results to multp_bounds_list.
-            multp_bounds_list.append([multp_name, multp_initial, multp_min, multp_max])
-
-    # #### 5. Save multiplier information into text.   
+            elif param_name == 'theta_sat': 
+                # 'theta_sat' param_min should be larger than the max of all other variables of soil_params.
+                # 'theta_sat' param_min = the max among the a priori values of all soil_param variables \
+                # and the local_param_min per hru.
+                param_min, param_max = local_param_limits[param_name]
+                param_min = np.maximum(np.maximum.reduce([priori[x] for x in soil_params]), param_min)
+                multp_min, multp_max = multp_range(param_priori, param_min, param_max, region=region, nregion=nregion)
+
+        elif param_name in basin_param_limits:
+            if param_name != 'routingGammaScale': 
+                param_min, param_max = basin_param_limits[param_name]
+                multp_min, multp_max = multp_range(param_priori, param_min, param_max, region=region, nregion=nregion)
+
+            elif param_name == 'routingGammaScale': 
+                # Calculate scale bounds based on GRU river length and runoff velocity.
+                # mean_time_delay = GRU_channel_length / runoff_velocity
+                # routingGammaScale = mean_time_delay / routingGammaShape
+                
+                # (a) Calculate GRU_channel_length (m)
+                # Assume each GRU is a round circle, take its radius as the mean chennel length.                     
+                GRU_area = domain_area/nGRU                   # mean GRU area in square meter
+                GRU_channel_length = np.sqrt(GRU_area/np.pi)  # mean GRU chennel length in meter
+
+                # (b) Calculate routingGammaScale lower and upper bounds.
+                # Assume lower and upper runoff_velocity. Zero a priori routingGammaShape values are excluded.
+                v_lower, v_upper = 0.1, 10 # unit: m/s            
+                gammaShape_priori = priori['routingGammaShape']
+                valid = gammaShape_priori != 0.0
+                gammaShape = np.where(valid, gammaShape_priori, 1.0)
+                multp_min, multp_max = multp_range(param_priori, (GRU_channel_length/v_upper)/gammaShape, 
+                                                   (GRU_channel_length/v_lower)/gammaShape, mask=valid,
+                                                   region=region, nregion=nregion)
+
+        elif param_name == 'thickness': 
+            # Get thickness lower/upper bounds based canopy bottom and top bounds
+            canopyBottom_min, canopyBottom_max = local_param_limits['heightCanopyBottom']
+            canopyTop_min, canopyTop_max       = local_param_limits['heightCanopyTop']
+            param_min = canopyTop_min - canopyBottom_min
+            param_max = canopyTop_max - canopyBottom_max
+            multp_min, multp_max = multp_range(param_priori, param_min, param_max, region=region, nregion=nregion)
+
+        else:
+            print('Error: Parameter %s does not exist in localParam.txt and basinParam.txt'%(param_name))
+            sys.exit(1)
+
+        if np.any(multp_min>=multp_max):
+            print('Error: %s multiplier does not have a feasible range (multiplier min >= multiplier max).'%(param_name))
+            sys.exit(1)
+        if np.any(np.isinf(multp_min)) or np.any(np.isinf(multp_max)):
+            print('Error: %s a-prioir values are all 0.0 in a multiplier region.'%(param_name))
+            sys.exit(1)
+
+        # (4) Update initial multiplier value.
+        # When lower_bound < 1 < upper_bound (ie, a priori param value is in the param range), set initial multp = 1.0.
+        # If not, set initial multp = 0.5*(lower_bound + upper_bound).
+        multp_min, multp_max = np.atleast_1d(multp_min), np.atleast_1d(multp_max)
+        multp_initial = np.where((multp_max < 1) | (multp_min > 1), 0.5*(multp_min + multp_max), 1.0)
+        
+        # (5) Append to results to multp_bounds_list. Regional multipliers are named [param]_multp_r[N].
+        for ir in range(len(multp_min)):
+            name = multp_name if region is None else '%s_r%d'%(multp_name, ir+1)
+            multp_bounds_list.append([name, multp_initial[ir], multp_min[ir], multp_max[ir]])
+
+    # #### 5. Save multiplier regions and information into text. The regions are written only with valid bounds.
+    if multp_regions != 'none':
+        write_regions(region_file, hru_region, gru_region, region_labels)
+    elif os.path.exists(region_file):
+        os.remove(region_file)
     multp_bounds = os.path.join(calib_path, 'multiplier_bounds.txt')
     if os.path.exists(multp_bounds):
         os.remove(multp_bounds)
     with open(multp_bounds, 'w') as f:
         f.write('# MultiplierName,InitialValue,LowerLimit,UpperLimit.\n')
-        for i in range(object_multps_num):
-            iList = multp_bounds_list[i]
+        for iList in multp_bounds_list:
             f.write('%s,%.6f,%.6f,%.6f\n'%(iList[0],iList[1],iList[2],iList[3]))
 
     # #### 6. Create multiplier template file and multiplier txt file for the first time.
@@ -282,13 +349,13 @@ if __name__ == '__main__':
     if os.path.exists(multp_tpl):
         os.remove(multp_tpl)
     with open(multp_tpl, 'w') as f:
-        for i in range(object_multps_num):
-            f.write('%s\n'%(multp_bounds_list[i][0]))
+        for iList in multp_bounds_list:
+            f.write('%s\n'%(iList[0]))
  
     # Create a multiplier txt file. Write multiplier initial values.
     multp_value = os.path.join(calib_path, 'multipliers.txt')
     if os.path.exists(multp_value):
         os.remove(multp_value)
     with open(multp_value, 'w') as f:
-        for i in range(object_multps_num):
-            f.write('%.6f\n'%(multp_bounds_list[i][1]))
+        for iList in multp_bounds_list:
+            f.write('%.6f\n'%(iList[1]))
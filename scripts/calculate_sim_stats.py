@@ -12,7 +12,7 @@ import xarray as xr
 # define functions
 def process_command_line():
     '''Parse the commandline'''
-    parser = argparse.ArgumentParser(description='Script to calculate model evaluation statistics KGE.')
+    parser = argparse.ArgumentParser(description='Script to calculate model evaluation statistics (objectives, eg, KGE).')
     parser.add_argument('control_file', help='path of the active control file.')
     args = parser.parse_args()
     return(args)
@@ -34,18 +34,29 @@ def get_modified_KGE(obs,sim):
     kge    = 1.0-np.sqrt((r-1)**2 +(relvar-1)**2 + (bias-1)**2)
     return kge
 
-def read_from_control(control_file, setting):
-    ''' Function to extract a given setting from the control_file.'''    
+def get_NSE(obs,sim):
+    '''Nash-Sutcliffe efficiency.'''
+    return 1.0-np.sum((sim-obs)**2)/np.sum((obs-np.mean(obs))**2)
+
+def get_log_NSE(obs,sim):
+    '''Nash-Sutcliffe efficiency of log flows, which weights low flows. \
+    1% of the mean observed flow is added to the flows to avoid log(0).'''
+    eps = 0.01*np.mean(obs)
+    return get_NSE(np.log(obs+eps), np.log(np.maximum(sim,0)+eps))
+
+# Metrics that can be listed in objectives (higher is better for all).
+metric_functions = {'KGE': get_modified_KGE, 'NSE': get_NSE, 'logNSE': get_log_NSE}
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
     # Open 'control_active.txt' and locate the line with setting
     with open(control_file) as ff:
         for line in ff:
             line = line.strip()
             if line.startswith(setting):
-                break
-    # Extract the setting's value
-    substring = line.split('|',1)[1].split('#',1)[0].strip() 
-    # Return this value    
-    return substring
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
        
 def read_from_summa_route_config(config_file, setting):
     '''Function to extract a given setting from the summa or mizuRoute configuration file.'''
@@ -111,6 +122,13 @@ if __name__ == '__main__':
     # Specify the statistical output file.
     stat_output = os.path.join(calib_path, read_from_control(control_file, 'stat_output'))
 
+    # Specify the metrics. The first one is the objective of single-objective calibration.
+    objectives = [x.strip() for x in read_from_control(control_file, 'objectives', 'KGE').split(',')]
+    for metric in objectives:
+        if metric not in metric_functions:
+            print('ERROR: Unknown metric %s in objectives. Use any of %s.'%(metric, ', '.join(metric_functions)))
+            sys.exit(1)
+
     # #### 2. Calculate 
     # --- Read simulated flow (cms) --- 
     # Note: simVarName is hard coded for the demo output. Users can modify based on their output.
@@ -140,9 +158,10 @@ if __name__ == '__main__':
     df_merge    = df_merge.dropna()
 
     # --- Calculate diagnostics --- 
-    kge = get_modified_KGE(obs=df_merge['obs'].values, sim=df_merge['sim'].values)
-    
-    # #### 3. Save 
+    metrics = [metric_functions[x](obs=df_merge['obs'].values, sim=df_merge['sim'].values) for x in objectives]
+
+    # #### 3. Save
+    # One line with the metrics in the order of objectives and their names as a comment, eg, 0.812345\t#KGE.
     f = open(stat_output, 'w+')
-    f.write('%.6f' %kge + '\t#KGE\n')
+    f.write(''.join(['%.6f\t'%(x) for x in metrics]) + '#' + ' '.join(objectives) + '\n')
     f.close()
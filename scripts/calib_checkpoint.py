@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Checkpoint of the calibration state for restarting preempted or time-limited runs ####
+# The checkpoint [calib_path]/calib_checkpoint.json is written atomically (temporary file, fsync, rename) and holds:
+# - stage: 'generated' (a candidate param set is in flight) or 'recorded' (the last trial is saved),
+# - in_flight: the candidate param set(s) not yet recorded, and trial_iteration, the iteration that evaluates them,
+# - completed_iteration: the last iteration whose trial was recorded, and current: the param set in param_file then,
+# - best: the best objective function value and param set so far, and rng_state: the optimizer's random state.
+# DDS.py (--checkpoint) saves the random state and the in-flight candidate after generating a param set.
+# Mode 'record': after save_best.py, mark an iteration as recorded.
+# Mode 'resume': restore param_file (the in-flight candidate, or the current param set), and print
+#                '<next_iteration> <yes|no>', where yes means the in-flight candidate is restored and must be evaluated,
+#                and no means a new candidate must be generated first.
+
+# import packages
+import os, sys, argparse, json, time
+import numpy as np
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to record or resume the calibration checkpoint.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('mode', choices=['record', 'resume'], help='record: mark an iteration as recorded. resume: restore param_file.')
+    parser.add_argument('iteration_idx', nargs='?', default=None, help='recorded iteration id starting from 1 (used by record).')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def get_checkpoint_file(control_file):
+    '''Function to identify the checkpoint file based on the control_file.'''
+    return os.path.join(read_from_control(control_file, 'calib_path'), 'calib_checkpoint.json')
+
+def read_checkpoint(checkpoint_file):
+    '''Function to read the checkpoint. Return an empty dictionary if it does not exist.'''
+    if not os.path.exists(checkpoint_file):
+        return {}
+    with open(checkpoint_file) as f:
+        return json.load(f)
+
+def write_checkpoint(checkpoint_file, state):
+    '''Function to write the checkpoint atomically. A reader sees either the old or the new checkpoint, never a partial one.'''
+    state = dict(state, updated=time.strftime('%Y-%m-%d %H:%M:%S'))
+    temp_file = checkpoint_file + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(state, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, checkpoint_file)
+    dir_fd = os.open(os.path.dirname(os.path.abspath(checkpoint_file)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+def get_rng_state():
+    '''Function to return the numpy global random state in a JSON serializable form.'''
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    return [name, keys.tolist(), int(pos), int(has_gauss), float(cached_gaussian)]
+
+def set_rng_state(rng_state):
+    '''Function to restore the numpy global random state saved by get_rng_state.'''
+    name, keys, pos, has_gauss, cached_gaussian = rng_state
+    np.random.set_state((name, np.array(keys, dtype=np.uint32), pos, has_gauss, cached_gaussian))
+
+def read_param_file(param_file):
+    '''Function to read a param file (one value per line).'''
+    return np.atleast_1d(np.loadtxt(param_file)).tolist()
+
+def write_param_file(param_file, param_sample):
+    '''Function to write a param file (one value per line) as DDS.py does.'''
+    with open(param_file, 'w') as f:
+        for value in param_sample:
+            f.write('%.6E\n'%(value))
+
+def read_best(hist_file):
+    '''Function to read the best objective function value and param set of a history file. Return None if unavailable.'''
+    if not os.path.exists(hist_file):
+        return None
+    with open(hist_file) as f:
+        lines = [x.split() for x in f.readlines()[1:] if x.strip()]
+    if not lines:
+        return None
+    values = np.array([[float(v) for v in x[1:]] for x in lines])
+    ibest  = int(np.nanargmin(values[:,0]))
+    return {'obj': float(values[ibest,0]), 'params': values[ibest,1:].tolist()}
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python calib_checkpoint.py ../control_active.txt record 10
+    #             python calib_checkpoint.py ../control_active.txt resume
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 3:
+        print("Usage: %s <control_file> <record|resume> [iteration_idx]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = args.control_file
+
+    calib_path = read_from_control(control_file, 'calib_path')
+    checkpoint_file  = get_checkpoint_file(control_file)
+    param_file       = os.path.join(calib_path, 'multipliers.txt')
+    search_hist_file = os.path.join(calib_path, 'calib_search_history.txt')
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Record an iteration: its trial is saved, and param_file is the current param set of the optimizer.
+    state = read_checkpoint(checkpoint_file)
+    if args.mode == 'record':
+        if args.iteration_idx is None:
+            print('ERROR: iteration_idx is required by record.')
+            sys.exit(1)
+        state.update({'stage': 'recorded', 'completed_iteration': int(args.iteration_idx), 'in_flight': [],
+                      'current': read_param_file(param_file), 'best': read_best(search_hist_file)})
+        write_checkpoint(checkpoint_file, state)
+        sys.exit(0)
+
+    # #### 2. Resume: restore param_file and report where to continue.
+    if not state:
+        print('1 no')
+        sys.exit(0)
+    completed = state.get('completed_iteration', 0)
+    if state.get('stage') == 'generated' and state.get('in_flight'):
+        # Re-queue the in-flight candidate.
+        write_param_file(param_file, state['in_flight'][0])
+        print('%d yes'%(state.get('trial_iteration', completed+1)))
+    else:
+        if state.get('current') is not None:
+            write_param_file(param_file, state['current'])
+        print('%d no'%(completed+1))
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Extract the model domain upstream of the evaluated gauge ####
+# Only the GRUs that drain to the gauge segment (q_seg_index) affect the calibration objective.
+# 1. Trace upstream segments of the gauge segment in the mizuRoute topology.
+# 2. Identify the GRUs (routing HRUs) that drain to these segments, and their summa HRUs.
+# 3. Write a reduced model in [calib_path]/model_upstream: subset attributes, trial params, initial conditions,
+#    forcing and topology files, plus fileManager.txt and the mizuRoute control pointing to the reduced model.
+# 4. Write [calib_path]/control_upstream.txt, a copy of control_file with model_path and q_seg_index of the reduced model.
+# The extraction is skipped if control_upstream.txt and the reduced model are newer than control_file and the source
+# model files (attributes, topology, forcing list, initial conditions, fileManager.txt and the mizuRoute control), eg,
+# when a calibration resumes. The reduced model then keeps its a priori trial params (see generate_priori_trialParam.py).
+
+# import packages
+import os, sys, argparse, shutil
+from collections import deque
+import netCDF4 as nc
+import numpy as np
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to extract the model domain upstream of the gauge.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('--seg_index', nargs='+', type=int, default=None,
+                        help='gauge segment indices (start from 1). Default: q_seg_index in control_file.')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def read_from_summa_route_config(config_file, setting):
+    '''Function to extract a given setting from the summa or mizuRoute configuration file.'''
+    # Open fileManager.txt or route_control and locate the line with setting
+    with open(config_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                break
+    # Extract the setting's value
+    substring = line.split('!',1)[0].strip().split(None,1)[1].strip("'")
+    # Return this value
+    return substring
+
+def write_config(src_file, dst_file, updates, quote=''):
+    '''Function to copy a summa or mizuRoute configuration file with some settings replaced.'''
+    with open(src_file, 'r') as src:
+        with open(dst_file, 'w') as dst:
+            for line in src:
+                setting = line.split(None,1)[0] if line.strip() else ''
+                if setting in updates:
+                    comment = ('!' + line.split('!',1)[1]) if '!' in line else '\n'
+                    line = '%-20s %s%s%s %s'%(setting, quote, updates[setting], quote, comment)
+                dst.write(line)
+
+def write_control_copy(control_file, control_copy, updates):
+    '''Function to copy control_file with the values of some settings replaced.'''
+    with open(control_file, 'r') as src:
+        with open(control_copy, 'w') as dst:
+            for line in src:
+                setting = line.split('|',1)[0].strip() if '|' in line else ''
+                if setting in updates and not line.lstrip().startswith('#'):
+                    comment = ('#' + line.split('#',1)[1]) if '#' in line else '\n'
+                    line = '%-22s | %-21s %s'%(setting, updates[setting], comment)
+                dst.write(line)
+
+def upstream_segments(segIds, downSegIds, gauge_segIds):
+    '''Function to find all segments upstream of (and including) the gauge segments.'''
+    upstream = {}
+    for seg, down in zip(segIds, downSegIds):
+        upstream.setdefault(down, []).append(seg)
+    found, queue = set(gauge_segIds), deque(gauge_segIds)
+    while queue:
+        for seg in upstream.get(queue.popleft(), []):
+            if seg not in found:
+                found.add(seg)
+                queue.append(seg)
+    return found
+
+def subset_netcdf(src_file, dst_file, dim_index):
+    '''Function to copy a netCDF file, keeping only the given indices along some dimensions.
+    dim_index is a dictionary of dimension name: sorted index array.'''
+    with nc.Dataset(src_file) as src, nc.Dataset(dst_file, 'w', format=src.data_model) as dst:
+        src.set_auto_maskandscale(False)
+        dst.set_auto_maskandscale(False)
+        dst.setncatts(src.__dict__)
+        for name, dim in src.dimensions.items():
+            size = None if dim.isunlimited() else (len(dim_index[name]) if name in dim_index else len(dim))
+            dst.createDimension(name, size)
+        for name, var in src.variables.items():
+            attrs = var.__dict__
+            fill_value = attrs.pop('_FillValue', None)
+            dst_var = dst.createVariable(name, var.datatype, var.dimensions, fill_value=fill_value)
+            dst_var.setncatts(attrs)
+            data = var[:]
+            for axis, dim in enumerate(var.dimensions):
+                if dim in dim_index:
+                    data = np.take(data, dim_index[dim], axis=axis)
+            dst_var[:] = data
+
+def index_of(ids, keep_ids):
+    '''Function to return the sorted positions of ids that are in keep_ids.'''
+    return np.where(np.isin(ids, list(keep_ids)))[0]
+
+
+def get_model_files(control_file):
+    '''Function to read the model paths and the domain dependent input files of control_file into a dictionary.'''
+    files = {}
+    calib_path = read_from_control(control_file, 'calib_path')
+    model_path = read_from_control(control_file, 'model_path')
+    if model_path == 'default':
+        model_path = os.path.join(calib_path, 'model')
+    files['calib_path'] = calib_path
+    files['model_path'] = model_path
+
+    # summa and mizuRoute settings paths and configuration files.
+    files['summa_settings_relpath'] = read_from_control(control_file, 'summa_settings_relpath')
+    files['route_settings_relpath'] = read_from_control(control_file, 'route_settings_relpath')
+    files['summa_settings_path'] = os.path.join(model_path, files['summa_settings_relpath'])
+    files['route_settings_path'] = os.path.join(model_path, files['route_settings_relpath'])
+    files['summa_filemanager_name'] = read_from_control(control_file, 'summa_filemanager')
+    files['route_control_name']     = read_from_control(control_file, 'route_control')
+    summa_filemanager = os.path.join(files['summa_settings_path'], files['summa_filemanager_name'])
+    route_control     = os.path.join(files['route_settings_path'], files['route_control_name'])
+    files['summa_filemanager'] = summa_filemanager
+    files['route_control']     = route_control
+
+    # summa input files.
+    files['attributeFile']  = os.path.join(files['summa_settings_path'], read_from_summa_route_config(summa_filemanager, 'attributeFile'))
+    files['trialParamFile'] = os.path.join(files['summa_settings_path'], read_from_summa_route_config(summa_filemanager, 'trialParamFile'))
+    files['trialParamFile_priori'] = files['trialParamFile'].split('.nc')[0] + '.priori.nc'
+    files['statePath']         = read_from_summa_route_config(summa_filemanager, 'statePath')
+    files['initConditionFile'] = read_from_summa_route_config(summa_filemanager, 'initConditionFile')
+    files['forcingPath']       = read_from_summa_route_config(summa_filemanager, 'forcingPath')
+    files['forcingListFile']   = os.path.join(files['summa_settings_path'], read_from_summa_route_config(summa_filemanager, 'forcingListFile'))
+
+    # mizuRoute topology file.
+    files['fname_ntopOld'] = read_from_summa_route_config(route_control, '<fname_ntopOld>')
+    files['topologyFile']  = os.path.join(read_from_summa_route_config(route_control, '<ancil_dir>'), files['fname_ntopOld'])
+    return files
+
+def read_topology(topologyFile):
+    '''Function to read segment and routing HRU (summa GRU) ids of a mizuRoute topology file.'''
+    with nc.Dataset(topologyFile) as f:
+        segIds       = f['segId'][:].astype('int64')
+        downSegIds   = f['downSegId'][:].astype('int64')
+        route_hruIds = f['hruId'][:].astype('int64')
+        hruToSegIds  = f['hruToSegId'][:].astype('int64')
+    return segIds, downSegIds, route_hruIds, hruToSegIds
+
+def is_extracted(control_upstream, new_model_path, source_files):
+    '''Function to check that the reduced model and its control file exist and are newer than the source files.'''
+    if not (os.path.exists(control_upstream) and os.path.isdir(new_model_path)):
+        return False
+    return os.path.getmtime(control_upstream) >= max([os.path.getmtime(x) for x in source_files if os.path.exists(x)])
+
+def write_domain(files, summa_grus, route_segs, route_grus, new_model_path):
+    '''Function to write a subset model into new_model_path. summa runs summa_grus. mizuRoute routes route_segs
+    with the runoff of route_grus (route_grus may include GRUs whose runoff is not simulated by this summa, 
+    see merge_upstream_runoff.py). Segments draining out of route_segs become outlets.
+    Return the segIds of the subset topology (in the order of the subset file).'''
+    new_summa_settings_path = os.path.join(new_model_path, files['summa_settings_relpath'])
+    new_route_settings_path = os.path.join(new_model_path, files['route_settings_relpath'])
+    new_forcingPath = os.path.join(new_model_path, 'forcing')
+
+    # (1) GRUs and HRUs simulated by summa.
+    with nc.Dataset(files['attributeFile']) as f:
+        gruIds    = f['gruId'][:].astype('int64')
+        hruIds    = f['hruId'][:].astype('int64')
+        hru2gruId = f['hru2gruId'][:].astype('int64')
+    gru_index = index_of(gruIds, summa_grus)
+    hru_index = index_of(hru2gruId, summa_grus)
+    keep_hrus = set(hruIds[hru_index])
+
+    # (2) Copy settings, then replace the domain dependent files with their subsets.
+    if os.path.exists(new_model_path):
+        shutil.rmtree(new_model_path)
+    shutil.copytree(files['summa_settings_path'], new_summa_settings_path)
+    shutil.copytree(files['route_settings_path'], new_route_settings_path)
+    os.makedirs(new_forcingPath)
+    os.makedirs(os.path.join(new_model_path, 'simulations', 'SUMMA'))
+    os.makedirs(os.path.join(new_model_path, 'simulations', 'mizuRoute'))
+
+    dim_index = {'hru': hru_index, 'gru': gru_index}
+    subset_netcdf(files['attributeFile'], os.path.join(new_summa_settings_path, os.path.basename(files['attributeFile'])), dim_index)
+    for param_file in [files['trialParamFile'], files['trialParamFile_priori']]:
+        if os.path.exists(param_file):
+            subset_netcdf(param_file, os.path.join(new_summa_settings_path, os.path.basename(param_file)), dim_index)
+    subset_netcdf(os.path.join(files['statePath'], files['initConditionFile']), 
+                  os.path.join(new_summa_settings_path, files['initConditionFile']), dim_index)
+
+    # (3) Subset forcing files by hruId (forcing HRUs may be in a different order than attributes.nc).
+    with open(files['forcingListFile']) as f:
+        forcing_files = [x.strip().strip("'") for x in f if x.strip() and not x.startswith('!')]
+    for forcing_file in forcing_files:
+        with nc.Dataset(os.path.join(files['forcingPath'], forcing_file)) as f:
+            forcing_hru_index = index_of(f['hruId'][:].astype('int64'), keep_hrus)
+        subset_netcdf(os.path.join(files['forcingPath'], forcing_file), os.path.join(new_forcingPath, forcing_file),
+                      {'hru': forcing_hru_index})
+
+    # (4) Subset topology. 
+    segIds, _, route_hruIds, _ = read_topology(files['topologyFile'])
+    new_topologyFile = os.path.join(new_route_settings_path, files['fname_ntopOld'])
+    seg_index = index_of(segIds, route_segs)
+    subset_netcdf(files['topologyFile'], new_topologyFile, {'seg': seg_index, 'hru': index_of(route_hruIds, route_grus)})
+    with nc.Dataset(new_topologyFile, 'a') as f:
+        downSeg = f['downSegId'][:]
+        downSeg[~np.isin(downSeg, list(route_segs))] = 0
+        f['downSegId'][:] = downSeg
+
+    # (5) Update fileManager.txt and the mizuRoute control to point to the subset model.
+    write_config(files['summa_filemanager'], os.path.join(new_summa_settings_path, files['summa_filemanager_name']),
+                 {'settingsPath': new_summa_settings_path + '/',
+                  'forcingPath':  new_forcingPath + '/',
+                  'outputPath':   os.path.join(new_model_path, 'simulations', 'SUMMA') + '/',
+                  'statePath':    new_summa_settings_path + '/'}, quote="'")
+    write_config(files['route_control'], os.path.join(new_route_settings_path, files['route_control_name']),
+                 {'<ancil_dir>':  new_route_settings_path + '/',
+                  '<input_dir>':  os.path.join(new_model_path, 'simulations', 'SUMMA') + '/',
+                  '<output_dir>': os.path.join(new_model_path, 'simulations', 'mizuRoute') + '/'})
+    return segIds[seg_index]
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python extract_upstream_domain.py ../control_active.txt
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 2:
+        print("Usage: %s <control_file> [--seg_index <index> ...]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = args.control_file
+
+    # Read model paths and input files from control_file.
+    files = get_model_files(control_file)
+    calib_path = files['calib_path']
+
+    # Gauge segment indices (start from 1).
+    seg_index = args.seg_index if args.seg_index is not None else [int(read_from_control(control_file, 'q_seg_index'))]
+
+    # Output model and control file.
+    new_model_path = os.path.join(calib_path, 'model_upstream')
+    control_upstream = os.path.join(calib_path, 'control_upstream.txt')
+
+    # Keep an up-to-date reduced model of the gauge in control_file.
+    source_files = [control_file, files['attributeFile'], files['topologyFile'], files['forcingListFile'],
+                    os.path.join(files['statePath'], files['initConditionFile']), files['summa_filemanager'], files['route_control']]
+    if args.seg_index is None and is_extracted(control_upstream, new_model_path, source_files):
+        print('Reduced model %s is up to date. Use %s to calibrate it.'%(new_model_path, control_upstream))
+        sys.exit(0)
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Trace upstream segments of the gauge(s).
+    segIds, downSegIds, route_hruIds, hruToSegIds = read_topology(files['topologyFile'])
+    gauge_segIds = [segIds[i-1] for i in seg_index]
+    keep_segs = upstream_segments(segIds, downSegIds, gauge_segIds)
+
+    # #### 2. Identify the upstream GRUs.
+    keep_grus = set(route_hruIds[np.isin(hruToSegIds, list(keep_segs))])
+    with nc.Dataset(files['attributeFile']) as f:
+        nGRU = len(f.dimensions['gru'])
+    print('Upstream of segment(s) %s: %d of %d segments, %d of %d GRUs.'%(
+        ', '.join([str(x) for x in gauge_segIds]), len(keep_segs), len(segIds), len(keep_grus), nGRU))
+    if len(keep_grus) == 0:
+        print('ERROR: No GRU drains to the gauge segment(s).')
+        sys.exit(1)
+
+    # #### 3. Write the reduced model.
+    new_segIds = write_domain(files, keep_grus, keep_segs, keep_grus, new_model_path)
+
+    # #### 4. Write the control file of the reduced model. The (first) gauge keeps its segment in the subset.
+    new_q_seg_index = int(np.where(new_segIds == gauge_segIds[0])[0][0]) + 1
+    write_control_copy(control_file, control_upstream, {'model_path': new_model_path,
+                                                        'q_seg_index': str(new_q_seg_index)})
+    print('Reduced model is saved in %s. Use %s to calibrate it.'%(new_model_path, control_upstream))
@@ -3,14 +3,19 @@
 
 # #### Create a priori trial parameter file (trialParam.priori.nc) ####
 # Given a list of SUMMA parameter names, create their corresponding a priori parameter values. 
-# 1. Update outputControl.txt by adding parameter names.
-# 2. Update fileManager.txt by changing simStartTime and simEndTime. 
-#    Here use a 1-day simulation to get the a priori parameter values.
-# 3. Run SUMMA to get a priori parameter values in timestep summa output. 
-# 4. Extract a priori parameter values from summa output and generate trialParam.priori.nc.
+# 1. Write temporary copies of outputControl.txt (parameter names only) and fileManager.txt (one forcing time step, 
+#    no trial parameter file, output to [calib_path]/priori_run) in [calib_path]/priori_run.
+#    The model's own configuration files are not changed.
+# 2. Skip the SUMMA run if trialParam.priori.nc was created from the same settings (fingerprint of the parameter list,
+#    start time, SUMMA executable and the domain/parameter settings files).
+# 3. Run SUMMA to get a priori parameter values in timestep summa output. GRU subsets are run in parallel.
+# 4. Extract a priori parameter values from summa output and generate trialParam.priori.nc in one pass.
+#    The storage layout of the parameter variables (chunking, float32, compression) follows param_file_layout.
+#    trialParam.nc is a copy of this file, so update_paramTrial.py rewrites it in the same layout.
 
 # import module
-import os, sys, argparse, shutil, datetime
+import os, sys, argparse, shutil, datetime, hashlib, shlex, subprocess
+from glob import glob
 import netCDF4 as nc
 import numpy as np
 
@@ -18,21 +23,21 @@ def process_command_line():
     '''Parse the commandline'''
     parser = argparse.ArgumentParser(description='Script to prepare the a-priori summa trialParam.nc.')
     parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('--nproc', type=int, default=None, help='number of GRU subsets run in parallel. Default: number of available cores.')
+    parser.add_argument('--force', action='store_true', help='run SUMMA even if the a priori file is up to date.')
     args = parser.parse_args()
     return(args)
 
-def read_from_control(control_file, setting):
-    ''' Function to extract a given setting from the control_file.'''    
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
     # Open 'control_active.txt' and locate the line with setting
     with open(control_file) as ff:
         for line in ff:
             line = line.strip()
             if line.startswith(setting):
-                break
-    # Extract the setting's value
-    substring = line.split('|',1)[1].split('#',1)[0].strip() 
-    # Return this value    
-    return substring
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
        
 def read_from_summa_route_config(config_file, setting):
     '''Function to extract a given setting from the summa or mizuRoute configuration file.'''
@@ -47,6 +52,79 @@ def read_from_summa_route_config(config_file, setting):
     # Return this value    
     return substring
 
+def write_config(src_file, dst_file, updates):
+    '''Function to copy a summa configuration file with some settings replaced.'''
+    with open(src_file, 'r') as src:
+        with open(dst_file, 'w') as dst:
+            for line in src:
+                setting = line.split(None,1)[0] if line.strip() else ''
+                if setting in updates:
+                    comment = ('!' + line.split('!',1)[1]) if '!' in line else '\n'
+                    line = "%-20s '%s' %s"%(setting, updates[setting], comment)
+                dst.write(line)
+
+def settings_fingerprint(values, files):
+    '''Function to hash a list of strings and the contents of a list of files.'''
+    sha = hashlib.sha256()
+    for value in values:
+        sha.update(str(value).encode())
+    for file in files:
+        sha.update(file.encode())
+        if os.path.exists(file):
+            with open(file, 'rb') as f:
+                for chunk in iter(lambda: f.read(1<<20), b''):
+                    sha.update(chunk)
+    return sha.hexdigest()
+
+def forcing_time_step(forcingPath, forcingListFile):
+    '''Function to get the forcing time step (in seconds) from the first forcing file. Default: one hour
+    (eg, an empty forcing list or a single time step).'''
+    with open(forcingListFile) as f:
+        forcing_files = [x.strip().strip("'") for x in f if x.strip() and not x.startswith('!')]
+    if len(forcing_files) == 0:
+        return 3600
+    with nc.Dataset(os.path.join(forcingPath, forcing_files[0])) as f:
+        time = f['time']
+        if len(time) < 2:
+            return 3600
+        t0, t1 = nc.num2date(time[:2], time.units, getattr(time, 'calendar', 'standard'))
+        return int(round((t1 - t0).total_seconds()))
+
+def parse_param_layout(layout):
+    '''Function to parse the param_file_layout setting, eg, 'chunk:4, float32, zlib:1'.
+    chunk:N   - N equal chunks along hru/gru (align N with the number of summa GRU subsets).
+    float32   - store parameters in single precision (SUMMA reads them into double precision).
+    zlib:L    - compress with deflate level L (default 1) and shuffle.
+    Return a dictionary of nchunk (None: netCDF default), dtype, and complevel (0: no compression).'''
+    options = {'nchunk': None, 'dtype': 'f8', 'complevel': 0}
+    for item in [x.strip() for x in layout.split(',')]:
+        name, _, value = item.partition(':')
+        if name in ['', 'default', 'none']:
+            continue
+        elif name == 'chunk':
+            options['nchunk'] = int(value) if value else 1
+        elif name == 'float32':
+            options['dtype'] = 'f4'
+        elif name == 'zlib':
+            options['complevel'] = int(value) if value else 1
+        else:
+            raise ValueError('Unknown param_file_layout option %s.'%(item))
+    return options
+
+def param_var_kwargs(options, dim_len):
+    '''Function to return netCDF4 createVariable keyword arguments of a parameter variable for a layout.'''
+    kwargs = {'datatype': options['dtype'], 'fill_value': np.nan}
+    if options['complevel'] > 0:
+        kwargs.update({'zlib': True, 'complevel': options['complevel'], 'shuffle': True})
+    if options['nchunk'] is not None:
+        kwargs['chunksizes'] = (max(1, int(np.ceil(dim_len/float(options['nchunk'])))),)
+    return kwargs
+
+def split_grus(nGRU, nsubset):
+    '''Function to split GRUs into nsubset contiguous subsets. Return a list of (startGRU, countGRU).'''
+    bounds = np.linspace(0, nGRU, nsubset+1).round().astype(int)
+    return [(bounds[i]+1, bounds[i+1]-bounds[i]) for i in range(nsubset) if bounds[i+1] > bounds[i]]
+
 
 # main
 if __name__ == '__main__':
@@ -56,8 +134,8 @@ if __name__ == '__main__':
     # ------------------------------ Prepare ---------------------------------
     # Process command line  
     # Check args
-    if len(sys.argv) != 2:
-        print("Usage: %s <control_file>" % sys.argv[0])
+    if len(sys.argv) < 2:
+        print("Usage: %s <control_file> [--nproc <n>] [--force]" % sys.argv[0])
         sys.exit(0)
     # Otherwise continue
     args = process_command_line()    
@@ -73,25 +151,19 @@ if __name__ == '__main__':
     summa_settings_relpath = read_from_control(control_file, 'summa_settings_relpath')
     summa_settings_path = os.path.join(model_path, summa_settings_relpath)
 
-    # Identify fileManager.txt and define a temporary file. 
+    # Identify fileManager.txt and outputControl.txt.
     summa_filemanager = read_from_control(control_file, 'summa_filemanager')
-    summa_filemanager_temp = summa_filemanager.split('.txt')[0]+'_temp.txt'
-
     summa_filemanager = os.path.join(summa_settings_path, summa_filemanager)
-    summa_filemanager_temp = os.path.join(summa_settings_path, summa_filemanager_temp)
-
-    # Identify outputControl.txt and define a temporary file.
     outputControlFile = read_from_summa_route_config(summa_filemanager, 'outputControlFile')
-    outputControlFile_temp = outputControlFile.split('.txt')[0]+'_temp.txt'
-    
     outputControlFile = os.path.join(summa_settings_path, outputControlFile)
-    outputControlFile_temp = os.path.join(summa_settings_path, outputControlFile_temp)
 
-    # Identify summa output, attribtue, and trialParam files
-    outputPath = read_from_summa_route_config(summa_filemanager, 'outputPath')
-    outFilePrefix = read_from_summa_route_config(summa_filemanager, 'outFilePrefix')
-    outputFile = os.path.join(outputPath, outFilePrefix+'_timestep.nc')
+    # Temporary run directory with copies of fileManager.txt and outputControl.txt.
+    priori_path = os.path.join(calib_path, 'priori_run')
+    summa_filemanager_temp = os.path.join(priori_path, os.path.basename(summa_filemanager))
+    outputControlFile_temp = os.path.join(priori_path, os.path.basename(outputControlFile))
+    outFilePrefix = 'priori'
 
+    # Identify summa attribtue and trialParam files
     trialParamFile = read_from_summa_route_config(summa_filemanager, 'trialParamFile')
     trialParamFile_priori = trialParamFile.split('.nc')[0] + '.priori.nc' # a priori param file
 
@@ -100,10 +172,21 @@ if __name__ == '__main__':
 
     attributeFile = read_from_summa_route_config(summa_filemanager,'attributeFile')
     attributeFile = os.path.join(summa_settings_path, attributeFile)
+
+    # Summa executable
+    summa_exe_path = read_from_control(control_file, 'summa_exe_path')
+
+    # Storage layout of the parameter variables.
+    param_file_layout = read_from_control(control_file, 'param_file_layout', 'default')
+    try:
+        layout_options = parse_param_layout(param_file_layout)
+    except ValueError as e:
+        print('Error: %s'%(e))
+        sys.exit(1)
     
     # -----------------------------------------------------------------------
 
-    # #### 1. Update summa outputControl.txt by adding parameter names.
+    # #### 1. Write outputControl.txt and fileManager.txt copies.
     # Determine summa output parameters. 
     # Note object_params and output_params are not necessarily the same.
     object_params = read_from_control(control_file, 'object_parameters')  # users provided param names
@@ -124,136 +207,153 @@ if __name__ == '__main__':
         for height_param in height_params:
             if not height_param in object_params:
                 output_params.append(height_param)   
-                
-    # Add output_params to outputControl.txt            
-    with open(outputControlFile, 'r') as src:
-        content = src.read()
-        with open(outputControlFile_temp, 'w') as dst:
-            for param in output_params:
-                if not param in content:
-                    dst.write(param)
-                    dst.write('\n')
-            dst.write(content)
-    shutil.copy2(outputControlFile_temp, outputControlFile);
-    os.remove(outputControlFile_temp);
 
-    
-    # #### 2. Update fileManager.txt by changing simStartTime and simEndTime. 
     simStartTime = read_from_control(control_file, 'simStartTime')
+
+    # #### 2. Check whether the existing a priori file was created from the same settings.
+    setting_files = [attributeFile, os.path.join(read_from_summa_route_config(summa_filemanager, 'statePath'),
+                                                 read_from_summa_route_config(summa_filemanager, 'initConditionFile'))]
+    for setting in ['decisionsFile', 'globalHruParamFile', 'globalGruParamFile', 'vegTableFile', 'soilTableFile', 
+                    'generalTableFile', 'noahmpTableFile']:
+        setting_files.append(os.path.join(summa_settings_path, read_from_summa_route_config(summa_filemanager, setting)))
+    fingerprint = settings_fingerprint(output_params + [simStartTime, summa_exe_path, param_file_layout], setting_files)
+
+    if not args.force and os.path.exists(trialParamFile_priori):
+        with nc.Dataset(trialParamFile_priori) as f:
+            up_to_date = getattr(f, 'settings_fingerprint', '') == fingerprint
+        if up_to_date:
+            print('A priori parameter file %s is up to date. Skip the SUMMA run.'%(trialParamFile_priori))
+            shutil.copy2(trialParamFile_priori, trialParamFile)
+            sys.exit(0)
+
+    # The a priori run only needs one forcing time step. 
     simStartTime_priori = simStartTime  # in format 'yyyy-mm-dd hh:mm'
+    forcingPath = read_from_summa_route_config(summa_filemanager, 'forcingPath')
+    forcingListFile = os.path.join(summa_settings_path, read_from_summa_route_config(summa_filemanager, 'forcingListFile'))
+    dt = forcing_time_step(forcingPath, forcingListFile)
     simEndTime_priori = datetime.datetime.strftime(datetime.datetime.strptime(simStartTime, '%Y-%m-%d %H:%M') \
-                                                   + datetime.timedelta(days=1), '%Y-%m-%d %H:%M') 
-
-    # Change sim times in fileManager.txt            
-    with open(summa_filemanager, 'r') as src:
-        with open(summa_filemanager_temp, 'w') as dst:
-            for line in src:
-                if line.startswith('simStartTime'):
-                    simStartTime_old = line.split('!',1)[0].strip().split(None,1)[1]
-                    line = line.replace(simStartTime_old, simStartTime_priori)
-                elif line.startswith('simEndTime'):
-                    simEndTime_old = line.split('!',1)[0].strip().split(None,1)[1]
-                    line = line.replace(simEndTime_old, simEndTime_priori)
-                dst.write(line)
-    shutil.copy2(summa_filemanager_temp, summa_filemanager);
-    os.remove(summa_filemanager_temp);
-
+                                                   + datetime.timedelta(seconds=dt), '%Y-%m-%d %H:%M') 
+
+    # Write the copies. Parameters are written at the first time step. The trial parameter file does not exist, 
+    # so that SUMMA uses the default parameter values. File paths are relative to settingsPath in SUMMA.
+    if os.path.isdir(priori_path):
+        shutil.rmtree(priori_path)
+    os.makedirs(priori_path)
+    with open(outputControlFile_temp, 'w') as dst:
+        for param in output_params:
+            dst.write(param)
+            dst.write('\n')
+    write_config(summa_filemanager, summa_filemanager_temp, 
+                 {'simStartTime': simStartTime_priori,
+                  'simEndTime': simEndTime_priori,
+                  'outFilePrefix': outFilePrefix,
+                  'outputPath': priori_path + '/',
+                  'outputControlFile': os.path.relpath(outputControlFile_temp, summa_settings_path),
+                  'trialParamFile': os.path.relpath(os.path.join(priori_path, 'none.nc'), summa_settings_path)})
 
     # #### 3. Run SUMMA model to get a priori parameter values in summa output
-    # Summa executable
-    summa_exe_path = read_from_control(control_file, 'summa_exe_path')
-
-    # Remove existing summa parameter files
-    if os.path.exists(trialParamFile):
-        os.remove(trialParamFile)
-    if os.path.exists(trialParamFile_priori):
-        os.remove(trialParamFile_priori)
-
-    # Remove summa output path if it exists and create from scratch.
-    if os.path.isdir(outputPath):
-            shutil.rmtree(outputPath)
-    os.makedirs(outputPath)        
-
-    # Run SUMMA
-    cmd = summa_exe_path + ' -m '+ summa_filemanager
-    os.system(cmd)
-
+    with nc.Dataset(attributeFile) as src:
+        nGRU = len(src.dimensions['gru'])
+    nproc = args.nproc if args.nproc is not None else len(os.sched_getaffinity(0))
+    subsets = split_grus(nGRU, max(1, min(nproc, nGRU)))
+
+    # Run SUMMA GRU subsets in parallel.
+    cmd = shlex.split(summa_exe_path)
+    if len(subsets) == 1:
+        procs = [subprocess.Popen(cmd + ['-m', summa_filemanager_temp])]
+    else:
+        procs = [subprocess.Popen(cmd + ['-g', str(start), str(count), '-m', summa_filemanager_temp])
+                 for start, count in subsets]
+    returncodes = [proc.wait() for proc in procs]
+    if any(returncodes):
+        print('Error: SUMMA a priori run failed with exit code(s) %s.'%(', '.join([str(x) for x in returncodes])))
+        sys.exit(1)
+    outputFiles = sorted(glob(os.path.join(priori_path, outFilePrefix+'*_timestep.nc')))  # ordered by startGRU
 
     # #### 4. Extract a priori parameter values from summa timestep output and generate trialParam.priori.nc.
-    # Open summa output and attribute files for reading
-    with nc.Dataset(outputFile, 'r') as ff:
-        with nc.Dataset(attributeFile) as src:
-
-            # Create trialParamFile_priori based on attributeFile.
-            with nc.Dataset(trialParamFile_priori, "w") as dst:
-
-                # Copy dimensions from attributeFile
-                for name, dimension in src.dimensions.items():
-                     dst.createDimension(
-                        name, (len(dimension) if not dimension.isunlimited() else None))
-
-                # Copy gurId and hruId variables from attributeFile
-                include = ['gruId', 'hruId']
-                for name, variable in src.variables.items():
-                    if name in include:
-                        x = dst.createVariable(name, variable.datatype, variable.dimensions)               
-                        dst[name].setncatts(src[name].__dict__)
-                        dst[name][:]=src[name][:] 
-
-                # Create parameter variables one-by-one
-                for param_name in output_params:
-
-                    # Get param dimension from summa output
-                    param_dims = ff[param_name].dimensions
-
-                    # Get param value from summa output
-                    if param_name != 'routingGammaScale':
-
-                        # k_macropore, k_soil, theta_sat with dim (depth, hru).
-                        if param_dims == ('depth','hru'):
-                            param_value = ff[param_name][0,:] # use the first depth value.
-
-                        # other params with dim (hru) or (gru).
-                        elif param_dims == ('hru',) or param_dims == ('gru',):
-                            param_value = ff[param_name][:] 
-
-                        else:
-                            print('Parameter %s has dimensions more than gru, hru, depth:\n \
-                            Check before moving forward.'%(param_name), param_dims)
-                            sys.exit()
-                    
-                    # Calculate a-priori value for GammaScale (gru) based on GRU river length and runoff velocity
-                    elif param_name == 'routingGammaScale': 
-                        # (1) Read a-priori value of GammaShape
-                        shape_priori = ff['routingGammaShape'][:]
-
-                        # (2) Calculate gru streamline length (m)
-                        # Assume GRU is a round circle, take its radius as the mean chennel length. 
-                        nGRU = len(src.dimensions['gru'])
-                        domain_area = domain_area = src['HRUarea'][:].sum()
-
-                        GRU_area = domain_area/float(nGRU)            # mean GRU area in square meter
-                        GRU_channel_length = np.sqrt(GRU_area/np.pi)  # mean GRU chennel length in meter
-
-                        # (3) Calculate a-priori GammaScale = (GRU_channel_length/velocity)/GammaShape
-                        v_priori = 1.0 # unit: m/s
-                        param_value = (GRU_channel_length/v_priori)/shape_priori    
-
-                    # Identify param dimension for param_name
-                    if 'hru' in param_dims:
-                        param_dim = 'hru'
-                    elif 'gru' in param_dims:
-                        param_dim = 'gru'
-                    else:
-                        print('Parameter %s does not have dimensions gru or hru in summa output.\n \
-                        Check before moving forward.'%(param_name))
-                        sys.exit()
-
-                    # Create this param variable and fill value
-                    dst.createVariable(param_name, 'float', param_dim, fill_value=np.nan) 
-                    dst[param_name][:] = param_value
-
-
-    
-    # #### 6. Copy trialParamFile to get trialParamFile_priori
+    # (1) Read all parameter values. Subset outputs are concatenated along hru or gru.
+    param_values, param_dims = {}, {}
+    outputs = [nc.Dataset(x, 'r') for x in outputFiles]
+    try:
+        ff = outputs[0]
+        for param_name in output_params:
+            if param_name == 'routingGammaScale':
+                continue
+            param_dims[param_name] = ff[param_name].dimensions
+
+            # k_macropore, k_soil, theta_sat with dim (depth, hru). use the first depth value.
+            if param_dims[param_name] == ('depth','hru'):
+                parts = [x[param_name][0,:] for x in outputs]
+
+            # other params with dim (hru) or (gru).
+            elif param_dims[param_name] == ('hru',) or param_dims[param_name] == ('gru',):
+                parts = [x[param_name][:] for x in outputs]
+
+            else:
+                print('Parameter %s has dimensions more than gru, hru, depth:\n \
+                Check before moving forward.'%(param_name), param_dims[param_name])
+                sys.exit()
+            param_values[param_name] = np.ma.concatenate(parts)
+        if 'routingGammaScale' in output_params:
+            param_dims['routingGammaScale'] = ff['routingGammaScale'].dimensions
+            if 'routingGammaShape' not in param_values:
+                param_values['routingGammaShape'] = np.ma.concatenate([x['routingGammaShape'][:] for x in outputs])
+    finally:
+        for x in outputs:
+            x.close()
+
+    with nc.Dataset(attributeFile) as src:
+        # Calculate a-priori value for GammaScale (gru) based on GRU river length and runoff velocity
+        if 'routingGammaScale' in output_params:
+            # (a) Read a-priori value of GammaShape
+            shape_priori = param_values['routingGammaShape']
+
+            # (b) Calculate gru streamline length (m)
+            # Assume GRU is a round circle, take its radius as the mean chennel length. 
+            domain_area = src['HRUarea'][:].sum()
+
+            GRU_area = domain_area/float(nGRU)            # mean GRU area in square meter
+            GRU_channel_length = np.sqrt(GRU_area/np.pi)  # mean GRU chennel length in meter
+
+            # (c) Calculate a-priori GammaScale = (GRU_channel_length/velocity)/GammaShape
+            v_priori = 1.0 # unit: m/s
+            param_values['routingGammaScale'] = (GRU_channel_length/v_priori)/shape_priori    
+
+        # (2) Create trialParamFile_priori based on attributeFile, and write all variables.
+        with nc.Dataset(trialParamFile_priori, "w") as dst:
+
+            # Copy dimensions from attributeFile
+            for name, dimension in src.dimensions.items():
+                 dst.createDimension(
+                    name, (len(dimension) if not dimension.isunlimited() else None))
+
+            # Copy gurId and hruId variables from attributeFile
+            include = ['gruId', 'hruId']
+            for name, variable in src.variables.items():
+                if name in include:
+                    x = dst.createVariable(name, variable.datatype, variable.dimensions)               
+                    dst[name].setncatts(src[name].__dict__)
+                    dst[name][:]=src[name][:] 
+
+            # Create parameter variables
+            for param_name in output_params:
+                # Identify param dimension for param_name
+                if 'hru' in param_dims[param_name]:
+                    param_dim = 'hru'
+                elif 'gru' in param_dims[param_name]:
+                    param_dim = 'gru'
+                else:
+                    print('Parameter %s does not have dimensions gru or hru in summa output.\n \
+                    Check before moving forward.'%(param_name))
+                    sys.exit()
+                dst.createVariable(param_name, dimensions=(param_dim,), 
+                                   **param_var_kwargs(layout_options, len(dst.dimensions[param_dim])))
+
+            # Fill values and record the settings fingerprint.
+            for param_name in output_params:
+                dst[param_name][:] = param_values[param_name]
+            dst.settings_fingerprint = fingerprint
+
+    # #### 5. Copy trialParamFile_priori to get trialParamFile, and remove the temporary run directory.
     shutil.copy2(trialParamFile_priori, trialParamFile);
+    shutil.rmtree(priori_path)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Evaluate many param sets in one summa run by replicating the GRUs (ensemble as GRUs) ####
+# For a small domain, the summa start-up (reading settings, opening forcing and output files) dominates a trial.
+# In the ensemble mode (gru_ensemble), the domain is replicated [nmember] times, each replica (member) with its own
+# param set, so one summa run simulates a batch of param sets:
+# 1. Write the ensemble model in [calib_path]/model_ensemble: attributes, a priori trial params, initial conditions
+#    and forcing files with the hru and gru dimensions replicated. Member k (start from 0) gets the ids
+#    id + k*offset (offset: the power of ten above the largest hruId or gruId), so that summa keeps the members apart
+#    and matches their forcing by hruId.
+# 2. For a batch, write the param values of member k into block k of the ensemble trialParams.nc (update_paramTrial.py).
+# 3. Run summa once.
+# 4. Split the summa output by member, restore the original ids, and write member k's output (and its trialParams.nc)
+#    into a worker model (see trial_pool.py). mizuRoute and calculate_sim_stats.py then score each member in its worker
+#    (run_trial.sh with the route stage).
+# The ensemble files are written once per calibration. The forcing is replicated too (nmember times the forcing
+# size on disk), but it is read by one summa process.
+# Run this script to write and check the ensemble model, eg, before setting gru_ensemble in the control file.
+
+# import packages
+import os, sys, argparse, shutil, subprocess
+import netCDF4 as nc
+import numpy as np
+from extract_upstream_domain import get_model_files, subset_netcdf, write_config, read_from_summa_route_config
+
+# Id variables of summa input and output files, and the dimension of their offset.
+id_dims = {'hruId': 'hru', 'gruId': 'gru', 'hru2gruId': 'gru'}
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to write a GRU-replicated ensemble model.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('--nmember', type=int, default=None, help='number of members. Default: gru_ensemble in control_file.')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def get_id_offsets(attributeFile):
+    '''Function to return the id offset per dimension: the power of ten above the largest hruId or gruId.'''
+    with nc.Dataset(attributeFile) as f:
+        return {'hru': 10**int(np.ceil(np.log10(int(f['hruId'][:].max()) + 1))),
+                'gru': 10**int(np.ceil(np.log10(int(f['gruId'][:].max()) + 1)))}
+
+def shift_ids(nc_file, offsets, member_index):
+    '''Function to add member_index*offset to the id variables of nc_file. member_index has one value per
+    element of the dimension (an array), or is a scalar for all elements (eg, -k to restore the ids of member k).'''
+    with nc.Dataset(nc_file, 'a') as f:
+        for name, dim in id_dims.items():
+            if name in f.variables:
+                ids = f[name][:].astype('int64') + np.asarray(member_index[f[name].dimensions[-1]]) * offsets[dim]
+                if f[name].dtype.kind in 'iu' and np.iinfo(f[name].dtype).max < ids.max():
+                    print('ERROR: %s of the ensemble exceeds the %s type of %s. Use fewer members.'%(name, f[name].dtype, nc_file))
+                    sys.exit(1)
+                f[name][:] = ids
+
+def replicate_netcdf(src_file, dst_file, nmember, offsets):
+    '''Function to copy a netCDF file with its hru and gru dimensions replicated nmember times (member-major),
+    and the ids of member k shifted by k*offset.'''
+    with nc.Dataset(src_file) as f:
+        sizes = {dim: len(f.dimensions[dim]) for dim in ['hru', 'gru'] if dim in f.dimensions}
+    subset_netcdf(src_file, dst_file, {dim: np.tile(np.arange(n), nmember) for dim, n in sizes.items()})
+    shift_ids(dst_file, offsets, {dim: np.repeat(np.arange(nmember), n) for dim, n in sizes.items()})
+
+def extract_member(src_file, dst_file, member, sizes, offsets):
+    '''Function to write the block of member (start from 0) of an ensemble file with the original ids.
+    sizes is the number of HRUs and GRUs of the original domain.'''
+    with nc.Dataset(src_file) as f:
+        dims = [dim for dim in ['hru', 'gru'] if dim in f.dimensions]
+    subset_netcdf(src_file, dst_file, {dim: np.arange(member*sizes[dim], (member+1)*sizes[dim]) for dim in dims})
+    shift_ids(dst_file, offsets, {dim: -member for dim in dims})
+
+def write_ensemble_model(files, nmember, ens_model_path):
+    '''Function to write the ensemble model into ens_model_path. Return a dictionary with the ensemble fileManager,
+    trial param files, summa output file, the original sizes and the id offsets.'''
+    ens_settings_path = os.path.join(ens_model_path, files['summa_settings_relpath'])
+    ens_forcingPath = os.path.join(ens_model_path, 'forcing')
+    ens_outputPath = os.path.join(ens_model_path, 'simulations', 'SUMMA')
+    with nc.Dataset(files['attributeFile']) as f:
+        sizes = {'hru': len(f.dimensions['hru']), 'gru': len(f.dimensions['gru'])}
+    offsets = get_id_offsets(files['attributeFile'])
+
+    # (1) Copy the summa settings, then replace the domain dependent files with their replicates.
+    if os.path.exists(ens_model_path):
+        shutil.rmtree(ens_model_path)
+    shutil.copytree(files['summa_settings_path'], ens_settings_path)
+    os.makedirs(ens_forcingPath)
+    os.makedirs(ens_outputPath)
+    replicate_netcdf(files['attributeFile'], os.path.join(ens_settings_path, os.path.basename(files['attributeFile'])), nmember, offsets)
+    replicate_netcdf(files['trialParamFile_priori'], os.path.join(ens_settings_path, os.path.basename(files['trialParamFile_priori'])), nmember, offsets)
+    shutil.copy2(os.path.join(ens_settings_path, os.path.basename(files['trialParamFile_priori'])),
+                 os.path.join(ens_settings_path, os.path.basename(files['trialParamFile'])))
+    replicate_netcdf(os.path.join(files['statePath'], files['initConditionFile']),
+                     os.path.join(ens_settings_path, files['initConditionFile']), nmember, offsets)
+
+    # (2) Replicate forcing files. Their hruIds are shifted as in attributes.nc, so summa finds the forcing of each member.
+    with open(files['forcingListFile']) as f:
+        forcing_files = [x.strip().strip("'") for x in f if x.strip() and not x.startswith('!')]
+    for forcing_file in forcing_files:
+        replicate_netcdf(os.path.join(files['forcingPath'], forcing_file), os.path.join(ens_forcingPath, forcing_file), nmember, offsets)
+
+    # (3) Point fileManager.txt to the ensemble model.
+    ens_filemanager = os.path.join(ens_settings_path, files['summa_filemanager_name'])
+    write_config(files['summa_filemanager'], ens_filemanager,
+                 {'settingsPath': ens_settings_path + '/',
+                  'forcingPath':  ens_forcingPath + '/',
+                  'outputPath':   ens_outputPath + '/',
+                  'statePath':    ens_settings_path + '/'}, quote="'")
+    outFilePrefix = read_from_summa_route_config(files['summa_filemanager'], 'outFilePrefix')
+    return {'filemanager': ens_filemanager,
+            'trialParamFile': os.path.join(ens_settings_path, os.path.basename(files['trialParamFile'])),
+            'trialParamFile_priori': os.path.join(ens_settings_path, os.path.basename(files['trialParamFile_priori'])),
+            'output': os.path.join(ens_outputPath, outFilePrefix + '_day.nc'),
+            'sizes': sizes, 'offsets': offsets}
+
+def run_ensemble_summa(control_file, summa_exe, ens_filemanager, log_file):
+    '''Function to run summa once for all members (traced as stage summa_ensemble). Return the exit code.'''
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(log_file, 'w') as log:
+        return subprocess.call([sys.executable, os.path.join(script_dir, 'trace_stage.py'), control_file, 'summa_ensemble',
+                                summa_exe, '-r', 'never', '-m', ens_filemanager], stdout=log, stderr=subprocess.STDOUT)
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python gru_ensemble.py ../control_active.txt --nmember 16
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 2:
+        print("Usage: %s <control_file> [--nmember <n>]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = os.path.abspath(args.control_file)
+    files = get_model_files(control_file)
+    nmember = args.nmember if args.nmember is not None else int(read_from_control(control_file, 'gru_ensemble', '1'))
+    if nmember < 2:
+        print('ERROR: The ensemble needs at least 2 members.')
+        sys.exit(1)
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Write the ensemble model.
+    ens_model_path = os.path.join(files['calib_path'], 'model_ensemble')
+    ens = write_ensemble_model(files, nmember, ens_model_path)
+
+    # Check that the members keep distinct ids.
+    with nc.Dataset(os.path.join(os.path.dirname(ens['filemanager']), os.path.basename(files['attributeFile']))) as f:
+        nhru_unique, ngru_unique = len(np.unique(f['hruId'][:])), len(np.unique(f['gruId'][:]))
+    if nhru_unique != nmember*ens['sizes']['hru'] or ngru_unique != nmember*ens['sizes']['gru']:
+        print('ERROR: The ensemble ids are not unique. Check hruId and gruId of %s.'%(files['attributeFile']))
+        sys.exit(1)
+    print('Ensemble model of %d members (%d HRUs, %d GRUs) is saved in %s.'%(
+        nmember, nmember*ens['sizes']['hru'], nmember*ens['sizes']['gru'], ens_model_path))
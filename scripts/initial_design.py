@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Evaluate a space-filling initial design before the DDS search ####
+# Instead of starting DDS from one param set (initial values or one uniform random sample), evaluate a design of
+# M param sets in one parallel wave and start DDS from the best one. The design points count as the first M iterations.
+# 1. Generate M points within multiplier_bounds.txt: a Latin hypercube (lhs:M) or a scrambled Sobol sequence (sobol:M).
+#    With WarmStart yes, the best param set of the existing history competes with the design.
+# 2-4. Run the trials concurrently on a TrialPool (trial_pool.py) with [nparallel] workers in
+#    [calib_path]/initial_design. The pool records each trial in calib_search_history.txt and
+#    calib_converge_history.txt, and archives the outputs of the best trial in [calib_path]/output_archive.
+# 5. Write the best param set to multipliers.txt and record iteration M in the checkpoint (calib_checkpoint.py),
+#    so that the calibration continues from iteration M+1.
+
+# import packages
+import os, sys, argparse
+import numpy as np
+from trial_pool import TrialPool
+from calib_checkpoint import get_checkpoint_file, read_checkpoint, write_checkpoint, read_best
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to evaluate a space-filling initial design in parallel.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('--design', default=None, help='design method and size, lhs:M or sobol:M. Default: initial_design in control_file.')
+    parser.add_argument('--nparallel', type=int, default=None, help='number of trials run at the same time. Default: number of available cores.')
+    parser.add_argument('--trial_script', default='./run_trial.sh', help='script that runs one trial with a control file.')
+    parser.add_argument('--seed', type=int, default=None, help='random seed of the design.')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def latin_hypercube(npoint, ndim, rng):
+    '''Function to return a Latin hypercube design (npoint, ndim) in [0,1): one point per stratum in every dimension.'''
+    strata = np.argsort(rng.random((npoint, ndim)), axis=0)
+    return (strata + rng.random((npoint, ndim)))/npoint
+
+def sobol(npoint, ndim, seed):
+    '''Function to return a scrambled Sobol design (npoint, ndim) in [0,1).'''
+    try:
+        from scipy.stats import qmc
+    except ImportError:
+        print('ERROR: The sobol design needs scipy. Install scipy or use lhs.')
+        sys.exit(1)
+    return qmc.Sobol(d=ndim, scramble=True, seed=seed).random(npoint)
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python initial_design.py ../control_active.txt --design lhs:32 --nparallel 8
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 2:
+        print("Usage: %s <control_file> [--design <lhs:M|sobol:M>] [--nparallel <n>] [--trial_script <script>] [--seed <n>]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = os.path.abspath(args.control_file)
+
+    # Read the design method and size.
+    design = args.design if args.design is not None else read_from_control(control_file, 'initial_design', 'none')
+    if design == 'none':
+        sys.exit(0)
+    method, npoint = [x.strip() for x in design.split(':')] if ':' in design else (design, '')
+    if method not in ['lhs', 'sobol'] or not npoint.isdigit() or int(npoint) < 1:
+        print('ERROR: Unknown initial_design %s. Use none, lhs:M or sobol:M.'%(design))
+        sys.exit(1)
+    npoint = int(npoint)
+
+    nparallel = args.nparallel if args.nparallel is not None else len(os.sched_getaffinity(0))
+    nparallel = max(1, min(nparallel, npoint))
+
+    # Prepare the workers and read the history (warm start).
+    pool = TrialPool(control_file, 'initial_design', nparallel, args.trial_script)
+    param_file = os.path.join(pool.calib_path, 'multipliers.txt')
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Generate the design.
+    if method == 'lhs':
+        unit = latin_hypercube(npoint, len(pool.param_names), np.random.default_rng(args.seed))
+    else:
+        unit = sobol(npoint, len(pool.param_names), args.seed)
+    design_samples = pool.lower + unit*(pool.upper - pool.lower)
+
+    # #### 2-4. Run the trials concurrently, record them, and archive the best one.
+    print('Initial design: %s with %d points, %d parallel workers.'%(method, npoint, pool.nparallel))
+    for i_point, obj in enumerate(pool.evaluate(design_samples)):
+        print('Design point %d: obj.function %s.'%(i_point+1, '%.6E'%(obj) if np.isfinite(obj) else 'failed'))
+
+    # #### 5. Start the search from the best param set (the best so far with a warm start), and record the design
+    # in the checkpoint.
+    if pool.best is None:
+        print('ERROR: No trial of the initial design succeeded. See %s/worker_*/trial.log.'%(pool.pool_path))
+        sys.exit(1)
+    pool.close()
+    print('Initial design done. Best obj.function %.6E. The search continues from iteration %d.'%(pool.obj_best, npoint+1))
+
+    checkpoint_file = get_checkpoint_file(control_file)
+    state = read_checkpoint(checkpoint_file)
+    state.update({'stage': 'recorded', 'completed_iteration': npoint, 'in_flight': [],
+                  'current': np.atleast_1d(np.loadtxt(param_file)).tolist(), 'best': read_best(pool.search_file)})
+    write_checkpoint(checkpoint_file, state)
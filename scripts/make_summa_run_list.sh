@@ -62,6 +62,12 @@ summa_attributeFile="$(read_from_summa_route_config $summa_filemanager "attribut
 summa_attributeFile=$summa_settings_path/$summa_attributeFile
 nGRU=$( ncks -Cm -v gruId -m $summa_attributeFile | grep 'gru = '| cut -d' ' -f 7 )
 
+# Read the GRU split option (equal or balanced). Use equal if not set.
+gru_partition="$(read_from_control $control_file "gru_partition")"
+
+# Read whether each subset reads its own forcing files (yes or no). Use no if not set.
+forcing_subsets="$(read_from_control $control_file "forcing_subsets")"
+
 # -----------------------------------------------------------------------------------------
 # -------------------------------------- Execute ------------------------------------------
 # -----------------------------------------------------------------------------------------
@@ -73,7 +79,24 @@ chmod 744 summa.exe
 jobList=./summa_run_list.txt  
 rm -f $jobList # Remove existing file
 
-# Calculate countGRU value. May need an adjustment based on the subsest startGRU and endGRU.
+# Each subset run is traced (stage summa_subset) so that its run time can be used to balance the next partition.
+trace="python ../scripts/trace_stage.py $control_file summa_subset"
+
+# Balanced split: contiguous GRU subsets of similar estimated run time (see partition_grus.py).
+if [ "$gru_partition" = "balanced" ]; then
+    partition_file=$calib_path/gru_partition.txt
+    python ../scripts/partition_grus.py $control_file $nSubset --output $partition_file
+
+    # Write a subset per line to jobList
+    grep -v '^#' $partition_file | while read iSubset iStartGRU iCountGRU cost; do
+        echo $iSubset $trace ./summa.exe -g $iStartGRU $iCountGRU -r never -m $summa_filemanager >> $jobList
+    done
+    # Point each subset to its own forcing files (see subset_forcing.py).
+    if [ "$forcing_subsets" = "yes" ]; then python ../scripts/subset_forcing.py $control_file $jobList; fi
+    exit 0
+fi
+
+# Equal split: calculate countGRU value. May need an adjustment based on the subsest startGRU and endGRU.
 countGRU=$(( ( $nGRU / $nSubset ) + ( $nGRU % $nSubset > 0 ) )) 
 
 # Loop to write each GRU subset per line
@@ -92,8 +115,10 @@ while [ $iSubset -lt $nSubset ]; do
     fi     
     
     # Write a subset per line to jobList
-    echo $iSubset ./summa.exe -g $iStartGRU $iCountGRU -r never -m $summa_filemanager >> $jobList
+    echo $iSubset $trace ./summa.exe -g $iStartGRU $iCountGRU -r never -m $summa_filemanager >> $jobList
       
     iSubset=$(( iSubset + 1 ))
 done
 
+# Point each subset to its own forcing files (see subset_forcing.py).
+if [ "$forcing_subsets" = "yes" ]; then python ../scripts/subset_forcing.py $control_file $jobList; fi
@@ -60,6 +60,12 @@ summa_filemanager=$summa_settings_path/$summa_filemanager
 # Get summa executable path.
 summaExe="$(read_from_control $control_file "summa_exe_path")"
 
+# Read the GRU split option (equal or balanced). Use equal if not set.
+gru_partition="$(read_from_control $control_file "gru_partition")"
+
+# Read whether each subset reads its own forcing files (yes or no). Use no if not set.
+forcing_subsets="$(read_from_control $control_file "forcing_subsets")"
+
 # -----------------------------------------------------------------------------------------
 # -------------------------------------- Execute ------------------------------------------
 # -----------------------------------------------------------------------------------------
@@ -72,6 +78,24 @@ chmod 744 summa.exe
 jobList=summa_run_lists/summa_run_list_${offset}.txt
 rm -f $jobList
 
+# Each subset run is traced (stage summa_subset) so that its run time can be used to balance the next partition.
+trace="python ../scripts/trace_stage.py $control_file summa_subset"
+
+# Balanced split: use the subsets of this array job from gru_partition.txt (nJob*nSubset subsets in total), 
+# which is created by partition_grus.py before the summa job array is submitted.
+partition_file=$calib_path/gru_partition.txt
+if [ "$gru_partition" = "balanced" ] && [ -f $partition_file ]; then
+    grep -v '^#' $partition_file | while read iPart iStartGRU iCountGRU cost; do
+        iSubset=$(( iPart - offset*nSubset ))
+        if [ $iSubset -ge 0 ] && [ $iSubset -lt $nSubset ]; then
+            echo $iSubset $trace ./summa.exe -g $iStartGRU $iCountGRU -r never -m $summa_filemanager >> $jobList
+        fi
+    done
+    # Point each subset to its own forcing files (see subset_forcing.py).
+    if [ "$forcing_subsets" = "yes" ]; then python ../scripts/subset_forcing.py $control_file $jobList; fi
+    exit 0
+fi
+
 # Loop to write each GRU subset per line
 iSubset=0
 while [ $iSubset -lt $nSubset ]; do
@@ -88,7 +112,10 @@ while [ $iSubset -lt $nSubset ]; do
     fi    
 
     # Write a subset per line to jobList
-    echo $iSubset ./summa.exe -g $iStartGRU $iCountGRU -r never -m $summa_filemanager >> $jobList
+    echo $iSubset $trace ./summa.exe -g $iStartGRU $iCountGRU -r never -m $summa_filemanager >> $jobList
       
     iSubset=$(( iSubset + 1 ))
 done
+
+# Point each subset to its own forcing files (see subset_forcing.py).
+if [ "$forcing_subsets" = "yes" ]; then python ../scripts/subset_forcing.py $control_file $jobList; fi
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Merge fixed upstream GRU runoff into the summa output before routing ####
+# A downstream sub-basin (see schedule_subbasins.py) only simulates its own GRUs with summa, but mizuRoute routes
+# the whole upstream network. The runoff of the upstream GRUs is fixed from the best runs of the upstream sub-basins
+# and saved in route_inflow_file. This script appends it to the summa daily output ([outFilePrefix]_day.nc)
+# along the gru dimension, so that mizuRoute finds runoff for every GRU of its topology.
+
+# import packages
+import os, sys, argparse, shutil
+import netCDF4 as nc
+import numpy as np
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to merge fixed upstream GRU runoff into the summa output.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def read_from_summa_route_config(config_file, setting):
+    '''Function to extract a given setting from the summa or mizuRoute configuration file.'''
+    # Open fileManager.txt or route_control and locate the line with setting
+    with open(config_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                break
+    # Extract the setting's value
+    substring = line.split('!',1)[0].strip().split(None,1)[1].strip("'")
+    # Return this value
+    return substring
+
+def concat_gru(src_files, dst_file, gru_only=False):
+    '''Function to concatenate summa outputs along the gru dimension. Variables without the gru dimension are
+    taken from the first file (or dropped if gru_only, except time). A gru variable missing in a file is filled
+    with its fill value. All files must have the same time steps.'''
+    srcs = [nc.Dataset(x) for x in src_files]
+    try:
+        for src in srcs:
+            src.set_auto_maskandscale(False)
+        first = srcs[0]
+        ntime = [len(x.dimensions['time']) for x in srcs]
+        if len(set(ntime)) > 1:
+            raise ValueError('Files have different numbers of time steps: %s.'%(', '.join(
+                ['%s (%d)'%(f, n) for f, n in zip(src_files, ntime)])))
+        ngru = [len(x.dimensions['gru']) for x in srcs]
+
+        with nc.Dataset(dst_file, 'w', format=first.data_model) as dst:
+            dst.set_auto_maskandscale(False)
+            dst.setncatts(first.__dict__)
+            for name, var in first.variables.items():
+                if gru_only and 'gru' not in var.dimensions and var.dimensions != ('time',):
+                    continue
+                for dim in var.dimensions:
+                    if dim not in dst.dimensions:
+                        size = sum(ngru) if dim == 'gru' else len(first.dimensions[dim])
+                        dst.createDimension(dim, None if first.dimensions[dim].isunlimited() else size)
+                attrs = var.__dict__
+                fill_value = attrs.pop('_FillValue', None)
+                dst_var = dst.createVariable(name, var.datatype, var.dimensions, fill_value=fill_value)
+                dst_var.setncatts(attrs)
+                if 'gru' not in var.dimensions:
+                    dst_var[:] = var[:]
+                    continue
+                # Concatenate along gru.
+                axis = var.dimensions.index('gru')
+                parts = []
+                for src, n in zip(srcs, ngru):
+                    if name in src.variables:
+                        parts.append(src[name][:])
+                    else:
+                        shape = list(var.shape)
+                        shape[axis] = n
+                        fill = fill_value if fill_value is not None else nc.default_fillvals[var.dtype.str[1:]]
+                        parts.append(np.full(shape, fill, dtype=var.dtype))
+                dst_var[:] = np.concatenate(parts, axis=axis)
+    finally:
+        for src in srcs:
+            src.close()
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python merge_upstream_runoff.py ../control_active.txt
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 2:
+        print("Usage: %s <control_file>" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = args.control_file
+
+    # Read calibration path from control_file.
+    calib_path = read_from_control(control_file, 'calib_path')
+
+    # Read hydrologic model path from control_file.
+    model_path = read_from_control(control_file, 'model_path')
+    if model_path == 'default':
+        model_path = os.path.join(calib_path, 'model')
+
+    # Read summa output path and prefix.
+    summa_settings_path = os.path.join(model_path, read_from_control(control_file, 'summa_settings_relpath'))
+    summa_filemanager   = os.path.join(summa_settings_path, read_from_control(control_file, 'summa_filemanager'))
+    summa_outputPath    = read_from_summa_route_config(summa_filemanager, 'outputPath')
+    summa_outFilePrefix = read_from_summa_route_config(summa_filemanager, 'outFilePrefix')
+    summa_output_file   = os.path.join(summa_outputPath, summa_outFilePrefix+'_day.nc')
+
+    # Read the fixed upstream runoff file.
+    route_inflow_file = read_from_control(control_file, 'route_inflow_file', 'none')
+    if route_inflow_file == 'none':
+        sys.exit(0)
+    if not os.path.exists(route_inflow_file):
+        print('ERROR: Upstream runoff file %s does not exist.'%(route_inflow_file))
+        sys.exit(1)
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Append the upstream GRU runoff to the summa output.
+    merged_file = summa_output_file.split('.nc')[0] + '_merged.nc'
+    try:
+        concat_gru([summa_output_file, route_inflow_file], merged_file)
+    except ValueError as e:
+        print('ERROR: %s'%(e))
+        sys.exit(1)
+    shutil.move(merged_file, summa_output_file)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Run several DDS trajectories concurrently ####
+# DDS follows one trajectory, and different starts often end in different local optima. This script runs K
+# trajectories at the same time, each from its own start with its own random stream and a share of max_iterations.
+# 1. Split max_iterations among the K trajectories. Trajectory 1 starts from initial_option (or the best param set
+#    of the history with WarmStart yes). The others start from the next best distinct param sets of the history
+#    (WarmStart yes) or from uniform random samples.
+# 2. Prepare a TrialPool (trial_pool.py) with [nparallel] workers in [calib_path]/multistart.
+# 3. Run the trajectories concurrently. Each trajectory perturbs its best param set with the DDS neighbourhood of DDS.py
+#    and keeps the new one if it is not worse (Tolson and Shoemaker, 2007). Trials run on the first free worker.
+#    A param set that any trajectory has already evaluated (or is evaluating) is not run again (shared cache).
+# 4. The pool records each trial in calib_search_history.txt and calib_converge_history.txt, and archives the outputs
+#    of the best trial in [calib_path]/output_archive. The trajectory of each trial is recorded in multistart_history.txt.
+# 5. Write the best param set overall to multipliers.txt, and a summary per trajectory to multistart_summary.txt.
+
+# import packages
+import os, sys, argparse, threading
+import concurrent.futures
+import numpy as np
+from trial_pool import TrialPool
+from DDS import generate_neighbour
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to run several DDS trajectories concurrently.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('--nstart', type=int, default=None, help='number of DDS trajectories. Default: multistart in control_file.')
+    parser.add_argument('--nparallel', type=int, default=None, help='number of trials run at the same time. Default: min(nstart, available cores).')
+    parser.add_argument('--max_iterations', type=int, default=None, help='total number of trials of all trajectories. Default: max_iterations in control_file.')
+    parser.add_argument('--warm_start', default=None, help="start from the best param sets of the history: 'yes' or 'no'. Default: WarmStart in control_file.")
+    parser.add_argument('--trial_script', default='./run_trial.sh', help='script that runs one trial with a control file.')
+    parser.add_argument('--seed', type=int, default=None, help='random seed. The trajectory streams are spawned from it.')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def split_budget(max_iterations, nstart):
+    '''Function to split max_iterations among nstart trajectories (the first ones get the remainder).'''
+    return [max_iterations//nstart + (1 if k < max_iterations % nstart else 0) for k in range(nstart)]
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python multistart_DDS.py ../control_active.txt --nstart 4 --nparallel 4
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 2:
+        print("Usage: %s <control_file> [--nstart <n>] [--nparallel <n>] [--max_iterations <n>] [--warm_start <yes|no>] \
+        [--trial_script <script>] [--seed <n>]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = os.path.abspath(args.control_file)
+
+    # Read calibration settings.
+    nstart = args.nstart if args.nstart is not None else int(read_from_control(control_file, 'multistart', '1'))
+    max_iterations = args.max_iterations if args.max_iterations is not None else int(read_from_control(control_file, 'max_iterations'))
+    warm_start = args.warm_start if args.warm_start is not None else read_from_control(control_file, 'WarmStart')
+    initial_option = read_from_control(control_file, 'initial_option')
+    nparallel = args.nparallel if args.nparallel is not None else min(nstart, len(os.sched_getaffinity(0)))
+    nparallel = max(1, min(nparallel, nstart))
+
+    budgets = split_budget(max_iterations, nstart)
+    if min(budgets) < 2:
+        print('ERROR: %d iterations are too few for %d trajectories (at least 2 iterations each).'%(max_iterations, nstart))
+        sys.exit(1)
+
+    # Prepare the workers, and start new history files and a new archive or continue the existing ones (warm start).
+    pool = TrialPool(control_file, 'multistart', nparallel, args.trial_script, warm_start)
+    lower, upper = pool.lower, pool.upper
+    discrete_flags = np.zeros(len(pool.param_names))  # 1: discrete param. 0: continuous param
+    multistart_file = os.path.join(pool.calib_path, 'multistart_history.txt')
+    summary_file    = os.path.join(pool.calib_path, 'multistart_summary.txt')
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Set up the trajectories: budget, random stream and start.
+    if warm_start == 'no' and os.path.exists(multistart_file):
+        os.remove(multistart_file)
+    if not os.path.exists(multistart_file):
+        with open(multistart_file, 'w') as f:
+            f.write('Run  trajectory  iteration  obj.function  cache_hit\n')
+
+    history_starts = pool.history_starts(nstart)
+    streams = np.random.SeedSequence(args.seed).spawn(nstart)
+    trajectories = []
+    for k in range(nstart):
+        rs = np.random.RandomState(np.random.MT19937(streams[k]))
+        if k < len(history_starts):
+            start = history_starts[k]
+        elif k == 0 and initial_option == 'UseInitialParamValues':
+            start = pool.initial
+        else:
+            start = lower + (upper - lower)*rs.random_sample(len(pool.param_names))
+        trajectories.append({'rs': rs, 'budget': budgets[k], 'start': start, 'best': None, 'obj_best': np.inf,
+                             'ntrial': 0, 'nhit': 0, 'nimprove': 0})
+    print('Multi-start DDS: %d trajectories (%s iterations), %d parallel workers.'%(
+        nstart, ', '.join([str(x) for x in budgets]), pool.nparallel))
+
+    # #### 2-4. Run the trajectories concurrently with the shared cache and history of the pool.
+    rng_lock = threading.Lock()  # numpy global random state used by the DDS functions
+
+    def evaluate(k, iteration_idx, param_sample):
+        '''Evaluate a param set for trajectory k. Return its objective function value (inf if the trial failed).'''
+        def write_record(run_idx, obj, worker_control):
+            # Called under the pool lock when the trial is recorded.
+            trajectories[k]['ntrial'] += 1
+            with open(multistart_file, 'a') as f:
+                f.write('%s  %d  %d  %.6E  no\n'%('-' if run_idx is None else str(run_idx), k+1, iteration_idx, obj))
+        obj, hit = pool.run_once(param_sample, write_record)
+        if hit:
+            with pool.lock:
+                trajectories[k]['nhit'] += 1
+                with open(multistart_file, 'a') as f:
+                    f.write('-  %d  %d  %.6E  yes\n'%(k+1, iteration_idx, obj))
+        return obj
+
+    def run_trajectory(k):
+        '''Run DDS trajectory k to its budget. Return its best objective function value.'''
+        traj = trajectories[k]
+        traj['best'], traj['obj_best'] = traj['start'], evaluate(k, 1, traj['start'])
+        for iteration_idx in range(2, traj['budget']+1):
+            # Use the trajectory's own random stream for the DDS perturbation.
+            with rng_lock:
+                np.random.set_state(traj['rs'].get_state())
+                param_sample = generate_neighbour(traj['best'], lower, upper,
+                                                  discrete_flags, iteration_idx, traj['budget'])
+                traj['rs'].set_state(np.random.get_state())
+            obj = evaluate(k, iteration_idx, param_sample)
+            if obj <= traj['obj_best']:
+                if obj < traj['obj_best']:
+                    traj['nimprove'] += 1
+                traj['best'], traj['obj_best'] = param_sample, obj
+        return traj['obj_best']
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=nstart) as executor:
+        futures = {executor.submit(run_trajectory, k): k for k in range(nstart)}
+        for future in concurrent.futures.as_completed(futures):
+            k = futures[future]
+            print('Trajectory %d finished: best obj.function %.6E.'%(k+1, future.result()))
+
+    # #### 5. Write the best param set overall and the summary.
+    k_best = int(np.argmin([x['obj_best'] for x in trajectories]))
+    if not np.isfinite(trajectories[k_best]['obj_best']):
+        print('ERROR: No trial succeeded. See %s/worker_*/trial.log.'%(pool.pool_path))
+        sys.exit(1)
+    pool.close()
+    with open(summary_file, 'w') as f:
+        f.write('trajectory  iterations  trials  cache_hits  improvements  best_obj.function\n')
+        for k, traj in enumerate(trajectories):
+            f.write('%d  %d  %d  %d  %d  %.6E\n'%(k+1, traj['budget'], traj['ntrial'], traj['nhit'], traj['nimprove'], traj['obj_best']))
+    print('Multi-start DDS done. Best obj.function %.6E by trajectory %d. See %s.'%(
+        trajectories[k_best]['obj_best'], k_best+1, summary_file))
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Split GRUs into contiguous subsets of balanced run time for parallel summa runs ####
+# summa -g needs a start GRU and a GRU count, so every subset is a contiguous block of GRUs.
+# 1. Estimate the cost of each GRU from its HRU count in attributes.nc.
+# 2. If earlier summa subset runs are recorded in the trace file (stage summa_subset, see trace_stage.py),
+#    refine the per-GRU cost so that it reproduces the measured subset run times.
+# 3. Find the contiguous partition that minimizes the largest subset cost.
+# 4. Save the partition into [calib_path]/gru_partition.txt (iSubset startGRU countGRU cost).
+
+# import packages
+import os, sys, argparse, json
+import netCDF4 as nc
+import numpy as np
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to split GRUs into subsets of balanced summa run time.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('nSubset', type=int, help='number of GRU subsets.')
+    parser.add_argument('--output', default=None, help='path of the partition file. Default: [calib_path]/gru_partition.txt.')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def read_from_summa_route_config(config_file, setting):
+    '''Function to extract a given setting from the summa or mizuRoute configuration file.'''
+    # Open fileManager.txt or route_control and locate the line with setting
+    with open(config_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                break
+    # Extract the setting's value
+    substring = line.split('!',1)[0].strip().split(None,1)[1].strip("'")
+    # Return this value
+    return substring
+
+def count_hrus_per_gru(attributeFile):
+    '''Function to count the HRUs of each GRU, in the GRU order of attributes.nc.'''
+    with nc.Dataset(attributeFile) as f:
+        gruIds    = f['gruId'][:]
+        hru2gruId = f['hru2gruId'][:]
+    sorter  = np.argsort(gruIds)
+    gru_idx = sorter[np.searchsorted(gruIds, hru2gruId, sorter=sorter)]
+    return np.bincount(gru_idx, minlength=len(gruIds)).astype(float)
+
+def read_subset_times(trace_file):
+    '''Function to read successful summa subset run times from the trace file.
+    Return a list of (startGRU, countGRU, seconds).'''
+    records = []
+    if not os.path.exists(trace_file):
+        return records
+    with open(trace_file) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('stage') == 'summa_subset' and record.get('returncode') == 0 and 'gru_start' in record:
+                records.append((record['gru_start'], record['gru_count'], record['wall_s']))
+    return records
+
+def estimate_gru_costs(nhru, records, n_sweeps=50):
+    '''Function to estimate the run time of each GRU.
+    Without records, the cost is proportional to the HRU count. With records, the HRU-count based costs are
+    scaled by multiplicative updates until the sum of costs within each recorded subset matches its run time.'''
+    cost = nhru.copy()
+    if len(records) == 0:
+        return cost
+    starts  = np.array([x[0] for x in records], dtype=int) - 1  # zero-based
+    ends    = starts + np.array([x[1] for x in records], dtype=int)
+    seconds = np.array([x[2] for x in records], dtype=float)
+    valid   = (starts >= 0) & (ends <= len(nhru)) & (ends > starts) & (seconds > 0)
+    starts, ends, seconds = starts[valid], ends[valid], seconds[valid]
+    if len(seconds) == 0:
+        return cost
+
+    # Start from the mean measured run time per HRU.
+    prefix = np.concatenate([[0.0], np.cumsum(nhru)])
+    cost   = nhru * seconds.sum() / (prefix[ends] - prefix[starts]).sum()
+
+    # Number of records covering each GRU (a difference array over the recorded ranges).
+    coverage = np.zeros(len(nhru)+1)
+    np.add.at(coverage, starts, 1.0)
+    np.add.at(coverage, ends, -1.0)
+    coverage = np.cumsum(coverage)[:-1]
+    covered  = coverage > 0
+
+    for i in range(n_sweeps):
+        prefix    = np.concatenate([[0.0], np.cumsum(cost)])
+        predicted = prefix[ends] - prefix[starts]
+        ratio     = np.zeros(len(nhru)+1)
+        np.add.at(ratio, starts, seconds/predicted)
+        np.add.at(ratio, ends, -seconds/predicted)
+        ratio = np.cumsum(ratio)[:-1]
+        cost[covered] = cost[covered] * ratio[covered] / coverage[covered]
+
+    # GRUs never measured keep their HRU count times the median cost per HRU of the measured GRUs.
+    if (~covered).any():
+        rate = np.median(cost[covered] / np.maximum(nhru[covered], 1.0))
+        cost[~covered] = nhru[~covered] * rate
+    return cost
+
+def split_greedy(prefix, bound, nSubset):
+    '''Function to split GRUs into contiguous subsets whose cost does not exceed bound.
+    Return the list of subset start indices (zero-based), or None if more than nSubset subsets are needed.'''
+    nGRU, starts, pos = len(prefix)-1, [], 0
+    while pos < nGRU:
+        if len(starts) == nSubset:
+            return None
+        starts.append(pos)
+        # The last GRU whose cumulative cost stays within bound. Take at least one GRU.
+        pos = max(pos+1, int(np.searchsorted(prefix, prefix[pos]+bound, side='right'))-1)
+    return starts
+
+def partition_contiguous(cost, nSubset):
+    '''Function to find contiguous subsets that minimize the largest subset cost.
+    Return the start indices (zero-based) and the GRU counts of exactly min(nSubset, nGRU) subsets.'''
+    nGRU    = len(cost)
+    nSubset = min(nSubset, nGRU)
+    prefix  = np.concatenate([[0.0], np.cumsum(cost)])
+
+    # Bisection on the largest subset cost; greedy splitting tests feasibility.
+    lower, upper = max(cost.max(), prefix[-1]/nSubset), prefix[-1]
+    starts = split_greedy(prefix, upper, nSubset)
+    for i in range(100):
+        if upper - lower <= 1e-9*prefix[-1]:
+            break
+        bound = 0.5*(lower + upper)
+        trial = split_greedy(prefix, bound, nSubset)
+        if trial is None:
+            lower = bound
+        else:
+            upper, starts = bound, trial
+
+    # Use exactly nSubset subsets: splitting a subset never increases the largest subset cost.
+    starts = list(starts)
+    while len(starts) < nSubset:
+        bounds = starts + [nGRU]
+        counts = np.diff(bounds)
+        costs  = prefix[bounds[1:]] - prefix[bounds[:-1]]
+        costs[counts < 2] = -1.0
+        i = int(np.argmax(costs))
+        # Split the costliest multi-GRU subset in the middle of its cost.
+        mid = int(np.searchsorted(prefix, 0.5*(prefix[bounds[i]] + prefix[bounds[i+1]])))
+        starts.insert(i+1, min(max(mid, bounds[i]+1), bounds[i+1]-1))
+    counts = np.diff(starts + [nGRU])
+    return np.array(starts), counts
+
+def subset_costs(cost, starts, counts):
+    '''Function to sum the GRU costs per subset.'''
+    prefix = np.concatenate([[0.0], np.cumsum(cost)])
+    return prefix[starts+counts] - prefix[starts]
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python partition_grus.py ../control_active.txt 6
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 3:
+        print("Usage: %s <control_file> <nSubset> [--output <partition_file>]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = args.control_file
+    nSubset      = args.nSubset
+
+    # Read calibration path from control_file.
+    calib_path = read_from_control(control_file, 'calib_path')
+
+    # Read hydrologic model path from control_file.
+    model_path = read_from_control(control_file, 'model_path')
+    if model_path == 'default':
+        model_path = os.path.join(calib_path, 'model')
+
+    # Read summa settings path and attribute file.
+    summa_settings_relpath = read_from_control(control_file, 'summa_settings_relpath')
+    summa_settings_path    = os.path.join(model_path, summa_settings_relpath)
+    summa_filemanager      = read_from_control(control_file, 'summa_filemanager')
+    summa_filemanager      = os.path.join(summa_settings_path, summa_filemanager)
+    attributeFile          = read_from_summa_route_config(summa_filemanager, 'attributeFile')
+    attributeFile          = os.path.join(summa_settings_path, attributeFile)
+
+    # Trace file with measured summa subset run times, and output partition file.
+    trace_file = os.path.join(calib_path, read_from_control(control_file, 'trace_output', 'calib_trace.jsonl'))
+    partition_file = args.output if args.output is not None else os.path.join(calib_path, 'gru_partition.txt')
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Estimate the cost per GRU.
+    nhru    = count_hrus_per_gru(attributeFile)
+    records = read_subset_times(trace_file)
+    cost    = estimate_gru_costs(nhru, records)
+
+    # #### 2. Find the balanced contiguous partition.
+    starts, counts = partition_contiguous(cost, nSubset)
+    costs = subset_costs(cost, starts, counts)
+
+    # Compare with the equal-count split (countGRU = ceil(nGRU/nSubset)) for information.
+    countGRU     = int(np.ceil(len(cost)/float(nSubset)))
+    equal_starts = np.arange(0, len(cost), countGRU)
+    equal_counts = np.minimum(countGRU, len(cost)-equal_starts)
+    equal_costs  = subset_costs(cost, equal_starts, equal_counts)
+    print('GRU partition based on %s: largest subset cost %.3f (equal-count split: %.3f), mean %.3f.'%(
+        ('%d measured subset runs'%len(records)) if records else 'HRU counts', costs.max(), equal_costs.max(), costs.mean()))
+
+    # #### 3. Save the partition (startGRU is one-based as in summa -g).
+    with open(partition_file, 'w') as f:
+        f.write('# iSubset startGRU countGRU cost\n')
+        for i in range(len(starts)):
+            f.write('%d %d %d %.6f\n'%(i, starts[i]+1, counts[i], costs[i]))
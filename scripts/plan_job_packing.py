@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Plan how many calibration iterations fit in the remaining wall time of a packed job ####
+# In the packed mode of demo4 (packing_walltime), one allocation runs many iterations back-to-back instead of
+# submitting a summa job array and a route job per iteration. Before each iteration, the packed job asks this
+# script how many more iterations fit in the allocation:
+# 1. Read the trace file written by trace_stage.py, and estimate the trial time per iteration as the sum of the
+#    wall times of its stages (nested summa_subset records and background archive_async records are skipped).
+#    Queue waits are therefore not counted. The trace file is never reset, so an iteration traced by several jobs
+#    (a new calibration in the same calib_path, or an in-flight iteration re-run after preemption) is counted
+#    from the records of its latest job only, and the iterations are ordered by their latest record.
+# 2. Take the max of the latest [--window] iterations, times a safety factor, as the expected trial time.
+# 3. Print the number of iterations that fit in the wall-time limit minus the elapsed time and a margin.
+#    Without a measured iteration, print 1 (run one iteration to measure) if any time is left.
+
+# import packages
+import os, sys, argparse, json
+import numpy as np
+
+# Stages recorded inside another traced stage (their time is already counted), or run in the background while the
+# next trial runs (async_archiver.py).
+nested_stages = ['summa_subset', 'archive_async']
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to plan the number of iterations per packed job.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('walltime', help='wall-time limit of the packed job, in format [D-]HH:MM:SS.')
+    parser.add_argument('--elapsed', type=float, default=0.0, help='seconds elapsed in the packed job.')
+    parser.add_argument('--window', type=int, default=5, help='number of latest measured iterations used.')
+    parser.add_argument('--safety', type=float, default=1.2, help='safety factor on the expected trial time.')
+    parser.add_argument('--margin', type=float, default=120.0, help='seconds kept free at the end of the job.')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def parse_walltime(walltime):
+    '''Function to convert a SLURM wall time into seconds. Formats: MM, MM:SS, HH:MM:SS, D-HH, D-HH:MM, D-HH:MM:SS.'''
+    parts = [float(x) for x in walltime.split('-', 1)[-1].split(':')]
+    if '-' in walltime:
+        days = int(walltime.split('-', 1)[0])
+        parts = parts + [0]*(3-len(parts))      # D-HH[:MM[:SS]]
+    else:
+        days = 0
+        parts = [0]*(3-len(parts)) + parts if len(parts) > 1 else [0, parts[0], 0]  # [HH:]MM:SS or MM
+    hours, minutes, seconds = parts
+    return days*86400 + hours*3600 + minutes*60 + seconds
+
+def read_trial_times(trace_file):
+    '''Function to read the trial time per iteration (sum of stage wall times of its latest job) from the trace file.
+    Return an array of trial times in the order the iterations were last traced (the latest iterations last).'''
+    trial_times, trial_jobs = {}, {}
+    if not os.path.exists(trace_file):
+        return np.array([])
+    with open(trace_file) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # incomplete line, eg, an interrupted write
+            if record.get('iteration') is None or record.get('stage') in nested_stages:
+                continue
+            iteration_idx, job = record['iteration'], record.get('job')
+            trial_time = trial_times.pop(iteration_idx, 0.0)  # re-inserted last
+            if trial_jobs.get(iteration_idx, job) != job:
+                trial_time = 0.0  # a later job ran this iteration again
+            trial_jobs[iteration_idx] = job
+            trial_times[iteration_idx] = trial_time + record['wall_s']
+    return np.array(list(trial_times.values()))
+
+def count_fitting_iterations(trial_times, walltime_s, elapsed_s, window=5, safety=1.2, margin_s=120.0):
+    '''Function to return the number of iterations that fit in the remaining wall time.'''
+    remaining = walltime_s - elapsed_s - margin_s
+    if remaining <= 0:
+        return 0
+    if len(trial_times) == 0:
+        return 1
+    expected = safety*np.max(trial_times[-window:])
+    return int(remaining // expected) if expected > 0 else 1
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python plan_job_packing.py ../control_active.txt 03:00:00 --elapsed 1200
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 3:
+        print("Usage: %s <control_file> <walltime> [--elapsed <s>] [--window <n>] [--safety <f>] [--margin <s>]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = args.control_file
+
+    calib_path = read_from_control(control_file, 'calib_path')
+    trace_file = os.path.join(calib_path, read_from_control(control_file, 'trace_output', 'calib_trace.jsonl'))
+
+    # -----------------------------------------------------------------------
+
+    # #### 1-2. Estimate the trial time from the measured iterations.
+    trial_times = read_trial_times(trace_file)
+
+    # #### 3. Print the number of iterations that fit.
+    print(count_fitting_iterations(trial_times, parse_walltime(args.walltime), args.elapsed,
+                                   args.window, args.safety, args.margin))
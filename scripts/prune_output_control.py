@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Write a minimal summa output control for calibration trials ####
+# summa writes every variable of outputControl.txt into [outFilePrefix]_day.nc, and each trial time-shifts, routes
+# and archives that file. The objective is computed from the mizuRoute output, and mizuRoute only reads the runoff
+# variable <vname_qsim> of the route control (eg, averageRoutedRunoff_mean). With trial_output in the control file:
+# minimal:       write [outputControl]_trial.txt next to the full output control, with only the runoff variable at
+#                the output frequency of the full file, and point outputControlFile of fileManager.txt to it.
+# minimal_float: as minimal, and write the outputs in single precision (summa outputPrecision).
+# full:          point outputControlFile back to the full output control (eg, for the final run of the best param
+#                set, see rerun_best.py). The full output control is never changed.
+# With --full_only (workflows that do not rerun the best param set with rerun_best.py, eg, OSTRICH in demo1 and demo3,
+# and demo4), a trial_output other than full is an error, as the calibration would end without full outputs.
+
+# import packages
+import os, sys, argparse
+from extract_upstream_domain import get_model_files, write_config, read_from_summa_route_config
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to write a minimal summa output control for calibration trials.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('--trial_output', default=None, choices=['full', 'minimal', 'minimal_float'], help='output of the trials. Default: trial_output in control_file.')
+    parser.add_argument('--full_only', action='store_true', help='only accept trial_output full (the workflow does not run rerun_best.py).')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def get_output_control_names(summa_filemanager):
+    '''Function to return the file names (relative to settingsPath) of the full and the trial output control.
+    fileManager.txt may point to either of them.'''
+    outputControlFile = read_from_summa_route_config(summa_filemanager, 'outputControlFile')
+    root, ext = os.path.splitext(outputControlFile)
+    if root.endswith('_trial'):
+        root = root[:-len('_trial')]
+    return root + ext, root + '_trial' + ext
+
+def read_output_control(output_control):
+    '''Function to read the variables of a summa output control into a dictionary {name: [fields]}.
+    Comments (!) and empty lines are skipped.'''
+    variables = {}
+    with open(output_control) as f:
+        for line in f:
+            fields = [x.strip() for x in line.split('!',1)[0].split('|')]
+            if fields[0] != '':
+                variables[fields[0]] = fields[1:]
+    return variables
+
+def write_trial_output_control(full_output_control, trial_output_control, vname_qsim, single_precision):
+    '''Function to write the trial output control with only the summa variable of vname_qsim
+    (eg, averageRoutedRunoff_mean is averageRoutedRunoff with statistic mean).'''
+    variables = read_output_control(full_output_control)
+    names = [x for x in variables if vname_qsim.startswith(x + '_') and len(variables[x]) >= 2]
+    if len(names) == 0:
+        print('ERROR: The route input variable %s is not an output of %s.'%(vname_qsim, full_output_control))
+        sys.exit(1)
+    name = max(names, key=len)
+    outFreq, statistic = variables[name][0], vname_qsim[len(name)+1:]
+    with open(trial_output_control + '.tmp', 'w') as f:
+        f.write('! Calibration trial outputs written by prune_output_control.py from %s.\n'%(os.path.basename(full_output_control)))
+        f.write('! Only the runoff read by mizuRoute (%s). Do not edit: it is rewritten at each calibration start.\n'%(vname_qsim))
+        if single_precision:
+            f.write('outputPrecision | float\n')
+        f.write('%-21s | %-3s | %s\n'%(name, outFreq, statistic))
+    os.replace(trial_output_control + '.tmp', trial_output_control)
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python prune_output_control.py ../control_active.txt
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 2:
+        print("Usage: %s <control_file> [--trial_output <full|minimal|minimal_float>] [--full_only]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = args.control_file
+    files = get_model_files(control_file)
+    summa_filemanager = files['summa_filemanager']
+
+    trial_output = args.trial_output if args.trial_output is not None else read_from_control(control_file, 'trial_output', 'full')
+    if trial_output not in ['full', 'minimal', 'minimal_float']:
+        print('ERROR: Unknown trial_output %s. Use full, minimal or minimal_float.'%(trial_output))
+        sys.exit(1)
+    if args.full_only and trial_output != 'full':
+        print('ERROR: trial_output %s needs the rerun of the best param set with full outputs (rerun_best.py), which this workflow does not do. Set trial_output to full.'%(trial_output))
+        sys.exit(1)
+    full_name, trial_name = get_output_control_names(summa_filemanager)
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Write the trial output control.
+    if trial_output != 'full':
+        vname_qsim = read_from_summa_route_config(files['route_control'], '<vname_qsim>')
+        write_trial_output_control(os.path.join(files['summa_settings_path'], full_name),
+                                   os.path.join(files['summa_settings_path'], trial_name),
+                                   vname_qsim, trial_output == 'minimal_float')
+
+    # #### 2. Point fileManager.txt to the trial or the full output control.
+    output_name = full_name if trial_output == 'full' else trial_name
+    write_config(summa_filemanager, summa_filemanager + '.tmp', {'outputControlFile': output_name}, quote="'")
+    os.replace(summa_filemanager + '.tmp', summa_filemanager)
+    print('summa outputs: %s (%s).'%(output_name, trial_output))
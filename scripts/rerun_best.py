@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Rerun the best param set with the full summa outputs ####
+# With trial_output minimal or minimal_float in the control file, the calibration trials only write the runoff read
+# by mizuRoute (see prune_output_control.py). After the calibration, this script:
+# 1. Prepares a worker in [calib_path]/best_full_output (a copy of the model settings with its own outputs, see
+#    trial_pool.py), with the best param set ([calib_path]/output_archive/multipliers.txt, see save_best.py).
+# 2. Points the fileManager.txt of the worker to the full output control, and runs the trial script (eg, run_trial.sh).
+# 3. Copies the summa and mizuRoute outputs and the statistics into [calib_path]/output_archive/full_output.
+# Nothing is done with trial_output full, as the archived best trial already has the full outputs.
+
+# import packages
+import os, sys, argparse, shutil
+import numpy as np
+from extract_upstream_domain import get_model_files, write_config
+from trial_pool import make_worker, get_output_files, run_trial
+from prune_output_control import get_output_control_names
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to rerun the best param set with the full summa outputs.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('--trial_script', default='./run_trial.sh', help='script that runs one trial with a control file.')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python rerun_best.py ../control_active.txt --trial_script ./run_trial.sh
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 2:
+        print("Usage: %s <control_file> [--trial_script <script>]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = os.path.abspath(args.control_file)
+    if read_from_control(control_file, 'trial_output', 'full') == 'full':
+        sys.exit(0)
+
+    files = get_model_files(control_file)
+    calib_path = files['calib_path']
+    stat_output = read_from_control(control_file, 'stat_output')
+    trace_file = os.path.join(calib_path, read_from_control(control_file, 'trace_output', 'calib_trace.jsonl'))
+    best_param_file = os.path.join(calib_path, 'output_archive', 'multipliers.txt')
+    worker_dir = os.path.join(calib_path, 'best_full_output')
+    full_output_dir = os.path.join(calib_path, 'output_archive', 'full_output')
+    if not os.path.exists(best_param_file):
+        print('ERROR: Best param set %s does not exist. Run the calibration first.'%(best_param_file))
+        sys.exit(1)
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Prepare the worker with the best param set.
+    worker_control = make_worker(files, control_file, worker_dir, calib_path, trace_file)
+    shutil.copy2(best_param_file, worker_dir)
+
+    # #### 2. Point the worker to the full output control, and run the trial.
+    worker_filemanager = get_model_files(worker_control)['summa_filemanager']
+    full_name, _ = get_output_control_names(worker_filemanager)
+    write_config(worker_filemanager, worker_filemanager + '.tmp', {'outputControlFile': full_name}, quote="'")
+    os.replace(worker_filemanager + '.tmp', worker_filemanager)
+    returncode = run_trial(args.trial_script, worker_control, os.path.join(worker_dir, 'trial.log'))
+    if returncode != 0 or not os.path.exists(os.path.join(worker_dir, stat_output)):
+        print('ERROR: The rerun of the best param set failed. Check %s.'%(os.path.join(worker_dir, 'trial.log')))
+        sys.exit(1)
+
+    # #### 3. Archive the full outputs.
+    os.makedirs(full_output_dir, exist_ok=True)
+    for file in get_output_files(worker_control):
+        shutil.copy2(file, full_output_dir)
+    obj = float(np.loadtxt(os.path.join(worker_dir, stat_output), usecols=[0], ndmin=1)[0])
+    print('Best param set rerun with the full outputs in %s (%s %.6E).'%(full_output_dir, stat_output, obj))
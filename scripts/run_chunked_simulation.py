@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Run summa and mizuRoute in time chunks with routing pipelined behind summa ####
+# The simulation period is split into [sim_chunks] time chunks, linked by summa and mizuRoute restart files.
+# While summa computes chunk k+1, a background worker post-processes and routes chunk k.
+# 1. For each chunk, write a chunk fileManager (period, output prefix, initial condition) and run summa with -r e.
+# 2. In the background worker, shift the chunk's summa daily output time back one day (as ncap2 does in run_trial.sh),
+#    write a chunk mizuRoute control (period, runoff file, restart in/out) and run mizuRoute.
+# 3. Concatenate the chunk outputs into [outFilePrefix]_day.nc and [case_name].mizuRoute.nc,
+#    the same files the unchunked workflow produces for calculate_sim_stats.py and save_model_output.sh.
+# Note: Chunk files are written in the summa and mizuRoute output paths with names starting with
+# [outFilePrefix] and [case_name], so run_trial.sh removes them together with the other outputs.
+
+# import packages
+import os, sys, argparse, glob, math
+import concurrent.futures
+from datetime import datetime, timedelta
+import netCDF4 as nc
+from trace_stage import get_trace_file, get_iteration, run_traced, StageTimer
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to run summa and mizuRoute in pipelined time chunks.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('--nchunk', type=int, default=None, help='number of time chunks. Default: sim_chunks in control_file.')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def read_from_summa_route_config(config_file, setting):
+    '''Function to extract a given setting from the summa or mizuRoute configuration file.'''
+    # Open fileManager.txt or route_control and locate the line with setting
+    with open(config_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                break
+    # Extract the setting's value
+    substring = line.split('!',1)[0].strip().split(None,1)[1].strip("'")
+    # Return this value
+    return substring
+
+def write_config(src_file, dst_file, updates, quote=''):
+    '''Function to copy a summa or mizuRoute configuration file with some settings replaced.
+    updates is a dictionary of setting: value. Settings not in src_file are appended.'''
+    remaining = dict(updates)
+    with open(src_file, 'r') as src:
+        with open(dst_file, 'w') as dst:
+            for line in src:
+                setting = line.split(None,1)[0] if line.strip() else ''
+                if setting in remaining:
+                    line = '%-23s %s%s%s ! \n'%(setting, quote, remaining.pop(setting), quote)
+                dst.write(line)
+            for setting, value in remaining.items():
+                dst.write('%-23s %s%s%s ! \n'%(setting, quote, value, quote))
+
+def split_period(simStartTime, simEndTime, nchunk):
+    '''Function to split the simulation period into whole-day chunks.
+    Return a list of (chunk start, chunk end) datetimes. Chunk end is the last hour of the chunk's last day.'''
+    start   = datetime.strptime(simStartTime, '%Y-%m-%d %H:%M')
+    end     = datetime.strptime(simEndTime, '%Y-%m-%d %H:%M')
+    ndays   = (end.date() - start.date()).days + 1
+    nday_chunk = int(math.ceil(ndays/float(max(1, min(nchunk, ndays)))))
+    chunks  = []
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = datetime.combine(chunk_start.date(), datetime.min.time()) + timedelta(days=nday_chunk, hours=-1)
+        chunks.append((chunk_start, min(chunk_end, end)))
+        chunk_start = chunk_end + timedelta(hours=1)
+    return chunks
+
+def latest_file(pattern):
+    '''Function to return the most recently modified file that matches a pattern. Return None if none.'''
+    files = glob.glob(pattern)
+    return max(files, key=os.path.getmtime) if files else None
+
+def shift_time(filename, seconds=-86400):
+    '''Function to shift the time values of a netCDF file in place (eg, summa end-of-step to start-of-step time).'''
+    with nc.Dataset(filename, 'a') as f:
+        f['time'][:] = f['time'][:] + seconds
+
+def concat_time(files, output_file):
+    '''Function to concatenate netCDF files along the time dimension (as ncrcat does).
+    Variables without the time dimension are copied from the first file.'''
+    with nc.Dataset(files[0]) as src, nc.Dataset(output_file, 'w', format=src.data_model) as dst:
+        src.set_auto_maskandscale(False)
+        dst.set_auto_maskandscale(False)
+        dst.setncatts(src.__dict__)
+        for name, dim in src.dimensions.items():
+            dst.createDimension(name, None if name == 'time' else len(dim))
+        for name, var in src.variables.items():
+            attrs = var.__dict__
+            fill_value = attrs.pop('_FillValue', None)
+            dst_var = dst.createVariable(name, var.datatype, var.dimensions, fill_value=fill_value)
+            dst_var.setncatts(attrs)
+            dst_var[:] = var[:]
+    itime = None
+    with nc.Dataset(output_file, 'a') as dst:
+        dst.set_auto_maskandscale(False)
+        itime = len(dst.dimensions['time'])
+        for filename in files[1:]:
+            with nc.Dataset(filename) as src:
+                src.set_auto_maskandscale(False)
+                ntime = len(src.dimensions['time'])
+                for name, var in src.variables.items():
+                    if 'time' in var.dimensions:
+                        index = [slice(None)]*len(var.dimensions)
+                        index[var.dimensions.index('time')] = slice(itime, itime+ntime)
+                        dst[name][tuple(index)] = var[:]
+                itime += ntime
+
+class RouteWorker:
+    '''Background worker to post-process and route summa chunks in order, one at a time.
+    The chunks must be routed in order because each chunk starts from the previous chunk's mizuRoute restart.'''
+    def __init__(self, trace_file, iteration_idx, routeExe, route_control, route_outputPath, route_case,
+                 summa_outputPath):
+        self.trace_file       = trace_file
+        self.iteration_idx    = iteration_idx
+        self.routeExe         = routeExe
+        self.route_control    = route_control
+        self.route_outputPath = route_outputPath
+        self.route_case       = route_case
+        self.summa_outputPath = summa_outputPath
+        self.executor         = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.restart_file     = None
+
+    def submit(self, ichunk, chunk_start, chunk_end, summa_day_file):
+        '''Function to queue the routing of a chunk. Return a future whose result is the chunk case name.'''
+        return self.executor.submit(self.route, ichunk, chunk_start, chunk_end, summa_day_file)
+
+    def route(self, ichunk, chunk_start, chunk_end, summa_day_file):
+        '''Function to shift the time of a summa chunk output and route it.'''
+        # Summa uses end of time step for time values, but mizuRoute uses beginning of time step.
+        with StageTimer(self.trace_file, 'time_shift', self.iteration_idx):
+            shift_time(summa_day_file)
+
+        chunk_case = '%s_c%03d'%(self.route_case, ichunk)
+        updates = {'<input_dir>':     self.summa_outputPath,
+                   '<case_name>':     chunk_case,
+                   '<sim_start>':     chunk_start.strftime('%Y-%m-%d'),
+                   '<sim_end>':       chunk_end.strftime('%Y-%m-%d'),
+                   '<fname_qsim>':    os.path.basename(summa_day_file),
+                   '<restart_write>': 'last',
+                   '<restart_dir>':   self.route_outputPath}
+        if self.restart_file is not None:
+            updates['<fname_state_in>'] = os.path.basename(self.restart_file)
+        chunk_control = os.path.join(self.route_outputPath, chunk_case+'.control')
+        write_config(self.route_control, chunk_control, updates)
+
+        returncode = run_traced(self.trace_file, 'route', [self.routeExe, chunk_control], self.iteration_idx)
+        if returncode != 0:
+            raise RuntimeError('mizuRoute failed for chunk %d with exit code %d.'%(ichunk, returncode))
+        self.restart_file = latest_file(os.path.join(self.route_outputPath, chunk_case+'.r.*.nc'))
+        return chunk_case
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python run_chunked_simulation.py ../control_active.txt --nchunk 4
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 2:
+        print("Usage: %s <control_file> [--nchunk <n>]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = args.control_file
+    nchunk = args.nchunk if args.nchunk is not None else int(read_from_control(control_file, 'sim_chunks', '1'))
+
+    # Read calibration path from control_file.
+    calib_path = read_from_control(control_file, 'calib_path')
+
+    # Read hydrologic model path from control_file.
+    model_path = read_from_control(control_file, 'model_path')
+    if model_path == 'default':
+        model_path = os.path.join(calib_path, 'model')
+
+    # Read summa and mizuRoute settings paths, configuration files and executables.
+    summa_settings_path = os.path.join(model_path, read_from_control(control_file, 'summa_settings_relpath'))
+    route_settings_path = os.path.join(model_path, read_from_control(control_file, 'route_settings_relpath'))
+    summa_filemanager   = os.path.join(summa_settings_path, read_from_control(control_file, 'summa_filemanager'))
+    route_control       = os.path.join(route_settings_path, read_from_control(control_file, 'route_control'))
+    summaExe = read_from_control(control_file, 'summa_exe_path')
+    routeExe = read_from_control(control_file, 'route_exe_path')
+
+    # Read simulation period from control_file.
+    simStartTime = read_from_control(control_file, 'simStartTime')
+    simEndTime   = read_from_control(control_file, 'simEndTime')
+
+    # Read summa and mizuRoute output paths and names.
+    summa_outputPath    = read_from_summa_route_config(summa_filemanager, 'outputPath')
+    summa_outFilePrefix = read_from_summa_route_config(summa_filemanager, 'outFilePrefix')
+    route_outputPath    = read_from_summa_route_config(route_control, '<output_dir>')
+    route_case          = read_from_summa_route_config(route_control, '<case_name>')
+    for path in [summa_outputPath, route_outputPath]:
+        os.makedirs(path, exist_ok=True)
+
+    trace_file    = get_trace_file(control_file)
+    iteration_idx = get_iteration()
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Run summa chunk by chunk, and queue each finished chunk for routing.
+    chunks = split_period(simStartTime, simEndTime, nchunk)
+    worker = RouteWorker(trace_file, iteration_idx, routeExe, route_control, route_outputPath, route_case,
+                         summa_outputPath)
+    futures, summa_day_files, restart_file = [], [], None
+    try:
+        for ichunk, (chunk_start, chunk_end) in enumerate(chunks):
+            chunk_prefix = '%s_c%03d'%(summa_outFilePrefix, ichunk)
+            updates = {'simStartTime':  chunk_start.strftime('%Y-%m-%d %H:%M'),
+                       'simEndTime':    chunk_end.strftime('%Y-%m-%d %H:%M'),
+                       'outFilePrefix': chunk_prefix}
+            if restart_file is not None:
+                # Start from the restart file that summa wrote at the end of the previous chunk.
+                updates['statePath']         = summa_outputPath
+                updates['initConditionFile'] = os.path.basename(restart_file)
+            chunk_filemanager = os.path.join(summa_outputPath, chunk_prefix+'_fileManager.txt')
+            write_config(summa_filemanager, chunk_filemanager, updates, quote="'")
+
+            returncode = run_traced(trace_file, 'summa', [summaExe, '-r', 'e', '-m', chunk_filemanager], iteration_idx)
+            if returncode != 0:
+                print('ERROR: summa failed for chunk %d with exit code %d.'%(ichunk, returncode))
+                sys.exit(1)
+            restart_file = latest_file(os.path.join(summa_outputPath, chunk_prefix+'_restart_*.nc'))
+            if restart_file is None and ichunk < len(chunks)-1:
+                print('ERROR: summa restart file of chunk %d is not found in %s.'%(ichunk, summa_outputPath))
+                sys.exit(1)
+
+            summa_day_file = os.path.join(summa_outputPath, chunk_prefix+'_day.nc')
+            summa_day_files.append(summa_day_file)
+            futures.append(worker.submit(ichunk, chunk_start, chunk_end, summa_day_file))
+
+        # #### 2. Wait for the routing of the last chunk.
+        route_cases = [future.result() for future in futures]
+    except RuntimeError as e:
+        print('ERROR: %s'%(e))
+        sys.exit(1)
+    finally:
+        worker.shutdown()
+
+    # #### 3. Concatenate chunk outputs into the files of an unchunked run.
+    with StageTimer(trace_file, 'concat', iteration_idx):
+        concat_time(summa_day_files, os.path.join(summa_outputPath, summa_outFilePrefix+'_day.nc'))
+    with StageTimer(trace_file, 'route_merge', iteration_idx):
+        route_files = []
+        for chunk_case in route_cases:
+            route_files.extend(sorted(glob.glob(os.path.join(route_outputPath, chunk_case+'.h.*.nc'))))
+        concat_time(route_files, os.path.join(route_outputPath, route_case+'.mizuRoute.nc'))
+    print('Ran summa and mizuRoute in %d time chunks.'%(len(chunks)))
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Run split summa GRU subsets in parallel on the local machine (no srun --multi-prog needed) ####
+# 1. Read the summa run list (one subset per line: iSubset command [arguments]), as made by make_summa_run_list.sh.
+# 2. Run the subsets in a bounded pool of processes. Each process is pinned to its own CPU core.
+# 3. Retry failed subsets, and record each subset's exit code and wall time.
+# 4. Optionally merge the subset outputs with concat_summa_ouputs.py.
+# Subset run times are appended to the trace file as stage summa_subset (used by partition_grus.py),
+# unless the run list commands are already traced by trace_stage.py.
+
+# import packages
+import os, sys, argparse, shlex, subprocess, time, queue, resource
+import concurrent.futures
+from trace_stage import get_trace_file, get_iteration, get_gru_subset, append_trace, make_record
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to run summa GRU subsets in parallel on the local machine.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('run_list', help='path of the summa run list, eg, summa_run_list.txt.')
+    parser.add_argument('--nproc', type=int, default=None, help='number of subsets run at the same time. Default: number of available cores.')
+    parser.add_argument('--retries', type=int, default=1, help='number of times a failed subset is rerun.')
+    parser.add_argument('--no_pin', action='store_true', help='do not pin each subset process to a CPU core.')
+    parser.add_argument('--merge', action='store_true', help='merge subset outputs with concat_summa_ouputs.py after all subsets succeed.')
+    args = parser.parse_args()
+    return(args)
+
+def read_run_list(run_list):
+    '''Function to read a run list. Return a list of (iSubset, command as a list).'''
+    subsets = []
+    with open(run_list) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            splits = shlex.split(line)
+            subsets.append((int(splits[0]), splits[1:]))
+    return subsets
+
+def run_subset(command, cores, cwd=None):
+    '''Function to run one subset command, optionally pinned to a set of cores.
+    Return the exit code, start/end time and the child's resource usage.
+    If the command cannot be started (eg, a missing summa executable), return 127, as a shell does.'''
+    start = time.time()
+    try:
+        proc = subprocess.Popen(command, cwd=cwd)
+    except OSError as e:
+        print('ERROR: Failed to run %s: %s'%(' '.join(command), e), file=sys.stderr)
+        return 127, start, time.time(), resource.struct_rusage((0,)*16)
+    # Pin right after the start. Affinity is inherited by everything the command starts afterwards.
+    if cores is not None:
+        try:
+            os.sched_setaffinity(proc.pid, cores)
+        except OSError:
+            pass
+    _, status, ru_child = os.wait4(proc.pid, 0)
+    end = time.time()
+    return os.waitstatus_to_exitcode(status), start, end, ru_child
+
+class SubsetRunner:
+    '''Run subsets in a bounded thread pool. Each thread starts and waits for one subset process at a time.
+    Cores are handed out through a queue so that two running subsets never share a core.'''
+    def __init__(self, nproc, retries, trace_file=None, pin=True):
+        self.nproc      = nproc
+        self.retries    = retries
+        self.trace_file = trace_file
+        self.cores      = queue.Queue()
+        available = sorted(os.sched_getaffinity(0))
+        for i in range(nproc):
+            self.cores.put({available[i % len(available)]} if pin else None)
+
+    def run_one(self, iSubset, command):
+        '''Function to run a subset with retries. Return a result dictionary.'''
+        # Only trace here if the command is not already wrapped by trace_stage.py.
+        traced  = any(os.path.basename(x) == 'trace_stage.py' for x in command)
+        attempt = 0
+        while True:
+            attempt += 1
+            cores = self.cores.get()
+            try:
+                returncode, start, end, ru_child = run_subset(command, cores)
+            finally:
+                self.cores.put(cores)
+            if self.trace_file is not None and not traced:
+                ru_zero = resource.struct_rusage((0,)*16)
+                record  = make_record('summa_subset', get_iteration(), start, end, ru_zero, ru_child, returncode)
+                record.update(get_gru_subset(command))
+                append_trace(self.trace_file, record)
+            if returncode == 0 or attempt > self.retries:
+                break
+            print('Subset %d failed with exit code %d (attempt %d). Retry.'%(iSubset, returncode, attempt))
+        return {'iSubset': iSubset, 'returncode': returncode, 'attempts': attempt, 'wall_s': end - start}
+
+    def run(self, subsets):
+        '''Function to run all subsets. Return results sorted by subset index.'''
+        results = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.nproc) as executor:
+            futures = [executor.submit(self.run_one, iSubset, command) for iSubset, command in subsets]
+            for future in concurrent.futures.as_completed(futures):
+                results.append(future.result())
+        return sorted(results, key=lambda x: x['iSubset'])
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python run_summa_subsets.py ../control_active.txt summa_run_list.txt --nproc 4 --merge
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 3:
+        print("Usage: %s <control_file> <run_list> [--nproc <n>] [--retries <n>] [--merge]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = args.control_file
+
+    if not os.path.exists(args.run_list):
+        print('ERROR: Run list %s does not exist.'%(args.run_list))
+        sys.exit(1)
+    subsets = read_run_list(args.run_list)
+    nproc   = args.nproc if args.nproc is not None else len(os.sched_getaffinity(0))
+    nproc   = max(1, min(nproc, len(subsets)))
+    trace_file = get_trace_file(control_file)
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Run subsets.
+    start   = time.time()
+    runner  = SubsetRunner(nproc, args.retries, trace_file, pin=not args.no_pin)
+    results = runner.run(subsets)
+    print('Ran %d summa subsets with %d processes in %.1f s.'%(len(subsets), nproc, time.time()-start))
+
+    # #### 2. Report per-subset timings and failures.
+    walls = [x['wall_s'] for x in results]
+    if walls:
+        print('Subset wall time: min %.1f s, mean %.1f s, max %.1f s.'%(min(walls), sum(walls)/len(walls), max(walls)))
+    failed = [x for x in results if x['returncode'] != 0]
+    for x in failed:
+        print('ERROR: Subset %d failed with exit code %d after %d attempts.'%(x['iSubset'], x['returncode'], x['attempts']))
+    if failed:
+        sys.exit(1)
+
+    # #### 3. Merge subset outputs.
+    if args.merge:
+        concat_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'concat_summa_ouputs.py')
+        sys.exit(subprocess.call([sys.executable, concat_script, control_file]))
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Calibrate nested sub-basins independently, headwaters first ####
+# Instead of calibrating one multiplier set for the whole domain in one serial loop, decompose the river network
+# at the gauges into nested sub-basins and calibrate each of them separately.
+# 1. Read the gauges (segment index and observation file) from the gauge file (subbasin_gauges).
+# 2. Decompose the network: the sub-basin of a gauge is its upstream area minus the areas of the upstream gauges.
+#    Headwater sub-basins are level 0; a sub-basin is one level above its highest upstream sub-basin.
+# 3. Prepare each sub-basin in [calib_path]/subbasins/gauge_[segId]: a model where summa only runs the GRUs of the
+#    sub-basin and mizuRoute routes the whole upstream network, and a control file (control_active.txt).
+# 4. Calibrate the sub-basins level by level. The sub-basins of a level run concurrently with run_script (eg, run_DDS.sh).
+#    Before a level starts, the best summa runoff of the upstream sub-basins is merged into upstream_runoff.nc,
+#    which is fixed as the upstream inflow of the downstream sub-basin (route_inflow_file, merge_upstream_runoff.py).
+# 5. Write a summary of the sub-basins and their best objective function values.
+
+# import packages
+import os, sys, argparse, subprocess, time
+import concurrent.futures
+import numpy as np
+from extract_upstream_domain import get_model_files, read_topology, upstream_segments, write_domain
+from merge_upstream_runoff import concat_gru
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to calibrate nested sub-basins independently.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('--gauge_file', default=None, help='gauge file. Default: subbasin_gauges in control_file.')
+    parser.add_argument('--nparallel', type=int, default=None, help='max number of sub-basins calibrated at the same time. Default: number of available cores.')
+    parser.add_argument('--run_script', default='./run_DDS.sh', help='calibration script run with the sub-basin control file as argument.')
+    parser.add_argument('--prepare_only', action='store_true', help='only prepare the sub-basin models and control files.')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def read_from_summa_route_config(config_file, setting):
+    '''Function to extract a given setting from the summa or mizuRoute configuration file.'''
+    # Open fileManager.txt or route_control and locate the line with setting
+    with open(config_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                break
+    # Extract the setting's value
+    substring = line.split('!',1)[0].strip().split(None,1)[1].strip("'")
+    # Return this value
+    return substring
+
+def read_gauges(gauge_file):
+    '''Function to read the gauge file. Each line: q_seg_index obs_file. Return a list of (q_seg_index, obs_file).
+    Relative obs_file paths are relative to the gauge file.'''
+    gauges = []
+    with open(gauge_file) as f:
+        for line in f:
+            line = line.split('#',1)[0].strip()
+            if not line:
+                continue
+            seg_index, obs_file = line.split(None,1)
+            obs_file = os.path.join(os.path.dirname(os.path.abspath(gauge_file)), obs_file.strip())
+            gauges.append((int(seg_index), obs_file))
+    return gauges
+
+def decompose_subbasins(segIds, downSegIds, gauge_segIds):
+    '''Function to decompose the network into nested sub-basins at the gauges.
+    Return a dictionary of gauge segId: {'segs_all', 'segs_own', 'upstream_gauges', 'level'}.'''
+    upstream = {g: upstream_segments(segIds, downSegIds, [g]) for g in gauge_segIds}
+    subbasins = {}
+    for g in gauge_segIds:
+        inner  = [h for h in gauge_segIds if h != g and h in upstream[g]]
+        # Direct upstream gauges are not upstream of another upstream gauge.
+        direct = [h for h in inner if not any(h != k and h in upstream[k] for k in inner)]
+        own    = upstream[g].difference(*[upstream[h] for h in inner])
+        subbasins[g] = {'segs_all': upstream[g], 'segs_own': own, 'upstream_gauges': direct}
+    # Levels: headwater sub-basins are level 0.
+    def level(g):
+        if 'level' not in subbasins[g]:
+            subbasins[g]['level'] = 1 + max([level(h) for h in subbasins[g]['upstream_gauges']], default=-1)
+        return subbasins[g]['level']
+    for g in gauge_segIds:
+        level(g)
+    return subbasins
+
+def write_subbasin_control(control_file, control_copy, updates):
+    '''Function to copy control_file with some settings replaced. Settings not in control_file are appended.'''
+    remaining = dict(updates)
+    with open(control_file, 'r') as src:
+        with open(control_copy, 'w') as dst:
+            for line in src:
+                setting = line.split('|',1)[0].strip() if '|' in line else ''
+                if setting in remaining and not line.lstrip().startswith('#'):
+                    comment = ('#' + line.split('#',1)[1]) if '#' in line else '\n'
+                    line = '%-22s | %-21s %s'%(setting, remaining.pop(setting), comment)
+                dst.write(line)
+            for setting, value in remaining.items():
+                dst.write('%-22s | %-22s # set by schedule_subbasins.py\n'%(setting, value))
+
+def read_best_obj(calib_dir, stat_output):
+    '''Function to read the best objective function value (eg, KGE) of a sub-basin calibration.'''
+    stat_best = os.path.join(calib_dir, 'output_archive', stat_output)
+    if not os.path.exists(stat_best):
+        return np.nan
+    return float(np.loadtxt(stat_best, usecols=[0]))
+
+def run_subbasin(run_script, control, log_file):
+    '''Function to run the calibration of one sub-basin. Return the exit code and wall time. run_script runs in its
+    own folder, which concurrent sub-basins share: it writes its logs (eg, ExeOut.txt) under the calib_path of control.'''
+    start = time.time()
+    with open(log_file, 'w') as log:
+        returncode = subprocess.call([run_script, control], stdout=log, stderr=subprocess.STDOUT,
+                                     cwd=os.path.dirname(os.path.abspath(run_script)))
+    return returncode, time.time() - start
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python schedule_subbasins.py ../control_active.txt --nparallel 4 --run_script ./run_DDS.sh
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 2:
+        print("Usage: %s <control_file> [--gauge_file <file>] [--nparallel <n>] [--run_script <script>] [--prepare_only]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = os.path.abspath(args.control_file)
+
+    # Read model paths and input files from control_file.
+    files = get_model_files(control_file)
+    calib_path = files['calib_path']
+    stat_output = read_from_control(control_file, 'stat_output')
+    summa_outFilePrefix = read_from_summa_route_config(files['summa_filemanager'], 'outFilePrefix')
+
+    # Read the gauge file.
+    gauge_file = args.gauge_file if args.gauge_file is not None else read_from_control(control_file, 'subbasin_gauges', 'none')
+    if gauge_file == 'none' or not os.path.exists(gauge_file):
+        print('ERROR: Gauge file %s does not exist. Set subbasin_gauges in %s.'%(gauge_file, control_file))
+        sys.exit(1)
+
+    nparallel = args.nparallel if args.nparallel is not None else len(os.sched_getaffinity(0))
+    subbasin_path = os.path.join(calib_path, 'subbasins')
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Read gauges.
+    segIds, downSegIds, route_hruIds, hruToSegIds = read_topology(files['topologyFile'])
+    gauges = read_gauges(gauge_file)
+    gauge_segIds = [segIds[i-1] for i, _ in gauges]
+    if len(set(gauge_segIds)) < len(gauge_segIds):
+        print('ERROR: More than one gauge is on the same segment in %s.'%(gauge_file))
+        sys.exit(1)
+    obs_files = dict(zip(gauge_segIds, [x for _, x in gauges]))
+
+    # #### 2. Decompose the network into nested sub-basins.
+    subbasins = decompose_subbasins(segIds, downSegIds, gauge_segIds)
+    for g in gauge_segIds:
+        sb = subbasins[g]
+        sb['grus_own'] = set(route_hruIds[np.isin(hruToSegIds, list(sb['segs_own']))])
+        sb['grus_all'] = set(route_hruIds[np.isin(hruToSegIds, list(sb['segs_all']))])
+        sb['calib_dir'] = os.path.join(subbasin_path, 'gauge_%d'%(g))
+        sb['control']   = os.path.join(sb['calib_dir'], 'control_active.txt')
+        sb['inflow']    = os.path.join(sb['calib_dir'], 'upstream_runoff.nc') if sb['upstream_gauges'] else 'none'
+        if len(sb['grus_own']) == 0:
+            print('ERROR: Sub-basin of segment %d has no GRU of its own.'%(g))
+            sys.exit(1)
+        print('Sub-basin of segment %d: level %d, %d GRUs (%d upstream), upstream gauges: %s.'%(
+            g, sb['level'], len(sb['grus_own']), len(sb['grus_all'])-len(sb['grus_own']),
+            ', '.join([str(x) for x in sb['upstream_gauges']]) or 'none'))
+
+    # #### 3. Prepare sub-basin models and control files.
+    for g in gauge_segIds:
+        sb = subbasins[g]
+        new_model_path = os.path.join(sb['calib_dir'], 'model')
+        new_segIds = write_domain(files, sb['grus_own'], sb['segs_all'], sb['grus_all'], new_model_path)
+        new_q_seg_index = int(np.where(new_segIds == g)[0][0]) + 1
+        write_subbasin_control(control_file, sb['control'], {'calib_path':        sb['calib_dir'],
+                                                             'model_path':        new_model_path,
+                                                             'q_seg_index':       str(new_q_seg_index),
+                                                             'obs_file':          obs_files[g],
+                                                             'route_inflow_file': sb['inflow'],
+                                                             'sim_chunks':        '1',
+                                                             'upstream_only':     'no',
+                                                             'subbasin_gauges':   'none'})
+    if args.prepare_only:
+        sys.exit(0)
+
+    # #### 4. Calibrate level by level. Sub-basins of the same level are independent and run concurrently.
+    failed = set()
+    for level in range(max([x['level'] for x in subbasins.values()]) + 1):
+        run_list = []
+        for g in [x for x in gauge_segIds if subbasins[x]['level'] == level]:
+            sb = subbasins[g]
+            if any(h in failed for h in sb['upstream_gauges']):
+                print('Skip sub-basin of segment %d: an upstream sub-basin failed.'%(g))
+                failed.add(g)
+                continue
+            # Fix the upstream inflow from the best runs of the upstream sub-basins.
+            if sb['upstream_gauges']:
+                concat_gru([os.path.join(subbasins[h]['calib_dir'], 'output_archive', summa_outFilePrefix+'_day.nc')
+                            for h in sb['upstream_gauges']], sb['inflow'], gru_only=True)
+            run_list.append(g)
+
+        print('Level %d: calibrate %d sub-basin(s).'%(level, len(run_list)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, nparallel)) as executor:
+            futures = {executor.submit(run_subbasin, args.run_script, subbasins[g]['control'],
+                                       os.path.join(subbasins[g]['calib_dir'], 'calib.log')): g for g in run_list}
+            for future in concurrent.futures.as_completed(futures):
+                g = futures[future]
+                returncode, wall = future.result()
+                print('Sub-basin of segment %d finished with exit code %d in %.1f s.'%(g, returncode, wall))
+                if returncode != 0:
+                    failed.add(g)
+
+    # #### 5. Write the summary.
+    summary_file = os.path.join(subbasin_path, 'subbasin_summary.txt')
+    with open(summary_file, 'w') as f:
+        f.write('segId  level  nGRU  upstream_gauges  best_obj  calib_dir\n')
+        for g in sorted(gauge_segIds, key=lambda x: (subbasins[x]['level'], x)):
+            sb = subbasins[g]
+            f.write('%d  %d  %d  %s  %.6E  %s\n'%(g, sb['level'], len(sb['grus_own']),
+                    ','.join([str(x) for x in sb['upstream_gauges']]) or 'none',
+                    read_best_obj(sb['calib_dir'], stat_output), sb['calib_dir']))
+    print('Sub-basin summary is saved in %s.'%(summary_file))
+    if failed:
+        print('ERROR: Calibration failed for the sub-basin(s) of segment(s) %s.'%(', '.join([str(x) for x in sorted(failed)])))
+        sys.exit(1)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Multi-fidelity screening of a calibration candidate ####
+# A candidate param set is first evaluated on a short screening period. It is promoted to the full-period run
+# only if its screening objective is within screen_tolerance of the best screening objective so far.
+# Mode 'prepare': write [calib_path]/control_screen.txt, a copy of control_file with the screening
+#                 simulation/statistics periods and a separate stat_output (screen_stats.txt).
+# Mode 'decide':  read the screening statistics, append the candidate to [calib_path]/calib_screen_history.txt,
+#                 and print 'promote' or 'reject'.
+
+# import packages
+import os, sys, argparse
+import numpy as np
+import pandas as pd
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to screen a candidate param set on a short period.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('mode', choices=['prepare', 'decide'], help='prepare: write the screening control file. decide: promote or reject.')
+    parser.add_argument('iteration_idx', nargs='?', default='1', help='current iteration id starting from 1 (used by decide).')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def split_period(period):
+    '''Function to split a period setting 'start, end' into its start and end strings.'''
+    start, end = [x.strip() for x in period.split(',')]
+    return start, end
+
+def write_control_copy(control_file, control_copy, updates):
+    '''Function to copy control_file with the values of some settings replaced.'''
+    with open(control_file, 'r') as src:
+        with open(control_copy, 'w') as dst:
+            for line in src:
+                setting = line.split('|',1)[0].strip() if '|' in line else ''
+                if setting in updates and not line.lstrip().startswith('#'):
+                    comment = ('#' + line.split('#',1)[1]) if '#' in line else '\n'
+                    line = '%-22s | %-21s %s'%(setting, updates[setting], comment)
+                dst.write(line)
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python screen_candidate.py ../control_active.txt prepare
+    #             python screen_candidate.py ../control_active.txt decide 10
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 3:
+        print("Usage: %s <control_file> <prepare|decide> [iteration_idx]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = args.control_file
+
+    # Read calibration path and the screening settings from control_file.
+    calib_path = read_from_control(control_file, 'calib_path')
+    screen_simPeriod  = read_from_control(control_file, 'screen_simPeriod', 'none')
+    screen_statPeriod = read_from_control(control_file, 'screen_statPeriod', 'none')
+    screen_tolerance  = float(read_from_control(control_file, 'screen_tolerance', '0.1'))
+    if screen_simPeriod.lower() == 'none':
+        print('ERROR: screen_simPeriod is not set in %s.'%(control_file))
+        sys.exit(1)
+
+    control_screen   = os.path.join(calib_path, 'control_screen.txt')
+    screen_output    = 'screen_stats.txt'
+    screen_hist_file = os.path.join(calib_path, 'calib_screen_history.txt')
+    param_tpl_file   = os.path.join(calib_path, 'multipliers.tpl')
+    param_file       = os.path.join(calib_path, 'multipliers.txt')
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Write the screening control file.
+    if args.mode == 'prepare':
+        simStartTime, simEndTime = split_period(screen_simPeriod)
+        if screen_statPeriod.lower() == 'none':
+            statStartDate, statEndDate = simStartTime.split()[0], simEndTime.split()[0]
+        else:
+            statStartDate, statEndDate = split_period(screen_statPeriod)
+        write_control_copy(control_file, control_screen, {'simStartTime':  simStartTime,
+                                                          'simEndTime':    simEndTime,
+                                                          'statStartDate': statStartDate,
+                                                          'statEndDate':   statEndDate,
+                                                          'stat_output':   screen_output})
+        sys.exit(0)
+
+    # #### 2. Decide whether to promote the candidate to the full-period run.
+    screen_stat = os.path.join(calib_path, screen_output)
+    if not os.path.exists(screen_stat):
+        print('ERROR: Screening statistics file %s does not exist.'%(screen_stat))
+        sys.exit(1)
+    obj = np.loadtxt(screen_stat, usecols=[0]) * (-1)  # objective function, eg, obj = negative KGE
+    param_names  = list(np.loadtxt(param_tpl_file, dtype='str'))
+    param_sample = np.atleast_1d(np.loadtxt(param_file))
+
+    # Best screening objective so far. The first candidate is always promoted.
+    iteration_idx = int(args.iteration_idx)
+    warm_start = read_from_control(control_file, 'WarmStart')
+    if warm_start == 'no' and iteration_idx == 1 and os.path.exists(screen_hist_file):
+        os.remove(screen_hist_file)
+    if os.path.exists(screen_hist_file):
+        record_df = pd.read_csv(screen_hist_file, header='infer', skip_blank_lines=True,
+                                delim_whitespace=True, engine='python')
+        obj_best  = record_df['obj.function'].min()
+        run_count = len(record_df)
+    else:
+        with open(screen_hist_file, 'w') as f:
+            f.write('Run  obj.function  ' + ''.join([x+'  ' for x in param_names]) + '\n')
+        obj_best, run_count = np.nan, 0
+    promote = np.isnan(obj_best) or (obj <= obj_best + screen_tolerance)
+
+    # Save the screening record (same format as calib_search_history.txt).
+    with open(screen_hist_file, 'a') as f:
+        f.write('%d %.6E  '%(run_count+1, obj) + ''.join(['%.6E  '%(x) for x in param_sample]) + '\n')
+
+    print('promote' if promote else 'reject')
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Stage the model inputs on node-local storage ####
+# When many trials run at the same time, reading forcing, attributes, initial conditions and param files from the
+# shared filesystem (and writing the outputs there) slows every trial down. With node_staging in the control file
+# (a node-local folder, eg, $SLURM_TMPDIR or /dev/shm; environment variables are expanded), this script:
+# 1. Copies the model into [node_staging]/staged_[calib folder name]/model. The read-only netCDF inputs (forcing,
+#    attributes, initial conditions, a priori trial params, mizuRoute ancillary files) are hard-linked when the
+#    node-local folder is on the same device, and copied otherwise. Text files and trialParams.nc are copied, so
+#    trials never write into the shared model. With --keep_outputs (summa subsets on several nodes), trialParams.nc
+#    is a symbolic link to the shared one instead: the trial updates it on one node, and every node reads the update.
+# 2. Writes fileManager.txt and the mizuRoute control of the staged model, pointing to the staged inputs and to
+#    node-local output folders (summa outputs stay in the shared model with --keep_outputs, eg, when summa subsets
+#    run on several nodes with srun).
+# 3. Writes [node_staging]/staged_[calib folder name]/control_active.txt, a copy of control_file with model_path
+#    pointing to the staged model, and prints its path. calib_path is unchanged, so the history, multipliers.txt
+#    and the archived outputs (output_archive, save_model_output.sh, save_best.py) are written to the shared folder.
+# The staging is done once per node-local folder (eg, once per allocation). A later call prints the staged control
+# file, unless the model settings or control_file changed after the staging.
+
+# import packages
+import os, sys, argparse, shutil
+from extract_upstream_domain import get_model_files, write_config, write_control_copy, read_from_summa_route_config
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to stage the model inputs on node-local storage.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('--stage_path', default=None, help='node-local folder. Default: node_staging in control_file.')
+    parser.add_argument('--keep_outputs', action='store_true', help='keep the summa output folder of the shared model.')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def link_or_copy(src_file, dst_file):
+    '''Function to hard-link src_file to dst_file, or copy it if they are on different devices.'''
+    if os.path.exists(dst_file):
+        os.remove(dst_file)
+    try:
+        os.link(src_file, dst_file)
+    except OSError:
+        shutil.copy2(src_file, dst_file)
+
+def stage_folder(src_path, dst_path, writable_files=[]):
+    '''Function to stage a folder: netCDF files are linked (or copied), other files and writable_files are copied.'''
+    def stage_file(src_file, dst_file):
+        if src_file.endswith('.nc') and os.path.abspath(src_file) not in writable_files:
+            link_or_copy(src_file, dst_file)
+        else:
+            # Remove an earlier staged file first: it may be a hard link to the shared file.
+            if os.path.exists(dst_file):
+                os.remove(dst_file)
+            shutil.copy2(src_file, dst_file)
+        return dst_file
+    shutil.copytree(src_path, dst_path, copy_function=stage_file, dirs_exist_ok=True)
+
+def is_staged(staged_control, source_files):
+    '''Function to check that the staged control file exists and is newer than the source files.'''
+    if not os.path.exists(staged_control):
+        return False
+    return os.path.getmtime(staged_control) >= max([os.path.getmtime(x) for x in source_files if os.path.exists(x)])
+
+def stage_model(control_file, files, stage_root, keep_outputs=False):
+    '''Function to stage the model of control_file into stage_root. Return the path of the staged control file.'''
+    staged_model_path = os.path.join(stage_root, 'model')
+    staged_summa_settings_path = os.path.join(staged_model_path, files['summa_settings_relpath'])
+    staged_route_settings_path = os.path.join(staged_model_path, files['route_settings_relpath'])
+    staged_forcingPath = os.path.join(staged_model_path, 'forcing')
+    staged_summa_outputPath = os.path.join(staged_model_path, 'simulations', 'SUMMA')
+    staged_route_outputPath = os.path.join(staged_model_path, 'simulations', 'mizuRoute')
+    if keep_outputs:
+        staged_summa_outputPath = read_from_summa_route_config(files['summa_filemanager'], 'outputPath').rstrip('/')
+    for path in [staged_forcingPath, staged_summa_outputPath, staged_route_outputPath]:
+        os.makedirs(path, exist_ok=True)
+
+    # (1) Settings, initial conditions and forcing. trialParams.nc is written by every trial, so it is copied (or
+    # linked to the shared one if the summa subsets run on several nodes).
+    writable_files = [os.path.abspath(files['trialParamFile'])]
+    stage_folder(files['summa_settings_path'], staged_summa_settings_path, writable_files)
+    if keep_outputs:
+        staged_trialParamFile = os.path.join(staged_summa_settings_path,
+                                             os.path.relpath(files['trialParamFile'], files['summa_settings_path']))
+        if os.path.lexists(staged_trialParamFile):
+            os.remove(staged_trialParamFile)
+        os.symlink(os.path.abspath(files['trialParamFile']), staged_trialParamFile)
+    stage_folder(files['route_settings_path'], staged_route_settings_path)
+    link_or_copy(os.path.join(files['statePath'], files['initConditionFile']),
+                 os.path.join(staged_summa_settings_path, files['initConditionFile']))
+    with open(files['forcingListFile']) as f:
+        forcing_files = [x.strip().strip("'") for x in f if x.strip() and not x.startswith('!')]
+    for forcing_file in forcing_files:
+        link_or_copy(os.path.join(files['forcingPath'], forcing_file), os.path.join(staged_forcingPath, forcing_file))
+
+    # mizuRoute ancillary files (topology, remapping) may be outside of the mizuRoute settings.
+    ancil_dir = read_from_summa_route_config(files['route_control'], '<ancil_dir>')
+    staged_ancil_dir = staged_route_settings_path
+    if os.path.abspath(ancil_dir) != os.path.abspath(files['route_settings_path']):
+        staged_ancil_dir = os.path.join(staged_model_path, 'route_ancil')
+        stage_folder(ancil_dir, staged_ancil_dir)
+
+    # (2) Point fileManager.txt and the mizuRoute control to the staged model.
+    write_config(files['summa_filemanager'], os.path.join(staged_summa_settings_path, files['summa_filemanager_name']),
+                 {'settingsPath': staged_summa_settings_path + '/',
+                  'forcingPath':  staged_forcingPath + '/',
+                  'outputPath':   staged_summa_outputPath + '/',
+                  'statePath':    staged_summa_settings_path + '/'}, quote="'")
+    write_config(files['route_control'], os.path.join(staged_route_settings_path, files['route_control_name']),
+                 {'<ancil_dir>':  staged_ancil_dir + '/',
+                  '<input_dir>':  staged_summa_outputPath + '/',
+                  '<output_dir>': staged_route_outputPath + '/'})
+
+    # (3) Write the staged control file last, so that it only exists for a complete staging.
+    staged_control = os.path.join(stage_root, os.path.basename(control_file))
+    write_control_copy(control_file, staged_control + '.tmp', {'model_path': staged_model_path, 'node_staging': 'none'})
+    os.replace(staged_control + '.tmp', staged_control)
+    return staged_control
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python stage_model.py ../control_active.txt
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 2:
+        print("Usage: %s <control_file> [--stage_path <path>] [--keep_outputs]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = os.path.abspath(args.control_file)
+    files = get_model_files(control_file)
+
+    stage_path = args.stage_path if args.stage_path is not None else read_from_control(control_file, 'node_staging', 'none')
+    stage_path = os.path.expandvars(stage_path)
+    if stage_path == 'none' or stage_path == '' or '$' in stage_path:
+        print('ERROR: node_staging (%s) is not a folder. Set it to a node-local folder, eg, $SLURM_TMPDIR.'%(stage_path))
+        sys.exit(1)
+    stage_root = os.path.join(stage_path, 'staged_' + os.path.basename(os.path.normpath(files['calib_path'])))
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Stage the model unless it is already staged.
+    staged_control = os.path.join(stage_root, os.path.basename(control_file))
+    source_files = [control_file, files['summa_filemanager'], files['route_control'], files['trialParamFile_priori']]
+    if not is_staged(staged_control, source_files):
+        staged_control = stage_model(control_file, files, stage_root, args.keep_outputs)
+
+    # #### 2. Print the staged control file (used by the calling script).
+    print(staged_control)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Write per-partition forcing files for split summa runs ####
+# A summa run of a GRU subset (summa -g startGRU countGRU) reads its HRUs from the full forcing files, so the
+# forcing is read (and, on a shared filesystem, transferred) once per subset. This script gives each subset its own
+# forcing and fileManager:
+# 1. Read the summa run list (one subset per line: iSubset command [arguments], see make_summa_run_list.sh).
+# 2. For each subset, write the forcing files with only the HRUs of its GRUs into
+#    [calib_path]/forcing_subsets/G[startGRU]-[endGRU], chunked along time (--time_chunk steps per chunk).
+#    A subset whose forcing is already written (eg, by an earlier trial with the same partition) is reused.
+# 3. Write the subset fileManager (forcingPath points to the subset forcing), and point the run list line to it.
+# Remove [calib_path]/forcing_subsets after changing the forcing or attributes.nc.
+
+# import packages
+import os, sys, argparse, shlex, shutil
+import netCDF4 as nc
+import numpy as np
+from extract_upstream_domain import get_model_files, write_config
+from run_summa_subsets import read_run_list
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to write per-partition forcing files and fileManagers for split summa runs.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('run_list', help='path of the summa run list, eg, summa_run_list.txt. It is rewritten in place.')
+    parser.add_argument('--time_chunk', type=int, default=24, help='number of time steps per chunk of the forcing variables.')
+    args = parser.parse_args()
+    return(args)
+
+def get_subset_hrus(attributeFile, forcing_hruIds, startGRU, countGRU):
+    '''Function to return the sorted positions in the forcing file of the HRUs of GRUs startGRU to
+    startGRU+countGRU-1 (one-based, in the GRU order of attributes.nc, as in summa -g).'''
+    with nc.Dataset(attributeFile) as f:
+        gruIds    = f['gruId'][:].astype('int64')
+        hruIds    = f['hruId'][:].astype('int64')
+        hru2gruId = f['hru2gruId'][:].astype('int64')
+    subset_hruIds = hruIds[np.isin(hru2gruId, gruIds[startGRU-1:startGRU-1+countGRU])]
+    return np.where(np.isin(forcing_hruIds, subset_hruIds))[0], len(subset_hruIds)
+
+def write_forcing_subset(src_file, dst_file, hru_index, time_chunk):
+    '''Function to copy a forcing file with only the HRUs of hru_index. Only the contiguous HRU range that contains
+    hru_index is read. Variables with a time dimension are chunked along time.'''
+    lo, hi = hru_index[0], hru_index[-1]+1
+    with nc.Dataset(src_file) as src:
+        # Chunking needs the netCDF4 (HDF5) format.
+        data_model = src.data_model if src.data_model.startswith('NETCDF4') else 'NETCDF4_CLASSIC'
+        with nc.Dataset(dst_file, 'w', format=data_model) as dst:
+            src.set_auto_maskandscale(False)
+            dst.set_auto_maskandscale(False)
+            dst.setncatts(src.__dict__)
+            for name, dim in src.dimensions.items():
+                size = None if dim.isunlimited() else (len(hru_index) if name == 'hru' else len(dim))
+                dst.createDimension(name, size)
+            for name, var in src.variables.items():
+                attrs = var.__dict__
+                fill_value = attrs.pop('_FillValue', None)
+                chunksizes = None
+                if 'time' in var.dimensions:
+                    chunksizes = [min(time_chunk, len(src.dimensions['time'])) if dim == 'time' else
+                                  (len(hru_index) if dim == 'hru' else len(src.dimensions[dim])) for dim in var.dimensions]
+                    chunksizes = [max(1, x) for x in chunksizes]
+                dst_var = dst.createVariable(name, var.datatype, var.dimensions, fill_value=fill_value, chunksizes=chunksizes)
+                dst_var.setncatts(attrs)
+                if 'hru' in var.dimensions:
+                    axis = var.dimensions.index('hru')
+                    slices = tuple(slice(lo, hi) if x == axis else slice(None) for x in range(len(var.dimensions)))
+                    dst_var[:] = np.take(var[slices], hru_index-lo, axis=axis)
+                else:
+                    dst_var[:] = var[:]
+
+def write_partition_forcing(files, forcing_files, startGRU, countGRU, subset_path, time_chunk):
+    '''Function to write the forcing of a GRU subset into subset_path, unless it exists.
+    The files are written into a temporary folder that is renamed at the end, so subset_path is always complete.'''
+    if os.path.exists(subset_path):
+        return
+    tmp_path = subset_path + '.tmp%d'%(os.getpid())
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    for forcing_file in forcing_files:
+        src_file = os.path.join(files['forcingPath'], forcing_file)
+        with nc.Dataset(src_file) as f:
+            forcing_hruIds = f['hruId'][:].astype('int64')
+        hru_index, nhru = get_subset_hrus(files['attributeFile'], forcing_hruIds, startGRU, countGRU)
+        if len(hru_index) != nhru:
+            print('ERROR: %d of the %d HRUs of GRUs %d-%d are in %s.'%(len(hru_index), nhru, startGRU, startGRU+countGRU-1, src_file))
+            sys.exit(1)
+        write_forcing_subset(src_file, os.path.join(tmp_path, forcing_file), hru_index, time_chunk)
+    os.rename(tmp_path, subset_path)
+
+def write_partition_filemanager(summa_filemanager, subset_path):
+    '''Function to write the fileManager of a GRU subset (forcingPath points to subset_path). Return its path.'''
+    filemanager = os.path.join(subset_path, os.path.basename(summa_filemanager))
+    write_config(summa_filemanager, filemanager + '.tmp', {'forcingPath': subset_path + '/'}, quote="'")
+    os.replace(filemanager + '.tmp', filemanager)
+    return filemanager
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python subset_forcing.py ../control_active.txt summa_run_list.txt
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 3:
+        print("Usage: %s <control_file> <run_list> [--time_chunk <n>]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = args.control_file
+    files = get_model_files(control_file)
+
+    if not os.path.exists(args.run_list):
+        print('ERROR: Run list %s does not exist.'%(args.run_list))
+        sys.exit(1)
+    subsets = read_run_list(args.run_list)
+
+    with open(files['forcingListFile']) as f:
+        forcing_files = [x.strip().strip("'") for x in f if x.strip() and not x.startswith('!')]
+    forcing_subsets_path = os.path.join(files['calib_path'], 'forcing_subsets')
+    if not os.path.exists(forcing_subsets_path):
+        os.makedirs(forcing_subsets_path, exist_ok=True)
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Write the forcing and fileManager of each subset, and point its command to the fileManager.
+    lines, nwritten = [], 0
+    for iSubset, command in subsets:
+        if '-g' not in command or '-m' not in command:
+            print('ERROR: Subset %d of %s has no -g startGRU countGRU or -m fileManager.'%(iSubset, args.run_list))
+            sys.exit(1)
+        ig = command.index('-g')
+        startGRU, countGRU = int(command[ig+1]), int(command[ig+2])
+        subset_path = os.path.join(forcing_subsets_path, 'G%d-%d'%(startGRU, startGRU+countGRU-1))
+        nwritten += int(not os.path.exists(subset_path))
+        write_partition_forcing(files, forcing_files, startGRU, countGRU, subset_path, args.time_chunk)
+        command[command.index('-m')+1] = write_partition_filemanager(files['summa_filemanager'], subset_path)
+        lines.append(' '.join([str(iSubset)] + [shlex.quote(x) for x in command]))
+
+    # #### 2. Rewrite the run list.
+    with open(args.run_list + '.tmp', 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(args.run_list + '.tmp', args.run_list)
+    print('Forcing of %d GRU subsets in %s (%d written, %d reused).'%(len(subsets), forcing_subsets_path, nwritten, len(subsets)-nwritten))
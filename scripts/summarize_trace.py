@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Summarize the calibration trace file written by trace_stage.py.
+# Report per stage: number of calls, total/mean/max wall time, share of the total wall time,
+# CPU time, peak RSS, and bytes read/written. Also report per-iteration wall time if available.
+
+# import packages
+import os, sys, argparse, json
+import numpy as np
+import pandas as pd
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to summarize where calibration wall time goes.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('--csv', default=None, help='optional path of a csv file to save the stage summary.')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def read_trace(trace_file):
+    '''Function to read the trace file into a DataFrame. Incomplete lines (eg, an interrupted write) are skipped.'''
+    records = []
+    with open(trace_file) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return pd.DataFrame.from_records(records)
+
+def summarize_stages(df):
+    '''Function to aggregate the trace records per stage, sorted by total wall time.'''
+    df = df.assign(cpu_s=df['user_s'] + df['sys_s'])
+    summary = df.groupby('stage').agg(calls=('wall_s','size'),
+                                      wall_total_s=('wall_s','sum'),
+                                      wall_mean_s=('wall_s','mean'),
+                                      wall_max_s=('wall_s','max'),
+                                      cpu_total_s=('cpu_s','sum'),
+                                      maxrss_mb=('maxrss_kb','max'),
+                                      read_mb=('read_bytes','sum'),
+                                      write_mb=('write_bytes','sum'),
+                                      failures=('returncode', lambda x: int(np.count_nonzero(x))))
+    summary['maxrss_mb'] = summary['maxrss_mb']/1024.0
+    summary['read_mb']   = summary['read_mb']/1024.0**2
+    summary['write_mb']  = summary['write_mb']/1024.0**2
+    summary['wall_pct']  = 100.0*summary['wall_total_s']/summary['wall_total_s'].sum()
+    return summary.sort_values('wall_total_s', ascending=False)
+
+# main
+if __name__ == '__main__':
+
+    # an example: python summarize_trace.py ../control_active.txt
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 2:
+        print("Usage: %s <control_file> [--csv <summary_csv>]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = args.control_file
+
+    # Identify the trace file.
+    calib_path = read_from_control(control_file, 'calib_path')
+    trace_file = os.path.join(calib_path, read_from_control(control_file, 'trace_output', 'calib_trace.jsonl'))
+    if not os.path.exists(trace_file):
+        print('ERROR: Trace file %s does not exist.'%(trace_file))
+        sys.exit(1)
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Read the trace records.
+    df = read_trace(trace_file)
+    if df.empty:
+        print('Trace file %s has no records.'%(trace_file))
+        sys.exit(0)
+
+    # #### 2. Summarize per stage.
+    summary = summarize_stages(df)
+    pd.set_option('display.width', 200)
+    print('Stage summary (%d records, %.1f s traced wall time):'%(len(df), df['wall_s'].sum()))
+    print(summary.round(3).to_string())
+
+    # #### 3. Summarize per iteration (only for records with a known iteration index).
+    df_iter = df.dropna(subset=['iteration'])
+    if not df_iter.empty:
+        iter_wall = df_iter.groupby('iteration')['wall_s'].sum()
+        print('\nIteration wall time: n=%d, mean=%.3f s, median=%.3f s, min=%.3f s, max=%.3f s'%(
+            len(iter_wall), iter_wall.mean(), iter_wall.median(), iter_wall.min(), iter_wall.max()))
+
+    # #### 4. Save the stage summary.
+    if args.csv is not None:
+        summary.to_csv(args.csv)
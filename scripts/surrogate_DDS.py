@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Generate a param set based on surrogate-assisted DDS ####
+# Instead of sending one random DDS neighbour of the best param set to the model, generate many neighbours with
+# the DDS perturbation of DDS.py, predict their objective function with a radial basis function (RBF) surrogate
+# fitted on the search history, and write the most promising neighbour to param_file.
+# 1. Read the search history (calib_search_history.txt). If it has too few records, fall back to DDS.py.
+# 2. Generate [ncandidate] DDS neighbours of the best param set.
+# 3. Fit a cubic RBF surrogate (with a linear tail) on the history records nearest to the best param set.
+# 4. Score the neighbours by a weighted sum of the predicted objective and the distance to evaluated param sets
+#    (the weight cycles over iterations to alternate between local refinement and exploration).
+# 5. Write the best-scored neighbour to param_file.
+# Arguments are the same as DDS.py (including --checkpoint and --trial_idx), plus --search_hist_file and --ncandidate.
+
+# import packages
+import os, sys, argparse
+import numpy as np
+import pandas as pd
+import math as m
+from DDS import perturb_type
+from calib_checkpoint import read_checkpoint, write_checkpoint, get_rng_state, set_rng_state
+
+# Weights of the predicted objective in the candidate score, cycled over iterations (Regis and Shoemaker, 2013).
+score_weights = [0.3, 0.5, 0.8, 0.95]
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to generate a param set based on surrogate-assisted DDS.')
+    parser.add_argument('iteration_idx',     help='current iteration id starting from 1.')
+    parser.add_argument('max_iterations',    help='max iteration limit.')
+    parser.add_argument('initial_option',    help="initial value option: 'UseInitialParamValues' or 'UseRandomParamValues'.")
+    parser.add_argument('warm_start',        help="whether use the the best param set of the existing record file. 'yes' or 'no'.")
+    parser.add_argument('param_bounds_file', help='param feasible range file.')
+    parser.add_argument('param_tpl_file',    help='param template file where param value is replaced by param name.')
+    parser.add_argument('param_file',        help='param file that stores one set of param sample.')
+    parser.add_argument('converge_hist_file', help='converge history file that saves all the best param searching history.')
+    parser.add_argument('--search_hist_file', default=None, help='search history file. Default: calib_search_history.txt next to converge_hist_file.')
+    parser.add_argument('--ncandidate', type=int, default=200, help='number of DDS neighbours screened by the surrogate.')
+    parser.add_argument('--max_points', type=int, default=500, help='max number of history records used to fit the surrogate.')
+    parser.add_argument('--checkpoint', default=None, help='calibration checkpoint file (see calib_checkpoint.py). Default: no checkpoint.')
+    parser.add_argument('--trial_idx', type=int, default=None, help='iteration id that evaluates the new param set. Default: iteration_idx.')
+    args = parser.parse_args()
+    return(args)
+
+def generate_neighbours(param_best, lower, upper, iteration_idx, max_iterations, ncandidate):
+    '''Function to generate DDS neighbours of param_best with the perturbation of DDS.py.'''
+    param_dim = len(param_best)
+    Pn = 1.0-m.log1p(iteration_idx)/m.log(max_iterations)  # probability of being selected as neighbour
+    candidates = np.tile(param_best, (ncandidate, 1))
+    for i in range(ncandidate):
+        selected = np.where(np.random.random(param_dim) < Pn)[0]
+        if len(selected) == 0:
+            selected = [int(m.floor(param_dim*np.random.random()))]
+        for i_param in selected:
+            candidates[i, i_param] = perturb_type(param_best[i_param], lower[i_param], upper[i_param], 0)
+    return candidates
+
+def fit_rbf(x, y, smoothing=1e-8):
+    '''Function to fit a cubic RBF interpolant with a linear tail. x is (npoint, ndim), scaled to [0,1].
+    Return the RBF weights and the polynomial coefficients.'''
+    npoint, ndim = x.shape
+    dist = np.sqrt(((x[:,None,:] - x[None,:,:])**2).sum(axis=2))
+    P = np.hstack([np.ones((npoint,1)), x])
+    A = np.zeros((npoint+ndim+1, npoint+ndim+1))
+    A[:npoint,:npoint] = dist**3 + smoothing*np.eye(npoint)  # smoothing keeps near-duplicate points solvable
+    A[:npoint,npoint:] = P
+    A[npoint:,:npoint] = P.T
+    b = np.concatenate([y, np.zeros(ndim+1)])
+    coef = np.linalg.lstsq(A, b, rcond=None)[0]
+    return coef[:npoint], coef[npoint:]
+
+def predict_rbf(x_new, x, weights, poly):
+    '''Function to evaluate a fitted RBF interpolant at x_new (ncandidate, ndim).'''
+    dist = np.sqrt(((x_new[:,None,:] - x[None,:,:])**2).sum(axis=2))
+    return dist**3 @ weights + poly[0] + x_new @ poly[1:]
+
+def min_distance(x_new, x, chunk_size=256):
+    '''Function to return the distance of each row of x_new (ncandidate, ndim) to its nearest row of x (nrecord, ndim).
+    x is read in chunks, so memory stays at ncandidate x chunk_size x ndim however long the history grows.'''
+    dist2_min = np.full(len(x_new), np.inf)
+    for start in range(0, len(x), chunk_size):
+        dist2 = ((x_new[:,None,:] - x[None,start:start+chunk_size,:])**2).sum(axis=2)
+        dist2_min = np.minimum(dist2_min, dist2.min(axis=1))
+    return np.sqrt(dist2_min)
+
+def scale_01(values):
+    '''Function to scale values to [0,1]. Return zeros if all values are equal.'''
+    vrange = values.max() - values.min()
+    return (values - values.min())/vrange if vrange > 0 else np.zeros(len(values))
+
+
+# main
+if __name__ == "__main__":
+
+    # Example: python surrogate_DDS.py 20 500 UseInitialParamValues no \
+    # multiplier_bounds.txt multipliers.tpl multipliers.txt calib_converge_history.txt --ncandidate 200
+
+    # ------------------------------ Prepare ---------------------------------
+    # process command line
+    # check args
+    if len(sys.argv) < 9:
+        print("Usage: %s <iteration_idx> <max_iterations> <initial_option> <warm_start> \
+        <param_bounds_file> <param_tpl_file> <param_file> <converge_hist_file> \
+        [--search_hist_file <file>] [--ncandidate <n>] [--checkpoint <file>] [--trial_idx <n>]" % sys.argv[0])
+        sys.exit(0)
+
+    # otherwise continue
+    args = process_command_line()
+    iteration_idx = int(args.iteration_idx)     # input. current iteration id starting from 1
+    max_iterations = int(args.max_iterations)   # input. max iteration.
+    param_bounds_file = args.param_bounds_file  # input. file storing param range
+    param_tpl_file = args.param_tpl_file        # input. param template file where param value is replaced by param name.
+    param_file = args.param_file                # output. one set of param sample.
+    search_hist_file = args.search_hist_file    # input. param and obj search history file.
+    if search_hist_file is None:
+        search_hist_file = os.path.join(os.path.dirname(os.path.abspath(args.converge_hist_file)), 'calib_search_history.txt')
+
+    # read param ranges
+    param_bounds_df = pd.read_csv(param_bounds_file, delimiter=',', comment='#',
+                                  names=['MultiplierName','InitialValue','LowerLimit','UpperLimit'])
+    param_dim   = len(param_bounds_df)                   # total number of parameters
+    param_names = list(param_bounds_df.iloc[:,0])        # param name list
+    param_lower_limit, param_upper_limit = param_bounds_df['LowerLimit'].values, param_bounds_df['UpperLimit'].values
+    param_range = param_upper_limit - param_lower_limit  # param range array
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Read the search history. Fall back to DDS.py while the history is too small for a surrogate.
+    record_df = None
+    if iteration_idx > 1 and os.path.exists(search_hist_file):
+        record_df = pd.read_csv(search_hist_file, header='infer', skip_blank_lines=True,
+                                delim_whitespace=True, engine='python')
+        record_df = record_df.dropna(subset=['obj.function'])
+    if record_df is None or len(record_df) < 2*(param_dim+1):
+        dds_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'DDS.py')
+        positional = [args.iteration_idx, args.max_iterations, args.initial_option, args.warm_start,
+                      args.param_bounds_file, args.param_tpl_file, args.param_file, args.converge_hist_file]
+        if args.checkpoint is not None:
+            positional += ['--checkpoint', args.checkpoint]
+        if args.trial_idx is not None:
+            positional += ['--trial_idx', str(args.trial_idx)]
+        os.execv(sys.executable, [sys.executable, dds_script] + positional)
+
+    # continue the random sequence of the previous iterations
+    checkpoint = {}
+    if args.checkpoint is not None:
+        checkpoint = read_checkpoint(args.checkpoint)
+        if checkpoint.get('rng_state') is not None:
+            set_rng_state(checkpoint['rng_state'])
+
+    x_hist   = record_df[param_names].values.astype(float)
+    obj_hist = record_df['obj.function'].values.astype(float)
+    param_best = x_hist[np.argmin(obj_hist)]
+
+    # #### 2. Generate DDS neighbours of the best param set.
+    candidates = generate_neighbours(param_best, param_lower_limit, param_upper_limit,
+                                     iteration_idx, max_iterations, args.ncandidate)
+
+    # #### 3. Fit the surrogate on the records nearest to the best param set (in scaled param space).
+    x_hist_scaled = (x_hist - param_lower_limit)/param_range
+    x_best_scaled = (param_best - param_lower_limit)/param_range
+    nearest = np.argsort(((x_hist_scaled - x_best_scaled)**2).sum(axis=1))[:args.max_points]
+    weights, poly = fit_rbf(x_hist_scaled[nearest], obj_hist[nearest])
+
+    # #### 4. Score the neighbours: low predicted objective and far from evaluated param sets score better.
+    x_cand_scaled = (candidates - param_lower_limit)/param_range
+    obj_pred  = predict_rbf(x_cand_scaled, x_hist_scaled[nearest], weights, poly)
+    dist_min  = min_distance(x_cand_scaled, x_hist_scaled)
+    w_obj     = score_weights[(iteration_idx-1) % len(score_weights)]
+    score     = w_obj*scale_01(obj_pred) + (1.0-w_obj)*(1.0-scale_01(dist_min))
+    score[dist_min <= 1e-12] = np.inf  # never re-evaluate a param set in the history
+    param_sample = candidates[np.argmin(score)]
+    print('Surrogate-assisted DDS: %d neighbours screened with %d records, predicted obj %.6E (best obj %.6E).'%(
+        args.ncandidate, len(nearest), obj_pred[np.argmin(score)], obj_hist.min()))
+
+    # #### 5. Output the new param set in the order of the template file.
+    param_names_tpl = list(np.loadtxt(param_tpl_file, dtype='str'))
+    with open(param_file,'w') as f:
+        for i_param in range(len(param_names_tpl)):
+            param_idx = param_names.index(param_names_tpl[i_param])
+            f.write('%.6E\n'%(param_sample[param_idx]))
+
+    # save the random state and the in-flight param set, so that a restarted calibration re-evaluates it
+    if args.checkpoint is not None:
+        checkpoint.update({'stage': 'generated', 'trial_iteration': args.trial_idx if args.trial_idx is not None else iteration_idx,
+                           'dds_iteration': iteration_idx, 'in_flight': [np.atleast_1d(np.loadtxt(param_file)).tolist()],
+                           'rng_state': get_rng_state()})
+        write_checkpoint(args.checkpoint, checkpoint)
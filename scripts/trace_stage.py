@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Run one calibration stage and append its timing and resource usage to a trace file.
+# Each stage (eg, update params, run summa, route) is recorded as one JSON line with:
+# start/end timestamps, wall time, user/system CPU time, peak RSS, and bytes read/written.
+# The trace file is [calib_path]/[trace_output] (default: calib_trace.jsonl).
+# The iteration index is read from the environment variable CALIB_ITERATION if it is set, and the SLURM job id
+# (job) from SLURM_JOB_ID.
+# For summa GRU subset runs (summa -g startGRU countGRU), the GRU range is recorded too (used by partition_grus.py).
+
+# import packages
+import os, sys, argparse, json, time, resource, socket, subprocess
+from datetime import datetime
+
+# define functions
+def process_command_line():
+    '''Parse the commandline'''
+    parser = argparse.ArgumentParser(description='Script to run a calibration stage and record its timing and resource usage.')
+    parser.add_argument('control_file', help='path of the active control file.')
+    parser.add_argument('stage', help='stage name, eg, update_params, summa, route.')
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='command (and its arguments) to run.')
+    args = parser.parse_args()
+    return(args)
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def get_trace_file(control_file):
+    '''Function to identify the trace file based on the control_file.'''
+    calib_path = read_from_control(control_file, 'calib_path')
+    trace_file = read_from_control(control_file, 'trace_output', 'calib_trace.jsonl')
+    return os.path.join(calib_path, trace_file)
+
+def get_iteration():
+    '''Function to get the current iteration index from the environment. Return None if unknown.'''
+    iteration_idx = os.environ.get('CALIB_ITERATION', '')
+    return int(iteration_idx) if iteration_idx.strip().isdigit() else None
+
+def get_gru_subset(command):
+    '''Function to get the GRU range of a summa command (-g startGRU countGRU). Return an empty dictionary if none.'''
+    if '-g' in command:
+        i = command.index('-g')
+        if i+2 < len(command) and command[i+1].isdigit() and command[i+2].isdigit():
+            return {'gru_start': int(command[i+1]), 'gru_count': int(command[i+2])}
+    return {}
+
+def append_trace(trace_file, record):
+    '''Function to append one stage record to the trace file (one JSON object per line).'''
+    # A single write of a short line in append mode keeps concurrent writers from interleaving records.
+    with open(trace_file, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+def make_record(stage, iteration_idx, start, end, ru_start, ru_end, returncode=0):
+    '''Function to build a stage record from two wall-clock times and two resource usage snapshots.
+    ru_start and ru_end are resource.struct_rusage. ru_maxrss is in KB on Linux.
+    Bytes read/written are block-device I/O (ru_inblock/ru_oublock, 512-byte units).'''
+    record = {'stage':      stage,
+              'iteration':  iteration_idx,
+              'job':        os.environ.get('SLURM_JOB_ID'),
+              'host':       socket.gethostname(),
+              'pid':        os.getpid(),
+              'start':      datetime.fromtimestamp(start).isoformat(timespec='milliseconds'),
+              'end':        datetime.fromtimestamp(end).isoformat(timespec='milliseconds'),
+              'wall_s':     round(end - start, 6),
+              'user_s':     round(ru_end.ru_utime - ru_start.ru_utime, 6),
+              'sys_s':      round(ru_end.ru_stime - ru_start.ru_stime, 6),
+              'maxrss_kb':  int(ru_end.ru_maxrss),
+              'read_bytes': int(ru_end.ru_inblock - ru_start.ru_inblock) * 512,
+              'write_bytes':int(ru_end.ru_oublock - ru_start.ru_oublock) * 512,
+              'returncode': returncode}
+    return record
+
+def run_traced(trace_file, stage, command, iteration_idx=None):
+    '''Function to run a command as a child process and trace it. Return the command exit code.
+    Resource usage is collected by wait4 for this child (and the descendants it waited for).
+    If the command cannot be started (eg, a missing executable), the failure is recorded and 127 is returned, as a shell does.'''
+    # Zero usage baseline so that make_record can be shared with StageTimer.
+    ru_zero = resource.struct_rusage((0,)*16)
+    start = time.time()
+    try:
+        proc = subprocess.Popen(command)
+    except OSError as e:
+        print('ERROR: Failed to run %s: %s'%(' '.join(command), e), file=sys.stderr)
+        record = make_record(stage, iteration_idx, start, time.time(), ru_zero, ru_zero, 127)
+        record.update(get_gru_subset(command))
+        record['error'] = str(e)
+        append_trace(trace_file, record)
+        return 127
+    _, status, ru_child = os.wait4(proc.pid, 0)
+    end   = time.time()
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    record  = make_record(stage, iteration_idx, start, end, ru_zero, ru_child, proc.returncode)
+    record.update(get_gru_subset(command))
+    append_trace(trace_file, record)
+    return proc.returncode
+
+class StageTimer:
+    '''Context manager to trace an in-process stage (eg, a Python optimizer step).
+    Example: with StageTimer(trace_file, 'dds', iteration_idx): ...
+    Peak RSS of an in-process stage is the peak of the whole Python process so far.'''
+    def __init__(self, trace_file, stage, iteration_idx=None):
+        self.trace_file    = trace_file
+        self.stage         = stage
+        self.iteration_idx = iteration_idx
+
+    def __enter__(self):
+        self.start    = time.time()
+        self.ru_start = resource.getrusage(resource.RUSAGE_SELF)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        ru_end = resource.getrusage(resource.RUSAGE_SELF)
+        end    = time.time()
+        returncode = 0 if exc_type is None else 1
+        append_trace(self.trace_file, make_record(self.stage, self.iteration_idx, self.start, end,
+                                                  self.ru_start, ru_end, returncode))
+        return False
+
+
+# main
+if __name__ == '__main__':
+
+    # an example: python trace_stage.py ../control_active.txt summa summa.exe -m fileManager.txt
+
+    # ------------------------------ Prepare ---------------------------------
+    # Process command line
+    # Check args
+    if len(sys.argv) < 4:
+        print("Usage: %s <control_file> <stage> <command> [command arguments]" % sys.argv[0])
+        sys.exit(0)
+    # Otherwise continue
+    args = process_command_line()
+    control_file = args.control_file
+    trace_file   = get_trace_file(control_file)
+
+    # -----------------------------------------------------------------------
+
+    # #### 1. Run the stage command and record the trace.
+    returncode = run_traced(trace_file, args.stage, args.command, get_iteration())
+
+    # #### 2. Return the command exit code to the calling script.
+    sys.exit(returncode)
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# #### Concurrent evaluation of param sets (initial_design.py, multistart_DDS.py, GLUE.py, SCE_UA.py, GA.py, PA_DDS.py) ####
+# A TrialPool runs param sets with the trial script (eg, run_trial.sh) on [nparallel] workers in
+# [calib_path]/[name]/worker_[k] (make_worker: a copy of the model settings with its own trial param file and
+# outputs, forcing and initial conditions are shared, and a control file), and shares with DDS.py:
+# - the bounds and template files (multiplier_bounds.txt, multipliers.tpl),
+# - the history store (calib_search_history.txt and calib_converge_history.txt, as save_param_obj.py writes them),
+# - the best-output archive ([calib_path]/output_archive, as save_best.py writes it).
+# A param set in the history (or evaluated earlier by the pool) is not run again. A failed trial returns inf and is
+# not recorded. With record_history=False (eg, GLUE.py), the pool leaves these calibration files alone: it neither
+# reads nor writes the history files and the archive, and does not write multipliers.txt.
+# With several objectives (multi-objective optimizers, eg, PA_DDS.py), a trial returns the negative of all metrics of
+# the stat file (see objectives in calculate_sim_stats.py), and calib_objectives_history.txt records them. The
+# history files of DDS record the first objective.
+# With gru_ensemble > 1 in the control file, make_pool returns an EnsemblePool, which runs summa once for a batch of
+# [gru_ensemble] param sets (see gru_ensemble.py), then routes and scores each member in its worker.
+
+# import packages
+import os, sys, shutil, glob, subprocess, threading, queue
+import concurrent.futures
+import netCDF4 as nc
+import numpy as np
+import pandas as pd
+from extract_upstream_domain import get_model_files, write_config, write_control_copy, read_from_summa_route_config
+from update_paramTrial import read_multipliers, read_regions, update_param_values
+from gru_ensemble import write_ensemble_model, extract_member, run_ensemble_summa
+
+def read_from_control(control_file, setting, default=None):
+    ''' Function to extract a given setting from the control_file. Return default if the setting does not exist.'''
+    # Open 'control_active.txt' and locate the line with setting
+    with open(control_file) as ff:
+        for line in ff:
+            line = line.strip()
+            if line.startswith(setting):
+                # Extract the setting's value
+                return line.split('|',1)[1].split('#',1)[0].strip()
+    return default
+
+def read_bounds(calib_path):
+    '''Function to read param names, initial values and bounds from multiplier_bounds.txt (in the order of that file).'''
+    param_bounds_df = pd.read_csv(os.path.join(calib_path, 'multiplier_bounds.txt'), delimiter=',', comment='#',
+                                  names=['MultiplierName','InitialValue','LowerLimit','UpperLimit'])
+    return (list(param_bounds_df['MultiplierName'].str.strip()), param_bounds_df['InitialValue'].values.astype(float),
+            param_bounds_df['LowerLimit'].values.astype(float), param_bounds_df['UpperLimit'].values.astype(float))
+
+def write_param_file(param_file, param_names, param_names_tpl, param_sample):
+    '''Function to write a param set in the order of the template file (as DDS.py does).'''
+    with open(param_file, 'w') as f:
+        for name in param_names_tpl:
+            f.write('%.6E\n'%(param_sample[param_names.index(name)]))
+
+def write_history_record(hist_file, run_idx, obj, param_sample, param_names):
+    '''Function to append one record to a history file in the format of save_param_obj.py. Create the file if needed.'''
+    new_file = not os.path.exists(hist_file)
+    with open(hist_file, 'a') as f:
+        if new_file:
+            f.write('Run  obj.function  ' + ''.join([x+'  ' for x in param_names]) + '\n')
+        f.write('%d %.6E  '%(run_idx, obj) + ''.join(['%.6E  '%(x) for x in param_sample]) + '\n')
+
+def make_worker(files, control_file, worker_dir, calib_path, trace_file):
+    '''Function to prepare a worker: model settings copy with its own outputs, calibration files, and control file.
+    Return the worker control file.'''
+    worker_model_path = os.path.join(worker_dir, 'model')
+    summa_settings_path = os.path.join(worker_model_path, files['summa_settings_relpath'])
+    route_settings_path = os.path.join(worker_model_path, files['route_settings_relpath'])
+    summa_outputPath = os.path.join(worker_model_path, 'simulations', 'SUMMA')
+    route_outputPath = os.path.join(worker_model_path, 'simulations', 'mizuRoute')
+    if os.path.exists(worker_dir):
+        shutil.rmtree(worker_dir)
+    shutil.copytree(files['summa_settings_path'], summa_settings_path)
+    shutil.copytree(files['route_settings_path'], route_settings_path)
+    os.makedirs(summa_outputPath)
+    os.makedirs(route_outputPath)
+
+    # The worker reads the shared forcing, initial conditions and mizuRoute ancillary files, and writes its own outputs.
+    write_config(files['summa_filemanager'], os.path.join(summa_settings_path, files['summa_filemanager_name']),
+                 {'settingsPath': summa_settings_path + '/',
+                  'statePath':    files['statePath'] if files['statePath'].endswith('/') else files['statePath'] + '/',
+                  'outputPath':   summa_outputPath + '/'}, quote="'")
+    write_config(files['route_control'], os.path.join(route_settings_path, files['route_control_name']),
+                 {'<input_dir>':  summa_outputPath + '/',
+                  '<output_dir>': route_outputPath + '/'})
+
+    for file in ['multipliers.tpl', 'multiplier_bounds.txt', 'multiplier_regions.nc']:
+        if os.path.exists(os.path.join(calib_path, file)):
+            shutil.copy2(os.path.join(calib_path, file), worker_dir)
+    worker_control = os.path.join(worker_dir, 'control_active.txt')
+    write_control_copy(control_file, worker_control, {'calib_path':   worker_dir,
+                                                      'model_path':   worker_model_path,
+                                                      'trace_output': trace_file})
+    return worker_control
+
+def get_output_files(control_file):
+    '''Function to return the files save_best.py archives for the run of control_file.'''
+    files = get_model_files(control_file)
+    summa_outputPath    = read_from_summa_route_config(files['summa_filemanager'], 'outputPath')
+    summa_outFilePrefix = read_from_summa_route_config(files['summa_filemanager'], 'outFilePrefix')
+    route_outputPath    = read_from_summa_route_config(files['route_control'], '<output_dir>')
+    route_outFilePrefix = read_from_summa_route_config(files['route_control'], '<case_name>')
+    return [os.path.join(summa_outputPath, summa_outFilePrefix+'_day.nc'),
+            os.path.join(route_outputPath, route_outFilePrefix+'.mizuRoute.nc'),
+            os.path.join(files['calib_path'], read_from_control(control_file, 'stat_output')),
+            files['trialParamFile']] + glob.glob(os.path.join(files['calib_path'], 'multiplier*'))
+
+def run_trial(trial_script, worker_control, log_file, start_stage=None):
+    '''Function to run one trial with the worker control file. Return the exit code.
+    start_stage (eg, route) starts the trial at a later stage, see run_trial.sh.'''
+    with open(log_file, 'w') as log:
+        return subprocess.call([trial_script, worker_control] + ([start_stage] if start_stage else []), stdout=log,
+                               stderr=subprocess.STDOUT, cwd=os.path.dirname(os.path.abspath(trial_script)))
+
+def write_objectives_record(hist_file, run_idx, objs, objectives, param_sample, param_names):
+    '''Function to append one record (all objectives) to calib_objectives_history.txt. Create the file if needed.'''
+    new_file = not os.path.exists(hist_file)
+    with open(hist_file, 'a') as f:
+        if new_file:
+            f.write('Run  ' + ''.join(['obj.'+x+'  ' for x in objectives]) + ''.join([x+'  ' for x in param_names]) + '\n')
+        f.write('%d  '%(run_idx) + ''.join(['%.6E  '%(x) for x in objs]) + ''.join(['%.6E  '%(x) for x in param_sample]) + '\n')
+
+class TrialPool:
+    '''Evaluate batches of param sets concurrently. Example:
+    pool = TrialPool(control_file, 'sce', nparallel=8)
+    objs = pool.evaluate(samples)  # samples is (nsample, nparam) in the order of multiplier_bounds.txt
+    pool.close()
+    With objectives (a list of metric names), evaluate returns (nsample, len(objectives)).'''
+    def __init__(self, control_file, name, nparallel=None, trial_script='./run_trial.sh', warm_start=None, objectives=None,
+                 record_history=True):
+        control_file = os.path.abspath(control_file)
+        files = get_model_files(control_file)
+        self.control_file, self.files = control_file, files
+        self.calib_path  = files['calib_path']
+        self.stat_output = read_from_control(control_file, 'stat_output')
+        self.trial_script = trial_script
+        self.param_names, self.initial, self.lower, self.upper = read_bounds(self.calib_path)
+        self.param_names_tpl = list(np.loadtxt(os.path.join(self.calib_path, 'multipliers.tpl'), dtype='str', ndmin=1))
+        self.search_file   = os.path.join(self.calib_path, 'calib_search_history.txt')
+        self.converge_file = os.path.join(self.calib_path, 'calib_converge_history.txt')
+        self.objectives_file = os.path.join(self.calib_path, 'calib_objectives_history.txt')
+        self.objectives    = objectives
+        self.record_history = record_history
+        self.failed        = np.inf if objectives is None else np.full(len(objectives), np.inf)
+        self.save_best_dir = os.path.join(self.calib_path, 'output_archive')
+        self.pool_path     = os.path.join(self.calib_path, name)
+        self.nparallel     = nparallel if nparallel is not None else len(os.sched_getaffinity(0))
+        self.lock          = threading.Lock()
+        self.cache, self.pending, self.run_count, self.ntrial = {}, {}, 0, 0
+        self.obj_best, self.best = np.inf, None
+
+        # Start new history files and a new archive, or continue the existing ones (warm start). Without record_history,
+        # leave them as they are.
+        warm_start = warm_start if warm_start is not None else read_from_control(control_file, 'WarmStart')
+        if record_history and warm_start == 'no':
+            for hist_file in [self.search_file, self.converge_file, self.objectives_file]:
+                if os.path.exists(hist_file):
+                    os.remove(hist_file)
+            if os.path.exists(self.save_best_dir):
+                shutil.rmtree(self.save_best_dir)
+        elif record_history and os.path.exists(self.search_file):
+            record_df = pd.read_csv(self.search_file, header='infer', skip_blank_lines=True, delim_whitespace=True, engine='python')
+            self.run_count = len(record_df)
+            for _, record in record_df.dropna(subset=['obj.function']).iterrows():
+                param_sample = record[self.param_names].values.astype(float)
+                self.cache[self.cache_key(param_sample)] = float(record['obj.function'])
+                if record['obj.function'] < self.obj_best:
+                    self.obj_best, self.best = float(record['obj.function']), param_sample
+            if objectives is not None:
+                # Only the trials recorded with all objectives are reused.
+                self.cache = {}
+                if os.path.exists(self.objectives_file):
+                    record_df = pd.read_csv(self.objectives_file, header='infer', skip_blank_lines=True, delim_whitespace=True, engine='python')
+                    if not set(['obj.'+x for x in objectives]).issubset(record_df.columns):
+                        record_df = record_df.iloc[0:0]
+                    for _, record in record_df.iterrows():
+                        self.cache[self.cache_key(record[self.param_names].values.astype(float))] = \
+                            record[['obj.'+x for x in objectives]].values.astype(float)
+        if record_history:
+            os.makedirs(self.save_best_dir, exist_ok=True)
+
+        # Prepare the workers.
+        trace_file = os.path.join(self.calib_path, read_from_control(control_file, 'trace_output', 'calib_trace.jsonl'))
+        self.workers = queue.Queue()
+        for k in range(self.nparallel):
+            worker_dir = os.path.join(self.pool_path, 'worker_%d'%(k))
+            self.workers.put((worker_dir, make_worker(files, control_file, worker_dir, self.calib_path, trace_file)))
+
+    @staticmethod
+    def cache_key(param_sample):
+        '''Return the cache key of a param set, at the precision written to the param file.'''
+        return tuple(['%.6E'%(x) for x in param_sample])
+
+    def history_starts(self, n):
+        '''Return up to n best distinct param sets of the history (for a warm start), best first.'''
+        ranked = sorted(self.cache.items(), key=lambda x: np.atleast_1d(x[1])[0])[:n]
+        return np.array([[float(v) for v in key] for key, _ in ranked]).reshape(-1, len(self.param_names))
+
+    def run(self, param_sample, on_record=None):
+        '''Run one param set on a free worker, record it, and return its objective function value(s) (inf if failed).'''
+        worker_dir, worker_control = self.workers.get()
+        try:
+            write_param_file(os.path.join(worker_dir, 'multipliers.txt'), self.param_names, self.param_names_tpl, param_sample)
+            returncode = run_trial(self.trial_script, worker_control, os.path.join(worker_dir, 'trial.log'))
+            return self.record(worker_dir, worker_control, param_sample, returncode, on_record)
+        finally:
+            self.workers.put((worker_dir, worker_control))
+
+    def run_once(self, param_sample, on_record=None):
+        '''Run one param set unless it was evaluated before or is being evaluated by another thread (then wait for it).
+        Return its objective function value(s) and True for a cache hit.'''
+        key = self.cache_key(param_sample)
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key], True
+            hit = key in self.pending
+            if not hit:
+                self.pending[key] = concurrent.futures.Future()
+            future = self.pending[key]
+        if hit:
+            return future.result(), True
+        obj = self.failed
+        try:
+            obj = self.run(param_sample, on_record)
+        finally:
+            # Never leave other threads waiting on this param set.
+            with self.lock:
+                self.cache[key] = obj
+                self.ntrial += 1
+                del self.pending[key]
+            future.set_result(obj)
+        return obj, False
+
+    def record(self, worker_dir, worker_control, param_sample, returncode, on_record=None):
+        '''Read the statistics of a trial run by a worker, record the trial, and return its objective function value(s).
+        on_record(run_idx, objs, worker_control) is called under the lock of the history files while the worker holds
+        the trial outputs (eg, to record or read them for GLUE.py). run_idx is None for a failed trial.'''
+        worker_stat = os.path.join(worker_dir, self.stat_output)
+        try:
+            if returncode != 0 or not os.path.exists(worker_stat):
+                return self.record_failed(worker_control, on_record)
+            objs = np.loadtxt(worker_stat, ndmin=1) * (-1)  # eg, obj = negative KGE
+            if self.objectives is not None and len(objs) < len(self.objectives):
+                print('WARNING: %s has fewer metrics than objectives. Check objectives in the control file.'%(worker_stat))
+                return self.record_failed(worker_control, on_record)
+            obj = float(objs[0])
+            result = obj if self.objectives is None else objs[:len(self.objectives)]
+            with self.lock:
+                self.run_count += 1
+                if self.record_history:
+                    param_sample_tpl = [param_sample[self.param_names.index(x)] for x in self.param_names_tpl]
+                    write_history_record(self.search_file, self.run_count, obj, param_sample_tpl, self.param_names_tpl)
+                    if obj <= self.obj_best or not os.path.exists(self.converge_file):
+                        write_history_record(self.converge_file, self.run_count, obj, param_sample_tpl, self.param_names_tpl)
+                    if self.objectives is not None:
+                        write_objectives_record(self.objectives_file, self.run_count, objs[:len(self.objectives)], self.objectives,
+                                                param_sample_tpl, self.param_names_tpl)
+                if obj < self.obj_best or (self.record_history and not os.listdir(self.save_best_dir)):
+                    self.obj_best, self.best = obj, np.array(param_sample)
+                    if self.record_history:
+                        for file in get_output_files(worker_control):
+                            shutil.copy2(file, self.save_best_dir)
+                if on_record is not None:
+                    on_record(self.run_count, result, worker_control)
+            return result
+        finally:
+            # Remove the statistics so that a failed next trial of this worker is not read as a success.
+            if os.path.exists(worker_stat):
+                os.remove(worker_stat)
+
+    def record_failed(self, worker_control, on_record):
+        '''Return the objective function value(s) of a failed trial, after calling on_record.'''
+        if on_record is not None:
+            with self.lock:
+                on_record(None, self.failed, worker_control)
+        return self.failed
+
+    def run_batch(self, samples):
+        '''Run param sets concurrently. Return their objective function value(s) in order.'''
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.nparallel) as executor:
+            return list(executor.map(self.run, samples))
+
+    def evaluate(self, samples):
+        '''Evaluate param sets (nsample, nparam) concurrently. Return their objective function values (nsample,), or
+        (nsample, nobjective) with objectives. Param sets evaluated before, or repeated in the batch, are run once.'''
+        samples = np.atleast_2d(samples)
+        keys = [self.cache_key(x) for x in samples]
+        todo = {}
+        for i, key in enumerate(keys):
+            if key not in self.cache and key not in todo:
+                todo[key] = i
+        results = self.run_batch([samples[i] for i in todo.values()])
+        for key, obj in zip(todo.keys(), results):
+            self.cache[key] = obj
+        self.ntrial += len(todo)
+        return np.array([self.cache[key] for key in keys])
+
+    def close(self):
+        '''Write the best param set to multipliers.txt (with record_history) and remove the workers.'''
+        if self.best is not None and self.record_history:
+            write_param_file(os.path.join(self.calib_path, 'multipliers.txt'), self.param_names, self.param_names_tpl, self.best)
+        shutil.rmtree(self.pool_path, ignore_errors=True)
+
+class EnsemblePool(TrialPool):
+    '''Evaluate batches of param sets with one summa run per [nmember] param sets (GRU-replicated ensemble, see
+    gru_ensemble.py). Each member is routed and scored in its own worker, [nparallel] at the same time.'''
+    def __init__(self, control_file, name, nmember, nparallel=None, trial_script='./run_trial.sh', warm_start=None, objectives=None):
+        # One worker per member.
+        super().__init__(control_file, name, nmember, trial_script, warm_start, objectives)
+        if int(read_from_control(self.control_file, 'sim_chunks', '1')) > 1:
+            print('ERROR: gru_ensemble does not support sim_chunks > 1.')
+            sys.exit(1)
+        self.nmember  = nmember
+        self.nroute   = nparallel if nparallel is not None else len(os.sched_getaffinity(0))
+        self.members  = [self.workers.get() for k in range(nmember)]
+        self.ensemble = write_ensemble_model(self.files, nmember, os.path.join(self.pool_path, 'model_ensemble'))
+        self.summa_exe = read_from_control(self.control_file, 'summa_exe_path')
+        self.region_index = None
+        if os.path.exists(os.path.join(self.calib_path, 'multiplier_regions.nc')):
+            self.region_index = read_regions(os.path.join(self.calib_path, 'multiplier_regions.nc'))
+
+    def run_batch(self, samples):
+        '''Run param sets in ensembles of nmember. Return their objective function value(s) in order.'''
+        results = []
+        for start in range(0, len(samples), self.nmember):
+            results += self.run_ensemble(samples[start:start+self.nmember])
+        return results
+
+    def run_ensemble(self, samples):
+        '''Run up to nmember param sets in one summa run, then route and score each member in its worker.'''
+        ens = self.ensemble
+        # (1) Write the param values of member k into block k of the ensemble trialParams.nc.
+        shutil.copy2(ens['trialParamFile_priori'], ens['trialParamFile'])
+        with nc.Dataset(ens['trialParamFile_priori'], 'r') as src, nc.Dataset(ens['trialParamFile'], 'r+') as dst:
+            for k, param_sample in enumerate(samples):
+                worker_dir = self.members[k][0]
+                write_param_file(os.path.join(worker_dir, 'multipliers.txt'), self.param_names, self.param_names_tpl, param_sample)
+                param_multps = read_multipliers(os.path.join(worker_dir, 'multipliers.tpl'), os.path.join(worker_dir, 'multipliers.txt'))
+                block = {dim: slice(k*n, (k+1)*n) for dim, n in ens['sizes'].items()}
+                update_param_values(src, dst, param_multps, self.region_index, block=block)
+
+        # (2) Run summa once.
+        if os.path.exists(ens['output']):
+            os.remove(ens['output'])
+        returncode = run_ensemble_summa(self.control_file, self.summa_exe, ens['filemanager'],
+                                        os.path.join(self.pool_path, 'summa_ensemble.log'))
+        if returncode != 0 or not os.path.exists(ens['output']):
+            return [self.failed for x in samples]
+
+        # (3) Split the output by member (netCDF4 is not thread-safe, so before the threads start).
+        for k in range(len(samples)):
+            output_files = get_output_files(self.members[k][1])
+            extract_member(ens['output'], output_files[0], k, ens['sizes'], ens['offsets'])
+            extract_member(ens['trialParamFile'], output_files[3], k, ens['sizes'], ens['offsets'])
+
+        # (4) Route and score the members concurrently.
+        def route_member(k):
+            worker_dir, worker_control = self.members[k]
+            returncode = run_trial(self.trial_script, worker_control, os.path.join(worker_dir, 'trial.log'), 'route')
+            return self.record(worker_dir, worker_control, samples[k], returncode)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.nroute) as executor:
+            return list(executor.map(route_member, range(len(samples))))
+
+def make_pool(control_file, name, nparallel=None, trial_script='./run_trial.sh', warm_start=None, objectives=None):
+    '''Function to return an EnsemblePool if gru_ensemble > 1 in control_file, otherwise a TrialPool.'''
+    nmember = int(read_from_control(os.path.abspath(control_file), 'gru_ensemble', '1'))
+    if nmember > 1:
+        return EnsemblePool(control_file, name, nmember, nparallel, trial_script, warm_start, objectives)
+    return TrialPool(control_file, name, nparallel, trial_script, warm_start, objectives)
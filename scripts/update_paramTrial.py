@@ -7,9 +7,11 @@
 # 3. Update summa param values in trialParam.nc.
 # Note: summa parameter names are different from multiplier names.
 # eg, summa param "k_soil", multp name "k_soil_multp".
+# Regional multipliers (eg, "k_soil_multp_r2", see calculate_multp_bounds.py) are applied through the region index
+# of each HRU/GRU in [calib_path]/multiplier_regions.nc, ie, new_value = multiplier_vector[region_index] * default_value.
 
 # import packages
-import os, shutil, sys, argparse
+import os, re, shutil, sys, argparse
 import numpy as np
 import netCDF4 as nc
 
@@ -47,6 +49,99 @@ def read_from_summa_route_config(config_file, setting):
     # Return this value    
     return substring
 
+def read_multipliers(multp_tpl, multp_txt):
+    '''Function to read multiplier names and values. Return a dictionary of summa param name: multiplier value,
+    where the value of regional multipliers ([param]_multp_r[N]) is a vector ordered by region.'''
+    multp_names  = list(np.atleast_1d(np.loadtxt(multp_tpl, dtype='str')))
+    multp_values = np.atleast_1d(np.loadtxt(multp_txt))
+    param_multps = {}
+    regional = {}
+    for name, value in zip(multp_names, multp_values):
+        match = re.match(r'^(.+)_multp_r(\d+)$', name)
+        if match:
+            regional.setdefault(match.group(1), {})[int(match.group(2))] = value
+        else:
+            param_multps[name.replace('_multp','')] = value
+    for param_name, values in regional.items():
+        param_multps[param_name] = np.array([values[ir] for ir in sorted(values)])
+    return param_multps
+
+def read_regions(region_file):
+    '''Function to read the region index (start from 0) per HRU and GRU.'''
+    with nc.Dataset(region_file, 'r') as f:
+        return {'hru': f.variables['hruRegion'][:].data, 'gru': f.variables['gruRegion'][:].data}
+
+def expand_multiplier(multp, var, region_index):
+    '''Function to return a scalar multiplier, or gather a regional multiplier vector to the elements of var.'''
+    if np.ndim(multp) == 0:
+        return multp
+    return multp[region_index[var.dimensions[-1]]]
+
+def block_index(var, block):
+    '''Function to return the index of var that selects the block ({dimension: slice}) along its last dimension.'''
+    if block is None or var.dimensions[-1] not in block:
+        return slice(None)
+    return (Ellipsis, block[var.dimensions[-1]])
+
+def update_param_values(src, dst, param_multps, region_index, direct_param_list=[''], block=None):
+    '''Function to update the param values of dst (opened trialParam.nc) from the a priori values of src (opened
+    trialParam.priori.nc) and the multipliers. block ({'hru': slice, 'gru': slice}) selects the HRUs and GRUs to 
+    update, eg, one member of a GRU-replicated ensemble (see gru_ensemble.py). region_index is per HRU/GRU of the block.'''
+    for param_name, multp in param_multps.items():   # parameter name used in summa trialParam.nc
+
+        # Update all params except 'thickness'
+        if (param_name != 'thickness') and param_name in dst.variables.keys():  
+
+            # Update param values
+            index           = block_index(src.variables[param_name], block)     # HRUs/GRUs to update
+            param_priori_ma = src.variables[param_name][index]                  # priori param value mask array 
+            multp = expand_multiplier(multp, src.variables[param_name], region_index)
+            if not param_name in direct_param_list:                             # new_value = multipler * default_value
+                param_update_value = param_priori_ma.data * multp               # update param value mask array
+            elif param_name in direct_param_list:                               # new_value = new sample value
+                param_update_value = np.ones_like(param_priori_ma.data) * multp # update param value mask array
+            dst.variables[param_name][index] = np.ma.array(param_update_value, \
+                                                           mask=np.ma.getmask(param_priori_ma), \
+                                                           fill_value=param_priori_ma.get_fill_value())
+
+#             # If param is 'theta_sat', update other four soil variables using a priori param value fractions.
+#             if param_name == 'theta_sat':
+#                 param_priori_ma  = src.variables[param_name][:]
+#                 param_ma = dst.variables[param_name][:]
+
+#                 for add_param in ['theta_res', 'critSoilWilting', 'critSoilTranspire', 'fieldCapacity']:
+#                     add_param_priori_ma  = src.variables[add_param][:]
+#                     fraction =  np.divide(add_param_priori_ma.data, param_priori_ma.data) # fraction based on priori variable values
+#                     add_param_update_value = param_ma.data * fraction
+#                     dst.variables[add_param][:]= np.ma.array(add_param_update_value, \
+#                                                              mask=np.ma.getmask(add_param_priori_ma), \
+#                                                              fill_value=add_param_priori_ma.get_fill_value())
+        
+        # Exist code if this parameter does not exist in trialParam.nc.
+        elif (param_name != 'thickness') and not (param_name in dst.variables.keys()):
+            print('Unable to update parameter %s beucase it does not exist in trialParam.nc'%(param_name))
+            sys.exit(0)
+            
+            
+    # Update 'thickness' if it exists in multp_names.
+    # 'thickness' is used to calculate TopCanopyHeight. TopCanopyHeight = heightCanopyBottom + thickness.
+    # 'thickness' is updated after heightCanopyBottom is updated in the above loop.
+    if 'thickness' in param_multps:
+        # Get a priori thickness and updated heightCanopyBottom
+        index                  = block_index(src.variables['heightCanopyTop'], block)     # HRUs to update
+        canopyTop_priori_ma    = src.variables['heightCanopyTop'][index]                  # a priori TopCanopyHeight mask array 
+        canopyBottom_priori_ma = src.variables['heightCanopyBottom'][index]               # a priori BottomCanopyHeight mask array 
+        thickness_priori       = canopyTop_priori_ma.data-canopyBottom_priori_ma.data     # a priori canopy thickness
+        thickness_multp        = expand_multiplier(param_multps['thickness'], src.variables['heightCanopyTop'], region_index)
+        
+        canopyBottom_ma        = dst.variables['heightCanopyBottom'][index]               # updated BottomCanopyHeight mask array
+        
+        # Update heightCanopyTop
+        canopyTop_update_value = canopyBottom_ma.data + thickness_priori*thickness_multp  # update TopCanopyHeight values
+        dst.variables['heightCanopyTop'][index] = np.ma.array(canopyTop_update_value, \
+                                                              mask=np.ma.getmask(canopyTop_priori_ma), \
+                                                              fill_value=canopyTop_priori_ma.get_fill_value())
+
 # main
 if __name__ == '__main__':
     
@@ -92,9 +187,10 @@ if __name__ == '__main__':
     trialParamFile_priori = os.path.join(summa_settings_path, trialParamFile_priori)
 
     # #### 2. Read summa param names and multiplier values
-    multp_names  = list(np.loadtxt(multp_tpl, dtype='str'))
-    multp_values = list(np.loadtxt(multp_txt))
-    multp_num    = len(multp_names)
+    param_multps = read_multipliers(multp_tpl, multp_txt)
+    region_index = None
+    if any(np.ndim(x) > 0 for x in param_multps.values()):
+        region_index = read_regions(os.path.join(calib_path, 'multiplier_regions.nc'))
 
     # #### 3. Update summa param values
     # Copy trialParamFile_priori to be the base of trialParamFile.
@@ -103,62 +199,4 @@ if __name__ == '__main__':
     # Update param values in trialParamFile.
     with nc.Dataset(trialParamFile_priori, 'r') as src:
         with nc.Dataset(trialParamFile, 'r+') as dst:
-
-            for i in range(multp_num):
-                param_name = multp_names[i].replace('_multp','') # parameter name used in summa trialParam.nc
-
-                # Update all params except 'thickness'
-                if (param_name != 'thickness') and param_name in dst.variables.keys():  
-
-                    # Update param values
-                    if not param_name in direct_param_list:                             # new_value = multipler * default_value
-                        param_priori_ma    = src.variables[param_name][:]               # priori param value mask array 
-                        param_update_value = param_priori_ma.data * multp_values[i]     # update param value mask array
-                        dst.variables[param_name][:] = np.ma.array(param_update_value, \
-                                                                   mask=np.ma.getmask(param_priori_ma), \
-                                                                   fill_value=param_priori_ma.get_fill_value())
-                    elif param_name in direct_param_list:                                          # new_value = new sample value
-                        param_priori_ma    = src.variables[param_name][:]                          # priori param value mask array 
-                        param_update_value = np.ones_like(param_priori_ma.data) * multp_values[i]  # update param value mask array
-                        dst.variables[param_name][:] = np.ma.array(param_update_value, \
-                                                                   mask=np.ma.getmask(param_priori_ma), \
-                                                                   fill_value=param_priori_ma.get_fill_value())                   
-
-#                     # If param is 'theta_sat', update other four soil variables using a priori param value fractions.
-#                     if param_name == 'theta_sat':
-#                         param_priori_ma  = src.variables[param_name][:]
-#                         param_ma = dst.variables[param_name][:]
-
-#                         for add_param in ['theta_res', 'critSoilWilting', 'critSoilTranspire', 'fieldCapacity']:
-#                             add_param_priori_ma  = src.variables[add_param][:]
-#                             fraction =  np.divide(add_param_priori_ma.data, param_priori_ma.data) # fraction based on priori variable values
-#                             add_param_update_value = param_ma.data * fraction
-#                             dst.variables[add_param][:]= np.ma.array(add_param_update_value, \
-#                                                                      mask=np.ma.getmask(add_param_priori_ma), \
-#                                                                      fill_value=add_param_priori_ma.get_fill_value())
-                
-                # Exist code if this parameter does not exist in trialParam.nc.
-                elif (param_name != 'thickness') and not (param_name in dst.variables.keys()):
-                    print('Unable to update parameter %s beucase it does not exist in trialParam.nc'%(param_name))
-                    sys.exit(0)
-                    
-                    
-            # Update 'thickness' if it exists in multp_names.
-            # 'thickness' is used to calculate TopCanopyHeight. TopCanopyHeight = heightCanopyBottom + thickness.
-            # 'thickness' is updated after heightCanopyBottom is updated in the above loop.
-            if 'thickness_multp' in multp_names:
-                # Get the index of 'thickness_multp' in multp_names.
-                thick_idx = multp_names.index('thickness_multp')
-
-                # Get a priori thickness and updated heightCanopyBottom
-                canopyTop_priori_ma    = src.variables['heightCanopyTop'][:]                      # a priori TopCanopyHeight mask array 
-                canopyBottom_priori_ma = src.variables['heightCanopyBottom'][:]                   # a priori BottomCanopyHeight mask array 
-                thickness_priori       = canopyTop_priori_ma.data-canopyBottom_priori_ma.data     # a priori canopy thickness
-                
-                canopyBottom_ma        = dst.variables['heightCanopyBottom'][:]                   # updated BottomCanopyHeight mask array
-                
-                # Update heightCanopyTop
-                canopyTop_update_value = canopyBottom_ma.data + thickness_priori*multp_values[thick_idx]  # update TopCanopyHeight values
-                dst.variables['heightCanopyTop'][:] = np.ma.array(canopyTop_update_value, \
-                                                                  mask=np.ma.getmask(canopyTop_priori_ma), \
-                                                                  fill_value=canopyTop_priori_ma.get_fill_value())
+            update_param_values(src, dst, param_multps, region_index, direct_param_list)